@@ -1,22 +1,66 @@
 """Rate Limiter Service API App"""
 
-from flask import Flask
+from flask import Flask, Response, request
 from flask_restx import Api, Resource
 from os import environ
+from socket import gethostname
+from threading import Lock
 
 from core.apis.config import RateLimitConfig
 from core.apis.decrement import RateLimitDecrement
+from core.apis.leases import RateLimitLeasing
 from core.apis.policies import RateLimitPolicy
-from core.apis.status import RateLimitStatus
+from core.apis.status import PAGE_LIMIT, TOP_TALKERS, RateLimitStatus
+from core.models.leases import (
+    req_api_model as lease_req_api_model,
+    res_api_model as lease_res_api_model,
+    release_req_api_model as lease_release_req_api_model,
+    release_res_api_model as lease_release_res_api_model
+)
 from core.models.policies import (
     req_api_model as policies_req_api_model,
     res_api_model as policies_res_api_model
 )
 from core.models.rate_limits import (
     req_api_model as ratelimit_req_api_model,
-    res_api_model as ratelimit_res_api_model
+    res_api_model as ratelimit_res_api_model,
+    window_api_model as ratelimit_window_api_model
+)
+from core.common.exceptions import RateLimitException
+from core.common.utils import MonotonicClock, WallClock
+from core.controller.crdt import (
+    DEFAULT_INTERVAL as SYNC_INTERVAL,
+    DEFAULT_PORT as REPLICATION_PORT,
+    RateLimitCRDTStorage
+)
+from core.controller.heavy_hitters import (
+    DEFAULT_CAPACITY as HEAVY_HITTERS,
+    DEFAULT_WINDOW as HEAVY_HITTER_WINDOW
+)
+from core.controller.journal import (
+    DEFAULT_INTERVAL as JOURNAL_INTERVAL,
+    RateLimitJournal
 )
+from core.controller.loader import load_limits, print_progress
 from core.controller.rate_limiter import RateLimiter
+from core.controller.redis_storage import RateLimitRedisStorage
+from core.controller.snapshot import (
+    DEFAULT_INTERVAL as SNAPSHOT_INTERVAL,
+    RateLimitSnapshots
+)
+from core.controller.replica import (
+    DEFAULT_INTERVAL as STANDBY_INTERVAL,
+    RateLimitPrimary,
+    RateLimitStandby
+)
+from core.dataplane.http_server import (
+    DEFAULT_PORT as DATA_PLANE_PORT,
+    start_in_thread as start_data_plane
+)
+from core.dataplane.binary_server import (
+    DEFAULT_PORT as BINARY_PORT,
+    start_in_thread as start_binary_server
+)
 
 
 # --------------------------------------------------------------------------- #
@@ -26,12 +70,17 @@ from core.controller.rate_limiter import RateLimiter
 #   Create app, name space, API request/response models, API access objects:  #
 #                                                                             #
 #     1) control plane: rate-limit policy for administrator                   #
-#        - This is not integrated with data plane yet.                        #
+#        - The policies of rps are shared w/ data plane as named tiers.       #
 #                                                                             #
 #     2) data plane: rate-limiter configuration and request per globa/user    #
 #        - ns_config   : configuring rate-limit                               #
 #        - ns_decrement: rate-limit request                                   #
 #        - ns_status   : check rate-limit status                              #
+#        - ns_lease    : lease tokens to decide requests locally              #
+#        - The decrement APIs are also served by the asyncio server of the    #
+#          data plane (core/dataplane/http_server.py) w/o flask_restx.        #
+#        - The decisions are also served by the binary protocol over TCP or   #
+#          Unix domain socket (core/dataplane/binary_server.py).              #
 #                                                                             #
 # --------------------------------------------------------------------------- #
 
@@ -56,17 +105,124 @@ ns_status = api.namespace(
     'ratelimit-status',
     description='Rate Limiter Status for All Buckets'
 )
+ns_lease = api.namespace(
+    'ratelimit-leases',
+    description='Rate Limit Token Leases for Local Decisions'
+)
 
 policy_req_model = api.model('policies-request', policies_req_api_model())
 policy_res_model = api.model('policies-response', policies_res_api_model())
-limit_req_model = api.model('ratelimit-request', ratelimit_req_api_model())
-limit_res_model = api.model('ratelimit-response', ratelimit_res_api_model())
+limit_window_model = api.model('ratelimit-window',
+                               ratelimit_window_api_model())
+limit_req_model = api.model('ratelimit-request',
+                            ratelimit_req_api_model(limit_window_model))
+limit_res_model = api.model('ratelimit-response',
+                            ratelimit_res_api_model(limit_window_model))
+lease_req_model = api.model('lease-request', lease_req_api_model())
+lease_res_model = api.model('lease-response', lease_res_api_model())
+lease_release_req_model = api.model('lease-release-request',
+                                    lease_release_req_api_model())
+lease_release_res_model = api.model('lease-release-response',
+                                    lease_release_res_api_model())
+
+# The app server handles requests in threads, so the buckets are shared by
+# threads w/ lock striping unless RATE_LIMITER_LOCK_STRIPES is set to 0.
+# The pre-forked workers of a WSGI server (e.g. gunicorn --preload) share the
+# buckets in a shared memory if RATE_LIMITER_SHARED_CAPACITY (keys) is set.
+# The buckets are kept in a RESP server (e.g. Redis) shared by the instances
+# of the app if RATE_LIMITER_STORAGE_URL (e.g. redis://localhost:6379) is set,
+# which stamp the buckets by the wall clock shared by the instances.
+# The nodes of the app decide the requests locally on the consumption of all
+# the nodes replicated by G-counters (CRDT) if RATE_LIMITER_PEERS (e.g.
+# 'node-b:8004,node-c:8004') is set, which are synced every
+# RATE_LIMITER_SYNC_INTERVAL seconds over UDP.
+# The top talkers are counted by RATE_LIMITER_HEAVY_HITTERS counters (0 to
+# turn them off) per RATE_LIMITER_HEAVY_HITTER_WINDOW seconds.
+storage_url = environ.get("RATE_LIMITER_STORAGE_URL")
+peers = [peer for peer in environ.get("RATE_LIMITER_PEERS", "").split(",")
+         if peer]
+shared_capacity = int(environ.get("RATE_LIMITER_SHARED_CAPACITY", 0))
+primary_address = environ.get("RATE_LIMITER_PRIMARY")
+standby_port = int(environ.get("RATE_LIMITER_STANDBY_PORT", 0))
+if storage_url:
+    storage = RateLimitRedisStorage.from_url(storage_url)
+elif peers:
+    storage = RateLimitCRDTStorage(
+        environ.get("RATE_LIMITER_NODE_ID", gethostname()), peers,
+        float(environ.get("RATE_LIMITER_SYNC_INTERVAL", SYNC_INTERVAL)))
+else:
+    storage = None
+limiter = RateLimiter(
+    clock=WallClock() if (
+        storage_url or peers or primary_address or standby_port
+    ) else MonotonicClock(),
+    max_buckets=int(environ.get("RATE_LIMITER_MAX_BUCKETS", 0)) or None,
+    idle_ttl=float(environ.get("RATE_LIMITER_IDLE_TTL", 0)) or None,
+    lock_stripes=int(environ.get("RATE_LIMITER_LOCK_STRIPES", 64)) or None,
+    shared_capacity=shared_capacity or None,
+    storage=storage,
+    heavy_hitters=int(environ.get("RATE_LIMITER_HEAVY_HITTERS",
+                                  HEAVY_HITTERS)),
+    heavy_hitter_window=float(environ.get("RATE_LIMITER_HEAVY_HITTER_WINDOW",
+                                          HEAVY_HITTER_WINDOW))
+)
 
-policies_api = RateLimitPolicy(ns_policy)
-limiter = RateLimiter()
-config_api = RateLimitConfig(limiter, ns_config)
+# The bucket state and the tiers are streamed to the hot standbys connecting
+# to RATE_LIMITER_STANDBY_PORT (e.g. 8005, which isn't authenticated) every
+# RATE_LIMITER_STANDBY_INTERVAL seconds only if the port is set. The app
+# follows the primary as a standby instead if RATE_LIMITER_PRIMARY (e.g.
+# 'rate-limiter-a:8005') is set, which answers 503 to the APIs but the
+# status until it takes over when the primary is lost. The primary and the
+# standbys stamp the buckets by the wall clock shared by the machines.
+if primary_address:
+    replica = RateLimitStandby(limiter)
+elif standby_port and storage is None and not shared_capacity:
+    replica = RateLimitPrimary(limiter, float(environ.get(
+        "RATE_LIMITER_STANDBY_INTERVAL", STANDBY_INTERVAL)))
+else:
+    replica = None
+
+# The buckets and the tiers are saved to RATE_LIMITER_SNAPSHOT_PATH every
+# RATE_LIMITER_SNAPSHOT_INTERVAL seconds in the background, and the snapshot
+# is loaded when the app starts to restart w/ the quota of all the users.
+# The changes of the config and the policies are journaled to
+# RATE_LIMITER_JOURNAL_DIR instead, which is compacted into a snapshot every
+# RATE_LIMITER_JOURNAL_INTERVAL seconds and replayed when the app starts.
+snapshot_path = environ.get("RATE_LIMITER_SNAPSHOT_PATH")
+journal_dir = environ.get("RATE_LIMITER_JOURNAL_DIR")
+snapshots = journal = None
+if journal_dir and storage is None and not shared_capacity:
+    journal = RateLimitJournal(journal_dir, float(environ.get(
+        "RATE_LIMITER_JOURNAL_INTERVAL", JOURNAL_INTERVAL)))
+elif snapshot_path and storage is None and not shared_capacity:
+    snapshots = RateLimitSnapshots(limiter, snapshot_path, float(environ.get(
+        "RATE_LIMITER_SNAPSHOT_INTERVAL", SNAPSHOT_INTERVAL)))
+initialized, init_lock = False, Lock()
+policies_api = RateLimitPolicy(ns_policy, limiter, journal)
+config_api = RateLimitConfig(limiter, ns_config, journal)
 decrement_api = RateLimitDecrement(limiter, ns_decrement)
 status_api = RateLimitStatus(limiter, ns_decrement)
+lease_api = RateLimitLeasing(limiter, ns_lease)
+
+
+@app.before_request
+def gate_standby():
+    """Answer 503 to the requests which change the buckets or the config
+    while the app follows the primary as a standby."""
+    if not isinstance(replica, RateLimitStandby) or (
+            replica.promoted.is_set()):
+        return None
+    if request.method == 'GET' and not request.path.startswith(
+            '/ratelimit-decrement'):
+        return None
+    return {'message': 'the standby follows the primary'}, 503
+
+
+@api.errorhandler(RateLimitException)
+def handle_rate_limit_exception(e):
+    """Answer the status code of a rate-limit exception (e.g. 501 of an
+    operation which the bucket backend doesn't support) w/ its details."""
+    return e.to_dict(), e.status_code
 
 
 # --------------------------------------------------------------------------- #
@@ -141,6 +297,10 @@ class GetPutDelPolicyAPI(Resource):
 #       - global level: check quota remaining from global level limiter       #
 #       - a user level: check quota remaining from user level limiter         #
 #                                                                             #
+#    4) Leasing tokens                                                        #
+#       - global/user : lease a batch of tokens to decide requests locally    #
+#       - release     : return the unused tokens of a lease                   #
+#                                                                             #
 #   Note:                                                                     #
 #                                                                             #
 #    + The APIs are called by API gateway instead of each app's biz logic     #
@@ -179,6 +339,29 @@ class GlobalRateLimitConfigAPI(Resource):
         return config_api.delete()
 
 
+@ns_config.route('/bulk')
+@ns_config.response(400, 'The body is not a JSON array or NDJSON, of which '
+                         'the items before the error are configured.')
+class BulkRateLimitConfigAPI(Resource):
+    """Rate Limit API to configure the rate-limits of many users at once.
+
+    It is routed to the endpoint of '{{FQDN}}/ratelimit-config/bulk'.
+
+    The body is a JSON array or NDJSON (application/x-ndjson) of the pairs of
+    [user_id, limit] such as ["user-1", "gold"] or ["user-2", 10], or the
+    configs of users such as {"user_id": "user-3", "quota_limit": 10}. The
+    body is read as a stream and configured by the function of
+    configure_limits() in the class of RateLimiter by chunks, so provisioning
+    a tenant of many users doesn't call the API per user.
+    """
+    @ns_config.response(200, 'the numbers of the created and updated users, '
+                             'and [index, user_id] of the failed items')
+    def post(self):
+        """Configure the rate-limiters of many users."""
+        return config_api.bulk(request.stream, request.mimetype in (
+            'application/x-ndjson', 'application/jsonl'))
+
+
 @ns_config.route('/users/<string:id>')
 @ns_config.response(404, 'Unable to find a user rate-limit configuration.')
 @ns_config.response(409, 'The user rate-limit is already configured.')
@@ -263,15 +446,54 @@ class UserRateLimitDecrementAPI(Resource):
 
 @ns_status.route('')
 @ns_status.response(404, 'Status not found')
+@ns_status.param('cursor', 'The cursor of the page (X-Next-Cursor)', type=int)
+@ns_status.param('limit', 'The max number of the statuses of a page',
+                 type=int)
+@ns_status.param('prefix', 'The prefix of the keys of the buckets')
+@ns_status.param('exhausted', 'Only the buckets w/o the quota remaining',
+                 type=bool)
 class RateLimitStatusAPI(Resource):
     """Rate Limit API to list quota remaining status of global/user limiter.
 
     It is routed to the endpoint of '{{FQDN}}/ratelimit-status'.
+
+    The statuses are listed page by page, and the header of X-Next-Cursor is
+    the cursor of the next page unless it is the last page.
     """
     @ns_status.marshal_with(limit_res_model, code=200)
     def get(self):
         """Get list of remainig status of global/user rate-limiter"""
-        return status_api.list()
+        return status_api.list(**status_filters(),
+                               cursor=request.args.get('cursor', 0, int),
+                               limit=request.args.get('limit', PAGE_LIMIT,
+                                                      int))
+
+
+@ns_status.route('/stream')
+@ns_status.param('prefix', 'The prefix of the keys of the buckets')
+@ns_status.param('exhausted', 'Only the buckets w/o the quota remaining',
+                 type=bool)
+class RateLimitStatusStreamAPI(Resource):
+    """Rate Limit API to stream quota remaining status of all limiters.
+
+    It is routed to the endpoint of '{{FQDN}}/ratelimit-status/stream'.
+
+    The statuses of all the buckets are streamed as NDJSON (a JSON object
+    per line) while the buckets are scanned by chunks, so the process isn't
+    stopped by encoding millions of buckets at once.
+    """
+    @ns_status.produces(['application/x-ndjson'])
+    def get(self):
+        """Stream the remainig status of all rate-limiters as NDJSON"""
+        return Response(status_api.stream(**status_filters()),
+                        mimetype='application/x-ndjson')
+
+
+def status_filters():
+    """Return the filters of the status APIs of the query string."""
+    return {'prefix': request.args.get('prefix'),
+            'exhausted': request.args.get('exhausted', '').lower() in (
+                'true', '1')}
 
 
 @ns_status.route('/global')
@@ -300,6 +522,165 @@ class UserRateLimitStatusAPI(Resource):
         return status_api.get(id)
 
 
+@ns_status.route('/evictions')
+class RateLimitEvictionStatusAPI(Resource):
+    """Rate Limit API to get the number of buckets and evicted buckets.
+
+    It is routed to the endpoint of '{{FQDN}}/ratelimit-status/evictions'.
+
+    The idle buckets are evicted when the environment variables of the max
+    number of buckets (RATE_LIMITER_MAX_BUCKETS) or the idle TTL in seconds
+    (RATE_LIMITER_IDLE_TTL) are set.
+    """
+    def get(self):
+        """Get the number of evicted buckets by reason"""
+        return status_api.evictions()
+
+
+@ns_status.route('/top-talkers')
+@ns_status.response(404, 'Heavy hitters are turned off')
+@ns_status.param('top', 'The max number of the top talkers per window',
+                 type=int, default=TOP_TALKERS)
+class RateLimitTopTalkersStatusAPI(Resource):
+    """Rate Limit API to get the top talkers and their deny ratios.
+
+    It is routed to the endpoint of '{{FQDN}}/ratelimit-status/top-talkers'.
+
+    The keys of the most requests (allowed or denied) are counted by a fixed
+    number of counters (RATE_LIMITER_HEAVY_HITTERS) per time window
+    (RATE_LIMITER_HEAVY_HITTER_WINDOW), and listed of the current window and
+    the last windows. The requests of a key are an upper bound, which is
+    over-counted by the error at most.
+    """
+    def get(self):
+        """Get the top talkers and deny ratios per window"""
+        return status_api.top_talkers(
+            request.args.get('top', TOP_TALKERS, type=int))
+
+
+@ns_lease.route('/global')
+@ns_lease.response(404, 'Unable to find a global rate-limit configuration.')
+@ns_lease.response(429, 'Too many requests.')
+class GlobalRateLimitLeaseAPI(Resource):
+    """Rate Limit API to lease a batch of tokens of the global rate-limit.
+
+    It is routed to the endpoint of '{{FQDN}}/ratelimit-leases/global'.
+
+    The client (e.g. API gateway) decides the requests locally w/ the tokens
+    until the lease expires instead of calling the decrement API per request,
+    and returns the unused tokens. The tokens are charged to the bucket when
+    they are granted, so the quota limit is kept w/ the outstanding leases.
+    """
+    @ns_lease.expect(lease_req_model)
+    @ns_lease.marshal_with(lease_res_model, code=429)
+    @ns_lease.marshal_with(lease_res_model, code=200)
+    def post(self):
+        """Lease a batch of tokens of the global rate-limiter"""
+        return lease_api.post(api.payload)
+
+
+@ns_lease.route('/users/<string:id>')
+@ns_lease.response(404, 'Unable to find a user rate-limit configuration.')
+@ns_lease.response(429, 'Too many requests.')
+@ns_lease.param('id', 'Please enter a user ID')
+class UserRateLimitLeaseAPI(Resource):
+    """Rate Limit API to lease a batch of tokens of a user rate-limit.
+
+    It is routed to the endpoint of '{{FQDN}}/ratelimit-leases/users/<id>'.
+    """
+    @ns_lease.expect(lease_req_model)
+    @ns_lease.marshal_with(lease_res_model, code=429)
+    @ns_lease.marshal_with(lease_res_model, code=200)
+    def post(self, id):
+        """Lease a batch of tokens of a user's rate-limiter"""
+        return lease_api.post(api.payload, id)
+
+
+@ns_lease.route('/<int:lease_id>/release')
+@ns_lease.response(404, 'Unable to find the lease, or it is expired.')
+@ns_lease.param('lease_id', 'Please enter a lease ID')
+class RateLimitLeaseReleaseAPI(Resource):
+    """Rate Limit API to return the unused tokens of a lease.
+
+    It is routed to the endpoint of
+    '{{FQDN}}/ratelimit-leases/<int:lease_id>/release'.
+
+    The unused tokens are leased again to the key until the lease expires.
+    """
+    @ns_lease.expect(lease_release_req_model)
+    @ns_lease.marshal_with(lease_release_res_model, code=200)
+    def post(self, lease_id):
+        """Return the unused tokens of a lease"""
+        return lease_api.release(lease_id, api.payload)
+
+
+def init_app():
+    """Start the components of the app in the process serving the requests,
+    which is called once per process.
+
+    The buckets are restored from the snapshot or the journal, and the
+    limits of the users are loaded from RATE_LIMITER_LOAD_PATH (CSV or
+    JSONL). Then the decrement endpoints are also served by the asyncio
+    server of the data plane and the binary protocol server (TCP and/or Unix
+    socket path) sharing the limiter, and the deltas of the replicated
+    counters are synced w/ the peers or the bucket state is streamed to the
+    standbys. The servers of the decrement endpoints of a standby are
+    started when it is promoted."""
+    global initialized
+    with init_lock:
+        if initialized:
+            return
+        initialized = True
+    data_plane_port = int(environ.get("RATE_LIMITER_DATA_PLANE_PORT",
+                                      DATA_PLANE_PORT))
+    binary_port = int(environ.get("RATE_LIMITER_BINARY_PORT", BINARY_PORT))
+    binary_socket = environ.get("RATE_LIMITER_BINARY_SOCKET")
+    replication_port = int(environ.get("RATE_LIMITER_REPLICATION_PORT",
+                                       REPLICATION_PORT))
+    load_path = environ.get("RATE_LIMITER_LOAD_PATH")
+
+    def start_data_planes(limiter):
+        if data_plane_port:
+            start_data_plane(limiter, '0.0.0.0', data_plane_port)
+        if binary_port:
+            start_binary_server(limiter, '0.0.0.0', binary_port)
+        if binary_socket:
+            start_binary_server(limiter, path=binary_socket)
+
+    if journal is not None:
+        journal.open(limiter, policies_api)
+    if snapshots is not None:
+        snapshots.restore()
+        snapshots.start()
+    if load_path:
+        load_limits(limiter, load_path, progress=print_progress)
+    if isinstance(storage, RateLimitCRDTStorage):
+        storage.start('0.0.0.0', replication_port)
+    if isinstance(replica, RateLimitStandby):
+        replica.on_promote = start_data_planes
+        host, _, primary_port = primary_address.rpartition(':')
+        replica.follow(host, int(primary_port))
+    else:
+        start_data_planes(limiter)
+        if replica is not None:
+            replica.start('0.0.0.0', standby_port)
+
+
+def create_app():
+    """Return the app w/ its components started for a WSGI server (e.g.
+    gunicorn 'app:create_app()' or flask --app 'app:create_app()' run
+    --no-reload). The components of gunicorn --preload are started in the
+    master process, which shares the buckets w/ the pre-forked workers."""
+    init_app()
+    return app
+
+
 if __name__ == '__main__':
     port = int(environ.get("RATE_LIMITER_PORT", 8000))
-    app.run(debug=True, host='0.0.0.0', port=port)
+    debug = environ.get("RATE_LIMITER_DEBUG", "true").lower() == "true"
+
+    # The reloader of the debug mode runs the app in a child process, so the
+    # components are started in the child, not in the parent of the reloader.
+    if not debug or environ.get("WERKZEUG_RUN_MAIN") == "true":
+        init_app()
+    app.run(debug=debug, host='0.0.0.0', port=port)
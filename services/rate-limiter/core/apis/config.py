@@ -3,27 +3,41 @@
 from copy import deepcopy
 from core.common.constants import (
     RateLimitLevel as Level,
-    RateLimitPer as Per
+    WINDOW_LIMIT_PER
+)
+from core.common.exceptions import RateLimitConfigNotFound
+from core.common.utils import (
+    chunks,
+    data_not_found,
+    data_not_supported,
+    iter_json,
+    parse_config_item,
+    parse_limits
 )
-from core.common.utils import data_not_found
 from http import HTTPStatus
 
+BULK_CHUNK = 10000
+
 
 class RateLimitConfig:
     """Business Logic for Rate Limit Config API"""
 
-    def __init__(self, limiter=None, namespace=None):
+    def __init__(self, limiter=None, namespace=None, journal=None):
         self.limiter = limiter
         self.namespace = namespace
+        self.journal = journal
 
     def get(self, user_id=None):
         key = self._validate_limiter(user_id)
         if key is not None:
+            tier = self.limiter.tier(key)
             return {
                 'bucket_name': str(key),
-                'quota_limit': self.limiter.quota_limit(key),
-                'limit_per': Per.SEC,
-                'quota_remaining': self.limiter.cur_remaining(key)
+                'quota_limit': tier.quota_limit,
+                'limit_per': WINDOW_LIMIT_PER.get(tier.time_window),
+                'quota_remaining': self.limiter.cur_remaining(key),
+                'policy': tier.name,
+                'limits': _limits(tier)
             }, HTTPStatus.OK
 
     def put(self, data, user_id=None):
@@ -31,15 +45,86 @@ class RateLimitConfig:
         code = 200 if self.limiter.is_configured(key) else 201
         return self._upsert(key, data), code
 
+    def bulk(self, stream, ndjson=False):
+        """Configure the users of a JSON array, or NDJSON if ndjson is set,
+        of a stream.
+
+        An item is a pair of [user_id, limit] of which the limit is a name
+        of a policy, a quota limit per second or a body of the PUT API, or
+        a body of the PUT API w/ 'user_id'. The items are configured by
+        chunks in one pass, and the failed items are reported compactly by
+        [index, user_id].
+
+        If the stream isn't valid JSON, the items before the error are
+        configured, and 400 is returned w/ the results of them and the index
+        of the item of the error."""
+        created = updated = start = 0
+        failed, errors = [], []
+
+        def items_of(stream):
+            try:
+                yield from iter_json(stream, ndjson)
+            except ValueError as e:
+                errors.append(e)
+
+        for items in chunks(items_of(stream), BULK_CHUNK):
+            pairs, records, indexes = [], [], []
+            for i, item in enumerate(items):
+                config = parse_config_item(item)
+                if config is None:
+                    failed.append([start + i, _item_key(item)])
+                    continue
+                key, policy, limits = config
+                pairs.append((key, policy or limits))
+                records.append(config)
+                indexes.append(i)
+            res = self.limiter.configure_limits(pairs)
+            created += res.created
+            updated += res.updated
+            rejected = set(i for i, _ in res.failed)
+            for i, key in res.failed:
+                failed.append([start + indexes[i], key])
+            if self.journal is not None:
+                self.journal.log_configs(
+                    [record for i, record in enumerate(records)
+                     if i not in rejected])
+            start += len(items)
+        failed.sort()
+        res = {'created': created, 'updated': updated, 'failed': failed}
+        if errors:
+            res['error'] = {'index': start,
+                            'message': f'body ({errors[0]}) not supported'}
+            return res, HTTPStatus.BAD_REQUEST
+        return res, HTTPStatus.OK
+
     def _upsert(self, key, data):
-        quota_limit = data['quota_limit']
-        if key == Level.GLOBAL:
-            self.limiter.configure_global_limit(rps=quota_limit)
-        else:
-            self.limiter.configure_limit(user_id=key, rps=quota_limit)
+        policy = data.get('policy')
+        try:
+            limits, limit_per = ([], None) if policy else parse_limits(data)
+        except ValueError as e:
+            return data_not_supported(f"limits ({e})", self.namespace)
+        if limits is None:
+            return data_not_supported(f"limit_per ({limit_per})",
+                                      self.namespace)
+        try:
+            if key == Level.GLOBAL:
+                self.limiter.configure_global_limit(tier=policy, limits=limits)
+            else:
+                self.limiter.configure_limit(user_id=key, tier=policy,
+                                             limits=limits)
+        except RateLimitConfigNotFound:
+            return data_not_found(f"policy ({policy})", self.namespace)
+        except ValueError as e:
+            return data_not_supported(f"limits ({e})", self.namespace)
+        if self.journal is not None:
+            self.journal.log_config(key, policy, limits)
 
+        tier = self.limiter.tier(key)
         res = deepcopy(data)
         res['bucket_name'] = key
+        res['quota_limit'] = tier.quota_limit
+        res['limit_per'] = WINDOW_LIMIT_PER.get(tier.time_window)
+        res['limits'] = _limits(tier)
         res['quota_remaining'] = self.limiter.cur_remaining(key)
         return res
 
@@ -47,6 +132,8 @@ class RateLimitConfig:
         key = self._validate_limiter(user_id)
         if key is not None:
             self.limiter.remove_bucket(key)
+            if self.journal is not None:
+                self.journal.log_removal(key)
             return {}, HTTPStatus.NO_CONTENT
 
     def _validate_limiter(self, user_id=None):
@@ -55,3 +142,19 @@ class RateLimitConfig:
             data_not_found(key, self.namespace)
             return None
         return key
+
+
+def _item_key(item):
+    """Return the user ID of an item of the bulk API to report it."""
+    if isinstance(item, dict):
+        return item.get('user_id')
+    if isinstance(item, list) and item:
+        return item[0]
+    return None
+
+
+def _limits(tier):
+    """Return a list of the time windows of a tier for the response."""
+    return [{'quota_limit': quota_limit,
+             'limit_per': WINDOW_LIMIT_PER.get(time_window)}
+            for quota_limit, time_window in tier.limits()]
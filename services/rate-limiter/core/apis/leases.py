@@ -0,0 +1,50 @@
+"""Business Logic for Rate Limit Lease API"""
+
+from core.common.constants import NS_PER_SEC, RateLimitLevel as Level
+from core.common.exceptions import RateLimitLeaseNotFound
+from core.common.utils import data_not_found, data_not_supported, limit_per
+from http import HTTPStatus
+
+
+class RateLimitLeasing:
+    """Business Logic for Rate Limit Lease API
+
+    A lease grants a batch of tokens of the key which the client (e.g. API
+    gateway) spends to decide the requests locally w/o calling the decrement
+    API per request."""
+
+    def __init__(self, limiter=None, namespace=None):
+        self.limiter = limiter
+        self.namespace = namespace
+
+    def post(self, data, user_id=None):
+        key = Level.GLOBAL if user_id is None else user_id
+        tokens = data.get('tokens', 1)
+        ttl = data.get('ttl')
+        if not isinstance(tokens, int) or tokens < 1:
+            return data_not_supported(f"tokens ({tokens})", self.namespace)
+        if ttl is not None and (not isinstance(ttl, (int, float)) or ttl <= 0):
+            return data_not_supported(f"ttl ({ttl})", self.namespace)
+        now = self.limiter.time_ns()
+        lease = self.limiter.lease(key, tokens, ttl, now)
+        if lease is None:
+            return data_not_found(key, self.namespace)
+        return {
+            'lease_id': lease.lease_id,
+            'bucket_name': str(key),
+            'tokens': lease.tokens,
+            'expires_in': max(0, lease.expires_at - now) / NS_PER_SEC,
+            'quota_limit': lease.limit,
+            'limit_per': limit_per(lease.window),
+            'quota_remaining': lease.remaining
+        }, HTTPStatus.OK if lease.tokens else HTTPStatus.TOO_MANY_REQUESTS
+
+    def release(self, lease_id, data):
+        unused = data.get('unused', 0)
+        if not isinstance(unused, int) or unused < 0:
+            return data_not_supported(f"unused ({unused})", self.namespace)
+        try:
+            returned = self.limiter.release_lease(lease_id, unused)
+        except RateLimitLeaseNotFound:
+            return data_not_found(f"lease ({lease_id})", self.namespace)
+        return {'lease_id': lease_id, 'returned': returned}, HTTPStatus.OK
@@ -1,17 +1,32 @@
-"""Business Logic for Rate Limit Policy Configuration API in Control Plane"""
+"""Business Logic for Rate Limit Policy Configuration API in Control Plane
 
-from core.common.constants import RateLimitLevel as Level, RateLimitPer as Per
+The policies of requests per second (rps) or per sub-second period (e.g.
+rp100ms) are shared with the rate limiter as named tiers so that updating a
+policy updates the quota limit of all the users that are configured with the
+policy in O(1).
+"""
+
+from core.common.constants import (
+    RateLimitLevel as Level,
+    RateLimitPer as Per,
+    LIMIT_PER_WINDOW
+)
+from core.common.exceptions import RateLimitConfigNotFound
 from core.common.utils import data_not_found, data_already_exist
 
 
 class RateLimitPolicy:
     """Business Logic for Rate Limiter Policy API"""
 
-    def __init__(self, namespace=None):
+    def __init__(self, namespace=None, limiter=None, journal=None):
         self.rows = {}
         self.names = set()
         self.namespace = namespace
+        self.limiter = limiter
+        self.journal = None
         self._set_default_data()
+        self.defaults = tuple(self.rows)
+        self.journal = journal
 
     def list(self):
         """Get list of rate-limit policies"""
@@ -31,7 +46,7 @@ class RateLimitPolicy:
         if data['name'] in self.names:
             return data_already_exist(data['name'], self.namespace)
 
-        id = len(self.rows) + 1
+        id = max(self.rows, default=0) + 1
         return self._upsert(id, data), 201
 
     def put(self, id, data):
@@ -42,9 +57,17 @@ class RateLimitPolicy:
 
     def _upsert(self, id, data):
         """Create or Update a rate-limit policy"""
+        row = self.rows.get(id)
+        if row is not None and row['name'] != data['name']:
+            self._remove_tier(row['name'])
         data['id'] = id
         self.rows[id] = data
         self.names.add(data['name'])
+        window = LIMIT_PER_WINDOW.get(data.get('rate'))
+        if self.limiter is not None and window is not None:
+            self.limiter.configure_tier(data['name'], data['req_cnt'], window)
+        if self.journal is not None:
+            self.journal.log_policy(id, data)
         return data
 
     def delete(self, id):
@@ -52,9 +75,27 @@ class RateLimitPolicy:
         if id not in self.rows:
             return data_not_found(f"ID ({id})", self.namespace)
 
-        del self.rows[id]
+        self._remove(id)
+        if self.journal is not None:
+            self.journal.log_policy_removal(id)
         return {}, 204
 
+    def _remove(self, id):
+        """Remove a rate-limit policy and its named tier, if it exists"""
+        row = self.rows.pop(id, None)
+        if row is not None:
+            self._remove_tier(row['name'])
+
+    def _remove_tier(self, name):
+        """Remove the name and the named tier of a deleted or renamed policy,
+        of which the buckets keep the limits until they're configured."""
+        self.names.discard(name)
+        if self.limiter is not None:
+            try:
+                self.limiter.remove_tier(name)
+            except RateLimitConfigNotFound:
+                pass
+
     def _set_default_data(self):
         self.post({'id': 1, 'name': 'global-level-rate-limit',
                    'level': Level.GLOBAL, 'rate': Per.SEC, 'req_cnt': 5})
@@ -1,9 +1,24 @@
-"""Business Logic for Rate Limiter Status API"""
+"""Business Logic for Rate Limiter Status API
 
-from core.common.constants import RateLimitLevel as Level, RateLimitPer as Per
-from core.common.utils import data_not_found
+The statuses of millions of buckets are listed page by page by the cursor of
+the buckets (RateLimiter.scan_buckets), or streamed as NDJSON by chunks of
+the buckets, rather than built as a list of all the buckets at once. The
+filters (key prefix, exhausted only) are applied while the buckets are
+scanned.
+"""
+
+import json
+from core.common.constants import RateLimitLevel as Level
+from core.common.utils import data_not_found, limit_per
+from core.controller.heavy_hitters import DEFAULT_TOP as TOP_TALKERS
 from http import HTTPStatus
 
+PAGE_LIMIT = 1000
+MAX_PAGE_LIMIT = 10000
+
+_SCAN_COUNT = 4096
+_MAX_SCAN = 1 << 16
+
 
 class RateLimitStatus:
     """Business Logic for Rate Limit Status API"""
@@ -12,26 +27,89 @@ class RateLimitStatus:
         self.limiter = limiter
         self.namespace = namespace
 
-    def list(self):
-        res = [self._data(key) for key in self.limiter.buckets.keys()]
-        return res, 200 if self.limiter.buckets else 404
+    def list(self, cursor=0, limit=PAGE_LIMIT, prefix=None, exhausted=False):
+        """Return a page of up to limit statuses from the cursor, and the
+        next cursor by the header of X-Next-Cursor unless it is the last
+        page.
+
+        A page may have fewer statuses w/ the next cursor if the filters
+        don't match the buckets of a scan, so a request doesn't scan all the
+        buckets."""
+        limit = max(1, min(limit, MAX_PAGE_LIMIT))
+        res, next_cursor, scanned = [], cursor, 0
+        while True:
+            count = min(limit - len(res), _SCAN_COUNT)
+            next_cursor, keys = self.limiter.scan_buckets(next_cursor, count)
+            res += self._statuses(keys, prefix, exhausted)
+            scanned += count
+            if not next_cursor or len(res) >= limit or scanned >= _MAX_SCAN:
+                break
+        if next_cursor:
+            return res, HTTPStatus.OK, {'X-Next-Cursor': str(next_cursor)}
+        return res, 200 if res or cursor else 404
+
+    def stream(self, prefix=None, exhausted=False):
+        """Yield the statuses of all the buckets as NDJSON (a JSON object per
+        line) by chunks of the buckets."""
+        cursor = 0
+        while True:
+            cursor, keys = self.limiter.scan_buckets(cursor, _SCAN_COUNT)
+            lines = ''.join(f'{json.dumps(data)}\n' for data in
+                            self._statuses(keys, prefix, exhausted))
+            if lines:
+                yield lines.encode()
+            if not cursor:
+                return
 
     def get(self, user_id=None):
-        key = self._validate_limiter(user_id)
-        if key is not None:
-            return self._data(key), HTTPStatus.OK
+        key = Level.GLOBAL if user_id is None else user_id
+        data = self._data(key)
+        if data is None:
+            return data_not_found(key, self.namespace)
+        return data, HTTPStatus.OK
+
+    def evictions(self):
+        return self.limiter.eviction_stats(), HTTPStatus.OK
+
+    def top_talkers(self, top=TOP_TALKERS):
+        """Return the top talkers and the deny ratios of the windows of the
+        heavy hitters, of the current window first."""
+        if self.limiter.heavy_hitters is None:
+            return {'message': 'heavy hitters are turned off'}, 404
+        return [{
+            'start': window.start,
+            'end': window.end,
+            'requests': window.requests,
+            'denied': window.denied,
+            'deny_ratio': round(window.deny_ratio, 4),
+            'top_talkers': [{
+                'bucket_name': talker.key,
+                'requests': talker.requests,
+                'error': talker.error,
+                'denied': talker.denied,
+                'deny_ratio': round(talker.deny_ratio, 4)
+            } for talker in window.talkers]
+        } for window in self.limiter.top_talkers(top)], HTTPStatus.OK
+
+    def _statuses(self, keys, prefix=None, exhausted=False):
+        """Yield the statuses of the keys of the prefix, and of the exhausted
+        buckets only if exhausted is set."""
+        for key in keys:
+            if prefix and not str(key).startswith(prefix):
+                continue
+            data = self._data(key)
+            if data is None or (exhausted and data['quota_remaining'] > 0):
+                continue
+            yield data
 
     def _data(self, key):
+        """Return the status of a bucket w/o consuming the quota, or None."""
+        decision = self.limiter.try_acquire(key, cost=0)
+        if decision is None:
+            return None
         return {
             'bucket_name': key,
-            'quota_limit': self.limiter.quota_limit(key),
-            'limit_per': Per.SEC,
-            'quota_remaining': self.limiter.quota_limit(key)
+            'quota_limit': decision.limit,
+            'limit_per': limit_per(decision.window),
+            'quota_remaining': decision.remaining
         }
-
-    def _validate_limiter(self, user_id=None):
-        key = Level.GLOBAL if user_id is None else user_id
-        if not self.limiter.is_configured(key):
-            data_not_found(key, self.namespace)
-            return None
-        return key
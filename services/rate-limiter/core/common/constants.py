@@ -2,6 +2,8 @@
 
 
 class Duration(object):
+    MS10 = 0.01
+    MS100 = 0.1
     SEC = 1
     MIN = 60
     HOUR = 3600
@@ -16,9 +18,11 @@ class RateLimitLevel(object):
 
 
 class RateLimitPer(object):
+    MS10 = 'rp10ms'
+    MS100 = 'rp100ms'
     SEC = 'rps'
     MIN = 'rpm'
-    HOUR = 'rpm'
+    HOUR = 'rph'
     DAY = 'rpd'
     MON = 'rpM'
 
@@ -26,8 +30,22 @@ class RateLimitPer(object):
 class RateLimitAlgorithm(object):
     TOKEN_BUCKET = 1
     SLIDING_WINDOW_COUNTER = 2
+    GCRA = 3
 
 
+# time window (sec) per label of 'limit_per' which is supported by buckets.
+LIMIT_PER_WINDOW = {
+    RateLimitPer.MS10: Duration.MS10,
+    RateLimitPer.MS100: Duration.MS100,
+    RateLimitPer.SEC: Duration.SEC,
+    RateLimitPer.MIN: Duration.MIN,
+    RateLimitPer.HOUR: Duration.HOUR,
+    RateLimitPer.DAY: Duration.DAY,
+    RateLimitPer.MON: Duration.MON
+}
+WINDOW_LIMIT_PER = {v: k for k, v in LIMIT_PER_WINDOW.items()}
+
 DEFAULT_RPS = 5
 DEFAULT_USER_ID = 1
 DEFAULT_TIME_WINDOW = 1
+NS_PER_SEC = 1000000000
@@ -36,3 +36,18 @@ class RateLimitException(Exception):
 class RateLimitConfigNotFound(RateLimitException):
     status_code = HTTPStatus.NOT_FOUND
     description = 'The rate-limit policy is not configured'
+
+
+class RateLimitLeaseNotFound(RateLimitException):
+    status_code = HTTPStatus.NOT_FOUND
+    description = 'The lease of tokens is not found or expired'
+
+
+class RateLimitNotSupported(RateLimitException):
+    status_code = HTTPStatus.NOT_IMPLEMENTED
+    description = 'The operation is not supported by the bucket backend'
+
+
+class RateLimitJournalError(RateLimitException):
+    status_code = HTTPStatus.SERVICE_UNAVAILABLE
+    description = 'The change is not written to the journal on the disk'
@@ -1,8 +1,21 @@
 """Common Functions"""
 
+from codecs import getincrementaldecoder
+from core.common.constants import (
+    RateLimitPer as Per,
+    LIMIT_PER_WINDOW,
+    NS_PER_SEC,
+    WINDOW_LIMIT_PER
+)
+from itertools import islice
 import datetime as dt
+import json
 import time as tm
 
+_JSON = json.JSONDecoder()
+_READ_SIZE = 1 << 16
+_FIRST, _COMMA, _ITEM = range(3)
+
 
 def data_not_found(data, api=None):
     """return 404 error with body"""
@@ -14,11 +27,78 @@ def data_already_exist(data, api=None):
     api.abort(409, f"{data} already exist")
 
 
+def data_not_supported(data, api=None):
+    """return 400 error with body"""
+    api.abort(400, f"{data} not supported")
+
+
 def utc_time(ms):
     """return UTC format time"""
     return dt.datetime(1970, 1, 1) + dt.timedelta(milliseconds=ms*100)
 
 
+def to_ns(seconds):
+    """return integer nanoseconds of seconds"""
+    return int(round(seconds * NS_PER_SEC))
+
+
+def limit_per(window_ns):
+    """return the label of limit_per (e.g. 'rps') of a time window in ns"""
+    return WINDOW_LIMIT_PER.get(window_ns / NS_PER_SEC)
+
+
+def parse_limits(data):
+    """Return (limits, None) of a list of (quota limit, time window) of the
+    body of the PUT API, or (None, limit_per) if limit_per isn't supported.
+
+    Raise ValueError if a quota limit is missing or isn't a non-negative
+    integer."""
+    limits = []
+    for window in data.get('limits') or [data]:
+        limit_per = window.get('limit_per', Per.SEC)
+        if limit_per not in LIMIT_PER_WINDOW:
+            return None, limit_per
+        quota_limit = window.get('quota_limit')
+        if type(quota_limit) is not int or quota_limit < 0:
+            raise ValueError(f'quota_limit ({quota_limit}) of {limit_per}')
+        limits.append((quota_limit, LIMIT_PER_WINDOW[limit_per]))
+    return limits, None
+
+
+def parse_config_item(item):
+    """Return (user_id, policy, limits) of an item of the bulk config, or
+    None if it isn't valid.
+
+    The item is a pair of [user_id, limit] of which the limit is a name of
+    a policy, a quota limit per second or a body of the PUT API, or a body
+    of the PUT API w/ 'user_id'. The user_id is a string or an integer."""
+    if isinstance(item, dict):
+        key, data = item.get('user_id'), item
+    elif isinstance(item, list) and len(item) == 2:
+        key, data = item
+    else:
+        return None
+    if isinstance(key, bool) or not isinstance(key, (str, int)):
+        return None
+    if isinstance(data, str):
+        return str(key), data, []
+    if isinstance(data, bool):
+        return None
+    if isinstance(data, int):
+        data = {'quota_limit': data}
+    if not isinstance(data, dict):
+        return None
+    if data.get('policy'):
+        return str(key), data['policy'], []
+    try:
+        limits, _ = parse_limits(data)
+    except (AttributeError, ValueError):
+        return None
+    if limits is None:
+        return None
+    return str(key), data.get('policy'), limits
+
+
 def str_time(ltime):
     """return string format time.
 
@@ -41,17 +121,89 @@ def str_time(ltime):
     return f"{ss}.{ms:6}"
 
 
+class MonotonicClock(object):
+    """The clock protocol of the rate limiter.
+
+    Buckets only call time_ns() which returns integer nanoseconds of a
+    monotonic clock. So the quota isn't refilled or frozen when the wall clock
+    is stepped by NTP, and the time windows are calculated by integer math
+    without floating point errors. time() and sleep() are for logs and tests.
+    """
+
+    def time_ns(self):
+        return tm.monotonic_ns()
+
+    def time(self):
+        return tm.monotonic()
+
+    def sleep(self, seconds):
+        tm.sleep(seconds)
+
+
+class WallClock(MonotonicClock):
+    """A clock of integer nanoseconds of the wall clock (time.time_ns).
+
+    The monotonic clocks of the machines aren't comparable, so the nodes of
+    a replicated rate-limiter (e.g. core/controller/crdt.py) align the time
+    windows of the keys by the wall clock synchronized by NTP instead.
+    """
+
+    def time_ns(self):
+        return tm.time_ns()
+
+    def time(self):
+        return tm.time()
+
+
+class CoarseClock(object):
+    """A clock which reads the underlying clock only once per tick().
+
+    A data plane calls tick() once per request or batch of requests, and all
+    the decisions in between use the same cached time instead of reading the
+    clock several times per decision.
+
+        clock = CoarseClock()
+        limiter = RateLimiter(clock)
+        for batch in batches:
+            clock.tick()
+            for key in batch:
+                limiter.process_request(key)
+    """
+
+    def __init__(self, clock=None):
+        self._clock = MonotonicClock() if clock is None else clock
+        self.tick()
+
+    def tick(self):
+        """Read the underlying clock, and return the cached time (ns)."""
+        self._now = self._clock.time_ns()
+        return self._now
+
+    def time_ns(self):
+        return self._now
+
+    def time(self):
+        return self._now / NS_PER_SEC
+
+    def sleep(self, seconds):
+        self._clock.sleep(seconds)
+        self.tick()
+
+
 class FakeClock(object):
     """A fake clock for testing.
 
     The concept of a fake clock can run faster than the system clock so that we
     can quickly test the rate limiter without waiting full second when using a
-    function of sleep() function.
+    function of sleep() function. It implements the clock protocol of the
+    MonotonicClock.
 
     Attributes:
         factor: A float value indicating how to scale down system sleep time.
-                Regardless of scaling down a sleeping time, the time() returns
-                real current time based on the formula of 'time() * _factor'.
+                Regardless of scaling down a sleeping time, the time_ns()
+                returns real monotonic time based on the formula of
+                'monotonic_ns() * _factor', and the time() returns real
+                current time (wall clock) by 'time() * _factor'.
                 +--------+---------------------------+
                 | factor |       sleep() second      |
                 |        +--------------+------------+
@@ -66,6 +218,9 @@ class FakeClock(object):
     def __init__(self, factor=1):
         self._factor = factor
 
+    def time_ns(self):
+        return int(tm.monotonic_ns() * self._factor)
+
     def time(self):
         return tm.time() * self._factor
 
@@ -74,3 +229,93 @@ class FakeClock(object):
 
     def sleep(self, seconds):
         tm.sleep(seconds / self._factor)
+
+
+class ManualClock(object):
+    """A fake clock which is set or moved by the caller.
+
+    A test case (or a replay of requests) sets the time (ns) to now, or moves
+    it by sleep() w/o waiting. The time is moved by step (ns) per reading of
+    the clock if it is given, e.g. to measure a second per chunk of a loop.
+
+        clock = ManualClock(1000 * NS_PER_SEC)
+        limiter = RateLimiter(clock)
+        clock.now = timestamp
+    """
+
+    def __init__(self, now=0, step=0):
+        self.now = now
+        self.step = step
+
+    def time_ns(self):
+        self.now += self.step
+        return self.now
+
+    def time(self):
+        return self.time_ns() / NS_PER_SEC
+
+    def sleep(self, seconds):
+        self.now += to_ns(seconds)
+
+
+def iter_json(stream, ndjson=False, read_size=_READ_SIZE):
+    """Yield the items of a JSON array, or NDJSON (a JSON value per line) if
+    ndjson is set, of a binary stream (e.g. a request body) while it is read
+    in chunks.
+
+    So the memory is bound by a chunk and an item rather than the stream.
+    A ValueError is raised if the stream isn't a valid JSON array or NDJSON.
+    """
+    decoder = getincrementaldecoder('utf-8')()
+    buf, pos, eof, array = '', 0, False, False if ndjson else None
+    # the items of an array are separated by commas: the first item (or the
+    # end of the array), a comma (or the end) after an item, or an item
+    # after a comma is expected.
+    expected = _FIRST
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                if array:
+                    raise ValueError('JSON array is not closed')
+                return
+        elif array is None:
+            if buf[pos] != '[':
+                raise ValueError('not a JSON array')
+            array, pos = True, pos + 1
+            continue
+        elif array and buf[pos] == ']' and expected != _ITEM:
+            return
+        elif array and expected == _COMMA:
+            if buf[pos] != ',':
+                raise ValueError('comma is expected between the items')
+            expected, pos = _ITEM, pos + 1
+            continue
+        elif array and buf[pos] in ',]':
+            raise ValueError('item is expected')
+        else:
+            try:
+                item, end = _JSON.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                end = len(buf)
+            # the item at the end of the buffer may be cut (e.g. a number).
+            if end < len(buf) or eof:
+                pos, expected = end, _COMMA
+                yield item
+                continue
+        chunk = stream.read(read_size)
+        eof = not chunk
+        buf, pos = buf[pos:] + decoder.decode(chunk, final=eof), 0
+
+
+def chunks(iterable, size):
+    """Yield lists of up to size items of an iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,142 @@
+"""Vectorized Batch Decision Kernel for Token Buckets
+
+The kernel evaluates a large array of (bucket, timestamp) requests in one call
+with NumPy array math, and returns the same results of calling decrement() of
+each bucket one by one in the order of timestamps per key.
+
+How It Works:
+=============
+  The token bucket of RateLimitBucket.decrement() refills the whole quota when
+  at least one time window has passed since the last update, or when the quota
+  remaining is already full. So the events of a key are split into windows
+  which start at an 'anchor' event, and the first 'quota_limit' events of each
+  window are allowed.
+
+    events of a key :  e0  e1  e2 | e3  e4  e5  e6 | e7 ...
+    window          :  initial    | anchor=e3      | anchor=e7
+    allowed if      :  pos < R0   | pos < quota_limit
+
+  1. nxt[i]  : the first event j of the same key where t[j] - t[i] >= W,
+               i.e. the anchor of the next window if e[i] is an anchor.
+  2. start   : the first anchor of each key which depends on the bucket state
+               (R0: quota remaining, L0: last update time).
+  3. anchors : the events on the chain of start -> nxt[start] -> ... which are
+               found by list ranking and binary lifting in O(n log n).
+  4. allowed : the position of each event in its window < the window capacity.
+
+  Note that timestamps must be sorted per key, and must not be earlier than
+  the last update time of the bucket. All times are integer nanoseconds so
+  that the windows are decided exactly by integer math.
+"""
+
+import numpy as np
+
+
+def decide_batch(groups, timestamps, limits, windows, remaining, last_update):
+    """Decide a batch of requests for the buckets of the groups.
+
+    Args:
+        groups    : int64 array of a dense bucket ID (0 ~ G-1) per request.
+        timestamps: int64 array of request time (ns) per request.
+        limits, windows, remaining, last_update: bucket state per bucket ID.
+
+    Returns:
+        A tuple of (allowed per request, remaining per bucket ID, last update
+        time per bucket ID) after processing all requests.
+    """
+    n = len(groups)
+    if n == 0:
+        return np.empty(0, dtype=bool), remaining, last_update
+
+    order = np.argsort(groups, kind='stable')
+    g = groups[order]
+    t = timestamps[order]
+    idx = np.arange(n, dtype=np.int64)
+
+    # boundaries [lo, hi) of events per bucket ID.
+    first = np.empty(n, dtype=bool)
+    first[0] = True
+    np.not_equal(g[1:], g[:-1], out=first[1:])
+    starts = np.flatnonzero(first)
+    ends = np.append(starts[1:], n)
+    gid = np.cumsum(first) - 1
+    lo = starts[gid]
+    hi = ends[gid]
+    limit = limits[g]
+    window = windows[g]
+
+    if np.any(~first & (np.diff(t, prepend=t[0]) < 0)):
+        raise ValueError('timestamps must be sorted per key')
+    if np.any(t[starts] < last_update[g[starts]]):
+        raise ValueError('timestamps must not be earlier than last update')
+
+    nxt = _next_window(t, window, starts, hi, gid)
+
+    # the first anchor per bucket: the first event if the quota is full or
+    # the first event after a time window from the last update time.
+    refill = t - last_update[g] >= window
+    first_refill = np.minimum.reduceat(np.where(refill, idx, n), starts)
+    full = remaining[g[starts]] >= limits[g[starts]]
+    s = np.where(full, starts, first_refill)
+    s_ev = s[gid]
+
+    anchor = _on_chain(nxt, s_ev, idx, n)
+
+    a = np.maximum.accumulate(np.where(anchor, idx, -1))
+    initial = a < lo
+    base = np.where(initial, lo, a)
+    capacity = np.where(initial, remaining[g], limit)
+    allowed = (idx - base) < capacity
+
+    # bucket state of each bucket ID at the last event of the bucket.
+    last = ends - 1
+    count = last - base[last] + 1
+    cap = capacity[last]
+    new_remaining = remaining.copy()
+    new_last_update = last_update.copy()
+    new_remaining[g[last]] = cap - np.minimum(cap, count)
+    new_last_update[g[last]] = np.where(
+        limit[last] == 0, t[last],
+        np.where(initial[last], last_update[g[last]], t[base[last]]))
+
+    res = np.empty(n, dtype=bool)
+    res[order] = allowed
+    return res, new_remaining, new_last_update
+
+
+def _next_window(t, window, starts, hi, gid):
+    """Return the first event of the next window per event (n if none).
+
+    The events are shifted per group so that they are sorted globally without
+    overlapping the other groups, and then 't + window' of each event is found
+    by a binary search."""
+    n = len(t)
+    span = np.maximum.reduceat(t, starts) - t[starts] + window[starts] + 1
+    shift = (np.cumsum(span) - span - t[starts])[gid]
+    j = np.searchsorted(t + shift, t + shift + window, side='left')
+    return np.where(j < hi, j, n)
+
+
+def _on_chain(nxt, s_ev, idx, n):
+    """Return if each event is on the chain of anchors from its group start.
+
+    The depth (number of hops to the end) is computed by list ranking, and the
+    ancestor of the start at the depth of each event is found by binary
+    lifting with doubling the jump table on the fly."""
+    jump = np.append(nxt, n)
+    depth = np.append((nxt != n).astype(np.int64), 0)
+    p = jump.copy()
+    while np.any(p[:n] != n):
+        depth = depth + depth[p]
+        p = p[p]
+
+    k = depth[s_ev] - depth[:n]
+    valid = (idx >= s_ev) & (k >= 0)
+    k = np.where(valid, k, 0)
+    pos = s_ev.copy()
+    while np.any(k):
+        odd = (k & 1).astype(bool)
+        pos[odd] = jump[pos[odd]]
+        jump = jump[jump]
+        k >>= 1
+    return valid & (pos == idx)
@@ -1,6 +1,6 @@
 """Token Bucket for Rate Limiter"""
 
-import time
+from core.common.utils import MonotonicClock, to_ns
 
 
 class RateLimitBucket:
@@ -43,7 +43,7 @@ class RateLimitBucket:
         +------------------+--------+-----+------------------+   +---------+
     """
 
-    def __init__(self, quota_limit, time_window, clock=time):
+    def __init__(self, quota_limit, time_window, clock=None):
         """Set request-quota limit associated to a client in time-window(sec).
 
         Attributes:
@@ -51,44 +51,57 @@ class RateLimitBucket:
                           per time window. (e.g. requests per second: rps)
             _time_window: An integer second which is an window size to track
                           fixed window (e.g. 1, 60 or 3600 seconds).
-            _clock      : A time object to use either real or fake clock.
+            _window_ns  : An integer nanoseconds of the time window.
+            _clock      : A clock object to use either real or fake clock.
         """
         self._quota_limit = quota_limit
         self._time_window = time_window
-        self._clock = clock
+        self._window_ns = to_ns(time_window)
+        self._clock = MonotonicClock() if clock is None else clock
         self.clear()
 
-    def clear(self):
+    def clear(self, now=None):
         """Initialize quota remaining and last update time either when creating
            this bucket or if quota remaining is greater than quota limit."""
         self._quota_remaining = self._quota_limit
-        self._last_update_time = self._clock.time()
+        self._last_update_time = self._clock.time_ns() if now is None else now
 
-    def decrement(self):
-        """Reduce the quota remaining."""
-        time_allowance = self.time_allowance()
+    def decrement(self, cost=1, now=None):
+        """Reduce the quota remaining by cost.
+
+        The clock is read once per request unless the time (ns) is given by
+        the caller (e.g. once per batch)."""
+        if now is None:
+            now = self._clock.time_ns()
+        time_allowance = self.time_allowance(now)
         self._quota_remaining += time_allowance * self._quota_limit
-        self._last_update_time += time_allowance * self._time_window
+        self._last_update_time += time_allowance * self._window_ns
 
         if self._quota_remaining >= self._quota_limit:
-            self.clear()
+            self.clear(now)
 
-        if self._quota_remaining < 1:
+        if self._quota_remaining < cost:
             return False
 
-        self._quota_remaining -= 1
+        self._quota_remaining -= cost
         return True
 
-    def time_allowance(self):
-        """Return the number of seconds until the quota resets."""
-        time_passed = self._clock.time() - self._last_update_time
-        return int(time_passed // self._time_window)
+    def time_allowance(self, now=None):
+        """Return the number of time windows passed since the last update."""
+        if now is None:
+            now = self._clock.time_ns()
+        return (now - self._last_update_time) // self._window_ns
 
-    def cur_remaining(self):
+    def cur_remaining(self, now=None):
         """Return updated quota remainining as current time is changed."""
         return min(
             self._quota_limit,
-            self._quota_remaining + self.time_allowance() * self._quota_limit)
+            self._quota_remaining +
+            self.time_allowance(now) * self._quota_limit)
+
+    def reset_at(self):
+        """Return the clock time (ns) when the quota remaining is refilled."""
+        return self._last_update_time + self._window_ns
 
     def quota_limit(self):
         """Return quota limit.
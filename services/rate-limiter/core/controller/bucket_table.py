@@ -0,0 +1,936 @@
+"""Compact Bucket Table for Rate Limiter
+
+The table keeps the token bucket state of every key in a struct-of-arrays
+layout instead of one RateLimitBucket object per key. Each slot is addressed
+by an open-addressing key index so that a key costs a handful of machine words
+rather than a Python object with its own __dict__.
+
+Memory Layout:
++---------------+-----------+------------------------------------------------+
+| Field         | Type      | Description                                    |
++---------------+-----------+------------------------------------------------+
+| _index        | int64[M]  | open-addressing index: hash(key) -> slot       |
+|               |           | (M is a power of 2, load factor <= 2/3)        |
+| _keys         | list[N]   | slot -> key (reference only, None if free)     |
+| _tier_ids     | uint32[N] | ID of the shared tier (quota limit, window)    |
+| _remaining    | int64[N]  | quota remaining                                |
+| _last_update  | int64[N]  | last update time (ns) of the time window       |
+| _referenced   | int8[N]   | reference bit of the clock hand for eviction   |
+| _accessed     | int64[N]  | last access time (ns) only if an idle TTL      |
+| _lanes[i]     | int64[N]x2| (remaining, last update) of the i-th window of |
+|               |           | composite tiers (lane 0: the arrays above)     |
++---------------+-----------+------------------------------------------------+
+
+  - per-key cost : 3 x 8 + 4 + 1 bytes for slot arrays + 12 ~ 24 bytes for
+                   the index. (the key object is shared with the caller, and
+                   the quota limit and time window are shared by the tier.)
+  - slot reuse   : removed slots are kept in a free list so that slot numbers
+                   of live keys never move when the table grows.
+  - multi-window : the lanes of extra windows (e.g. 300 rpm + 10k rpd w/ 10
+                   rps) are allocated only when a composite tier is used, and
+                   all the windows of a key are checked and committed at once.
+
+Eviction:
+  The buckets can be bounded by the max number of buckets and an idle TTL. A
+  clock hand sweeps the slots (CLOCK, an approximation of LRU) rather than
+  scanning all buckets periodically:
+    - idle TTL     : each request advances the hand by a few slots, and the
+                     buckets which aren't accessed for the TTL are reclaimed.
+                     (the last update of a bucket of a long window isn't
+                     moved by the requests until the window ends.)
+    - max buckets  : a new bucket advances the hand until a victim is found.
+                     1) idle: the quota is refilled to the quota limit, which
+                              holds no information, 2) ttl: expired bucket,
+                     3) lru : the reference bit is not set since the last
+                              sweep. (the bit is cleared otherwise.)
+  So the eviction costs amortized O(1) per request. The pinned keys such as
+  the global bucket are never evicted. An evicted key is not configured any
+  more until it is configured again (e.g. by the /login workflow).
+
+Concurrency:
+  The table itself isn't thread-safe, but it can be shared by threads w/ the
+  lock striping of RateLimitLockedBuckets (core/controller/locks.py). Only
+  the lookup of a key runs concurrently w/ the structural changes of other
+  keys, so the index is rebuilt aside and replaced at once, and an eviction
+  skips the buckets of which the stripe is locked by another thread.
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from contextlib import nullcontext
+from core.controller.batch import decide_batch
+from core.controller.decision import RateLimitDecision
+from core.common.exceptions import RateLimitNotSupported
+from core.common.utils import MonotonicClock, to_ns
+from core.controller.tier import RateLimitTiers
+import numpy as np
+import sys
+
+_EMPTY = -1
+_DELETED = -2
+_MIN_CAPACITY = 8
+_PERTURB_SHIFT = 5
+_SWEEP_STEPS = 2
+_IMAGE_CHUNK = 1 << 16
+_SCAN_COUNT = 1024
+_REMOVED = object()
+
+
+class RateLimitBucketState(namedtuple(
+        'RateLimitBucketState', ['tier', 'lanes'])):
+    """An exported state of a bucket to move it to another table.
+
+    Attributes:
+        tier : A RateLimitTier of the bucket.
+        lanes: A tuple of (remaining, last update) per time window of the
+               tier, of which the times (ns) are of the clock of the table.
+    """
+    __slots__ = ()
+
+
+class RateLimitTableImage(namedtuple(
+        'RateLimitTableImage', ['tiers', 'keys', 'tier_ids', 'lanes'])):
+    """A copy of all the buckets and tiers of a table to save or load them.
+
+    Attributes:
+        tiers   : A tuple of RateLimitTier per tier ID of the table.
+        keys    : A list of the key per slot, which is None if it is free.
+        tier_ids: An array('I') of the tier ID per slot.
+        lanes   : A list of (remaining, last update) of array('q') per slot
+                  per time window, of which the times (ns) are of the clock.
+    """
+    __slots__ = ()
+
+
+class RateLimitBucketTable:
+    """Token buckets of all keys stored in typed arrays.
+
+    The decision logic is the same as RateLimitBucket.decrement() so that
+    RateLimiter returns the same result regardless of the bucket storage.
+
+    Attributes:
+        tiers       : A registry of tiers (quota limit, time window) which are
+                      shared by the buckets.
+        evictions   : A dict of the number of evicted buckets by reason.
+        _clock      : A clock object to use either real or fake clock for test.
+        _max_buckets: An integer of the max number of buckets (None: no limit).
+        _idle_ttl   : An integer ns to keep idle buckets (None: forever) which
+                      is given in seconds.
+        _pinned     : A set of keys that are never evicted.
+        _locks      : A RateLimitLocks of the stripes of keys if the table is
+                      shared by threads, or None.
+        _hand       : An integer of the slot of the clock hand for eviction.
+        _size       : An integer indicating the number of configured keys.
+        _used       : An integer indicating the number of used index entries
+                      that includes deleted markers.
+        _removals   : An integer of the number of removed keys so far.
+        _accessed   : An int64 array of the last access time (ns) per slot
+                      if the idle TTL is given, or None.
+    """
+
+    def __init__(self, clock=None, capacity=_MIN_CAPACITY,
+                 max_buckets=None, idle_ttl=None, pinned=(), tiers=None,
+                 locks=None):
+        self.tiers = RateLimitTiers() if tiers is None else tiers
+        self.evictions = {'idle': 0, 'ttl': 0, 'lru': 0}
+        self._clock = MonotonicClock() if clock is None else clock
+        self._max_buckets = max_buckets
+        self._idle_ttl = None if idle_ttl is None else to_ns(idle_ttl)
+        self._pinned = frozenset(pinned)
+        self._locks = locks
+        self._structure = nullcontext() if locks is None else locks.structure
+        self._hand = 0
+        self._keys = []
+        self._tier_ids = array('I')
+        self._remaining = array('q')
+        self._last_update = array('q')
+        self._referenced = array('b')
+        self._lanes = [(self._remaining, self._last_update)]
+        self._accessed = None if idle_ttl is None else array('q')
+        self._free = array('q')
+        self._size = 0
+        self._used = 0
+        self._removals = 0
+        self._new_index(capacity)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __iter__(self):
+        return (key for key in self._keys if key is not None)
+
+    def keys(self):
+        """Return an iterator of configured keys in slot order."""
+        return iter(self)
+
+    def tier_ids(self):
+        """Return a set of the tier IDs of the buckets to reclaim the
+        others (RateLimitTiers.reclaim)."""
+        live = np.ones(len(self._tier_ids), dtype=bool)
+        live[np.frombuffer(self._free, dtype=np.int64)] = False
+        return set(np.unique(np.frombuffer(
+            self._tier_ids, dtype=np.uint32)[live]).tolist())
+
+    def scan(self, cursor=0, count=_SCAN_COUNT):
+        """Return (next cursor, keys) of up to count slots from the cursor,
+        of which the next cursor is 0 at the end.
+
+        The cursor is a slot, and a key stays in its slot until it is
+        removed. So a key configured during the whole scan is returned once
+        even if the other keys are added or removed in between."""
+        keys = self._keys[cursor:cursor + count]
+        end = cursor + len(keys)
+        return (end if end < len(self._keys) else 0), [
+            key for key in keys if key is not None]
+
+    def configure(self, key, quota_limit, time_window, extra_limits=()):
+        """Create or update a bucket of the key with a full quota."""
+        self.assign(key, self.tiers.intern(quota_limit, time_window,
+                                           extra_limits))
+
+    def assign(self, key, tier_id):
+        """Create or update a bucket of the key in a tier with a full quota."""
+        self._check_tier(tier_id)
+        slot = self._find(key)
+        if slot < 0:
+            if self._max_buckets is not None and (
+                    self._size >= self._max_buckets):
+                self._reclaim(self._clock.time_ns())
+            slot = self._insert(key)
+        self._referenced[slot] = 1
+        self._tier_ids[slot] = tier_id
+        self._reset(slot, self._clock.time_ns())
+
+    def assign_many(self, keys, tier_ids):
+        """Create or update the buckets of the keys in the tiers w/ a full
+        quota in one pass, and return the number of the created buckets.
+
+        The index is sized for all the keys at once instead of being rebuilt
+        as it grows, and the clock is read once for all of them."""
+        if self._max_buckets is not None:
+            created = 0
+            for key, tier_id in zip(keys, tier_ids):
+                created += self._find(key) < 0
+                self.assign(key, tier_id)
+            return created
+        if (self._used + len(keys)) * 3 > len(self._index) * 2:
+            self._new_index((self._size + len(keys)) * 3)
+        referenced, ids = self._referenced, self._tier_ids
+        now, size = self._clock.time_ns(), self._size
+        for key, tier_id in zip(keys, tier_ids):
+            self._check_tier(tier_id)
+            slot = self._find(key)
+            if slot < 0:
+                slot = self._insert(key)
+            referenced[slot] = 1
+            ids[slot] = tier_id
+            self._reset(slot, now)
+        return self._size - size
+
+    def export(self, key):
+        """Return a RateLimitBucketState of the tier and quota of the key."""
+        slot = self._slot(key)
+        tier_id = self._tier_ids[slot]
+        return RateLimitBucketState(self.tiers[tier_id], tuple(
+            (remaining[slot], last_update[slot])
+            for _, (remaining, last_update) in zip(
+                self._windows(tier_id), self._lanes)))
+
+    def restore(self, key, state):
+        """Create or replace the bucket of the key w/ an exported state.
+
+        The named tier of the state is used if it is defined in the table,
+        or an anonymous tier of the same limits otherwise."""
+        self.assign(key, self._tier_id(state.tier))
+        slot = self._find(key)
+        for (remaining, last_update), lane in zip(self._lanes, state.lanes):
+            remaining[slot], last_update[slot] = lane
+
+    def image(self):
+        """Return a RateLimitTableImage of the copies of the slot arrays.
+
+        The arrays are copied by memcpy in chunks of slots under the lock of
+        the structure, so the decisions are paused for a chunk at most. The
+        quota remaining is copied before the last update, so a bucket
+        decided in between loses its refill rather than refilled twice. A
+        key removed and configured again during the copy is kept once in the
+        later slot."""
+        keys, tier_ids = [], array('I')
+        lanes = [(array('q'), array('q')) for _ in self._lanes]
+        removals, start = self._removals, 0
+        while start < len(self._keys):
+            with self._structure:
+                end = start + _IMAGE_CHUNK
+                keys += self._keys[start:end]
+                tier_ids += self._tier_ids[start:end]
+                while len(lanes) < len(self._lanes):
+                    zeros = bytes(8 * start)
+                    lanes.append((array('q', zeros), array('q', zeros)))
+                for (remaining, last_update), (
+                        remaining_copy, last_update_copy) in zip(
+                            self._lanes, lanes):
+                    remaining_copy += remaining[start:end]
+                    last_update_copy += last_update[start:end]
+                start = len(keys)
+        if self._removals != removals:
+            slots = {}
+            for slot, key in enumerate(keys):
+                if key is not None:
+                    if key in slots:
+                        keys[slots[key]] = None
+                    slots[key] = slot
+        return RateLimitTableImage(tuple(self.tiers), keys, tier_ids, lanes)
+
+    def load(self, image):
+        """Replace all the buckets w/ an image, and redefine its named tiers.
+
+        The list and the arrays of the image are taken by the table w/o a
+        copy. The index is rebuilt in a vectorized pass as the hash of a
+        string isn't the same in another process."""
+        ids = [0 if tier is None else self._tier_id(tier) if (
+               tier.name is None) else self.tiers.define(*tier)
+               for tier in image.tiers]
+        tier_ids = image.tier_ids
+        if ids != list(range(len(ids))):
+            tier_ids = array('I', np.asarray(ids, dtype=np.uint32)[
+                np.frombuffer(tier_ids, dtype=np.uint32)].tobytes())
+        n = len(image.keys)
+        with self._structure:
+            self._keys = image.keys
+            self._tier_ids = tier_ids
+            self._referenced = array('b', bytes(n))
+            self._lanes = [(remaining, last_update)
+                           for remaining, last_update in image.lanes]
+            self._remaining, self._last_update = self._lanes[0]
+            if self._accessed is not None:
+                self._accessed = array('q', [self._clock.time_ns()]) * n
+            self._free = array('q', (
+                slot for slot, key in enumerate(self._keys) if key is None)
+                if None in self._keys else ())
+            self._size = n - len(self._free)
+            self._hand = 0
+            self._new_index(self._size * 3 // 2 + 1)
+
+    def remove(self, key):
+        """Remove the bucket of the key and recycle its slot."""
+        pos, slot = self._probe(key)
+        if slot < 0:
+            raise KeyError(key)
+        self._index[pos] = _DELETED
+        self._keys[slot] = None
+        self._free.append(slot)
+        self._size -= 1
+        self._removals += 1
+
+    def decrement(self, key, now=None):
+        """Reduce the quota remaining of the key."""
+        decision = self.acquire(key, 1, now)
+        if decision is None:
+            raise KeyError(key)
+        return decision.allowed
+
+    def acquire(self, key, cost=1, now=None):
+        """Reduce the quota remaining of the key by cost w/ a single lookup.
+
+        Return a decision, or None if the key is not configured. The clock is
+        read once unless the time (ns) is given by the caller. A probe of
+        cost 0 (e.g. the status API) is read-only, so it doesn't keep an
+        idle bucket from the eviction."""
+        slot = self._find(key)
+        if slot < 0:
+            return None
+        if now is None:
+            now = self._clock.time_ns()
+        tier_id = self._tier_ids[slot]
+        if self.tiers.extras[tier_id]:
+            return self._acquire_lanes(slot, tier_id, cost, now)
+        limit = self.tiers.limits[tier_id]
+        window = self.tiers.windows[tier_id]
+        remaining = self._remaining[slot]
+        last_update = self._last_update[slot]
+
+        time_allowance = (now - last_update) // window
+        remaining += time_allowance * limit
+        last_update += time_allowance * window
+
+        if remaining >= limit:
+            remaining = limit
+            last_update = now
+
+        allowed = remaining >= cost
+        if cost:
+            if allowed:
+                remaining -= cost
+            self._remaining[slot] = remaining
+            self._last_update[slot] = last_update
+            self._touch(slot, now)
+        return RateLimitDecision(allowed, limit, remaining,
+                                 last_update + window, window)
+
+    def acquire_many(self, keys, timestamps):
+        """Reduce the quota remaining of the keys at the timestamps in a batch.
+
+        Return a boolean array of the results per request which is the same as
+        calling decrement() in the order of the timestamps (ns) per key. Raise
+        a KeyError with the list of keys that are not configured.
+
+        The requests of the keys of composite tiers are decided one by one
+        after the others are decided by the batch kernel."""
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        uniq, groups = self._unique(keys)
+        slots = np.fromiter((self._find(key) for key in uniq),
+                            dtype=np.int64, count=len(uniq))
+        if np.any(slots < 0):
+            raise KeyError([uniq[i] for i in np.flatnonzero(slots < 0)])
+
+        tier_ids = np.frombuffer(self._tier_ids, dtype=np.uint32)[slots]
+        composite = np.fromiter(
+            (bool(self.tiers.extras[t]) for t in tier_ids.tolist()),
+            dtype=bool, count=len(uniq))[groups]
+        seq = np.flatnonzero(composite)
+        if len(seq):
+            self._check_sequence(groups[seq], timestamps[seq], slots)
+
+        allowed, remaining, last_update = decide_batch(
+            groups[~composite], timestamps[~composite],
+            np.asarray(self.tiers.limits, dtype=np.int64)[tier_ids],
+            np.asarray(self.tiers.windows, dtype=np.int64)[tier_ids],
+            np.frombuffer(self._remaining, dtype=np.int64)[slots],
+            np.frombuffer(self._last_update, dtype=np.int64)[slots])
+
+        np.frombuffer(self._remaining, dtype=np.int64)[slots] = remaining
+        np.frombuffer(self._last_update, dtype=np.int64)[slots] = last_update
+        if self._accessed is not None:
+            np.maximum.at(np.frombuffer(self._accessed, dtype=np.int64),
+                          slots[groups], timestamps)
+        if not len(seq):
+            return allowed
+
+        res = np.empty(len(composite), dtype=bool)
+        res[~composite] = allowed
+        for i, group, now in zip(seq.tolist(), groups[seq].tolist(),
+                                 timestamps[seq].tolist()):
+            res[i] = self.acquire(uniq[group], 1, now).allowed
+        return res
+
+    def _check_sequence(self, groups, timestamps, slots):
+        """Raise ValueError if timestamps aren't sorted per key or earlier
+        than the last update time of the bucket."""
+        order = np.argsort(groups, kind='stable')
+        g, t = groups[order], timestamps[order]
+        same = np.append(False, g[1:] == g[:-1])
+        if np.any(same & (np.diff(t, prepend=t[:1]) < 0)):
+            raise ValueError('timestamps must be sorted per key')
+        last_update = np.frombuffer(self._last_update, dtype=np.int64)
+        if np.any(~same & (t < last_update[slots[g]])):
+            raise ValueError('timestamps must not be earlier than last update')
+
+    def time_allowance(self, key):
+        """Return the number of time windows passed since the last update."""
+        slot = self._slot(key)
+        time_passed = self._clock.time_ns() - self._last_update[slot]
+        return time_passed // self.tiers.windows[self._tier_ids[slot]]
+
+    def cur_remaining(self, key):
+        """Return updated quota remainining as current time is changed.
+
+        It is the least one of all the windows if the key has many windows."""
+        slot = self._slot(key)
+        now = self._clock.time_ns()
+        return min(
+            self._refill(limit, window, remaining[slot], last_update[slot],
+                         now)[0]
+            for (limit, window), (remaining, last_update) in zip(
+                self._windows(self._tier_ids[slot]), self._lanes))
+
+    def quota_limit(self, key):
+        """Return quota limit of the key."""
+        return self.tiers.limits[self._tier_ids[self._slot(key)]]
+
+    def tier(self, key):
+        """Return the tier of the key."""
+        return self.tiers[self._tier_ids[self._slot(key)]]
+
+    def quota_remaining(self, key):
+        """Return quota remainining right after the last decrement()."""
+        slot = self._slot(key)
+        if not self.tiers.extras[self._tier_ids[slot]]:
+            return self._remaining[slot]
+        return min(remaining[slot] for _, (remaining, _) in zip(
+            self._windows(self._tier_ids[slot]), self._lanes))
+
+    def nbytes(self):
+        """Return the number of bytes allocated by the table itself.
+
+        The key objects are excluded as they are owned by the caller."""
+        arrays = (self._index, self._tier_ids, self._referenced, self._free,
+                  *(a for lane in self._lanes for a in lane),
+                  *(() if self._accessed is None else (self._accessed,)))
+        return (sys.getsizeof(self._keys) +
+                sum(a.buffer_info()[1] * a.itemsize for a in arrays))
+
+    @staticmethod
+    def _unique(keys):
+        """Return unique keys and the index of the unique key per request."""
+        if isinstance(keys, np.ndarray):
+            keys = keys.tolist()
+        ids = {}
+        groups = np.fromiter((ids.setdefault(key, len(ids)) for key in keys),
+                             dtype=np.int64, count=len(keys))
+        return list(ids), groups
+
+    def _tier_id(self, tier):
+        """Return the tier ID of a named tier of the table, or the one of an
+        anonymous tier of the same limits if the name isn't defined."""
+        tier_id = None if tier.name is None else self.tiers.id_of(tier.name)
+        if tier_id is None:
+            tier_id = self.tiers.intern(tier.quota_limit, tier.time_window,
+                                        tier.extra_limits)
+        return tier_id
+
+    def _slot(self, key):
+        slot = self._find(key)
+        if slot < 0:
+            raise KeyError(key)
+        return slot
+
+    def _find(self, key):
+        """Return the slot of the key or -1 if the key is not configured."""
+        index, keys = self._index, self._keys
+        mask = len(index) - 1
+        perturb = hash(key) & 0xFFFFFFFFFFFFFFFF
+        pos = perturb & mask
+        while True:
+            slot = index[pos]
+            if slot == _EMPTY:
+                return -1
+            if slot >= 0 and keys[slot] == key:
+                return slot
+            perturb >>= _PERTURB_SHIFT
+            pos = (pos * 5 + perturb + 1) & mask
+
+    def _probe(self, key):
+        """Return (index position, slot) of the key.
+
+        If the key is not found, the slot is -1 and the position is the first
+        reusable entry (deleted or empty) along the probe sequence."""
+        index, keys, mask = self._index, self._keys, self._mask
+        perturb = hash(key) & 0xFFFFFFFFFFFFFFFF
+        pos = perturb & mask
+        reusable = -1
+        while True:
+            slot = index[pos]
+            if slot == _EMPTY:
+                return (pos if reusable < 0 else reusable), -1
+            if slot == _DELETED:
+                if reusable < 0:
+                    reusable = pos
+            elif keys[slot] == key:
+                return pos, slot
+            perturb >>= _PERTURB_SHIFT
+            pos = (pos * 5 + perturb + 1) & mask
+
+    def _insert(self, key):
+        """Allocate a slot for a new key and register it in the index."""
+        if (self._used + 1) * 3 > len(self._index) * 2:
+            self._new_index((self._size + 1) * 3)
+
+        pos, _ = self._probe(key)
+        if self._index[pos] == _EMPTY:
+            self._used += 1
+
+        if self._free:
+            slot = self._free.pop()
+            self._keys[slot] = key
+        else:
+            slot = len(self._keys)
+            self._keys.append(key)
+            self._tier_ids.append(0)
+            self._referenced.append(0)
+            if self._accessed is not None:
+                self._accessed.append(0)
+            for remaining, last_update in self._lanes:
+                remaining.append(0)
+                last_update.append(0)
+
+        self._index[pos] = slot
+        self._size += 1
+        return slot
+
+    def _touch(self, slot, now):
+        """Set the reference bit of a slot, and sweep idle buckets if TTL."""
+        self._referenced[slot] = 1
+        if self._idle_ttl is not None:
+            self._accessed[slot] = now
+            self._sweep(now, _SWEEP_STEPS)
+
+    def _sweep(self, now, steps):
+        """Advance the clock hand by steps to reclaim buckets idle for TTL."""
+        keys, n = self._keys, len(self._keys)
+        for _ in range(min(steps, n)):
+            slot = self._hand
+            self._hand = slot + 1 if slot + 1 < n else 0
+            key = keys[slot]
+            if key is None or key in self._pinned:
+                continue
+            if self._idle_time(slot, now) >= self._idle_ttl:
+                self._evict(slot, 'ttl')
+
+    def _reclaim(self, now):
+        """Advance the clock hand until a bucket is evicted for a new bucket.
+
+        The hand goes around at most twice as the reference bits are cleared
+        in the first round. No bucket is evicted if all of them are pinned or
+        locked by the other threads."""
+        keys, n = self._keys, len(self._keys)
+        for _ in range(2 * n):
+            slot = self._hand
+            self._hand = slot + 1 if slot + 1 < n else 0
+            key = keys[slot]
+            if key is None or key in self._pinned:
+                continue
+            if self._is_refilled(slot, now):
+                reason = 'idle'
+            elif (self._idle_ttl is not None and
+                    self._idle_time(slot, now) >= self._idle_ttl):
+                reason = 'ttl'
+            elif self._referenced[slot]:
+                self._referenced[slot] = 0
+                continue
+            else:
+                reason = 'lru'
+            if self._evict(slot, reason):
+                return
+
+    def _acquire_lanes(self, slot, tier_id, cost, now):
+        """Decide a request of a composite tier in one pass over its windows.
+
+        The request is allowed only if every window has enough quota, and
+        then the cost is consumed from all the windows at once. The decision
+        is of the most restrictive window."""
+        windows = self._windows(tier_id)
+        if len(windows) > len(self._lanes):
+            self._add_lanes(len(windows))
+        state = [self._refill(limit, window, remaining[slot],
+                              last_update[slot], now)
+                 for (limit, window), (remaining, last_update) in zip(
+                     windows, self._lanes)]
+        allowed = all(available >= cost for available, _ in state)
+
+        least, remaining_least, last_least = -1, 0, 0
+        for i, (limit, window) in enumerate(windows):
+            available, last = state[i]
+            if cost:
+                if allowed:
+                    available -= cost
+                    last = self._take(limit, window, last, cost)
+                remaining, last_update = self._lanes[i]
+                remaining[slot] = available
+                last_update[slot] = last
+            if least < 0 or available < remaining_least:
+                least, remaining_least, last_least = i, available, last
+        if cost:
+            self._touch(slot, now)
+
+        limit, window = windows[least]
+        return RateLimitDecision(
+            allowed, limit, remaining_least,
+            self._reset_at(window, last_least), window)
+
+    def _check_tier(self, tier_id):
+        """Raise KeyError if the tier ID isn't defined, before a slot is
+        taken for a bucket of it."""
+        if not 0 <= tier_id < len(self.tiers.limits) or (
+                self.tiers[tier_id] is None):
+            raise KeyError(f'tier ID ({tier_id}) not found')
+
+    def _windows(self, tier_id):
+        """Return a tuple of (quota limit, time window) of all the windows."""
+        tiers = self.tiers
+        return ((tiers.limits[tier_id], tiers.windows[tier_id]),
+                *tiers.extras[tier_id])
+
+    def _add_lanes(self, n):
+        """Allocate the lanes of (remaining, last update) up to n windows."""
+        with self._structure:
+            while len(self._lanes) < n:
+                zeros = bytes(8 * len(self._keys))
+                self._lanes.append((array('q', zeros), array('q', zeros)))
+
+    def _refill(self, limit, window, remaining, last_update, now):
+        """Return (quota available, last update) of a window at now."""
+        time_allowance = (now - last_update) // window
+        remaining += time_allowance * limit
+        if remaining >= limit:
+            return limit, now
+        return remaining, last_update + time_allowance * window
+
+    def _take(self, limit, window, last_update, cost):
+        """Return the last update of a window after consuming cost."""
+        return last_update
+
+    def _reset_at(self, window, last_update):
+        """Return the time when the quota of a window is refilled."""
+        return last_update + window
+
+    def _reset(self, slot, now):
+        """Initialize the state of a slot with a full quota."""
+        windows = self._windows(self._tier_ids[slot])
+        if len(windows) > len(self._lanes):
+            self._add_lanes(len(windows))
+        for (limit, _), (remaining, last_update) in zip(windows, self._lanes):
+            remaining[slot] = limit
+            last_update[slot] = now
+        if self._accessed is not None:
+            self._accessed[slot] = now
+
+    def _is_refilled(self, slot, now):
+        """Return if the quota of a slot is refilled to the quota limit."""
+        return all(
+            self._refill(limit, window, remaining[slot], last_update[slot],
+                         now)[0] >= limit
+            for (limit, window), (remaining, last_update) in zip(
+                self._windows(self._tier_ids[slot]), self._lanes))
+
+    def _idle_time(self, slot, now):
+        """Return the number of ns since a slot is accessed."""
+        return now - self._accessed[slot]
+
+    def _evict(self, slot, reason):
+        """Remove the bucket of a slot, and return if it is evicted.
+
+        The bucket is skipped if its stripe is locked by another thread as it
+        is being used."""
+        key = self._keys[slot]
+        if self._locks is None:
+            self.remove(key)
+            self.evictions[reason] += 1
+            return True
+
+        lock = self._locks.of(key)
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            with self._structure:
+                if self._keys[slot] is not key:
+                    return False
+                self.remove(key)
+                self.evictions[reason] += 1
+                return True
+        finally:
+            lock.release()
+
+    def _new_index(self, min_capacity):
+        """Rebuild the index with a power-of-2 capacity w/o deleted markers.
+
+        The index is built aside and replaced at once so that concurrent
+        lookups see either the old or the new index."""
+        capacity = _MIN_CAPACITY
+        while capacity < min_capacity:
+            capacity <<= 1
+
+        keys = self._keys
+        if self._size == len(keys):
+            slots = np.arange(len(keys), dtype=np.int64)
+        else:
+            slots = np.asarray([slot for slot, key in enumerate(keys)
+                                if key is not None], dtype=np.int64)
+            keys = map(keys.__getitem__, slots.tolist())
+        hashes = np.fromiter(map(hash, keys), dtype=np.int64,
+                             count=len(slots))
+        self._mask = capacity - 1
+        self._index = array('q', _build_index(slots, hashes,
+                                              capacity).tobytes())
+        self._used = self._size
+
+
+class RateLimitBucketMap(dict):
+    """Bucket objects per key exposing the same interface of the table.
+
+    This is used by the algorithms that keep their own state per object such
+    as the sliding window counter, which decide a single time window. So the
+    tiers of multiple time windows are rejected by ValueError.
+    """
+
+    def __init__(self, bucket_class, clock=None, tiers=None):
+        super().__init__()
+        self.tiers = RateLimitTiers(multi_window=False) if (
+            tiers is None) else tiers
+        self.evictions = {}
+        self._tier_ids = {}
+        self._order = RateLimitScanOrder()
+        self._bucket_class = bucket_class
+        self._clock = MonotonicClock() if clock is None else clock
+
+    def configure(self, key, quota_limit, time_window, extra_limits=()):
+        self.assign(key, self.tiers.intern(quota_limit, time_window,
+                                           extra_limits))
+
+    def assign(self, key, tier_id):
+        """Create a bucket object w/ a copy of the tier.
+
+        Note that the bucket object isn't updated when the tier is changed
+        until it is configured again."""
+        tier = self.tiers[tier_id]
+        if tier.extra_limits:
+            raise ValueError('multiple time windows')
+        self[key] = self._bucket_class(
+            tier.quota_limit, tier.time_window, self._clock)
+        self._tier_ids[key] = tier_id
+        self._order.add(key)
+
+    def assign_many(self, keys, tier_ids):
+        created = 0
+        for key, tier_id in zip(keys, tier_ids):
+            created += key not in self
+            self.assign(key, tier_id)
+        return created
+
+    def scan(self, cursor=0, count=_SCAN_COUNT):
+        """Return (next cursor, keys) of up to count keys in the insertion
+        order from the cursor, of which the next cursor is 0 at the end."""
+        return self._order.scan(cursor, count)
+
+    def remove(self, key):
+        del self[key]
+        del self._tier_ids[key]
+        self._order.discard(key)
+
+    def tier_ids(self):
+        return set(self._tier_ids.values())
+
+    def tier(self, key):
+        return self.tiers[self._tier_ids[key]]
+
+    def decrement(self, key, now=None):
+        return self[key].decrement(1, now)
+
+    def acquire_many(self, keys, timestamps):
+        """Reduce the quota remaining of the keys at the timestamps one by
+        one. Raise a KeyError with the list of keys that are not configured.
+        """
+        if isinstance(keys, np.ndarray):
+            keys = keys.tolist()
+        missing = [key for key in dict.fromkeys(keys) if key not in self]
+        if missing:
+            raise KeyError(missing)
+        return np.fromiter(
+            (self[key].decrement(1, now)
+             for key, now in zip(keys, np.asarray(timestamps).tolist())),
+            dtype=bool, count=len(keys))
+
+    def export(self, key):
+        raise RateLimitNotSupported(
+            'exporting a bucket is supported by the tables only')
+
+    def image(self):
+        raise RateLimitNotSupported(
+            'a snapshot of the buckets is supported by the tables only')
+
+    def load(self, image):
+        raise RateLimitNotSupported(
+            'a snapshot of the buckets is supported by the tables only')
+
+    def restore(self, key, state):
+        raise RateLimitNotSupported(
+            'restoring a bucket is supported by the tables only')
+
+    def acquire(self, key, cost=1, now=None):
+        bucket = self.get(key)
+        if bucket is None:
+            return None
+        allowed = bucket.decrement(cost, now)
+        return RateLimitDecision(allowed, bucket.quota_limit(),
+                                 bucket.quota_remaining(), bucket.reset_at(),
+                                 self.tiers.windows[self._tier_ids[key]])
+
+    def cur_remaining(self, key):
+        return self[key].cur_remaining()
+
+    def quota_limit(self, key):
+        return self[key].quota_limit()
+
+    def quota_remaining(self, key):
+        return self[key].quota_remaining()
+
+
+class RateLimitScanOrder:
+    """Keys in the insertion order to scan them page by page by a cursor.
+
+    The cursor is the sequence number of a key when it is added, which
+    doesn't change until the key is removed (like a slot of the table). So a
+    key kept during the whole scan is returned once even if the other keys
+    are added or removed in between, and a page costs O(log N + count).
+
+    Attributes:
+        _lists  : A tuple of the list of the sequence numbers in asc. order
+                  and the list of the key per sequence number, which is
+                  _REMOVED after the key is removed until they're compacted.
+        _seqs   : A dict of key to its sequence number.
+        _removed: An integer of the removed keys in the lists.
+    """
+
+    def __init__(self):
+        self._lists = ([], [])
+        self._seqs = {}
+        self._removed = 0
+        self._next = 1
+
+    def add(self, key):
+        """Add a key after all the keys unless it is added already."""
+        if key in self._seqs:
+            return
+        seqs, keys = self._lists
+        self._seqs[key] = seq = self._next
+        self._next += 1
+        keys.append(key)
+        seqs.append(seq)
+
+    def discard(self, key):
+        """Remove a key, and compact the lists if a half of them is removed.
+        """
+        seq = self._seqs.pop(key, None)
+        if seq is None:
+            return
+        seqs, keys = self._lists
+        keys[bisect_left(seqs, seq)] = _REMOVED
+        self._removed += 1
+        if self._removed > len(seqs) // 2:
+            kept = [i for i, key in enumerate(keys) if key is not _REMOVED]
+            self._lists = [seqs[i] for i in kept], [keys[i] for i in kept]
+            self._removed = 0
+
+    def scan(self, cursor, count):
+        """Return (next cursor, keys) of up to count keys from the cursor,
+        of which the next cursor is 0 at the end."""
+        seqs, keys = self._lists
+        start = bisect_left(seqs, cursor)
+        end = start + count
+        return (seqs[end] if end < len(seqs) else 0), [
+            key for key in keys[start:end] if key is not _REMOVED]
+
+
+def _build_index(slots, hashes, capacity):
+    """Return an int64 array of the open-addressing index of the slots.
+
+    All the keys probe their sequences at once: one of the keys of an empty
+    position takes it, and the others move to the next position. So each key
+    is placed at the same position as the key-by-key insertion of the keys in
+    some order, which is found by the same probe sequence."""
+    index = np.full(capacity, _EMPTY, dtype=np.int64)
+    mask = np.uint64(capacity - 1)
+    perturb = hashes.view(np.uint64)
+    pos = perturb & mask
+    while len(slots):
+        # the slots claim the empty positions, and the last claim is taken.
+        free = np.flatnonzero(index[pos] == _EMPTY)
+        index[pos[free]] = slots[free]
+        rest = index[pos] != slots
+        slots, perturb, pos = slots[rest], perturb[rest], pos[rest]
+        perturb >>= np.uint64(_PERTURB_SHIFT)
+        pos = (pos * np.uint64(5) + perturb + np.uint64(1)) & mask
+    return index
@@ -0,0 +1,263 @@
+"""Active-Active Replication of Rate Limiter Nodes by G-Counters (CRDT)
+
+Each node (RateLimiter of a machine) decides the requests locally on the
+merged view of the consumption of all the nodes, and exchanges the deltas of
+its own counters w/ the peers at an interval. There is no coordinator in the
+path of a request, so a node keeps deciding while the peers are unreachable.
+
+  +--------+  deltas (UDP) every interval  +--------+
+  | node a | <---------------------------> | node b |    consumption of a key
+  +--------+                               +--------+    in the window epoch:
+      ^             +--------+                 ^
+      +-----------> | node c | <---------------+    local + sum(peer counts)
+                    +--------+
+
+  - counter: a grow-only counter (G-counter) of the consumption per key and
+             window epoch (now // window), whose component per node is only
+             incremented by the node. A peer's component is merged by max(),
+             so the deltas are idempotent and may be reordered or repeated.
+  - epoch  : the counters of an older epoch are dropped when a newer one is
+             seen, so the quota is refilled at the boundary of the epochs
+             which are aligned by a clock shared by the nodes (WallClock).
+  - delta  : the absolute counts of the node's own components of the keys
+             changed since the last sync. A lost datagram is healed by the
+             next delta of the key.
+
+Error Bound:
+============
+  A node doesn't see the consumption of the peers of the last interval, so a
+  key admits up to the limit plus what the other nodes admitted within the
+  interval per window. e.g. N nodes at R requests/sec in total over-admit
+  about (N - 1) / N * R * interval per window at most, and N times the limit
+  if the interval is longer than the window. Note that the counters are
+  grow-only, so re-configuring a key updates the limit w/o a full quota.
+"""
+
+import select
+import socket
+import struct
+from threading import Lock, Thread
+
+from core.common.utils import MonotonicClock
+from core.controller.bucket_table import RateLimitScanOrder
+from core.controller.decision import RateLimitDecision
+from core.controller.storage import RateLimitStorage
+
+DEFAULT_PORT = 8004
+DEFAULT_INTERVAL = 0.05
+
+_HEADER = struct.Struct('!H')     # length of the node ID
+_ENTRY = struct.Struct('!BHQQ')   # type and length of the key, epoch, count
+_STR, _INT = 0, 1
+_DATAGRAM_SIZE = 60000
+
+
+class RateLimitCRDTStorage(RateLimitStorage):
+    """Storage backend of the G-counters replicated w/ the peer nodes.
+
+    Attributes:
+        node_id : A string ID of the node, which is unique among the peers.
+        peers   : A list of (host, port) of the peers to send the deltas.
+        interval: A float of seconds between the syncs of the deltas.
+        _limits : A dict of key to (limit, window) configured in the node.
+        _order  : A RateLimitScanOrder of the keys of _limits to scan them.
+        _counts : A dict of key to [epoch, local count, sum of the peer
+                  counts, dict of peer node ID to count].
+        _dirty  : A set of the keys counted locally since the last sync.
+        _lock   : A lock of the counters shared by threads and the sync.
+    """
+
+    def __init__(self, node_id, peers=(), interval=DEFAULT_INTERVAL):
+        self.node_id = node_id
+        self.peers = [_address(peer) for peer in peers]
+        self.interval = interval
+        self._limits = {}
+        self._order = RateLimitScanOrder()
+        self._counts = {}
+        self._dirty = set()
+        self._lock = Lock()
+        self._header = _encode_str(_HEADER, node_id)
+        self._sock = None
+        self._thread = None
+
+    def __len__(self):
+        return len(self._limits)
+
+    def start(self, host='0.0.0.0', port=DEFAULT_PORT):
+        """Bind the UDP socket of the deltas from the peers, and start the
+        sync thread. Return the bound (host, port)."""
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((host, port))
+        self._thread = Thread(target=self._run, name='crdt-sync',
+                              daemon=True)
+        self._thread.start()
+        return self._sock.getsockname()
+
+    def close(self):
+        sock, self._sock = self._sock, None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if sock is not None:
+            sock.close()
+
+    def put(self, key, limit, window, now):
+        with self._lock:
+            self._limits[key] = (limit, window)
+            self._order.add(key)
+
+    def delete(self, key):
+        with self._lock:
+            self._order.discard(key)
+            self._counts.pop(key, None)
+            self._dirty.discard(key)
+            return self._limits.pop(key, None) is not None
+
+    def get(self, key):
+        config = self._limits.get(key)
+        if config is None:
+            return None
+        limit, window = config
+        with self._lock:
+            epoch, used = self._used(key, None)
+        return limit, window, max(0, limit - used), epoch * window
+
+    def acquire_many(self, requests):
+        res = []
+        with self._lock:
+            for key, cost, now in requests:
+                config = self._limits.get(key)
+                if config is None:
+                    res.append(None)
+                    continue
+                limit, window = config
+                epoch, used = self._used(key, now // window)
+                allowed = used + cost <= limit
+                if allowed and cost:
+                    self._counts[key][1] += cost
+                    self._dirty.add(key)
+                    used += cost
+                res.append(RateLimitDecision(
+                    allowed, limit, max(0, limit - used),
+                    (epoch + 1) * window, window))
+        return res
+
+    def keys(self):
+        return list(self._limits)
+
+    def scan(self, cursor, count):
+        with self._lock:
+            return self._order.scan(cursor, count)
+
+    def merge(self, data):
+        """Merge a datagram of the deltas of a peer into the counters."""
+        node, pos = _decode_str(_HEADER, data, 0)
+        with self._lock:
+            while pos < len(data):
+                key_type, size, epoch, count = _ENTRY.unpack_from(data, pos)
+                pos += _ENTRY.size
+                key = data[pos:pos + size].decode()
+                pos += size
+                if key_type == _INT:
+                    key = int(key)
+                state = self._counts.get(key)
+                if state is None or state[0] < epoch:
+                    self._counts[key] = [epoch, 0, count, {node: count}]
+                elif state[0] == epoch:
+                    old = state[3].get(node, 0)
+                    if count > old:
+                        state[3][node] = count
+                        state[2] += count - old
+
+    def sync(self, sock=None):
+        """Send the deltas of the keys counted since the last sync to the
+        peers, and return the number of the keys.
+
+        The keys are counted again if the deltas aren't encoded, so they are
+        sent by the next sync."""
+        sock = sock or self._sock
+        if sock is None:
+            return 0
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            entries = [(key, *self._counts[key][:2]) for key in dirty]
+        try:
+            datagrams = list(self._datagrams(entries))
+        except Exception:
+            with self._lock:
+                self._dirty |= dirty & self._counts.keys()
+            raise
+        for datagram in datagrams:
+            for peer in self.peers:
+                try:
+                    sock.sendto(datagram, peer)
+                except OSError:
+                    pass  # the peer is healed by the next delta.
+        return len(entries)
+
+    def _used(self, key, epoch):
+        """Return (epoch, merged count) of the key at the epoch, or at the
+        epoch of the counters if it is None or older (i.e. clock skew)."""
+        state = self._counts.get(key)
+        if state is None or (epoch is not None and state[0] < epoch):
+            if epoch is None:
+                return 0, 0
+            state = self._counts[key] = [epoch, 0, 0, {}]
+        return state[0], state[1] + state[2]
+
+    def _datagrams(self, entries):
+        datagram = [self._header]
+        size = len(self._header)
+        for key, epoch, count in entries:
+            key_type = _INT if isinstance(key, int) else _STR
+            try:
+                key = str(key).encode()
+            except UnicodeEncodeError:
+                continue  # the key of lone surrogates isn't replicated.
+            if size + _ENTRY.size + len(key) > _DATAGRAM_SIZE:
+                yield b''.join(datagram)
+                datagram = [self._header]
+                size = len(self._header)
+            datagram.append(_ENTRY.pack(key_type, len(key), epoch, count) +
+                            key)
+            size += _ENTRY.size + len(key)
+        if len(datagram) > 1:
+            yield b''.join(datagram)
+
+    def _run(self):
+        sock, clock = self._sock, MonotonicClock()
+        next_sync = clock.time() + self.interval
+        while self._sock is sock:
+            timeout = max(0, next_sync - clock.time())
+            readable, _, _ = select.select([sock], [], [], timeout)
+            if readable:
+                try:
+                    self.merge(sock.recv(_DATAGRAM_SIZE + 1))
+                except (OSError, struct.error, ValueError):
+                    pass  # a malformed datagram is dropped.
+            if clock.time() >= next_sync:
+                try:
+                    self.sync(sock)
+                except Exception:
+                    pass  # the keys are synced again at the next interval.
+                next_sync = max(next_sync + self.interval, clock.time())
+        self.sync(sock)
+
+
+def _address(peer):
+    """Return (host, port) of a peer of 'host:port' or (host, port)."""
+    if isinstance(peer, str):
+        host, _, port = peer.rpartition(':')
+        return host or 'localhost', int(port)
+    return tuple(peer)
+
+
+def _encode_str(header, value):
+    value = value.encode()
+    return header.pack(len(value)) + value
+
+
+def _decode_str(header, data, pos):
+    size, = header.unpack_from(data, pos)
+    pos += header.size
+    return data[pos:pos + size].decode(), pos + size
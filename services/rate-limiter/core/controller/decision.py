@@ -0,0 +1,21 @@
+"""Rate Limit Decision Record"""
+
+from collections import namedtuple
+
+
+class RateLimitDecision(namedtuple(
+        'RateLimitDecision',
+        ['allowed', 'limit', 'remaining', 'reset_at', 'window'])):
+    """A result of RateLimiter.try_acquire() for a key.
+
+    The limit, remaining, reset_at and window are of the most restrictive
+    time window (the least remaining) if the key has multiple time windows.
+
+    Attributes:
+        allowed  : A boolean indicating if the request is allowed.
+        limit    : An integer of quota limit per time window.
+        remaining: An integer of quota remaining after the decision.
+        reset_at : A clock time (ns) when the quota remaining is refilled.
+        window   : An integer of the time window (ns).
+    """
+    __slots__ = ()
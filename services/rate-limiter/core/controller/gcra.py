@@ -0,0 +1,177 @@
+"""GCRA (Generic Cell Rate Algorithm) for Rate Limiter
+
+GCRA keeps a single 'theoretical arrival time' (TAT) per key instead of the
+quota remaining and the last update time of a token bucket. Each request is
+expected to arrive every emission interval (T = time window / quota limit),
+and a burst of up to quota limit requests is tolerated. So a request is
+decided by one subtraction and one comparison, and the quota is refilled one
+by one every T rather than the whole quota at the end of the time window.
+
+    T        : emission interval = time_window / quota_limit
+    tolerance: T * quota_limit (the burst of quota_limit requests)
+
+    tat      = max(TAT, now)
+    allowed  = tat + T * cost - now <= tolerance  -> TAT = tat + T * cost
+    remaining= (tolerance - (TAT - now)) // T
+
+The following use case shows the smooth spacing of the requests:
+    _quota_limit: 5 ea.  _time_window: 1 sec  (T: 0.2 sec)
+
+    +------------------+------+------+------+------+------+------+------+
+    | clock time (sec) | 0.0  | 0.0  | 0.0  | 0.0  | 0.0  | 0.0  | 0.2  |
+    +------------------+------+------+------+------+------+------+------+
+    | TAT - now (sec)  | 0.2  | 0.4  | 0.6  | 0.8  | 1.0  | 1.0  | 1.0  |
+    | remaining        | 4    | 3    | 2    | 1    | 0    | 0    | 0    |
+    | allowed          | True | True | True | True | True | False| True |
+    +------------------+------+------+------+------+------+------+------+
+
+Note that the TAT is kept in integer nanoseconds, and T is rounded up to a
+nanosecond so that the burst of quota limit requests is decided exactly.
+"""
+
+import numpy as np
+
+from core.common.utils import MonotonicClock, to_ns
+from core.controller.bucket_table import RateLimitBucketTable
+from core.controller.decision import RateLimitDecision
+
+
+def emission_interval(quota_limit, window_ns):
+    """Return the emission interval in nanoseconds which is rounded up.
+
+    The interval of the time window is used if the quota limit is zero so that
+    every request is denied."""
+    return -(-window_ns // max(quota_limit, 1))
+
+
+class RateLimitGCRA:
+    """GCRA state to manage quota remaining for each key
+
+    Attributes:
+        _quota_limit: An integer of the maximum number of requests per window.
+        _time_window: A number of seconds of the time window.
+        _clock      : A clock object to use either real or fake clock.
+        _interval   : An integer of the emission interval in nanoseconds.
+        _tolerance  : An integer of the burst tolerance in nanoseconds.
+        _tat        : An integer of the theoretical arrival time in ns.
+    """
+
+    def __init__(self, quota_limit, time_window, clock=None):
+        self._quota_limit = quota_limit
+        self._time_window = time_window
+        self._clock = MonotonicClock() if clock is None else clock
+        self._interval = emission_interval(quota_limit, to_ns(time_window))
+        self._tolerance = self._interval * quota_limit
+        self.clear()
+
+    def clear(self, now=None):
+        """Initialize quota remaining and TAT with a full quota."""
+        self._quota_remaining = self._quota_limit
+        self._tat = self._clock.time_ns() if now is None else now
+
+    def decrement(self, cost=1, now=None):
+        """Reduce the quota remaining by cost."""
+        if now is None:
+            now = self._clock.time_ns()
+        tat = self._tat
+        if tat < now:
+            tat = now
+        interval = self._interval
+        new_tat = tat + interval * cost
+        allowed = new_tat - now <= self._tolerance
+        if allowed:
+            self._tat = tat = new_tat
+        self._quota_remaining = (self._tolerance - tat + now) // interval
+        return allowed
+
+    def cur_remaining(self, now=None):
+        """Return updated quota remainining as current time is changed."""
+        if now is None:
+            now = self._clock.time_ns()
+        tat = max(self._tat, now)
+        return (self._tolerance - (tat - now)) // self._interval
+
+    def reset_at(self):
+        """Return the clock time (ns) when the quota is refilled to limit."""
+        return self._tat
+
+    def quota_limit(self):
+        return self._quota_limit
+
+    def quota_remaining(self):
+        return self._quota_remaining
+
+
+class RateLimitGCRATable(RateLimitBucketTable):
+    """GCRA state of all keys stored in typed arrays.
+
+    The table shares the key index, tiers and eviction of the token bucket
+    table, and keeps the TAT (ns) of each key in _last_update instead of the
+    last update time. _remaining keeps the quota remaining right after the
+    last request.
+    """
+
+    def acquire(self, key, cost=1, now=None):
+        """Reduce the quota remaining of the key by cost w/ a single lookup.
+
+        Return a decision, or None if the key is not configured. A probe of
+        cost 0 is read-only like the token bucket table."""
+        slot = self._find(key)
+        if slot < 0:
+            return None
+        if now is None:
+            now = self._clock.time_ns()
+        tier_id = self._tier_ids[slot]
+        if self.tiers.extras[tier_id]:
+            return self._acquire_lanes(slot, tier_id, cost, now)
+        limit = self.tiers.limits[tier_id]
+        window = self.tiers.windows[tier_id]
+        interval = emission_interval(limit, window)
+        tolerance = interval * limit
+
+        tat = self._last_update[slot]
+        if tat < now:
+            tat = now
+        new_tat = tat + interval * cost
+        allowed = new_tat - now <= tolerance
+        if allowed and cost:
+            self._last_update[slot] = tat = new_tat
+
+        remaining = (tolerance - (tat - now)) // interval
+        if cost:
+            self._remaining[slot] = remaining
+            self._touch(slot, now)
+        return RateLimitDecision(allowed, limit, remaining, tat, window)
+
+    def acquire_many(self, keys, timestamps):
+        """Reduce the quota remaining of the keys at the timestamps one by
+        one, as the batch kernel decides the token buckets. Raise a KeyError
+        with the list of keys that are not configured."""
+        if isinstance(keys, np.ndarray):
+            keys = keys.tolist()
+        uniq = dict.fromkeys(keys)
+        missing = [key for key in uniq if self._find(key) < 0]
+        if missing:
+            raise KeyError(missing)
+        acquire = self.acquire
+        return np.fromiter(
+            (acquire(key, 1, now).allowed
+             for key, now in zip(keys, np.asarray(timestamps).tolist())),
+            dtype=bool, count=len(keys))
+
+    def time_allowance(self, key):
+        """Return the number of time windows passed since the TAT, which
+        is 0 while the TAT is ahead of the clock."""
+        return max(0, super().time_allowance(key))
+
+    def _refill(self, limit, window, remaining, tat, now):
+        interval = emission_interval(limit, window)
+        if tat < now:
+            tat = now
+        return (interval * limit - (tat - now)) // interval, tat
+
+    def _take(self, limit, window, tat, cost):
+        return tat + emission_interval(limit, window) * cost
+
+    def _reset_at(self, window, tat):
+        return tat
@@ -0,0 +1,233 @@
+"""Top-K Heavy Hitters of Rate Limit Decisions by Space-Saving
+
+The keys which send the most requests (top talkers) are found w/o a counter
+per key. A fixed number of counters is kept by the Space-Saving algorithm,
+which replaces the key of the least counter w/ a new key and counts the new
+key from the least count. So the memory is bound by the capacity of the
+counters instead of the number of the keys, and a key of more requests than
+1/capacity of all the requests of a window is always counted.
+
+  +-------------+ record(key, allowed)  +-----------------------------------+
+  | decision of | --------------------> | counters: key -> [count, error,   |
+  | the limiter |                       |                   denied]         |
+  +-------------+                       | groups  : count -> keys (the min  |
+                                        |           group for replacement)  |
+                                        +-----------------------------------+
+                                          | every window (e.g. a minute)
+                                          v
+                                        +-----------------------------------+
+                                        | history: top talkers of the last  |
+                                        |          windows                  |
+                                        +-----------------------------------+
+
+  - record : a decision is appended to the pending decisions w/o a lock,
+             which are counted by a batch under the lock. The counter of the
+             key is moved from the group of its count to the next group, and
+             the least count is kept, so a decision is counted in O(1)
+             whether the key is counted or replaces the key of the least
+             counter (error: the count of the replaced key).
+  - window : the counters are reset when a window ends after the top talkers
+             of the window are kept in the history.
+  - top    : the counters are sorted when the top talkers are queried, so a
+             count is an upper bound of the requests of the key w/ the error,
+             and the count - error is a lower bound. The denied requests are
+             counted since the key is counted in the window, so the deny
+             ratio is of the lower bound.
+
+The counters are kept per process like the leases even if the buckets are
+shared by the processes or a storage backend.
+"""
+
+import heapq
+from collections import deque, namedtuple
+from threading import Lock
+
+from core.common.utils import to_ns
+
+DEFAULT_CAPACITY = 1024
+DEFAULT_WINDOW = 60
+DEFAULT_WINDOWS = 10
+DEFAULT_TOP = 10
+DEFAULT_BATCH = 256
+
+
+class RateLimitTalker(namedtuple(
+        'RateLimitTalker', ['key', 'requests', 'error', 'denied'])):
+    """A top talker of a window of RateLimitHeavyHitters.
+
+    Attributes:
+        key     : A key of the bucket.
+        requests: An integer of the counted requests, which is an upper bound
+                  of the requests of the key in the window.
+        error   : An integer of the max over-count of the requests, which is
+                  the count of the key replaced by this key.
+        denied  : An integer of the denied requests since the key is counted.
+    """
+    __slots__ = ()
+
+    @property
+    def deny_ratio(self):
+        observed = self.requests - self.error
+        return self.denied / observed if observed else 0.0
+
+
+class RateLimitTrafficWindow(namedtuple(
+        'RateLimitTrafficWindow',
+        ['start', 'end', 'requests', 'denied', 'talkers'])):
+    """The top talkers of a window of RateLimitHeavyHitters.
+
+    Attributes:
+        start   : A clock time (ns) when the window starts.
+        end     : A clock time (ns) when the window ends.
+        requests: An integer of the requests of all the keys in the window.
+        denied  : An integer of the denied requests of all the keys.
+        talkers : A list of RateLimitTalker by the requests in desc. order.
+    """
+    __slots__ = ()
+
+    @property
+    def deny_ratio(self):
+        return self.denied / self.requests if self.requests else 0.0
+
+
+class RateLimitHeavyHitters:
+    """Top talkers of the decisions per window by the Space-Saving counters.
+
+    Attributes:
+        capacity: An integer of the max number of the counted keys.
+        window  : An integer of the time window (ns) of the counters.
+        top     : An integer of the number of the top talkers kept in the
+                  history per window.
+        history : A deque of RateLimitTrafficWindow of the last windows in
+                  asc. order of the time.
+        batch   : An integer of the number of the pending decisions to
+                  count them by a batch.
+        _pending : A deque of (key, allowed, now) of the decisions which
+                   aren't counted yet.
+        _counters: A dict of key to [count, error, denied] of the counted
+                   keys of the current window.
+        _groups  : A dict of count to the keys (a dict as an ordered set) of
+                   the count, of which the min count is _min.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, window=DEFAULT_WINDOW,
+                 windows=DEFAULT_WINDOWS, top=DEFAULT_TOP,
+                 batch=DEFAULT_BATCH):
+        if capacity < 1:
+            raise ValueError('capacity must be positive')
+        self.capacity = capacity
+        self.window = to_ns(window)
+        self.top = top
+        self.batch = batch
+        self.history = deque(maxlen=windows)
+        self._pending = deque()
+        self._counters = {}
+        self._groups = {}
+        self._min = 0
+        self._start = None
+        self._end = None
+        self._requests = 0
+        self._denied = 0
+        self._lock = Lock()
+
+    def record(self, key, allowed, now):
+        """Record a decision of the key at the time (ns), which is counted
+        when a batch of the decisions is pending."""
+        pending = self._pending
+        pending.append((key, allowed, now))
+        if len(pending) >= self.batch:
+            with self._lock:
+                self._count()
+
+    def windows(self, top=DEFAULT_TOP, now=None):
+        """Return a list of RateLimitTrafficWindow of up to top talkers of
+        the current window and the history in desc. order of the time.
+
+        The current window ends if the time (ns) is given after it."""
+        with self._lock:
+            self._count()
+            if now is not None and self._end is not None and now >= self._end:
+                self._rotate(now)
+            current = self._current(top) if self._requests else None
+            history = list(self.history)
+        res = [] if current is None else [current]
+        res += (window._replace(talkers=window.talkers[:top])
+                for window in reversed(history))
+        return res
+
+    def clear(self):
+        """Reset the counters and the history."""
+        with self._lock:
+            self._pending.clear()
+            self._reset()
+            self.history.clear()
+            self._start = self._end = None
+
+    def _count(self):
+        """Count the pending decisions in O(1) per decision."""
+        counters, groups = self._counters, self._groups
+        pop = self._pending.popleft
+        for _ in range(len(self._pending)):
+            key, allowed, now = pop()
+            if self._end is None or now >= self._end:
+                self._rotate(now)
+                counters, groups = self._counters, self._groups
+            self._requests += 1
+            counter = counters.get(key)
+            if counter is None:
+                if len(counters) < self.capacity:
+                    counter = counters[key] = [0, 0, 0]
+                    group = groups.get(0)
+                    if group is None:
+                        group = groups[0] = {}
+                    self._min = 0
+                else:
+                    group = groups[self._min]
+                    replaced, _ = group.popitem()
+                    counter = counters.pop(replaced)
+                    counter[1], counter[2] = counter[0], 0
+                    counters[key] = counter
+                group[key] = None
+            count = counter[0]
+            group = groups[count]
+            del group[key]
+            if not group:
+                del groups[count]
+                if self._min == count:
+                    self._min = count + 1
+            count += 1
+            counter[0] = count
+            group = groups.get(count)
+            if group is None:
+                groups[count] = {key: None}
+            else:
+                group[key] = None
+            if not allowed:
+                counter[2] += 1
+                self._denied += 1
+
+    def _current(self, top):
+        talkers = heapq.nlargest(top, self._counters.items(),
+                                 key=lambda item: item[1][0])
+        return RateLimitTrafficWindow(
+            self._start, self._end, self._requests, self._denied,
+            [RateLimitTalker(key, *counter) for key, counter in talkers])
+
+    def _rotate(self, now):
+        """Keep the top talkers of the current window in the history, and
+        start the window of the time w/ the reset counters."""
+        if self._requests:
+            self.history.append(self._current(self.top))
+        self._reset()
+        if self._start is None:
+            self._start = now
+        else:
+            self._start += (now - self._start) // self.window * self.window
+        self._end = self._start + self.window
+
+    def _reset(self):
+        self._counters = {}
+        self._groups = {}
+        self._min = 0
+        self._requests = 0
+        self._denied = 0
@@ -0,0 +1,369 @@
+"""Append-Only Journal of Rate Limit Config and Policies w/ Group Commit
+
+The config of the users and the policies of the control plane are kept in
+the memory of the rate limiter. The journal is a write-ahead log of their
+changes, so the rate limiter restarts w/ all of them.
+
+  +-----------+ append  +---------+ write + fsync  +------------------------+
+  | config    | ------> | pending | -------------> | journal.<generation>   |
+  | policies  |  wait   | records |  flusher       | (NDJSON per change)    |
+  +-----------+ <------ +---------+ <------------- +------------------------+
+                committed                          | snapshot.<generation>  |
+                                                   | (buckets and tiers)    |
+                                                   +------------------------+
+
+  - append  : a change is appended as a line of JSON after it is applied,
+              and the caller waits until the line is flushed to the disk.
+  - group   : the flusher thread writes all the pending lines of the callers
+              by a single fsync, so a burst of changes shares the fsyncs.
+  - error   : if a write or an fsync fails (e.g. the disk is full), the
+              callers waiting for it are raised RateLimitJournalError (503),
+              and the partial write is truncated. The flusher keeps the
+              records, and retries them w/ the later ones every
+              retry_interval seconds.
+  - compact : a new generation of the journal is started w/ the policies,
+              and the snapshot of the buckets (snapshot.py) is saved in the
+              background. Then the older generations are removed. A change
+              applied before the new generation is in the snapshot, and the
+              ones after it are in the new journal.
+  - replay  : the latest snapshot is loaded, and the journals of the same or
+              later generations are replayed line by line in a stream. A
+              torn line at the end of a journal (e.g. a crash in a write) is
+              ignored.
+
+Record:
+=======
+  +---------------------------------+---------------------------------------+
+  | ["C", key, policy, limits]      | configure the key (or the global key) |
+  | ["D", key]                      | remove the bucket of the key          |
+  | ["P", id, policy]               | create or update a policy             |
+  | ["X", id]                       | delete a policy                       |
+  +---------------------------------+---------------------------------------+
+"""
+
+import json
+import logging
+import os
+from threading import Condition, Event, Thread
+
+from core.common.constants import RateLimitLevel as Level
+from core.common.exceptions import (
+    RateLimitConfigNotFound,
+    RateLimitJournalError
+)
+from core.common.utils import WallClock
+from core.controller.snapshot import restore_snapshot, save_snapshot
+
+DEFAULT_INTERVAL = 300
+DEFAULT_COMPACT_BYTES = 64 << 20
+DEFAULT_RETRY_INTERVAL = 1
+
+CONFIG, REMOVE, POLICY, POLICY_REMOVE = 'C', 'D', 'P', 'X'
+
+_DECODE = json.JSONDecoder().decode
+_JOURNAL = 'journal'
+_SNAPSHOT = 'snapshot'
+
+_log = logging.getLogger(__name__)
+
+
+class RateLimitJournal:
+    """Write-ahead journal of the config and the policies in a directory.
+
+    Attributes:
+        directory     : A string of the directory of the journals and the
+                        snapshots named w/ their generation.
+        interval      : A float of seconds between the compactions.
+        compact_bytes : An integer of the bytes of a journal to compact it.
+        retry_interval: A float of seconds to retry a failed write.
+        generation    : An integer of the generation of the current journal.
+        commits       : An integer of the number of the group commits (fsync).
+        appended      : An integer of the number of the appended records.
+        limiter       : A RateLimiter of the config, or None until opened.
+        policies      : A RateLimitPolicy of the policies, or None.
+    """
+
+    def __init__(self, directory, interval=DEFAULT_INTERVAL,
+                 compact_bytes=DEFAULT_COMPACT_BYTES, wall=None):
+        self.directory = directory
+        self.interval = interval
+        self.compact_bytes = compact_bytes
+        self.retry_interval = DEFAULT_RETRY_INTERVAL
+        self.generation = 0
+        self.commits = 0
+        self.appended = 0
+        self.limiter = None
+        self.policies = None
+        self._wall = WallClock() if wall is None else wall
+        self._file = None
+        self._size = 0
+        self._pending = []
+        self._committed = 0
+        self._failed = 0
+        self._error = None
+        self._rotate_error = None
+        self._rotate = False
+        self._stopped = False
+        self._replaying = False
+        self._compacted = 0
+        self._cond = Condition()
+        self._rotated = Event()
+        self._compact = Event()
+        self._threads = []
+
+    def open(self, limiter, policies=None):
+        """Load the latest snapshot and replay the journals after it, then
+        start a new generation of the journal and the threads of flushing
+        and compaction. Return the number of the replayed records."""
+        self.limiter, self.policies = limiter, policies
+        os.makedirs(self.directory, exist_ok=True)
+        snapshots = self._generations(_SNAPSHOT)
+        journals = self._generations(_JOURNAL)
+        base = snapshots[-1] if snapshots else 0
+        if snapshots:
+            restore_snapshot(limiter, self._path(_SNAPSHOT, base), self._wall)
+        replayed = sum(self.replay(self._path(_JOURNAL, generation))
+                       for generation in journals if generation >= base)
+        self.generation = max(snapshots + journals + [0]) + 1
+        self._compacted = -1 if replayed else 0
+        self._file = open(self._path(_JOURNAL, self.generation), 'ab')
+        self._threads = [
+            Thread(target=self._flush, name='journal-flush', daemon=True),
+            Thread(target=self._run, name='journal-compact', daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return replayed
+
+    def close(self):
+        """Flush the pending records, and stop the threads."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._compact.set()
+        for thread in self._threads:
+            thread.join()
+        self._file.close()
+
+    def log_config(self, key, policy, limits):
+        self.append([CONFIG, key, policy, limits])
+
+    def log_configs(self, records):
+        """Append the (key, policy, limits) of many keys w/ a single wait."""
+        self.append(*([CONFIG, key, policy, limits]
+                      for key, policy, limits in records))
+
+    def log_removal(self, key):
+        self.append([REMOVE, key])
+
+    def log_policy(self, id, data):
+        self.append([POLICY, id, data])
+
+    def log_policy_removal(self, id):
+        self.append([POLICY_REMOVE, id])
+
+    def append(self, *records):
+        """Append the records, and wait until they are flushed to the disk.
+        They are skipped before the journal is opened or while it is
+        replayed.
+
+        Raise RateLimitJournalError if the write of the records fails, of
+        which the records are kept to be retried."""
+        if self._file is None or self._replaying or not records:
+            return
+        lines = [json.dumps(record, separators=(',', ':')).encode() + b'\n'
+                 for record in records]
+        with self._cond:
+            self._pending += lines
+            self.appended += len(lines)
+            seq = self.appended
+            self._cond.notify_all()
+            while self._committed < seq:
+                if self._failed >= seq:
+                    raise RateLimitJournalError(
+                        message=f'journal ({self.directory}) not written: '
+                                f'{self._error}')
+                self._cond.wait()
+
+    def replay(self, path):
+        """Apply the records of a journal in a stream, and return the number
+        of them."""
+        limiter, policies = self.limiter, self.policies
+        count = 0
+        self._replaying = True
+        try:
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        op, *args = _DECODE(line.decode())
+                    except ValueError:
+                        break
+                    if op == CONFIG:
+                        _configure(limiter, *args)
+                    elif op == REMOVE:
+                        if limiter.is_configured(args[0]):
+                            limiter.remove_bucket(args[0])
+                    elif policies is None:
+                        pass
+                    elif op == POLICY:
+                        policies._upsert(*args)
+                    elif op == POLICY_REMOVE:
+                        policies._remove(args[0])
+                    count += 1
+        finally:
+            self._replaying = False
+        return count
+
+    def compact(self):
+        """Start a new generation of the journal, and fold the older ones
+        into a snapshot of the buckets. Return the new generation.
+
+        Raise an error if the new generation or the snapshot isn't written,
+        of which the older generations are kept to be replayed."""
+        with self._cond:
+            self._rotated.clear()
+            self._rotate = True
+            self._cond.notify_all()
+        self._rotated.wait()
+        with self._cond:
+            error, self._rotate_error = self._rotate_error, None
+            appended = self.appended
+        if error is not None:
+            raise error
+        generation = self.generation
+        save_snapshot(self.limiter, self._path(_SNAPSHOT, generation),
+                      self._wall)
+        self._compacted = appended
+        for kind in (_JOURNAL, _SNAPSHOT):
+            for old in self._generations(kind):
+                if old < generation:
+                    os.remove(self._path(kind, old))
+        return generation
+
+    def _flush(self):
+        """Write the pending records by a single fsync per batch, and start
+        a new generation w/ the policies if it is requested. The records of
+        a failed write are kept, and retried after retry_interval."""
+        while True:
+            with self._cond:
+                while not (self._pending or self._rotate or self._stopped):
+                    self._cond.wait()
+                lines, self._pending = self._pending, []
+                seq, rotate = self.appended, self._rotate
+                self._rotate = False
+                stopped = self._stopped
+            error = None
+            if lines:
+                try:
+                    self._write(b''.join(lines))
+                except (OSError, ValueError) as e:
+                    error = e
+            if rotate:
+                try:
+                    self._next_generation()
+                except (OSError, ValueError) as e:
+                    self._rotate_error = e
+            with self._cond:
+                if error is None:
+                    self._committed = seq
+                    if lines:
+                        self.commits += 1
+                else:
+                    _log.error('journal (%s) not written: %s',
+                               self.directory, error)
+                    self._failed, self._error = seq, error
+                    self._pending[:0] = lines
+                self._cond.notify_all()
+            if rotate:
+                self._rotated.set()
+            if error is not None:
+                with self._cond:
+                    if stopped or self._cond.wait_for(
+                            lambda: self._stopped, self.retry_interval):
+                        return
+                continue
+            if self._size >= self.compact_bytes:
+                self._compact.set()
+            if stopped and not lines:
+                return
+
+    def _write(self, data):
+        """Write and fsync the data, or truncate a partial write of it and
+        raise the error."""
+        try:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except (OSError, ValueError):
+            self._reopen()
+            raise
+        self._size += len(data)
+
+    def _reopen(self):
+        """Reopen the journal w/o the bytes after the last fsync, so a
+        retried write doesn't follow a torn line."""
+        try:
+            self._file.close()
+        except OSError:
+            pass
+        try:
+            self._file = open(self._path(_JOURNAL, self.generation), 'ab')
+            self._file.truncate(self._size)
+        except OSError:
+            pass
+
+    def _next_generation(self):
+        """Switch to a new journal beginning w/ all the policies, so the
+        older journals aren't needed once the snapshot is saved. A default
+        policy that was deleted is recorded as deleted, since the defaults
+        are seeded again on every boot."""
+        self._file.close()
+        self.generation += 1
+        self._size = 0
+        self._file = open(self._path(_JOURNAL, self.generation), 'ab')
+        if self.policies is not None:
+            rows = dict(self.policies.rows)
+            records = [[POLICY_REMOVE, id] for id in self.policies.defaults
+                       if id not in rows]
+            records += [[POLICY, id, dict(data)] for id, data in rows.items()]
+            self._write(b''.join(
+                json.dumps(record, separators=(',', ':')).encode() + b'\n'
+                for record in records))
+
+    def _run(self):
+        while True:
+            self._compact.wait(self.interval)
+            self._compact.clear()
+            with self._cond:
+                if self._stopped:
+                    return
+                idle = self._compacted == self.appended
+            if not idle:
+                try:
+                    self.compact()
+                except Exception:
+                    _log.exception('journal (%s) not compacted',
+                                   self.directory)
+
+    def _generations(self, kind):
+        """Return a sorted list of the generations of the files of a kind."""
+        prefix = f'{kind}.'
+        return sorted(int(name[len(prefix):])
+                      for name in os.listdir(self.directory)
+                      if name.startswith(prefix) and
+                      name[len(prefix):].isdigit())
+
+    def _path(self, kind, generation):
+        return os.path.join(self.directory, f'{kind}.{generation}')
+
+
+def _configure(limiter, key, policy, limits):
+    """Configure the key by a record, which is skipped if the policy of it
+    is not found."""
+    limits = [tuple(limit) for limit in limits]
+    try:
+        if key == Level.GLOBAL:
+            limiter.configure_global_limit(tier=policy, limits=limits)
+        else:
+            limiter.configure_limit(key, tier=policy, limits=limits)
+    except RateLimitConfigNotFound:
+        pass
@@ -0,0 +1,174 @@
+"""Token Leases of Rate Limit Buckets for Local Decisions
+
+A gateway calls the rate limiter per request, so every request of a busy
+location costs a round trip. A lease grants a batch of tokens of a key to a
+client which decides the requests locally until the tokens are spent or the
+lease expires, and then returns the unused tokens.
+
+  +----------+  lease(user-1, 20)   +------------------------------------+
+  | gateway  | -------------------> | bucket of user-1: remaining -= 20  |
+  | (client) | <- lease 7, 20 tok.  | leased of user-1: 20 (outstanding) |
+  |          |                      |                                    |
+  |          |  release(7, 5)       | leased of user-1: 0                |
+  |          | -------------------> | returned of user-1: 5 (until exp.) |
+  +----------+                      +------------------------------------+
+
+  - grant   : the tokens are charged to the bucket at once (a decision of the
+              cost), so the outstanding leases are counted in the state of the
+              bucket and the other requests of the key can't use them. If the
+              bucket doesn't have enough tokens, its remaining is granted.
+  - expiry  : a lease expires at the earlier of the TTL and the reset time of
+              the decision, so the tokens are spent within the time window
+              which they are charged to. (The window of the least remaining
+              if the key has multiple time windows.)
+  - return  : the unused tokens of a lease are kept for the key until the
+              lease expires, and granted first to the next lease of the key.
+              They aren't put back to the bucket which may be refilled since.
+"""
+
+import heapq
+from collections import namedtuple
+from itertools import count
+from threading import Lock
+
+
+class RateLimitLease(namedtuple(
+        'RateLimitLease',
+        ['lease_id', 'key', 'tokens', 'expires_at', 'limit', 'remaining',
+         'window'])):
+    """A result of RateLimiter.lease() for a key.
+
+    Attributes:
+        lease_id  : An integer ID of the lease, or None if no token is granted.
+        key       : A key of the bucket.
+        tokens    : An integer of the granted tokens.
+        expires_at: A clock time (ns) when the lease expires, which is the
+                    time to lease again if no token is granted.
+        limit     : An integer of quota limit per time window.
+        remaining : An integer of quota remaining of the bucket after the
+                    lease.
+        window    : An integer of the time window (ns).
+    """
+    __slots__ = ()
+
+
+class RateLimitLeases:
+    """Outstanding leases and returned tokens of the keys.
+
+    Attributes:
+        _leases  : A dict of lease ID to [key, tokens, expires at] of the
+                   outstanding leases.
+        _leased  : A dict of key to the tokens of its outstanding leases.
+        _returned: A dict of key to [tokens, expires at] of the returned
+                   tokens which can be granted again.
+        _expiry  : A heap of (expires at, lease ID, key) to expire the leases.
+        _lock    : A lock of the leases shared by threads.
+    """
+
+    def __init__(self):
+        self._leases = {}
+        self._leased = {}
+        self._returned = {}
+        self._expiry = []
+        self._ids = count(1)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._leases)
+
+    def leased(self, key):
+        """Return the tokens of the outstanding leases of the key."""
+        return self._leased.get(key, 0)
+
+    def grant(self, buckets, key, tokens, ttl, now):
+        """Lease up to tokens of the key from the returned tokens and then
+        the bucket for ttl (ns, None for the time window).
+
+        Return a RateLimitLease, or None if the key is not configured."""
+        if tokens < 1:
+            raise ValueError(f'tokens must be positive: {tokens}')
+        with self._lock:
+            self._expire(now)
+            pooled, expires_at = self._take_returned(key, tokens, now)
+        need = tokens - pooled
+        decision = buckets.acquire(key, need, now)
+        if decision is None:
+            return None
+        charged = need if decision.allowed else 0
+        if not decision.allowed and decision.remaining > 0:
+            cost = decision.remaining
+            decision = buckets.acquire(key, cost, now)
+            charged = cost if decision.allowed else 0
+        if charged or expires_at is None:
+            expires_at = min(expires_at or decision.reset_at,
+                             decision.reset_at)
+        if ttl is not None:
+            expires_at = min(expires_at, now + ttl)
+        granted = pooled + charged
+        if not granted:
+            return RateLimitLease(None, key, 0, expires_at, decision.limit,
+                                  decision.remaining, decision.window)
+        with self._lock:
+            lease_id = next(self._ids)
+            self._leases[lease_id] = [key, granted, expires_at]
+            self._leased[key] = self._leased.get(key, 0) + granted
+            heapq.heappush(self._expiry, (expires_at, lease_id, key))
+        return RateLimitLease(lease_id, key, granted, expires_at,
+                              decision.limit, decision.remaining,
+                              decision.window)
+
+    def release(self, lease_id, unused, now):
+        """Close the lease and keep its unused tokens for the next lease of
+        the key until the lease expires. Return the number of the tokens.
+
+        Raise a KeyError if the lease is not found or expired."""
+        with self._lock:
+            self._expire(now)
+            lease = self._leases.pop(lease_id, None)
+            if lease is None:
+                raise KeyError(lease_id)
+            key, tokens, expires_at = lease
+            self._unlease(key, tokens)
+            unused = max(0, min(unused, tokens))
+            if unused:
+                returned = self._returned.get(key)
+                if returned is None or returned[1] <= now:
+                    self._returned[key] = [unused, expires_at]
+                else:
+                    returned[0] += unused
+                    returned[1] = min(returned[1], expires_at)
+            return unused
+
+    def _take_returned(self, key, tokens, now):
+        """Return (tokens, expires at) taken from the returned tokens of the
+        key, or (0, None) if there is none."""
+        returned = self._returned.get(key)
+        if returned is None:
+            return 0, None
+        if returned[1] <= now:
+            del self._returned[key]
+            return 0, None
+        taken = min(tokens, returned[0])
+        returned[0] -= taken
+        if not returned[0]:
+            del self._returned[key]
+        return taken, returned[1]
+
+    def _expire(self, now):
+        """Drop the leases and the returned tokens which are expired."""
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            _, lease_id, key = heapq.heappop(expiry)
+            lease = self._leases.pop(lease_id, None)
+            if lease is not None:
+                self._unlease(key, lease[1])
+            returned = self._returned.get(key)
+            if returned is not None and returned[1] <= now:
+                del self._returned[key]
+
+    def _unlease(self, key, tokens):
+        leased = self._leased[key] - tokens
+        if leased:
+            self._leased[key] = leased
+        else:
+            del self._leased[key]
@@ -0,0 +1,152 @@
+"""Streaming Loader of the Limits of Users from CSV or JSONL Files
+
+The limits of tens of millions of users are loaded into the rate limiter
+when it boots rather than configured by an API call per user. The file is
+read in a pipeline of generators, so the memory is bound by a chunk of the
+users instead of the parsed file.
+
+  +------+  lines  +-----------+  (user, limit)  +--------+  configure_limits
+  | file | ------> | rows      | --------------> | chunks | ---------------->
+  +------+         | (CSV or   |                 | (list) |   RateLimiter
+                   |  JSONL)   |                 +--------+
+                   +-----------+
+
+File:
+=====
+  +-------+-----------------------------------------------------------------+
+  | CSV   | user_id,limit[,limit_per] per line w/ an optional header, of    |
+  |       | which the limit is a name of a policy or a quota limit, and the |
+  |       | limit_per is a time window of the quota limit (default: rps).   |
+  | JSONL | an item of the bulk config API per line such as ["user-1",      |
+  |       | "gold"], ["user-2", 10] or {"user_id": "user-3", "quota_limit": |
+  |       | 10, "limit_per": "rpm"}. A malformed line is a failed row.      |
+  +-------+-----------------------------------------------------------------+
+
+The file is loaded when the app starts if RATE_LIMITER_LOAD_PATH is set,
+after the snapshot or the journal is restored so that the policies of the
+file are defined. So the file overrides the restored limits of its users.
+"""
+
+import csv
+import io
+import json
+import sys
+from collections import namedtuple
+
+from core.common.constants import RateLimitPer as Per, LIMIT_PER_WINDOW
+from core.common.utils import (
+    MonotonicClock,
+    chunks,
+    parse_config_item
+)
+
+DEFAULT_CHUNK = 10000
+DEFAULT_INTERVAL = 1.0
+
+
+class RateLimitLoadResult(namedtuple(
+        'RateLimitLoadResult',
+        ['rows', 'created', 'updated', 'failed', 'seconds'])):
+    """A result of loading a file of the limits of users.
+
+    Attributes:
+        rows   : An integer of the number of the rows (users) of the file.
+        created: An integer of the number of the created buckets.
+        updated: An integer of the number of the updated buckets.
+        failed : An integer of the number of the rows which aren't valid or
+                 of which the policy isn't found.
+        seconds: A float of the seconds of loading the file.
+    """
+    __slots__ = ()
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def load_limits(limiter, path, fmt=None, chunk_size=DEFAULT_CHUNK,
+                progress=None, interval=DEFAULT_INTERVAL,
+                clock=None):
+    """Load the limits of the users of a CSV or JSONL file into the limiter,
+    and return a RateLimitLoadResult.
+
+    The format is found by the extension of the path (.csv, or .jsonl and
+    .ndjson) unless fmt is given. The progress is called w/ the result so
+    far every interval seconds and at the end."""
+    clock = MonotonicClock() if clock is None else clock
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+    rows = created = updated = failed = 0
+    started = reported = clock.time()
+    with open(path, 'rb') as f:
+        for chunk in chunks(read_limits(f, fmt), chunk_size):
+            res = limiter.configure_limits(chunk)
+            rows += len(chunk)
+            created += res.created
+            updated += res.updated
+            failed += len(res.failed)
+            now = clock.time()
+            if progress is not None and now - reported >= interval:
+                reported = now
+                progress(RateLimitLoadResult(rows, created, updated, failed,
+                                             now - started))
+    result = RateLimitLoadResult(rows, created, updated, failed,
+                                 clock.time() - started)
+    if progress is not None:
+        progress(result)
+    return result
+
+
+def read_limits(f, fmt='csv'):
+    """Yield (user_id, limit) of configure_limits() per row of a binary
+    file, of which the limit is None if the row isn't valid."""
+    if fmt == 'csv':
+        return _read_csv(io.TextIOWrapper(f, encoding='utf-8', newline=''))
+    if fmt in ('jsonl', 'ndjson'):
+        return _read_jsonl(f)
+    raise ValueError(f'format ({fmt}) not supported')
+
+
+def _read_csv(f):
+    for i, row in enumerate(csv.reader(f)):
+        if not row or (i == 0 and row[0] == 'user_id'):
+            continue
+        yield row[0], _csv_limit(row)
+
+
+def _csv_limit(row):
+    """Return the limit of a CSV row, or None if it isn't valid."""
+    if len(row) < 2 or len(row) > 3:
+        return None
+    limit = row[1].strip()
+    if not limit.isdigit():
+        return limit if len(row) == 2 and limit else None
+    window = LIMIT_PER_WINDOW.get(row[2].strip() if len(row) == 3 else
+                                  Per.SEC)
+    return None if window is None else [(int(limit), window)]
+
+
+def _read_jsonl(f):
+    """Yield (user_id, limit) per line, of which a malformed line (e.g. a
+    line cut by a crash of the writer) is (None, None) as an invalid row
+    rather than the end of the file."""
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield None, None
+            continue
+        config = parse_config_item(item)
+        if config is None:
+            yield None, None
+            continue
+        key, policy, limits = config
+        yield key, policy or limits
+
+
+def print_progress(result):
+    """Print the rows and the rows per second of a RateLimitLoadResult."""
+    print(f'{result.rows} rows ({result.failed} failed) in '
+          f'{result.seconds:.1f} s: {result.rows_per_sec:.0f} rows/s',
+          file=sys.stderr)
@@ -0,0 +1,246 @@
+"""Lock Striping of Rate Limit Buckets for Multithreaded Servers
+
+A threaded WSGI server calls the rate limiter from many threads at once, and
+a decision is a read-modify-write of the bucket state. A single lock for all
+the buckets would make every request wait for the others. So the keys are
+sharded into stripes of locks by the hash of the key, and a decision only
+locks the stripe of its key. Different users rarely share a stripe, so they
+don't contend with each other.
+
+  +---------------------+     +--------+-----------------------------------+
+  | request             |     | stripe | lock                              |
+  +---------------------+     +--------+-----------------------------------+
+  | user-1: decision    | --> |   0    | RLock  <- user-1, user-9, ...     |
+  | user-2: decision    | --> |   1    | RLock  <- user-2, ...             |
+  | user-3: configure   | --> |   2    | RLock  <- user-3  + structure lock|
+  +---------------------+     +--------+-----------------------------------+
+
+  - decision  : the lock of the stripe of the key.
+  - configure : the lock of the stripe of the key + the structure lock of the
+                table (index, slots, lanes and tiers).
+  - batch     : the locks of all the stripes in order.
+  - eviction  : try-lock of the stripe of the victim + the structure lock.
+                So an eviction never waits for a stripe while holding the
+                structure lock, which can't make a deadlock.
+  - striped   : the contended keys such as the global key are decided by a
+                striped bucket (RateLimitStripedBucket) w/o the stripe lock.
+"""
+
+from contextlib import ExitStack
+from threading import RLock
+
+import numpy as np
+
+from core.common.utils import MonotonicClock
+from core.controller.striped import DEFAULT_CELLS, RateLimitStripedBucket
+
+DEFAULT_STRIPES = 64
+
+_BULK_CHUNK = 4096
+
+
+class RateLimitLocks:
+    """Stripes of locks over the key shards.
+
+    Attributes:
+        structure: An RLock of the structural changes of the buckets.
+        _stripes : A list of RLock per stripe (a power of 2).
+        _mask    : An integer mask of the hash of a key to find its stripe.
+    """
+
+    def __init__(self, stripes=DEFAULT_STRIPES):
+        n = 1
+        while n < stripes:
+            n <<= 1
+        self.structure = RLock()
+        self._stripes = [RLock() for _ in range(n)]
+        self._mask = n - 1
+
+    def __len__(self):
+        return len(self._stripes)
+
+    def of(self, key):
+        """Return the lock of the stripe of the key."""
+        return self._stripes[hash(key) & self._mask]
+
+    def all(self):
+        """Return a context manager which locks all the stripes in order."""
+        stack = ExitStack()
+        for lock in self._stripes:
+            stack.enter_context(lock)
+        return stack
+
+
+class RateLimitLockedBuckets:
+    """Buckets (table or map) shared by threads w/ lock striping.
+
+    This exposes the same interface of the buckets, and each call locks the
+    stripe of the key so that concurrent requests don't lose updates or
+    over-admit requests.
+
+    The striped keys of a single time window are decided by a striped bucket
+    per key instead of the buckets, which keep the tier of the key.
+    """
+
+    def __init__(self, buckets, locks, clock=None, striped=(),
+                 cells=DEFAULT_CELLS):
+        self.tiers = buckets.tiers
+        self._buckets = buckets
+        self._locks = locks
+        self._clock = MonotonicClock() if clock is None else clock
+        self._striped_keys = frozenset(striped)
+        self._striped = {}
+        self._cells = cells
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def __contains__(self, key):
+        return key in self._buckets
+
+    def __iter__(self):
+        return iter(self._buckets)
+
+    @property
+    def evictions(self):
+        return self._buckets.evictions
+
+    def keys(self):
+        return self._buckets.keys()
+
+    def tier_ids(self):
+        with self._locks.structure:
+            return self._buckets.tier_ids() | {
+                bucket.tier_id() for bucket in self._striped.values()}
+
+    def scan(self, cursor, count):
+        return self._buckets.scan(cursor, count)
+
+    def configure(self, key, quota_limit, time_window, extra_limits=()):
+        with self._locks.of(key), self._locks.structure:
+            self._assign(key, self.tiers.intern(quota_limit, time_window,
+                                                extra_limits))
+
+    def assign(self, key, tier_id):
+        with self._locks.of(key), self._locks.structure:
+            self._assign(key, tier_id)
+
+    def assign_many(self, keys, tier_ids):
+        """Assign the keys in chunks w/ all the stripes locked, so the
+        decisions wait for a chunk at most rather than all the keys."""
+        created = 0
+        for start in range(0, len(keys), _BULK_CHUNK):
+            chunk = keys[start:start + _BULK_CHUNK]
+            ids = tier_ids[start:start + _BULK_CHUNK]
+            with self._locks.all(), self._locks.structure:
+                created += self._buckets.assign_many(chunk, ids)
+                for key, tier_id in zip(chunk, ids):
+                    if key in self._striped_keys:
+                        self._stripe(key, tier_id)
+        return created
+
+    def _assign(self, key, tier_id):
+        self._buckets.assign(key, tier_id)
+        if key in self._striped_keys:
+            self._stripe(key, tier_id)
+
+    def _stripe(self, key, tier_id):
+        if self.tiers.extras[tier_id]:
+            self._striped.pop(key, None)
+        else:
+            self._striped[key] = RateLimitStripedBucket(
+                self.tiers, tier_id, self._clock, self._cells)
+
+    def remove(self, key):
+        with self._locks.of(key), self._locks.structure:
+            self._buckets.remove(key)
+            self._striped.pop(key, None)
+
+    def export(self, key):
+        """Return the exported state of the bucket. The tokens of a striped
+        key (e.g. the global key) in the cells of threads aren't included,
+        so the striped keys aren't moved between rate-limiters."""
+        with self._locks.of(key):
+            return self._buckets.export(key)
+
+    def restore(self, key, state):
+        with self._locks.of(key), self._locks.structure:
+            self._buckets.restore(key, state)
+
+    def image(self):
+        """Return an image of the buckets. The decisions of the stripes go
+        on while the arrays are copied under the structure lock, and the
+        tokens in the cells of the striped keys aren't included."""
+        return self._buckets.image()
+
+    def load(self, image):
+        """Replace all the buckets w/ an image. The striped keys start w/ a
+        full quota of new cells."""
+        with self._locks.all(), self._locks.structure:
+            self._buckets.load(image)
+            self._striped = {}
+            for key in self._striped_keys:
+                if key in self._buckets:
+                    tier = self._buckets.tier(key)
+                    self._assign(key, self.tiers.intern(*tier[1:])
+                                 if tier.name is None else
+                                 self.tiers.id_of(tier.name))
+
+    def decrement(self, key, now=None):
+        striped = self._striped.get(key)
+        if striped is not None:
+            return striped.decrement(1, now)
+        with self._locks.of(key):
+            return self._buckets.decrement(key, now)
+
+    def acquire(self, key, cost=1, now=None):
+        striped = self._striped.get(key)
+        if striped is not None:
+            return striped.acquire(cost, now)
+        with self._locks.of(key):
+            return self._buckets.acquire(key, cost, now)
+
+    def acquire_many(self, keys, timestamps):
+        """Decide a batch w/ all the stripes locked. The requests of the
+        striped keys are decided one by one after the others."""
+        with self._locks.all():
+            if not self._striped:
+                return self._buckets.acquire_many(keys, timestamps)
+            if isinstance(keys, np.ndarray):
+                keys = keys.tolist()
+            timestamps = np.asarray(timestamps, dtype=np.int64)
+            striped = np.fromiter((key in self._striped for key in keys),
+                                  dtype=bool, count=len(keys))
+            rest = np.flatnonzero(~striped)
+            res = np.empty(len(keys), dtype=bool)
+            res[rest] = self._buckets.acquire_many(
+                [keys[i] for i in rest.tolist()], timestamps[rest])
+            for i in np.flatnonzero(striped).tolist():
+                res[i] = self._striped[keys[i]].decrement(
+                    1, int(timestamps[i]))
+            return res
+
+    def tier(self, key):
+        with self._locks.of(key):
+            return self._buckets.tier(key)
+
+    def cur_remaining(self, key):
+        striped = self._striped.get(key)
+        if striped is not None:
+            return striped.cur_remaining()
+        with self._locks.of(key):
+            return self._buckets.cur_remaining(key)
+
+    def quota_limit(self, key):
+        striped = self._striped.get(key)
+        if striped is not None:
+            return striped.quota_limit()
+        with self._locks.of(key):
+            return self._buckets.quota_limit(key)
+
+    def quota_remaining(self, key):
+        striped = self._striped.get(key)
+        if striped is not None:
+            return striped.quota_remaining()
+        with self._locks.of(key):
+            return self._buckets.quota_remaining(key)
@@ -5,6 +5,23 @@ Features:
   1. Configuring global or user level rate-limit
   2. Processing rate-limit request
   3. Managing rate-limit buckets
+  4. Evicting idle buckets w/ the max number of buckets and an idle TTL
+  5. Sharing rate-limit tiers (flyweight policies) among buckets
+  6. Choosing an algorithm: token bucket, sliding window counter or GCRA
+  7. Multiple time windows per key (e.g. 10 rps + 300 rpm + 10k rpd)
+  8. Sharing the rate-limiter by threads w/ lock striping over key shards
+  9. Striped token pools of the contended global key (LongAdder-like)
+ 10. Sharing the quota by pre-forked worker processes w/ a shared memory
+ 11. Leasing a batch of tokens to a client (e.g. gateway) to decide locally
+ 12. Keeping the buckets in a storage backend (in-process or RESP server)
+ 13. Active-active nodes replicating the consumption by G-counters (CRDT)
+ 14. Moving a bucket between instances partitioned by a consistent hash ring
+ 15. Hot standby following the bucket state streamed by the primary
+ 16. Warm restart of all the buckets from a periodic snapshot file (mmap)
+ 17. Durable journal of the config and the policies w/ group commit
+ 18. Loading the limits of many users from a CSV or JSONL stream at boot
+ 19. Scanning the buckets by a stable cursor for paged or streamed status
+ 20. Top talkers and deny ratios per window by Space-Saving heavy hitters
 
 Time and Space Complexity:
 +------------+----------------------------------------------------------------+
@@ -13,7 +30,9 @@ Time and Space Complexity:
 |            | - range of N          : 0 <= N <= 500,000,000 (500M)           |
 |            | - The requests-per-sec (rps) limit is set globally or per-user.|
 |            |   If both are set, only the user's limit should be used.       |
-|            | - The rate limiter runs only on one machine in one process.    |
+|            | - The rate limiter runs only on one machine in one process, or |
+|            |   in pre-forked processes sharing the buckets in a shared mmap.|
+|            |   (or on the nodes replicating the counters w/ the peers.)     |
 +------------+----------------------------------------------------------------+
 | Time       |   Algorithm  | Insert | Search | Update | Delete               |
 | Complexity | -------------+--------+--------+--------+--------              |
@@ -30,17 +49,21 @@ Pros and Cons:
 |            |   + buckets     : average CRUD O(1) for buckets                |
 |            |   + each bucket : O(1), don't use queue, hash table            |
 |            | - Memory efficient: don't manage real queue in each bucket.    |
+|            |   + buckets are kept in typed arrays w/ an open-addressing     |
+|            |     index (tens of bytes per key instead of an object per key).|
 |            | - Allows a burst for short periods than fixed window algorithm.|
+|            | - Integer ns of a monotonic clock: no floating point error and |
+|            |   no refill/freeze of quota when the wall clock is stepped.    |
 |            | - Easy to reset available quota at the end of time window fits |
 +------------+----------------------------------------------------------------+
-| Cons       | - Minimum time window: 1 second (miliseconds aren't accurate.) |
-|            |   e.g. requests: #1(0:000001), #2(0:999999) -> deny            |
-|            |                  #1(0:000001), #2(1:000001) -> allow           |
-|            |   There may have small error rate of floating point. But, it   |
-|            |   would be normally allowed unless strict rule is required.    |
+| Cons       | - Minimum time window of the config API: 10 ms (rp10ms).       |
+|            |   e.g. 50 rps -> 5 rp100ms not to allow all the requests in    |
+|            |   the first millisecond. (decided exactly by integer ns.)      |
 |            | - Additional bursts and delays are not supported.              |
-|            | - Concurrent users requests + HA are not supported yet.        |
-|            | - Limited types: multi types aren't supported per global/user. |
+|            | - HA is not supported yet. (concurrent requests of threads are |
+|            |   supported by the lock_stripes option, and the active-active  |
+|            |   nodes by the CRDT storage w/ a bounded over-admission, and a |
+|            |   hot standby takes over w/ the state of the last interval.)   |
 +------------+----------------------------------------------------------------+
 
 Future Improvements:
@@ -75,10 +98,60 @@ from core.common.constants import (
     RateLimitAlgorithm as Algo,
     RateLimitLevel as Level
 )
-from core.common.exceptions import RateLimitConfigNotFound
+from core.common.exceptions import (
+    RateLimitConfigNotFound,
+    RateLimitLeaseNotFound
+)
+from core.common.utils import MonotonicClock, to_ns
+from collections import namedtuple
+from contextlib import nullcontext
 from core.controller.bucket import RateLimitBucket
+from core.controller.bucket_table import (
+    RateLimitBucketMap,
+    RateLimitBucketTable
+)
+from core.controller.gcra import RateLimitGCRA, RateLimitGCRATable
+from core.controller.heavy_hitters import (
+    DEFAULT_CAPACITY as HEAVY_HITTERS,
+    DEFAULT_TOP as TOP_TALKERS,
+    DEFAULT_WINDOW as HEAVY_HITTER_WINDOW,
+    RateLimitHeavyHitters
+)
+from core.controller.lease import RateLimitLeases
+from core.controller.locks import (
+    DEFAULT_STRIPES,
+    RateLimitLockedBuckets,
+    RateLimitLocks
+)
+from core.controller.shared_table import RateLimitSharedTable
 from core.controller.sliding_window import RateLimitSlidingWindowCounter
-import time
+from core.controller.storage import RateLimitStorageBuckets
+from core.controller.striped import DEFAULT_CELLS
+
+TIER_RECLAIM = 1024
+
+_TABLES = {
+    Algo.TOKEN_BUCKET: RateLimitBucketTable,
+    Algo.GCRA: RateLimitGCRATable
+}
+_BUCKETS = {
+    Algo.TOKEN_BUCKET: RateLimitBucket,
+    Algo.SLIDING_WINDOW_COUNTER: RateLimitSlidingWindowCounter,
+    Algo.GCRA: RateLimitGCRA
+}
+
+
+class RateLimitBulkResult(namedtuple(
+        'RateLimitBulkResult', ['created', 'updated', 'failed'])):
+    """A result of RateLimiter.configure_limits() for many keys.
+
+    Attributes:
+        created: An integer of the number of the created buckets.
+        updated: An integer of the number of the updated buckets.
+        failed : A list of (index, key) of the pairs which aren't configured
+                 as the tier isn't found or the limit isn't valid.
+    """
+    __slots__ = ()
 
 
 class RateLimiter:
@@ -86,75 +159,395 @@ class RateLimiter:
 
     Attributes:
         buckets: An object indicating token buckets to manage each user quota.
-        _clock: A time object to use either real clock or fake clock for test.
+                 The token bucket and GCRA algorithms keep all buckets in a
+                 compact table (e.g. RateLimitBucketTable) rather than an
+                 object per key unless the compact option is turned off. The
+                 table can evict idle buckets by the max number of buckets and
+                 an idle TTL (seconds) except the global bucket.
+                 The buckets are shared by threads w/ lock striping over key
+                 shards if the number of lock stripes is given. Then the
+                 global token bucket is split into cells of tokens leased by
+                 threads (RateLimitStripedBucket) unless global_cells is 0.
+                 The buckets are kept in a shared memory of the processes
+                 (RateLimitSharedTable) if the shared capacity of keys is
+                 given, which must be created before forking the workers.
+                 The buckets are kept in a storage backend (RateLimitStorage)
+                 such as a RESP server shared by the rate-limiters of many
+                 machines if the storage is given, or the G-counters of the
+                 nodes replicated w/ the peers (RateLimitCRDTStorage).
+        leases: Outstanding leases of tokens (RateLimitLeases) which are
+                charged to the buckets when they are granted. The leases are
+                kept per process even if the buckets are shared.
+        heavy_hitters: Top talkers of the decisions per window w/ a fixed
+                       number of counters (RateLimitHeavyHitters), or None if
+                       the number of the counters (heavy_hitters) is 0. They
+                       are kept per process like the leases.
+        _clock: A clock object of integer nanoseconds (time_ns) to use either
+                monotonic clock, coarse clock (CoarseClock) or fake clock.
+        _structure: A lock of the structural changes such as tiers, or a null
+                    context if the rate-limiter isn't shared by threads.
     """
 
-    def __init__(self, clock=time, algorithm=Algo.TOKEN_BUCKET):
-        self.buckets = {}
+    def __init__(self, clock=None, algorithm=Algo.TOKEN_BUCKET,
+                 compact=True, max_buckets=None, idle_ttl=None,
+                 lock_stripes=None, global_cells=DEFAULT_CELLS,
+                 shared_capacity=None, storage=None,
+                 heavy_hitters=HEAVY_HITTERS,
+                 heavy_hitter_window=HEAVY_HITTER_WINDOW):
+        clock = MonotonicClock() if clock is None else clock
+        locks = RateLimitLocks(lock_stripes) if (
+            lock_stripes and not shared_capacity and storage is None) else None
+        if storage is not None:
+            if algorithm != Algo.TOKEN_BUCKET:
+                raise ValueError(
+                    'the storage backends support the token bucket only')
+            self.buckets = RateLimitStorageBuckets(storage, clock)
+        elif shared_capacity:
+            if algorithm != Algo.TOKEN_BUCKET:
+                raise ValueError(
+                    'the shared table supports the token bucket only')
+            self.buckets = RateLimitSharedTable(
+                clock, shared_capacity, lock_stripes or DEFAULT_STRIPES)
+        elif compact and algorithm in _TABLES:
+            self.buckets = _TABLES[algorithm](
+                clock, max_buckets=max_buckets, idle_ttl=idle_ttl,
+                pinned=(Level.GLOBAL,), locks=locks)
+        else:
+            self.buckets = RateLimitBucketMap(_BUCKETS[algorithm], clock)
+        if locks is not None:
+            striped = (Level.GLOBAL,) if (
+                global_cells and algorithm == Algo.TOKEN_BUCKET) else ()
+            self.buckets = RateLimitLockedBuckets(
+                self.buckets, locks, clock, striped, global_cells)
+        self.leases = RateLimitLeases()
+        self.heavy_hitters = RateLimitHeavyHitters(
+            heavy_hitters, heavy_hitter_window) if heavy_hitters else None
+        self._structure = nullcontext() if locks is None else locks.structure
         self._clock = clock
         self._algorithm = algorithm
+        self._reclaim_at = TIER_RECLAIM
+
+    def configure_tier(self, name, rps: int = None, window=Dur.SEC,
+                       limits=None):
+        """Configure a named rate-limit tier shared by buckets.
 
-    def configure_global_limit(self, rps: int):
+        Buckets only refer to the tier, so re-configuring the tier updates the
+        quota limit of all the buckets of the tier in O(1)."""
+        with self._structure:
+            self.buckets.tiers.define(name,
+                                      *_split_limits(rps, window, limits))
+
+    def remove_tier(self, name):
+        """Remove a named rate-limit tier.
+
+        The buckets of the tier keep its limits until they're configured
+        again, and the tier is reclaimed when no bucket refers to it."""
+        with self._structure:
+            if not self.buckets.tiers.remove(name):
+                raise RateLimitConfigNotFound(
+                    message=f'tier ({name}) not found')
+            self._reclaim_tiers(force=True)
+
+    def configure_global_limit(self, rps: int = None, tier=None,
+                               window=Dur.SEC, limits=None):
         """Configure global-level rate-limit policy in a bucket."""
-        if self._algorithm == Algo.TOKEN_BUCKET:
-            self.buckets[Level.GLOBAL] = RateLimitBucket(
-                quota_limit=rps, time_window=Dur.SEC, clock=self._clock)
-        else:
-            self.buckets[Level.GLOBAL] = RateLimitSlidingWindowCounter(
-                quota_limit=rps, time_window=Dur.SEC, clock=self._clock)
-
-    def configure_limit(self, user_id, rps: int):
-        """Configure user-level rate-limit policy in a bucket."""
-        if self._algorithm == Algo.TOKEN_BUCKET:
-            self.buckets[user_id] = RateLimitBucket(
-                quota_limit=rps, time_window=Dur.SEC, clock=self._clock)
+        self.configure_limit(Level.GLOBAL, rps, tier, window, limits)
+
+    def configure_limit(self, user_id, rps: int = None, tier=None,
+                        window=Dur.SEC, limits=None):
+        """Configure user-level rate-limit policy in a bucket.
+
+        The bucket refers to the named tier if it is given, or an anonymous
+        tier shared by the buckets of the same rps otherwise. The rps is the
+        number of requests per time window (sec) such as Dur.MS100 for a
+        burst protection within a second.
+
+        The limits of a list of (rps, window) such as [(10, Dur.SEC), (300,
+        Dur.MIN)] configure multiple time windows instead of rps and window.
+        A request is allowed only if all of them have enough quota. They are
+        rejected by ValueError if the buckets decide a single window (e.g.
+        the sliding window counter)."""
+        if tier is None:
+            self.buckets.configure(user_id,
+                                   *_split_limits(rps, window, limits))
         else:
-            self.buckets[user_id] = RateLimitSlidingWindowCounter(
-                quota_limit=rps, time_window=Dur.SEC, clock=self._clock)
+            with self._structure:
+                tier_id = self.buckets.tiers.id_of(tier)
+                if tier_id is None:
+                    raise RateLimitConfigNotFound(
+                        message=f'tier ({tier}) not found')
+                self.buckets.tiers.pin((tier_id,))
+            try:
+                self.buckets.assign(user_id, tier_id)
+            finally:
+                with self._structure:
+                    self.buckets.tiers.unpin((tier_id,))
+        with self._structure:
+            self._reclaim_tiers()
+
+    def configure_limits(self, limits):
+        """Configure the buckets of many keys in one pass.
+
+        The limits are a mapping or an iterable of (key, limit) pairs, of
+        which the limit is a name of a tier, an rps per second, or a list of
+        (rps, window) of multiple time windows. The tier of the same limit
+        is looked up once, and the storage of the buckets is sized for all
+        the keys at once.
+
+        Return a RateLimitBulkResult of the numbers of the created and the
+        updated buckets, and the failed pairs."""
+        if hasattr(limits, 'items'):
+            limits = limits.items()
+        keys, tier_ids, failed, cache = [], [], [], {}
+        with self._structure:
+            for i, (key, limit) in enumerate(limits):
+                id_key = _limit_key(limit)
+                tier_id = cache.get(id_key)
+                if tier_id is None:
+                    tier_id = cache[id_key] = self._tier_id_of(id_key)
+                if tier_id < 0:
+                    failed.append((i, key))
+                else:
+                    keys.append(key)
+                    tier_ids.append(tier_id)
+            pinned = [tier_id for tier_id in cache.values() if tier_id >= 0]
+            self.buckets.tiers.pin(pinned)
+        try:
+            created = self.buckets.assign_many(keys, tier_ids)
+        finally:
+            with self._structure:
+                self.buckets.tiers.unpin(pinned)
+                self._reclaim_tiers()
+        return RateLimitBulkResult(created, len(keys) - created, failed)
+
+    def _reclaim_tiers(self, force=False):
+        """Free the tier IDs which no bucket refers to if forced or the
+        tiers are doubled since the last time, so the sweep of the buckets
+        is amortized over the new tiers."""
+        tiers = self.buckets.tiers
+        if force or len(tiers) >= self._reclaim_at:
+            tiers.reclaim(self.buckets.tier_ids())
+            self._reclaim_at = max(TIER_RECLAIM, 2 * len(tiers))
 
-    def process_request(self, user_id=None) -> bool:
-        """Reduce the quota remaining of either global or user rate-limit."""
+    def _tier_id_of(self, limit):
+        """Return the tier ID of a limit of configure_limits(), or -1 if it
+        isn't found or valid."""
+        tiers = self.buckets.tiers
+        if isinstance(limit, str):
+            tier_id = tiers.id_of(limit)
+            return -1 if tier_id is None else tier_id
+        if isinstance(limit, int) and not isinstance(limit, bool):
+            return tiers.intern(limit, Dur.SEC) if limit >= 0 else -1
+        if isinstance(limit, tuple) and limit and all(
+                map(_is_window, limit)):
+            try:
+                return tiers.intern(*_split_limits(None, None, limit))
+            except ValueError:
+                return -1
+        return -1
+
+    def tier(self, key=Level.GLOBAL):
+        """Return the rate-limit tier of the bucket."""
+        try:
+            return self.buckets.tier(key)
+        except KeyError:
+            raise RateLimitConfigNotFound
+
+    def process_request(self, user_id=None, now=None) -> bool:
+        """Reduce the quota remaining of either global or user rate-limit.
+
+        The clock is read once per request unless the time (ns) of the clock
+        is given by the caller. (once more for the heavy hitters.)"""
+        key = Level.GLOBAL if user_id is None else user_id
         try:
-            if user_id is None:
-                return self.buckets[Level.GLOBAL].decrement()
-            return self.buckets[user_id].decrement()
+            allowed = self.buckets.decrement(key, now)
         except KeyError:
             raise RateLimitConfigNotFound
+        if self.heavy_hitters is not None:
+            self.heavy_hitters.record(
+                key, allowed, self._clock.time_ns() if now is None else now)
+        return allowed
+
+    def try_acquire(self, key=Level.GLOBAL, cost=1, now=None):
+        """Reduce the quota remaining by cost with a single bucket lookup.
+
+        Return a RateLimitDecision of allowed, limit, remaining and reset_at,
+        or None if the key is not configured instead of raising an exception.
+        The cost of 0 returns the current status without consuming quota,
+        which isn't counted by the heavy hitters."""
+        decision = self.buckets.acquire(key, cost, now)
+        if (decision is not None and cost > 0 and
+                self.heavy_hitters is not None):
+            self.heavy_hitters.record(
+                key, decision.allowed,
+                self._clock.time_ns() if now is None else now)
+        return decision
+
+    def top_talkers(self, top=TOP_TALKERS, now=None):
+        """Return a list of RateLimitTrafficWindow of up to top keys of the
+        most requests and their deny ratios per window, of the current
+        window first. The list is empty if the heavy hitters are off."""
+        if self.heavy_hitters is None:
+            return []
+        return self.heavy_hitters.windows(
+            top, self._clock.time_ns() if now is None else now)
+
+    def lease(self, key=Level.GLOBAL, tokens=1, ttl=None, now=None):
+        """Grant a lease of up to tokens of the key to decide locally for
+        ttl seconds at most, or until the time window of the tokens ends.
+
+        Return a RateLimitLease of the granted tokens (0 if the quota is
+        exhausted until expires_at), or None if the key is not configured."""
+        if now is None:
+            now = self._clock.time_ns()
+        return self.leases.grant(self.buckets, key, tokens,
+                                 None if ttl is None else to_ns(ttl), now)
+
+    def release_lease(self, lease_id, unused=0, now=None):
+        """Close a lease and return its unused tokens to be leased again
+        within the lease's time. Return the number of the returned tokens."""
+        if now is None:
+            now = self._clock.time_ns()
+        try:
+            return self.leases.release(lease_id, unused, now)
+        except KeyError:
+            raise RateLimitLeaseNotFound(
+                message=f'lease ({lease_id}) not found or expired')
+
+    def time_ns(self):
+        """Return the time (ns) of the clock of the rate-limiter, which is
+        given as 'now' to decide a batch of requests at the same time."""
+        return self._clock.time_ns()
+
+    def process_requests(self, keys, timestamps):
+        """Process a batch of rate-limit requests of keys at timestamps.
+
+        This is to replay a large number of (e.g. historical) requests in one
+        call with vectorized array math. The result per request is the same as
+        calling process_request() in the order of timestamps per key. So the
+        timestamps (integer ns of the clock of the rate-limiter) must be sorted
+        per key, and not earlier than the time when the buckets are configured.
+
+        Return a numpy array of booleans that indicates if each request is
+        allowed."""
+        try:
+            return self.buckets.acquire_many(keys, timestamps)
+        except KeyError as e:
+            raise RateLimitConfigNotFound(payload={'keys': e.args[0]})
 
     def quota_limit(self, key=Level.GLOBAL):
         """Return the amount of quota limit within time window."""
         try:
-            return self.buckets[key].quota_limit()
+            return self.buckets.quota_limit(key)
         except KeyError:
             raise RateLimitConfigNotFound
 
     def quota_remaining(self, key=Level.GLOBAL):
         """Return quota remainining once process_request() is called."""
         try:
-            return self.buckets[key].quota_remaining()
+            return self.buckets.quota_remaining(key)
         except KeyError:
             raise RateLimitConfigNotFound
 
     def cur_remaining(self, key=Level.GLOBAL):
         """Return updated quota remainining as current time is changed."""
         try:
-            return self.buckets[key].cur_remaining()
+            return self.buckets.cur_remaining(key)
         except KeyError:
             raise RateLimitConfigNotFound
 
     def remove_bucket(self, key=Level.GLOBAL):
         """Remove rate-limiter bucket by key"""
         try:
-            del self.buckets[key]
+            self.buckets.remove(key)
+        except KeyError:
+            raise RateLimitConfigNotFound
+
+    def export_bucket(self, key=Level.GLOBAL):
+        """Return a RateLimitBucketState of the tier and the quota of the
+        bucket to move it to another rate-limiter w/o resetting its quota."""
+        try:
+            return self.buckets.export(key)
         except KeyError:
             raise RateLimitConfigNotFound
 
+    def restore_bucket(self, key, state):
+        """Create or replace the bucket of the key w/ an exported state.
+
+        The times of the state are of the clock of the exporting rate-limiter,
+        so both of them must share the clock (e.g. the monotonic clock of the
+        processes of a machine)."""
+        self.buckets.restore(key, state)
+
+    def image_buckets(self):
+        """Return a RateLimitTableImage of the copies of all the buckets and
+        tiers to save them w/o stalling the decisions (snapshot.py)."""
+        return self.buckets.image()
+
+    def load_buckets(self, image):
+        """Replace all the buckets and the named tiers w/ an image.
+
+        The times of the image must be of the clock of the rate-limiter,
+        which are shifted by the reader of a snapshot (snapshot.py)."""
+        self.buckets.load(image)
+
+    def scan_buckets(self, cursor=0, count=1024):
+        """Return (next cursor, keys) of the buckets of up to count slots
+        from the cursor to list them page by page, of which the next cursor
+        is 0 at the end (like SCAN of Redis).
+
+        A key configured during the whole scan is returned once even if the
+        other keys are added or removed in between (or more than once by the
+        SCAN of a Redis storage), but an added key may or may not be
+        returned."""
+        return self.buckets.scan(cursor, count)
+
     def is_configured(self, key=Level.GLOBAL):
         """Return if a rate-limiter bucket is configured by the key."""
         return True if key in self.buckets else False
 
+    def eviction_stats(self):
+        """Return the number of buckets and evicted buckets by reason."""
+        return dict(self.buckets.evictions, buckets=len(self.buckets))
+
+    def limits(self, key=Level.GLOBAL):
+        """Return a list of (quota limit, time window) of all the windows."""
+        return self.tier(key).limits()
+
     def is_exhausted(self, user_id=None):
         """Check if the rate-limiter is exhausted globally or per-user."""
         if user_id is None:
             return self.quota_remaining(Level.GLOBAL) < 1
         return self.quota_remaining(user_id) < 1
+
+
+def _limit_key(limit):
+    """Return a hashable key of a limit of configure_limits(), or None if
+    it isn't valid.
+
+    A bool isn't a limit, which would share the key of 0 or 1 otherwise."""
+    if isinstance(limit, (list, tuple)):
+        try:
+            key = tuple(map(tuple, limit))
+        except TypeError:
+            return None
+        return None if any(isinstance(x, bool) for window in key
+                           for x in window) else key
+    if isinstance(limit, bool):
+        return None
+    return limit if isinstance(limit, (str, int)) else None
+
+
+def _is_window(limit):
+    """Return if a limit is a valid (rps, window)."""
+    return len(limit) == 2 and all(
+        isinstance(x, (int, float)) for x in limit) and (
+        limit[0] >= 0 and limit[1] > 0)
+
+
+def _split_limits(rps, window, limits):
+    """Return (rps, window, extra limits) of the primary and other windows."""
+    if not limits:
+        return rps, window, ()
+    (rps, window), *extra_limits = limits
+    return rps, window, tuple(extra_limits)
@@ -0,0 +1,301 @@
+"""RESP (Redis Protocol) Storage Backend of Token Buckets
+
+The state of a key is a hash of the RESP server (e.g. Redis), and a request
+is decided by a Lua script of the token bucket which is run atomically by
+the server. The scripts of a batch are sent in a pipeline, so the requests of
+a batch cost one round trip and one read/write of the server.
+
+  +-------------+  EVALSHA <sha> 1 ratelimit:user-1 <now> <cost>  (x N)
+  | rate limiter| ------------------------------------------------------+
+  |  (client)   |  [allowed, limit, remaining, last, window]     (x N)  |
+  +-------------+ <-----------------------------------------------------+
+                           RESP server: HSET ratelimit:user-1
+                           limit, window, remaining, last (us)
+
+  - script : loaded once by SCRIPT LOAD, and loaded again if the server
+             replies NOSCRIPT (e.g. restarted).
+  - count  : the number of the keys is kept in the key of count:<prefix>
+             by the replies of HSET and DEL, so len() is a GET instead of
+             a SCAN of all the keys. It drifts if a client is lost between
+             a command and the count of it.
+  - time   : Lua numbers are doubles, so the times of the state are integer
+             microseconds (exact up to 2^53 us) instead of nanoseconds.
+  - server : the local stand-in (core/controller/resp_server.py) runs the
+             Python equivalents of the scripts of this module for the tests
+             and the development. The tests check the SHA1 and the keys,
+             args, fields and reply of the Lua text against them, but the
+             Lua itself is run only by a Redis server, and is unverified by
+             the tests.
+"""
+
+import hashlib
+import re
+import socket
+from threading import Lock
+
+from core.controller.decision import RateLimitDecision
+from core.controller.storage import RateLimitStorage
+
+DEFAULT_PORT = 6379
+DEFAULT_PREFIX = 'ratelimit:'
+NS_PER_US = 1000
+
+TOKEN_BUCKET_SCRIPT = b"""\
+local state = redis.call('HMGET', KEYS[1], 'limit', 'window', 'remaining',
+                         'last')
+if not state[1] then
+  return false
+end
+local limit = tonumber(state[1])
+local window = tonumber(state[2])
+local remaining = tonumber(state[3])
+local last = tonumber(state[4])
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local allowance = math.max(0, math.floor((now - last) / window))
+remaining = remaining + allowance * limit
+last = last + allowance * window
+if remaining >= limit then
+  remaining = limit
+  last = now
+end
+local allowed = 0
+if remaining >= cost then
+  allowed = 1
+  remaining = remaining - cost
+end
+redis.call('HSET', KEYS[1], 'remaining', string.format('%d', remaining),
+           'last', string.format('%d', last))
+return {allowed, limit, remaining, last, window}
+"""
+TOKEN_BUCKET_SHA = hashlib.sha1(TOKEN_BUCKET_SCRIPT).hexdigest()
+
+_RECV_SIZE = 1 << 16
+_SCAN_COUNT = 1000
+
+
+class RESPError(Exception):
+    """An error reply of the RESP server."""
+
+
+def encode_command(*args):
+    """Return a RESP command of an array of bulk strings."""
+    out = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(out)
+
+
+# the script command w/o the key and the args, and the array of its reply.
+_EVALSHA = b'*6\r\n' + encode_command(b'EVALSHA', TOKEN_BUCKET_SHA, 1)[4:]
+_SCRIPT_REPLY = re.compile(rb'\*5\r\n' + rb':(-?\d+)\r\n' * 5)
+
+
+def parse_reply(buf, pos=0):
+    """Return (reply, next position) of a RESP value in the buffer from the
+    position, or (None, -1) if the value is incomplete. An error reply is
+    returned as a RESPError, and a nil as None."""
+    end = buf.find(b'\r\n', pos)
+    if end < 0:
+        return None, -1
+    kind = buf[pos]
+    if kind == 0x2A:  # '*'
+        size = int(buf[pos + 1:end])
+        if size < 0:
+            return None, end + 2
+        items, pos = [], end + 2
+        for _ in range(size):
+            # the bulk strings and integers of an array are parsed inline
+            # w/o the recursion as the commands and the script replies are.
+            end = buf.find(b'\r\n', pos)
+            if end < 0:
+                return None, -1
+            kind = buf[pos]
+            if kind == 0x24 and buf[pos + 1] != 0x2D:  # '$' w/o '-'
+                start = end + 2
+                end = start + int(buf[pos + 1:end])
+                if len(buf) < end + 2:
+                    return None, -1
+                items.append(bytes(buf[start:end]))
+                pos = end + 2
+            elif kind == 0x3A:  # ':'
+                items.append(int(buf[pos + 1:end]))
+                pos = end + 2
+            else:
+                item, pos = parse_reply(buf, pos)
+                if pos < 0:
+                    return None, -1
+                items.append(item)
+        return items, pos
+    line = bytes(buf[pos + 1:end])
+    if kind == 0x2B:  # '+'
+        return line.decode(), end + 2
+    if kind == 0x2D:  # '-'
+        return RESPError(line.decode()), end + 2
+    if kind == 0x3A:  # ':'
+        return int(line), end + 2
+    if kind == 0x24:  # '$'
+        size = int(line)
+        if size < 0:
+            return None, end + 2
+        if len(buf) < end + 4 + size:
+            return None, -1
+        return bytes(buf[end + 2:end + 2 + size]), end + 4 + size
+    raise RESPError(f'invalid RESP type: {chr(kind)!r}')
+
+
+def _parse_script_reply(buf, pos=0):
+    """Return (reply, next position) of a reply of TOKEN_BUCKET_SCRIPT by
+    a regular expression of its array, or parse_reply() of the others."""
+    match = _SCRIPT_REPLY.match(buf, pos)
+    if match is None:
+        return parse_reply(buf, pos)
+    return [int(value) for value in match.groups()], match.end()
+
+
+class RateLimitRedisStorage(RateLimitStorage):
+    """Storage backend of a RESP server w/ the pipelined Lua scripts.
+
+    Attributes:
+        _sock  : A connected socket of the server.
+        _buf   : A bytearray of the replies received so far.
+        _prefix: A string prefix of the keys of the server.
+        _count : A string key of the number of the keys of the prefix.
+        _lock  : A lock of the connection shared by threads, which sends a
+                 pipeline and receives its replies at once.
+    """
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT,
+                 prefix=DEFAULT_PREFIX, timeout=None):
+        self._sock = socket.create_connection((host, port), timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buf = bytearray()
+        self._prefix = prefix
+        self._count = f'count:{prefix}'
+        self._lock = Lock()
+        self._load_script()
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """Connect to the server of a URL such as 'redis://localhost:6379'."""
+        address = url.split('://', 1)[-1].split('/', 1)[0]
+        host, _, port = address.rpartition(':')
+        return cls(host or 'localhost', int(port or DEFAULT_PORT), **kwargs)
+
+    def __len__(self):
+        return max(0, int(self._call(b'GET', self._count) or 0))
+
+    def close(self):
+        self._sock.close()
+
+    def put(self, key, limit, window, now):
+        if self._call(b'HSET', self._key(key), b'limit', limit,
+                      b'window', window // NS_PER_US, b'remaining', limit,
+                      b'last', now // NS_PER_US) == 4:
+            self._call(b'INCRBY', self._count, 1)
+
+    def delete(self, key):
+        if self._call(b'DEL', self._key(key)) > 0:
+            self._call(b'INCRBY', self._count, -1)
+            return True
+        return False
+
+    def get(self, key):
+        state = self._call(b'HMGET', self._key(key), b'limit', b'window',
+                           b'remaining', b'last')
+        if state[0] is None:
+            return None
+        limit, window, remaining, last_update = map(int, state)
+        return limit, window * NS_PER_US, remaining, last_update * NS_PER_US
+
+    def missing(self, keys):
+        replies = self._pipeline([encode_command(b'EXISTS', self._key(key))
+                                  for key in keys])
+        return [key for key, found in zip(keys, replies) if not found]
+
+    def acquire_many(self, requests):
+        commands = [_script_command(self._key(key).encode(),
+                                    b'%d' % (now // NS_PER_US), b'%d' % cost)
+                    for key, cost, now in requests]
+        replies = self._pipeline(commands, _parse_script_reply)
+        retry = [i for i, reply in enumerate(replies)
+                 if isinstance(reply, RESPError)
+                 and str(reply).startswith('NOSCRIPT')]
+        if retry:
+            self._load_script()
+            for i, reply in zip(retry, self._pipeline(
+                    [commands[i] for i in retry], _parse_script_reply)):
+                replies[i] = reply
+        return [None if reply is None else _decision(reply)
+                for reply in map(_check, replies)]
+
+    def keys(self):
+        """Return a list of the keys by SCAN w/o blocking the server."""
+        keys, cursor = [], 0
+        while True:
+            cursor, more = self.scan(cursor, _SCAN_COUNT)
+            keys += more
+            if not cursor:
+                return list(dict.fromkeys(keys))
+
+    def scan(self, cursor, count):
+        """Return (next cursor, keys) of a SCAN of the keys of the prefix,
+        of which the next cursor is 0 at the end. A key may be returned
+        more than once, and a page may be empty."""
+        cursor, keys = self._call(
+            b'SCAN', cursor, b'MATCH', self._prefix.replace('*', r'\*') + '*',
+            b'COUNT', count)
+        size = len(self._prefix)
+        return int(cursor), [key[size:].decode() for key in keys]
+
+    def _key(self, key):
+        return f'{self._prefix}{key}'
+
+    def _load_script(self):
+        self._call(b'SCRIPT', b'LOAD', TOKEN_BUCKET_SCRIPT)
+
+    def _call(self, *args):
+        """Send a command and return its reply, or raise a RESPError."""
+        return _check(self._pipeline([encode_command(*args)])[0])
+
+    def _pipeline(self, commands, parse=parse_reply):
+        """Send the commands in one write, and return a list of their replies
+        including the errors parsed by the function of parse_reply()."""
+        with self._lock:
+            self._sock.sendall(b''.join(commands))
+            replies, buf, pos = [], self._buf, 0
+            while len(replies) < len(commands):
+                reply, end = parse(buf, pos) if pos < len(buf) else (
+                    None, -1)
+                if end < 0:
+                    del buf[:pos]
+                    pos = 0
+                    chunk = self._sock.recv(_RECV_SIZE)
+                    if not chunk:
+                        raise ConnectionError('connection closed by server')
+                    buf += chunk
+                    continue
+                replies.append(reply)
+                pos = end
+            del buf[:pos]
+            return replies
+
+
+def _script_command(key, now, cost):
+    return b'%s$%d\r\n%s\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n' % (
+        _EVALSHA, len(key), key, len(now), now, len(cost), cost)
+
+
+def _check(reply):
+    if isinstance(reply, RESPError):
+        raise reply
+    return reply
+
+
+def _decision(reply):
+    allowed, limit, remaining, last_update, window = reply
+    return RateLimitDecision(bool(allowed), limit, remaining,
+                             (last_update + window) * NS_PER_US,
+                             window * NS_PER_US)
@@ -0,0 +1,489 @@
+"""Hot-Standby Replica of Rate Limiter w/ Streamed Bucket State
+
+The buckets and the config of a rate limiter are kept in its memory, so a
+restart gives every user a full quota and loses all the config. The primary
+streams the mutations of its buckets and tiers to the standby as batched
+deltas, so the standby can take over w/ the state of the last interval.
+
+  +-----------------+   frame of deltas every interval (TCP)   +---------+
+  | primary         | ---------------------------------------> | standby |
+  | (recorded keys) |   TIER gold | PUT user-1 | REMOVE user-2   | limiter |
+  +-----------------+   (a full snapshot when it connects)     +---------+
+
+  - record : the buckets of the primary are wrapped by the recorder which
+             appends the keys of the decisions and config changes to a
+             queue w/o a lock (a probe of cost 0 isn't recorded). A key is
+             sent once per interval however many times it is changed.
+  - delta  : the exported state (tier and quota) of a changed key, the
+             removal of a key, and the named tiers which are changed or
+             removed (e.g. a deleted policy).
+  - apply  : the standby restores the buckets by the deltas, and is promoted
+             to decide the requests when the primary is lost. The standby
+             must not decide the requests or change the config before it is
+             promoted, which is overwritten by the deltas of the primary.
+  - clock  : the times of the state are of the clock of the primary, so the
+             standby must share the clock (e.g. the monotonic clock of the
+             processes of a machine, or WallClock of the machines, which
+             the app uses for the primary and the standbys).
+
+Frame:
+======
+  +----------------+---------------------------------------------------+
+  | length (4B)    | records                                           |
+  +----------------+---------------------------------------------------+
+  | record         | kind (1B), key type (1B), key length (2B), key    |
+  |  - PUT         | + tier name length (2B, 0xFFFF if anonymous),     |
+  |                |   name, windows (1B) x (limit, window, remaining, |
+  |                |   last)                                           |
+  |  - REMOVE      | (no more fields)                                  |
+  |  - TIER        | + windows (1B) x (limit, window) of a tier (key)  |
+  |  - TIER_REMOVE | (no more fields) of a removed tier (key)          |
+  +----------------+---------------------------------------------------+
+
+Note that the evictions of the primary aren't sent, and the tokens of the
+cells of a striped key (e.g. the global key) aren't included in its state.
+"""
+
+import socket
+import struct
+from collections import deque, namedtuple
+from threading import Event, Lock, Thread
+
+import numpy as np
+
+from core.common.constants import NS_PER_SEC
+from core.common.exceptions import RateLimitConfigNotFound
+from core.common.utils import MonotonicClock, to_ns
+from core.controller.bucket_table import RateLimitBucketState
+from core.controller.tier import RateLimitTier
+
+DEFAULT_PORT = 8005
+DEFAULT_INTERVAL = 0.05
+
+PUT, REMOVE, TIER, TIER_REMOVE = 1, 2, 3, 4
+
+_FRAME = struct.Struct('!I')
+_RECORD = struct.Struct('!BBH')
+_NAME = struct.Struct('!H')
+_COUNT = struct.Struct('!B')
+_LANE = struct.Struct('!qqqq')
+_LIMIT = struct.Struct('!qq')
+_ANONYMOUS = 0xFFFF
+_STR, _INT = 0, 1
+
+_Removal = namedtuple('_Removal', ['key'])
+
+
+class RateLimitRecordedBuckets:
+    """Buckets recording the keys changed since the last drain().
+
+    This exposes the same interface of the buckets, and each decision or
+    config change of a key appends the key (or a _Removal of the key) to the
+    pending changes, which is atomic w/o a lock. The changes are folded into
+    the sets of the changed and removed keys by drain() in order.
+
+    Attributes:
+        _pending: A deque of the keys changed and the _Removal of the keys
+                  removed since the last drain().
+    """
+
+    def __init__(self, buckets):
+        self.tiers = buckets.tiers
+        self._buckets = buckets
+        self._pending = deque()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def __contains__(self, key):
+        return key in self._buckets
+
+    def __iter__(self):
+        return iter(self._buckets)
+
+    @property
+    def evictions(self):
+        return self._buckets.evictions
+
+    def keys(self):
+        return self._buckets.keys()
+
+    def tier_ids(self):
+        return self._buckets.tier_ids()
+
+    def scan(self, cursor, count):
+        return self._buckets.scan(cursor, count)
+
+    def drain(self):
+        """Return (changed keys, removed keys) since the last drain(),
+        which is called by a thread at a time."""
+        changed, removed = set(), set()
+        pop = self._pending.popleft
+        for _ in range(len(self._pending)):
+            key = pop()
+            if type(key) is _Removal:
+                changed.discard(key.key)
+                removed.add(key.key)
+            else:
+                changed.add(key)
+                removed.discard(key)
+        return changed, removed
+
+    def configure(self, key, quota_limit, time_window, extra_limits=()):
+        self._buckets.configure(key, quota_limit, time_window, extra_limits)
+        self._pending.append(key)
+
+    def assign(self, key, tier_id):
+        self._buckets.assign(key, tier_id)
+        self._pending.append(key)
+
+    def assign_many(self, keys, tier_ids):
+        created = self._buckets.assign_many(keys, tier_ids)
+        self._pending.extend(keys)
+        return created
+
+    def restore(self, key, state):
+        self._buckets.restore(key, state)
+        self._pending.append(key)
+
+    def load(self, image):
+        self._buckets.load(image)
+        self._pending.extend(key for key in image.keys if key is not None)
+
+    def remove(self, key):
+        self._buckets.remove(key)
+        self._pending.append(_Removal(key))
+
+    def decrement(self, key, now=None):
+        allowed = self._buckets.decrement(key, now)
+        self._pending.append(key)
+        return allowed
+
+    def acquire(self, key, cost=1, now=None):
+        decision = self._buckets.acquire(key, cost, now)
+        if decision is not None and cost:
+            self._pending.append(key)
+        return decision
+
+    def acquire_many(self, keys, timestamps):
+        res = self._buckets.acquire_many(keys, timestamps)
+        if isinstance(keys, np.ndarray):
+            keys = keys.tolist()
+        self._pending.extend(keys)
+        return res
+
+    def export(self, key):
+        return self._buckets.export(key)
+
+    def image(self):
+        return self._buckets.image()
+
+    def tier(self, key):
+        return self._buckets.tier(key)
+
+    def cur_remaining(self, key):
+        return self._buckets.cur_remaining(key)
+
+    def quota_limit(self, key):
+        return self._buckets.quota_limit(key)
+
+    def quota_remaining(self, key):
+        return self._buckets.quota_remaining(key)
+
+
+class RateLimitPrimary:
+    """Primary of the rate limiter streaming its deltas to the standbys.
+
+    Attributes:
+        limiter  : A RateLimiter of which the buckets are recorded.
+        interval : A float of seconds between the frames of the deltas.
+        _buckets : The recorder (RateLimitRecordedBuckets) of the buckets.
+        _standbys: A list of the sockets of the connected standbys.
+        _tiers   : A dict of the named tiers sent by the last delta, or
+                   None of the ones only in a snapshot.
+        _lock    : A lock of the standbys and a frame being sent.
+    """
+
+    def __init__(self, limiter, interval=DEFAULT_INTERVAL):
+        self.limiter = limiter
+        self.interval = interval
+        self._buckets = RateLimitRecordedBuckets(limiter.buckets)
+        limiter.buckets = self._buckets
+        self._standbys = []
+        self._tiers = {}
+        self._lock = Lock()
+        self._server = None
+        self._stopped = Event()
+
+    def start(self, host='0.0.0.0', port=DEFAULT_PORT):
+        """Listen to the standbys, and start the threads of accepting the
+        standbys and sending the deltas. Return the bound (host, port)."""
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen()
+        Thread(target=self._accept, name='primary-accept',
+               daemon=True).start()
+        Thread(target=self._run, name='primary-deltas', daemon=True).start()
+        return self._server.getsockname()
+
+    def close(self):
+        self._stopped.set()
+        if self._server is not None:
+            # wake up the accept thread, which keeps the port otherwise.
+            try:
+                self._server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._server.close()
+        with self._lock:
+            for sock in self._standbys:
+                sock.close()
+            self._standbys = []
+
+    def sync(self):
+        """Send a frame of the deltas since the last frame to the standbys,
+        and return the number of the records."""
+        with self._lock:
+            changed, removed = self._buckets.drain()
+            records = self._tier_records(full=False)
+            records += [_encode_put(key, self._export(key))
+                        for key in changed]
+            records += [_encode_key(REMOVE, key) for key in removed]
+            records = [record for record in records if record]
+            if records and self._standbys:
+                self._send(_frame(records))
+            return len(records)
+
+    def _accept(self):
+        while not self._stopped.is_set():
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # a full snapshot is sent before the deltas of the next frame,
+            # and the keys changed in between are sent again by the frame.
+            with self._lock:
+                records = self._tier_records(full=True) + [
+                    _encode_put(key, self._export(key))
+                    for key in list(self._buckets.keys())]
+                try:
+                    sock.sendall(_frame([r for r in records if r]))
+                except OSError:
+                    sock.close()
+                    continue
+                self._standbys.append(sock)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sync()
+
+    def _send(self, frame):
+        for sock in list(self._standbys):
+            try:
+                sock.sendall(frame)
+            except OSError:
+                sock.close()
+                self._standbys.remove(sock)
+
+    def _export(self, key):
+        """Return the state of the key, or None if it is evicted."""
+        try:
+            return self._buckets.export(key)
+        except KeyError:
+            return None
+
+    def _tier_records(self, full):
+        """Return the records of the named tiers changed or removed since
+        the last delta, or all of them for the snapshot if full.
+
+        A tier of the snapshot which isn't in the last delta is sent again
+        by the next delta for the other standbys, and its removal is sent
+        if it is removed in between."""
+        tiers = {tier.name: tier for tier in list(self.limiter.buckets.tiers)
+                 if tier is not None and tier.name is not None}
+        if full:
+            for name in tiers:
+                self._tiers.setdefault(name, None)
+            return [_encode_tier(tier) for tier in tiers.values()]
+        records = [_encode_key(TIER_REMOVE, name) for name in self._tiers
+                   if name not in tiers]
+        records += [_encode_tier(tier) for name, tier in tiers.items()
+                    if self._tiers.get(name) != tier]
+        self._tiers = tiers
+        return records
+
+
+class RateLimitStandby:
+    """Standby of the rate limiter applying the deltas of the primary.
+
+    The standby is promoted by promote() or when the primary is lost, and
+    the writes of the rate-limiter (e.g. the APIs of the app) are gated by
+    the promoted event until then.
+
+    Attributes:
+        limiter   : A RateLimiter restored by the deltas.
+        connected : An Event set while the standby follows the primary.
+        promoted  : An Event set once the standby is promoted.
+        on_promote: A callable of the rate-limiter called once when the
+                    standby is promoted (e.g. to start the data plane), or
+                    None.
+        applied   : An integer of the records applied so far.
+        last_frame: A monotonic time (sec) of the last frame applied, or None.
+    """
+
+    def __init__(self, limiter, on_promote=None):
+        self.limiter = limiter
+        self.connected = Event()
+        self.promoted = Event()
+        self.on_promote = on_promote
+        self.applied = 0
+        self.last_frame = None
+        self._sock = None
+        self._clock = MonotonicClock()
+        self._lock = Lock()
+
+    def follow(self, host, port=DEFAULT_PORT, timeout=None):
+        """Connect to the primary, and start the thread of applying the
+        deltas until the primary is lost or the standby is promoted."""
+        self._sock = socket.create_connection((host, port), timeout)
+        self._sock.settimeout(None)
+        self.connected.set()
+        Thread(target=self._run, args=(self._sock,), name='standby',
+               daemon=True).start()
+
+    def staleness(self):
+        """Return the seconds since the last frame of the primary."""
+        if self.last_frame is None:
+            return None
+        return self._clock.time() - self.last_frame
+
+    def promote(self):
+        """Stop following the primary, and return the rate-limiter to
+        decide the requests."""
+        with self._lock:
+            sock, self._sock = self._sock, None
+            if sock is not None:
+                sock.close()
+            self.connected.clear()
+            if self.promoted.is_set():
+                return self.limiter
+            self.promoted.set()
+        if self.on_promote is not None:
+            self.on_promote(self.limiter)
+        return self.limiter
+
+    def apply(self, payload):
+        """Apply the records of a frame to the rate-limiter."""
+        limiter = self.limiter
+        for kind, key, value in _decode_records(payload):
+            if kind == PUT:
+                limiter.restore_bucket(key, value)
+            elif kind == REMOVE:
+                if limiter.is_configured(key):
+                    limiter.remove_bucket(key)
+            elif kind == TIER_REMOVE:
+                try:
+                    limiter.remove_tier(key)
+                except RateLimitConfigNotFound:
+                    pass
+            else:
+                limiter.configure_tier(key, limits=value.limits())
+            self.applied += 1
+        self.last_frame = self._clock.time()
+
+    def _run(self, sock):
+        buf = bytearray()
+        try:
+            while self._sock is sock:
+                chunk = sock.recv(1 << 16)
+                if not chunk:
+                    break
+                buf += chunk
+                pos = 0
+                while len(buf) - pos >= _FRAME.size:
+                    size, = _FRAME.unpack_from(buf, pos)
+                    end = pos + _FRAME.size + size
+                    if len(buf) < end:
+                        break
+                    self.apply(bytes(buf[pos + _FRAME.size:end]))
+                    pos = end
+                del buf[:pos]
+        except OSError:
+            pass
+        finally:
+            self.connected.clear()
+        # the primary is lost unless the standby is promoted by promote().
+        if self._sock is sock:
+            self.promote()
+
+
+def _frame(records):
+    payload = b''.join(records)
+    return _FRAME.pack(len(payload)) + payload
+
+
+def _encode_key(kind, key):
+    key_type = _INT if isinstance(key, int) else _STR
+    key = str(key).encode()
+    return _RECORD.pack(kind, key_type, len(key)) + key
+
+
+def _encode_put(key, state):
+    if state is None:
+        return b''
+    tier = state.tier
+    name = b'' if tier.name is None else str(tier.name).encode()
+    return b''.join([
+        _encode_key(PUT, key),
+        _NAME.pack(_ANONYMOUS if tier.name is None else len(name)), name,
+        _COUNT.pack(len(state.lanes)),
+        *(_LANE.pack(limit, to_ns(window), remaining, last_update)
+          for (limit, window), (remaining, last_update) in zip(
+              tier.limits(), state.lanes))])
+
+
+def _encode_tier(tier):
+    limits = tier.limits()
+    return b''.join([_encode_key(TIER, tier.name), _COUNT.pack(len(limits)),
+                     *(_LIMIT.pack(limit, to_ns(window))
+                       for limit, window in limits)])
+
+
+def _decode_records(payload):
+    """Yield (kind, key, state of PUT, tier of TIER or None of the
+    removals)."""
+    pos = 0
+    while pos < len(payload):
+        kind, key_type, size = _RECORD.unpack_from(payload, pos)
+        pos += _RECORD.size
+        key = payload[pos:pos + size].decode()
+        pos += size
+        if key_type == _INT:
+            key = int(key)
+        if kind in (REMOVE, TIER_REMOVE):
+            yield kind, key, None
+            continue
+        name = key
+        if kind == PUT:
+            size, = _NAME.unpack_from(payload, pos)
+            pos += _NAME.size
+            name = None
+            if size != _ANONYMOUS:
+                name = payload[pos:pos + size].decode()
+                pos += size
+        count, = _COUNT.unpack_from(payload, pos)
+        pos += _COUNT.size
+        record = _LANE if kind == PUT else _LIMIT
+        fields = [record.unpack_from(payload, pos + i * record.size)
+                  for i in range(count)]
+        pos += count * record.size
+        limits = [(limit, window / NS_PER_SEC)
+                  for limit, window, *_ in fields]
+        tier = RateLimitTier(name, *limits[0], tuple(limits[1:]))
+        if kind == PUT:
+            yield kind, key, RateLimitBucketState(
+                tier, tuple(tuple(lane) for _, _, *lane in fields))
+        else:
+            yield kind, key, tier
@@ -0,0 +1,288 @@
+"""Local RESP Server Standing in for Redis
+
+The RESP storage backend (core/controller/redis_storage.py) is tested and
+developed w/o a Redis server by this stand-in, which serves the commands of
+the backend over the same protocol. It can't run Lua, so the scripts of the
+backend are run by their Python equivalents looked up by the SHA1 of the
+script, and the other scripts are rejected.
+
+  - commands: PING, GET, INCRBY, HSET, HMGET, HGETALL, DEL, EXISTS, KEYS,
+              SCAN, DBSIZE, FLUSHALL, SCRIPT LOAD|EXISTS|FLUSH, EVAL and
+              EVALSHA.
+  - scan    : the cursor is the next CRC32 of the keys in asc. order, so a
+              key kept during a scan is returned once like Redis.
+  - pipeline: the replies of the commands of a read are sent by one write.
+  - state   : a dict of hashes in the memory of the server, which is lost
+              when the server is stopped.
+
+  $ python core/controller/resp_server.py 6379
+"""
+
+import asyncio
+import fnmatch
+import hashlib
+import heapq
+import sys
+import threading
+import zlib
+
+from core.controller.redis_storage import (
+    DEFAULT_PORT,
+    TOKEN_BUCKET_SCRIPT,
+    RESPError,
+    parse_reply
+)
+
+
+def token_bucket(db, keys, args):
+    """Python equivalent of TOKEN_BUCKET_SCRIPT."""
+    state = db.get(keys[0])
+    if state is None:
+        return None
+    limit, window = int(state[b'limit']), int(state[b'window'])
+    remaining, last = int(state[b'remaining']), int(state[b'last'])
+    now, cost = int(args[0]), int(args[1])
+    allowance = max(0, (now - last) // window)
+    remaining += allowance * limit
+    last += allowance * window
+    if remaining >= limit:
+        remaining = limit
+        last = now
+    allowed = 0
+    if remaining >= cost:
+        allowed = 1
+        remaining -= cost
+    state[b'remaining'] = b'%d' % remaining
+    state[b'last'] = b'%d' % last
+    return [allowed, limit, remaining, last, window]
+
+
+COMMANDS = frozenset((
+    'ping', 'get', 'incrby', 'hset', 'hmget', 'hgetall', 'del', 'exists',
+    'keys', 'scan', 'dbsize', 'flushall', 'script', 'eval', 'evalsha'
+))
+SCRIPTS = {
+    hashlib.sha1(TOKEN_BUCKET_SCRIPT).hexdigest(): token_bucket
+}
+
+
+class RESPStandInProtocol(asyncio.Protocol):
+    """Connection of the stand-in server.
+
+    Attributes:
+        _server   : A RESPStandIn of the data and the loaded scripts.
+        _buf      : A bytearray of the incomplete command received so far.
+        _transport: An asyncio transport of the connection.
+    """
+
+    def __init__(self, server):
+        self._server = server
+        self._buf = bytearray()
+        self._transport = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def data_received(self, data):
+        buf = self._buf
+        buf += data
+        out, pos = [], 0
+        while pos < len(buf):
+            try:
+                command, end = parse_reply(buf, pos)
+            except (RESPError, ValueError) as e:
+                out.append(encode_reply(RESPError(f'ERR protocol: {e}')))
+                pos = len(buf)
+                break
+            if end < 0:
+                break
+            pos = end
+            if not command or not isinstance(command, list) or not all(
+                    isinstance(arg, bytes) for arg in command):
+                out.append(encode_reply(RESPError('ERR invalid command')))
+                continue
+            out.append(encode_reply(self._server.execute(command)))
+        del buf[:pos]
+        if out:
+            self._transport.write(b''.join(out))
+
+
+class RESPStandIn:
+    """Data and scripts of the stand-in server shared by its connections.
+
+    Attributes:
+        db     : A dict of key (bytes) to a hash (dict of bytes to bytes)
+                 or a string (bytes).
+        loaded : A set of the SHA1 of the loaded scripts.
+    """
+
+    def __init__(self):
+        self.db = {}
+        self.loaded = set()
+
+    def execute(self, command):
+        """Return the reply of a command of a list of bulk strings."""
+        name = command[0].decode('latin-1').lower()
+        if name not in COMMANDS:
+            return RESPError(f"ERR unknown command '{name}'")
+        try:
+            return getattr(self, '_' + name)(*command[1:])
+        except (TypeError, ValueError, IndexError):
+            return RESPError(f"ERR wrong arguments for '{name}'")
+
+    def _ping(self, *args):
+        return args[0] if args else 'PONG'
+
+    def _get(self, key):
+        return self.db.get(key)
+
+    def _incrby(self, key, increment):
+        value = int(self.db.get(key, b'0')) + int(increment)
+        self.db[key] = b'%d' % value
+        return value
+
+    def _hset(self, key, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise ValueError
+        fields = self.db.setdefault(key, {})
+        added = sum(field not in fields for field in pairs[::2])
+        fields.update(zip(pairs[::2], pairs[1::2]))
+        return added
+
+    def _hmget(self, key, *fields):
+        values = self.db.get(key, {})
+        return [values.get(field) for field in fields]
+
+    def _hgetall(self, key):
+        return [item for pair in self.db.get(key, {}).items()
+                for item in pair]
+
+    def _del(self, *keys):
+        return sum(self.db.pop(key, None) is not None for key in keys)
+
+    def _exists(self, *keys):
+        return sum(key in self.db for key in keys)
+
+    def _keys(self, pattern):
+        pattern = pattern.decode()
+        return [key for key in self.db
+                if fnmatch.fnmatchcase(key.decode(), pattern)]
+
+    def _scan(self, cursor, *args):
+        """Return [next cursor, keys] of up to COUNT keys of which the CRC32
+        is the cursor or more, and the keys of the same CRC32 of the last."""
+        options = dict(zip((arg.upper() for arg in args[::2]), args[1::2]))
+        pattern = options.get(b'MATCH', b'*').decode()
+        cursor, count = int(cursor), int(options.get(b'COUNT', 10))
+        page = heapq.nsmallest(count, (
+            (crc, key) for crc, key in (
+                (zlib.crc32(key), key) for key in self.db) if crc >= cursor))
+        if len(page) < count:
+            cursor = 0
+        else:
+            cursor = page[-1][0] + 1
+            page += sorted((crc, key) for crc, key in (
+                (zlib.crc32(key), key) for key in self.db)
+                if crc == cursor - 1 and (crc, key) > page[-1])
+        return [b'%d' % cursor, [
+            key for _, key in page
+            if fnmatch.fnmatchcase(key.decode(), pattern)]]
+
+    def _dbsize(self):
+        return len(self.db)
+
+    def _flushall(self, *args):
+        self.db.clear()
+        return 'OK'
+
+    def _script(self, sub, *args):
+        sub = sub.upper()
+        if sub == b'LOAD':
+            sha = hashlib.sha1(args[0]).hexdigest()
+            if sha not in SCRIPTS:
+                return RESPError('ERR the stand-in runs the scripts of the '
+                                 'RESP storage backend only')
+            self.loaded.add(sha)
+            return sha.encode()
+        if sub == b'EXISTS':
+            return [int(sha.decode() in self.loaded) for sha in args]
+        if sub == b'FLUSH':
+            self.loaded.clear()
+            return 'OK'
+        raise ValueError
+
+    def _eval(self, script, *args):
+        sha = hashlib.sha1(script).hexdigest()
+        if sha not in SCRIPTS:
+            return RESPError('ERR the stand-in runs the scripts of the '
+                             'RESP storage backend only')
+        self.loaded.add(sha)
+        return self._evalsha(sha.encode(), *args)
+
+    def _evalsha(self, sha, num_keys, *args):
+        sha = sha.decode().lower()
+        if sha not in self.loaded:
+            return RESPError('NOSCRIPT No matching script. '
+                             'Please use EVAL.')
+        num_keys = int(num_keys)
+        return SCRIPTS[sha](self.db, args[:num_keys], args[num_keys:])
+
+
+def encode_reply(value):
+    """Return a RESP reply of a value: str as a simple string, bytes as a
+    bulk string, int, list, None as a nil and RESPError as an error."""
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, list) and len(value) == 5:
+        # the array of integers of the replies of the script.
+        try:
+            return b'*5\r\n:%d\r\n:%d\r\n:%d\r\n:%d\r\n:%d\r\n' % tuple(
+                value)
+        except TypeError:
+            pass
+    if isinstance(value, RESPError):
+        return b'-%s\r\n' % str(value).encode()
+    if isinstance(value, str):
+        return b'+%s\r\n' % value.encode()
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    return b''.join([b'*%d\r\n' % len(value),
+                     *(encode_reply(item) for item in value)])
+
+
+def serve(host='127.0.0.1', port=DEFAULT_PORT):
+    """Run the stand-in server until it is interrupted."""
+    async def serve_forever():
+        standin = RESPStandIn()
+        server = await asyncio.get_running_loop().create_server(
+            lambda: RESPStandInProtocol(standin), host, port,
+            reuse_address=True)
+        async with server:
+            await server.serve_forever()
+    asyncio.run(serve_forever())
+
+
+def start_in_thread(host='127.0.0.1', port=0):
+    """Start the stand-in server in the event loop of a daemon thread, and
+    return the server of asyncio."""
+    loop = asyncio.new_event_loop()
+    standin = RESPStandIn()
+    server = loop.run_until_complete(loop.create_server(
+        lambda: RESPStandInProtocol(standin), host, port,
+        reuse_address=True))
+    threading.Thread(target=loop.run_forever, name='resp-stand-in',
+                     daemon=True).start()
+    return server
+
+
+def stop_in_thread(server):
+    """Close the server started by start_in_thread(), and stop its loop."""
+    loop = server.get_loop()
+    loop.call_soon_threadsafe(server.close)
+    loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == '__main__':
+    serve(port=int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT)
@@ -0,0 +1,366 @@
+"""Consistent-Hash Router of Keys across Rate Limiter Instances
+
+A rate limiter keeps the bucket of every user, so the memory and the CPU of
+one process limit the number of users. The router partitions the keys across
+K instances of the rate limiter by a consistent hash ring, so each instance
+keeps about 1/K of the buckets.
+
+                 hash ring (2^64) w/ virtual nodes of the instances
+  +---------+       a#0     b#3   a#7      c#1    b#0     c#5
+  | router  |  ------+-------+-----+--------+------+-------+------->
+  +---------+                   ^
+  | user-1  | -- hash(user-1) --+--> the first vnode clockwise: a#7 -> a
+
+  - vnodes : an instance has vnodes * weight points on the ring, so the keys
+             are spread evenly by weight, and adding or removing an instance
+             moves about 1/K of the keys from or to all the others.
+  - migrate: the buckets of the moved keys are exported from the old owner
+             and restored to the new owner w/ their quota remaining, so the
+             quota isn't reset by a change of the instances.
+  - global : the global limit is split across the instances by weight (the
+             shares sum to the limit by the largest remainder), and the
+             requests w/o a user ID are spread over the instances by smooth
+             weighted round-robin of the shares. The fraction of the limit
+             remaining in all the instances is carried over to the new
+             shares when an instance is added or removed.
+  - hash   : 64-bit BLAKE2b of the key string, which is the same in all the
+             processes unlike hash() of Python.
+
+Note that the instances must share the clock to move the buckets (e.g. the
+processes of a machine), and the instances aren't added or removed while
+the requests are being decided. The ring is kept as it was if the buckets of
+an instance can't be moved (RateLimitNotSupported, e.g. a storage backend).
+"""
+
+import hashlib
+from bisect import bisect_right
+
+import numpy as np
+
+from core.common.constants import Duration as Dur, RateLimitLevel as Level
+from core.common.exceptions import (
+    RateLimitConfigNotFound,
+    RateLimitNotSupported
+)
+
+DEFAULT_VNODES = 128
+
+
+class RateLimitHashRing:
+    """Consistent hash ring of the names of instances w/ virtual nodes.
+
+    Attributes:
+        vnodes  : An integer of the virtual nodes per weight of an instance.
+        weights : A dict of the name of an instance to its weight.
+        _points : A sorted list of the hashes of the virtual nodes.
+        _owners : A list of the name of the instance per point.
+    """
+
+    def __init__(self, vnodes=DEFAULT_VNODES):
+        self.vnodes = vnodes
+        self.weights = {}
+        self._points = []
+        self._owners = []
+
+    def __len__(self):
+        return len(self.weights)
+
+    def __contains__(self, name):
+        return name in self.weights
+
+    def __iter__(self):
+        return iter(self.weights)
+
+    def add(self, name, weight=1):
+        if name in self.weights:
+            raise ValueError(f'instance ({name}) already exists')
+        self.weights[name] = weight
+        self._build()
+
+    def remove(self, name):
+        del self.weights[name]
+        self._build()
+
+    def owner(self, key):
+        """Return the name of the instance of the key."""
+        if not self._points:
+            raise LookupError('no instance in the ring')
+        i = bisect_right(self._points, _hash(key))
+        return self._owners[i if i < len(self._owners) else 0]
+
+    def _build(self):
+        ring = sorted((_hash(f'{name}#{i}'), name)
+                      for name, weight in self.weights.items()
+                      for i in range(max(1, round(self.vnodes * weight))))
+        self._points = [point for point, _ in ring]
+        self._owners = [name for _, name in ring]
+
+
+class RateLimitRouter:
+    """Rate limiter of the keys partitioned across the instances.
+
+    This exposes the interface of RateLimiter to configure and decide the
+    keys, and each call goes to the instance of the key on the ring.
+
+    Attributes:
+        instances: A dict of the name of an instance to its RateLimiter.
+        ring     : A consistent hash ring (RateLimitHashRing) of the names.
+        _tiers   : A dict of the named tiers to define in a new instance.
+        _global  : (rps, window, limits) of the global limit, or None.
+        _shares  : A dict of the name of an instance to its global share.
+        _credits : A dict of the name of an instance to the current credit of
+                   the smooth weighted round-robin of the global requests.
+    """
+
+    def __init__(self, vnodes=DEFAULT_VNODES):
+        self.instances = {}
+        self.ring = RateLimitHashRing(vnodes)
+        self._tiers = {}
+        self._global = None
+        self._shares = {}
+        self._credits = {}
+
+    def __len__(self):
+        return sum(len(limiter.buckets)
+                   for limiter in self.instances.values())
+
+    def add_instance(self, name, limiter, weight=1):
+        """Add an instance, and move the buckets of the keys of the instance
+        on the new ring from the others. Return the number of moved keys."""
+        for tier, args in self._tiers.items():
+            limiter.configure_tier(tier, *args)
+        fraction = self._global_fraction()
+        self.ring.add(name, weight)
+        self.instances[name] = limiter
+        try:
+            moved = sum(self._move(other, self.instances[other])
+                        for other in self.ring if other != name)
+        except RateLimitNotSupported:
+            self.ring.remove(name)
+            del self.instances[name]
+            raise
+        self._split_global(fraction)
+        return moved
+
+    def remove_instance(self, name):
+        """Remove an instance, and move its buckets to the new owners of
+        the keys. Return the RateLimiter of the removed instance."""
+        if len(self.ring) == 1 and len(self.instances[name].buckets) > 0:
+            raise ValueError('the buckets of the last instance can\'t move')
+        fraction = self._global_fraction()
+        weight = self.ring.weights[name]
+        self.ring.remove(name)
+        limiter = self.instances.pop(name)
+        if self.ring:
+            try:
+                self._move(name, limiter)
+            except RateLimitNotSupported:
+                self.ring.add(name, weight)
+                self.instances[name] = limiter
+                raise
+        self._split_global(fraction)
+        return limiter
+
+    def instance(self, key):
+        """Return the RateLimiter of the instance of the key."""
+        return self.instances[self.ring.owner(key)]
+
+    def configure_tier(self, name, rps: int = None, window=Dur.SEC,
+                       limits=None):
+        """Configure a named rate-limit tier in all the instances."""
+        self._tiers[name] = (rps, window, limits)
+        for limiter in self.instances.values():
+            limiter.configure_tier(name, rps, window, limits)
+
+    def remove_tier(self, name):
+        """Remove a named rate-limit tier from all the instances."""
+        if self._tiers.pop(name, None) is None:
+            raise RateLimitConfigNotFound(message=f'tier ({name}) not found')
+        for limiter in self.instances.values():
+            limiter.remove_tier(name)
+
+    def configure_global_limit(self, rps: int = None, window=Dur.SEC,
+                               limits=None):
+        """Configure the global limit split across the instances by weight
+        w/ a full quota of the shares."""
+        self._global = (rps, window, limits)
+        self._split_global()
+
+    def configure_limit(self, user_id, rps: int = None, tier=None,
+                        window=Dur.SEC, limits=None):
+        self.instance(user_id).configure_limit(user_id, rps, tier, window,
+                                               limits)
+
+    def process_request(self, user_id=None, now=None) -> bool:
+        if user_id is None or user_id == Level.GLOBAL:
+            return self._next_global().process_request(None, now)
+        return self.instance(user_id).process_request(user_id, now)
+
+    def try_acquire(self, key=Level.GLOBAL, cost=1, now=None):
+        if key == Level.GLOBAL:
+            if self._global is None:
+                return None
+            return self._next_global().try_acquire(key, cost, now)
+        return self.instance(key).try_acquire(key, cost, now)
+
+    def process_requests(self, keys, timestamps):
+        """Process a batch of requests in a batch per instance. Return a
+        numpy array of booleans that indicates if each request is allowed.
+        """
+        if isinstance(keys, np.ndarray):
+            keys = keys.tolist()
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        missing = [key for key in dict.fromkeys(keys)
+                   if not self.is_configured(key)]
+        if missing:
+            raise RateLimitConfigNotFound(payload={'keys': missing})
+        groups = {}
+        for i, key in enumerate(keys):
+            name = self._next_name() if key == Level.GLOBAL else (
+                self.ring.owner(key))
+            groups.setdefault(name, []).append(i)
+        res = np.empty(len(keys), dtype=bool)
+        for name, index in groups.items():
+            res[index] = self.instances[name].process_requests(
+                [keys[i] for i in index], timestamps[index])
+        return res
+
+    def quota_limit(self, key=Level.GLOBAL):
+        return self._call('quota_limit', key)
+
+    def quota_remaining(self, key=Level.GLOBAL):
+        return self._call('quota_remaining', key)
+
+    def cur_remaining(self, key=Level.GLOBAL):
+        return self._call('cur_remaining', key)
+
+    def remove_bucket(self, key=Level.GLOBAL):
+        if key == Level.GLOBAL:
+            self._call('remove_bucket', key)
+            self._global = None
+            self._shares = {}
+            return
+        self.instance(key).remove_bucket(key)
+
+    def is_configured(self, key=Level.GLOBAL):
+        if key == Level.GLOBAL:
+            return self._global is not None
+        return bool(self.ring) and self.instance(key).is_configured(key)
+
+    def limits(self, key=Level.GLOBAL):
+        """Return a list of (quota limit, time window) of all the windows,
+        of which the global limits are the sum of the shares."""
+        if key != Level.GLOBAL:
+            return self.instance(key).limits(key)
+        rps, window, limits = self._check_global()
+        return limits or [(rps, window)]
+
+    def global_share(self, name):
+        """Return the share of the global limit (rps) of the instance."""
+        return self._shares.get(name, 0)
+
+    def _call(self, method, key):
+        """Call the method of the key, or sum it of all the instances of the
+        global key."""
+        if key != Level.GLOBAL:
+            return getattr(self.instance(key), method)(key)
+        self._check_global()
+        return sum(getattr(limiter, method)(key)
+                   for limiter in self.instances.values())
+
+    def _check_global(self):
+        if self._global is None:
+            raise RateLimitConfigNotFound
+        return self._global
+
+    def _move(self, name, limiter):
+        """Move the buckets of the instance which are not of it on the ring,
+        and return the number of the moved buckets."""
+        moved = 0
+        for key in list(limiter.buckets.keys()):
+            if key == Level.GLOBAL:
+                continue
+            owner = self.ring.owner(key)
+            if owner == name:
+                continue
+            self.instances[owner].restore_bucket(
+                key, limiter.export_bucket(key))
+            limiter.remove_bucket(key)
+            moved += 1
+        return moved
+
+    def _global_fraction(self):
+        """Return (remaining, limit) of the global limit of all the
+        instances, of which the remaining is of the least window."""
+        limiters = [limiter for limiter in self.instances.values()
+                    if self._global is not None and
+                    limiter.is_configured(Level.GLOBAL)]
+        limit = sum(limiter.quota_limit(Level.GLOBAL) for limiter in limiters)
+        if not limit:
+            return 1, 1
+        return sum(limiter.cur_remaining(Level.GLOBAL)
+                   for limiter in limiters), limit
+
+    def _split_global(self, fraction=(1, 1)):
+        """Configure the shares of the global limit in the instances, and
+        consume the quota of each share but the fraction of the share."""
+        self._credits = dict.fromkeys(self.instances, 0)
+        if self._global is None:
+            return
+        rps, window, limits = self._global
+        weights = self.ring.weights
+        if limits:
+            shares = [_split(limit, weights) for limit, _ in limits]
+            for name, limiter in self.instances.items():
+                limiter.configure_global_limit(limits=[
+                    (share[name], window) for share, (_, window) in zip(
+                        shares, limits)])
+            self._shares = shares[0]
+        else:
+            self._shares = _split(rps, weights)
+            for name, limiter in self.instances.items():
+                limiter.configure_global_limit(self._shares[name],
+                                               window=window)
+        remaining, limit = fraction
+        for name, limiter in self.instances.items():
+            share = self._shares[name]
+            consumed = share - share * max(remaining, 0) // limit
+            if consumed > 0:
+                limiter.buckets.acquire(Level.GLOBAL, consumed)
+
+    def _next_global(self):
+        if self._global is None:
+            raise RateLimitConfigNotFound
+        return self.instances[self._next_name()]
+
+    def _next_name(self):
+        """Return the next instance of a global request by smooth weighted
+        round-robin of the shares (e.g. a, b, a, c, a for 3:1:1)."""
+        total, best = 0, None
+        for name, credit in self._credits.items():
+            share = self._shares.get(name, 0)
+            total += share
+            credit += share
+            self._credits[name] = credit
+            if best is None or credit > self._credits[best]:
+                best = name
+        self._credits[best] -= total
+        return best
+
+
+def _hash(key):
+    """Return a 64-bit hash of the key string stable across processes."""
+    return int.from_bytes(hashlib.blake2b(
+        str(key).encode(), digest_size=8).digest(), 'big')
+
+
+def _split(limit, weights):
+    """Return a dict of the shares of the limit by weight, which sum to the
+    limit by the largest remainder."""
+    total = sum(weights.values())
+    exact = {name: limit * weight / total for name, weight in weights.items()}
+    shares = {name: int(value) for name, value in exact.items()}
+    left = limit - sum(shares.values())
+    for name in sorted(exact, key=lambda n: shares[n] - exact[n])[:left]:
+        shares[name] += 1
+    return shares
@@ -0,0 +1,365 @@
+"""Shared-Memory Bucket Table for Multi-Process Workers
+
+The module-level RateLimiter of each worker process has its own buckets, so N
+pre-forked workers would allow N times the quota limit of a user. The shared
+table keeps the token buckets of all the keys in an anonymous shared memory
+mapping (MAP_SHARED mmap) and the locks of multiprocessing. Both of them are
+created before forking the workers (e.g. gunicorn --preload), so all the
+workers decide the requests on the same quota.
+
+  +----------+     +------+-------+-------+--------+-----------+-------------+
+  | worker   |     | slot | state | limit | window | remaining | last update |
+  +----------+     +------+-------+-------+--------+-----------+-------------+
+  | worker-1 | --> |  0   | used  |   5   | 1 sec  |     3     | t (ns)      |
+  | worker-2 | --> |  1   | empty |       |        |           |             |
+  | worker-3 | --> |  2   | used  |  100  | 1 min  |    42     | t (ns)      |
+  +----------+     +------+-------+-------+--------+-----------+-------------+
+
+  - slot    : 96 bytes of the bucket state and the key (UTF-8, <= 63 bytes)
+              which is found by linear probing from the CRC32 of the key.
+  - decision: the lock of the stripe of the key, which is a semaphore of the
+              processes and threads.
+  - insert  : the lock of the stripe of the key + the structure lock. The key
+              is written before the state of the slot, so the lookups of the
+              other keys don't need the structure lock.
+  - remove  : the slot is marked as deleted (a tombstone) to keep the probes
+              of the other keys, which is reused by an insert. The slots are
+              rehashed w/o the tombstones under all the locks when they are
+              more than a quarter of the slots, so a probe doesn't degrade.
+  - clock   : the monotonic clock is the same for all the processes of the
+              machine, so the times of the slots are compared by them.
+
+Note that the tiers are kept per process, so a bucket keeps a copy of the
+limit and window of its tier like RateLimitBucketMap. The buckets aren't
+evicted, and the capacity of keys is fixed when the table is created.
+"""
+
+import mmap
+import multiprocessing
+import struct
+import zlib
+
+import numpy as np
+
+from core.common.constants import NS_PER_SEC
+from core.common.exceptions import (
+    RateLimitException,
+    RateLimitNotSupported
+)
+from core.common.utils import MonotonicClock, to_ns
+from core.controller.bucket_table import RateLimitBucketState
+from core.controller.decision import RateLimitDecision
+from core.controller.locks import DEFAULT_STRIPES
+from core.controller.tier import RateLimitTier, RateLimitTiers
+
+DEFAULT_CAPACITY = 1 << 16
+KEY_SIZE = 63
+
+_HEADER = struct.Struct('<qq')
+_STATE = struct.Struct('<qqqq')
+_SLOT_SIZE = _STATE.size + 1 + KEY_SIZE
+_STATE_OFFSET = _STATE.size
+_KEY_OFFSET = _STATE.size + 1
+_EMPTY, _USED, _DELETED = 0, 1, 2
+
+
+class RateLimitSharedTable:
+    """Token buckets of all keys in a shared memory of worker processes.
+
+    This exposes the same interface of RateLimitBucketTable except eviction
+    and multiple time windows, which are rejected by ValueError. Keys are
+    strings of up to 63 bytes in UTF-8, and the other types of keys (e.g.
+    integer) are converted to strings.
+
+    Attributes:
+        tiers     : A registry of tiers (RateLimitTiers) of the process.
+        evictions : An empty dict as the buckets are not evicted.
+        _buf      : An anonymous shared mmap of the header (the numbers of the
+                    keys and the deleted slots) and the slots.
+        _capacity : An integer of the max number of keys.
+        _mask     : An integer mask of the number of slots (a power of 2 that
+                    is at least twice of the capacity).
+        _stripes  : A list of multiprocessing locks per stripe of keys.
+        _structure: A multiprocessing lock of inserting and removing keys.
+    """
+
+    def __init__(self, clock=None, capacity=DEFAULT_CAPACITY,
+                 stripes=DEFAULT_STRIPES):
+        num_slots = 1
+        while num_slots < 2 * capacity:
+            num_slots <<= 1
+        num_stripes = 1
+        while num_stripes < stripes:
+            num_stripes <<= 1
+        self.tiers = RateLimitTiers(multi_window=False)
+        self.evictions = {}
+        self._clock = MonotonicClock() if clock is None else clock
+        self._capacity = capacity
+        self._mask = num_slots - 1
+        self._buf = mmap.mmap(-1, _HEADER.size + num_slots * _SLOT_SIZE)
+        self._stripes = [multiprocessing.Lock() for _ in range(num_stripes)]
+        self._stripe_mask = num_stripes - 1
+        self._structure = multiprocessing.Lock()
+
+    def __len__(self):
+        return _HEADER.unpack_from(self._buf, 0)[0]
+
+    def __contains__(self, key):
+        return self._probe(str(key).encode())[0] >= 0
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        """Return a list of the keys (strings) of the buckets."""
+        return self._keys(0, self._mask + 1)
+
+    def tier_ids(self):
+        """Return no tier ID as the slots keep the copies of the limits."""
+        return set()
+
+    def scan(self, cursor, count):
+        """Return (next cursor, keys) of up to count slots from the cursor.
+        A key stays in its slot of the shared memory until it is removed or
+        the slots are rehashed w/o the deleted slots."""
+        end = min(cursor + count, self._mask + 1)
+        return (end if end <= self._mask else 0), self._keys(cursor, end)
+
+    def _keys(self, start, end):
+        buf, keys = self._buf, []
+        for pos in range(start, end):
+            off = _offset(pos)
+            if buf[off + _STATE_OFFSET] == _USED:
+                key = buf[off + _KEY_OFFSET:off + _SLOT_SIZE]
+                keys.append(key.rstrip(b'\0').decode())
+        return keys
+
+    def nbytes(self):
+        """Return the size of the shared memory of the table in bytes."""
+        return len(self._buf)
+
+    def configure(self, key, quota_limit, time_window, extra_limits=()):
+        """Create or update a bucket of the key with a full quota. The
+        limit is copied to the slot w/o an anonymous tier."""
+        if extra_limits:
+            raise ValueError('multiple time windows')
+        self._put(key, quota_limit, to_ns(time_window))
+
+    def assign(self, key, tier_id):
+        """Create or update a bucket w/ a copy of the tier w/ a full quota."""
+        tier = self.tiers[tier_id]
+        if tier.extra_limits:
+            raise ValueError('multiple time windows')
+        self._put(key, tier.quota_limit, self.tiers.windows[tier_id])
+
+    def _put(self, key, quota_limit, window):
+        key_bytes = _encode(key)
+        with self._lock(key_bytes), self._structure:
+            pos, free = self._probe(key_bytes)
+            if pos < 0:
+                size, deleted = _HEADER.unpack_from(self._buf, 0)
+                if size >= self._capacity or free < 0:
+                    raise RateLimitException(
+                        message=f'shared table is full ({size} keys)')
+                pos = free
+                if self._buf[_offset(pos) + _STATE_OFFSET] == _DELETED:
+                    deleted -= 1
+                self._buf[_offset(pos) + _KEY_OFFSET:
+                          _offset(pos) + _SLOT_SIZE] = _pad(key_bytes)
+                _HEADER.pack_into(self._buf, 0, size + 1, deleted)
+            _STATE.pack_into(self._buf, _offset(pos), quota_limit, window,
+                             quota_limit, self._clock.time_ns())
+            self._buf[_offset(pos) + _STATE_OFFSET] = _USED
+
+    def assign_many(self, keys, tier_ids):
+        """Assign the keys one by one, and return the number of the created
+        buckets."""
+        created = 0
+        for key, tier_id in zip(keys, tier_ids):
+            created += key not in self
+            self.assign(key, tier_id)
+        return created
+
+    def remove(self, key):
+        """Remove the bucket of the key and mark its slot as deleted."""
+        key_bytes = str(key).encode()
+        with self._lock(key_bytes), self._structure:
+            pos = self._probe(key_bytes)[0]
+            if pos < 0:
+                raise KeyError(key)
+            self._buf[_offset(pos) + _STATE_OFFSET] = _DELETED
+            size, deleted = _HEADER.unpack_from(self._buf, 0)
+            _HEADER.pack_into(self._buf, 0, size - 1, deleted + 1)
+        if deleted + 1 > (self._mask + 1) // 4:
+            self._rehash()
+
+    def export(self, key):
+        """Return a RateLimitBucketState of the copy of the limit and quota
+        in the slot."""
+        limit, window, remaining, last_update = self._state(key)
+        return RateLimitBucketState(
+            RateLimitTier(None, limit, window / NS_PER_SEC),
+            ((remaining, last_update),))
+
+    def restore(self, key, state):
+        """Create or replace the bucket of the key w/ an exported state."""
+        tier = state.tier
+        self.configure(key, tier.quota_limit, tier.time_window,
+                       tier.extra_limits)
+        key_bytes = _encode(key)
+        with self._lock(key_bytes):
+            off = _offset(self._probe(key_bytes)[0])
+            limit, window = _STATE.unpack_from(self._buf, off)[:2]
+            _STATE.pack_into(self._buf, off, limit, window, *state.lanes[0])
+
+    def image(self):
+        raise RateLimitNotSupported(
+            'the shared table is kept by the shared memory of the workers')
+
+    def load(self, image):
+        raise RateLimitNotSupported(
+            'the shared table is kept by the shared memory of the workers')
+
+    def tier(self, key):
+        """Return an anonymous tier of the copy of the limit in the slot."""
+        limit, window = self._state(key)[:2]
+        return RateLimitTier(None, limit, window / NS_PER_SEC)
+
+    def decrement(self, key, now=None):
+        """Reduce the quota remaining of the key."""
+        decision = self.acquire(key, 1, now)
+        if decision is None:
+            raise KeyError(key)
+        return decision.allowed
+
+    def acquire(self, key, cost=1, now=None):
+        """Reduce the quota remaining of the key by cost like the table.
+
+        Return a decision, or None if the key is not configured."""
+        key_bytes = str(key).encode()
+        with self._lock(key_bytes):
+            pos = self._probe(key_bytes)[0]
+            if pos < 0:
+                return None
+            if now is None:
+                now = self._clock.time_ns()
+            off = _offset(pos)
+            limit, window, remaining, last_update = _STATE.unpack_from(
+                self._buf, off)
+
+            time_allowance = (now - last_update) // window
+            remaining += time_allowance * limit
+            last_update += time_allowance * window
+
+            if remaining >= limit:
+                remaining = limit
+                last_update = now
+
+            allowed = remaining >= cost
+            if allowed:
+                remaining -= cost
+            _STATE.pack_into(self._buf, off, limit, window, remaining,
+                             last_update)
+        return RateLimitDecision(allowed, limit, remaining,
+                                 last_update + window, window)
+
+    def acquire_many(self, keys, timestamps):
+        """Reduce the quota remaining of the keys at the timestamps one by
+        one. Raise a KeyError with the list of keys that are not configured.
+        """
+        if isinstance(keys, np.ndarray):
+            keys = keys.tolist()
+        missing = [key for key in dict.fromkeys(keys) if key not in self]
+        if missing:
+            raise KeyError(missing)
+        return np.fromiter(
+            (self.acquire(key, 1, now).allowed
+             for key, now in zip(keys, np.asarray(timestamps).tolist())),
+            dtype=bool, count=len(keys))
+
+    def cur_remaining(self, key):
+        """Return updated quota remainining as current time is changed."""
+        limit, window, remaining, last_update = self._state(key)
+        time_allowance = (self._clock.time_ns() - last_update) // window
+        return min(limit, remaining + time_allowance * limit)
+
+    def quota_limit(self, key):
+        return self._state(key)[0]
+
+    def quota_remaining(self, key):
+        """Return quota remainining right after the last decrement()."""
+        return self._state(key)[2]
+
+    def _state(self, key):
+        """Return (limit, window, remaining, last update) of the key."""
+        key_bytes = str(key).encode()
+        with self._lock(key_bytes):
+            pos = self._probe(key_bytes)[0]
+            if pos < 0:
+                raise KeyError(key)
+            return _STATE.unpack_from(self._buf, _offset(pos))
+
+    def _lock(self, key_bytes):
+        return self._stripes[zlib.crc32(key_bytes) & self._stripe_mask]
+
+    def _rehash(self):
+        """Insert the used slots again into the empty slots w/o the deleted
+        slots. All the stripes are locked in order before the structure lock
+        like an insert, so the lookups of all the processes are paused."""
+        for lock in self._stripes:
+            lock.acquire()
+        try:
+            with self._structure:
+                buf, mask = self._buf, self._mask
+                if _HEADER.unpack_from(buf, 0)[1] <= (mask + 1) // 4:
+                    return
+                slots = [bytes(buf[_offset(pos):_offset(pos + 1)])
+                         for pos in range(mask + 1)
+                         if buf[_offset(pos) + _STATE_OFFSET] == _USED]
+                buf[_HEADER.size:] = bytes(len(buf) - _HEADER.size)
+                for slot in slots:
+                    key_bytes = slot[_KEY_OFFSET:].rstrip(b'\0')
+                    pos = zlib.crc32(key_bytes) & mask
+                    while buf[_offset(pos) + _STATE_OFFSET] != _EMPTY:
+                        pos = (pos + 1) & mask
+                    buf[_offset(pos):_offset(pos + 1)] = slot
+                _HEADER.pack_into(buf, 0, len(slots), 0)
+        finally:
+            for lock in reversed(self._stripes):
+                lock.release()
+
+    def _probe(self, key_bytes):
+        """Return the slot of the key (-1 if it is not found) and the first
+        free slot (-1 if none) to insert the key by linear probing. A key
+        longer than KEY_SIZE is never found."""
+        buf, mask = self._buf, self._mask
+        padded = _pad(key_bytes)
+        pos = zlib.crc32(key_bytes) & mask
+        free = -1
+        for _ in range(mask + 1):
+            off = _offset(pos)
+            state = buf[off + _STATE_OFFSET]
+            if state == _EMPTY:
+                return -1, pos if free < 0 else free
+            if state == _DELETED:
+                if free < 0:
+                    free = pos
+            elif buf[off + _KEY_OFFSET:off + _SLOT_SIZE] == padded:
+                return pos, free
+            pos = (pos + 1) & mask
+        return -1, free
+
+
+def _offset(pos):
+    return _HEADER.size + pos * _SLOT_SIZE
+
+
+def _encode(key):
+    key_bytes = str(key).encode()
+    if len(key_bytes) > KEY_SIZE:
+        raise ValueError(f'key is longer than {KEY_SIZE} bytes: {key}')
+    return key_bytes
+
+
+def _pad(key_bytes):
+    return key_bytes.ljust(KEY_SIZE, b'\0')
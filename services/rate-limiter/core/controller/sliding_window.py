@@ -7,48 +7,62 @@ is just kept to refactor main algorthm and unit/functional/integration testing
 codes for the future.
 """
 
-import time
+from core.common.utils import MonotonicClock, to_ns
 
 
 class RateLimitSlidingWindowCounter:
 
-    def __init__(self, quota_limit, time_window, clock=time):
+    def __init__(self, quota_limit, time_window, clock=None):
         self._quota_limit = quota_limit
         self._time_window = time_window
-        self._clock = clock
+        self._window_ns = to_ns(time_window)
+        self._clock = MonotonicClock() if clock is None else clock
         self.clear(quota_limit)
 
-    def clear(self, pre_cnt):
+    def clear(self, pre_cnt, now=None):
         self._quota_remaining = self._quota_limit
-        self._last_update_time = self._clock.time()
+        self._last_update_time = self._clock.time_ns() if now is None else now
         self._pre_cnt = pre_cnt
         self._cur_cnt = 0
 
-    def decrement(self):
-        time_passed, res = self.is_enough_time_window()
+    def decrement(self, cost=1, now=None):
+        if now is None:
+            now = self._clock.time_ns()
+        time_passed, res = self.is_enough_time_window(now)
         if res:
-            self.clear(self._cur_cnt)
+            self.clear(self._cur_cnt, now)
+            time_passed = 0
 
-        time_remained = self._time_window - time_passed
-        estimated_cnt = (
-            self._pre_cnt * time_remained / self._time_window
-        ) + self._cur_cnt
+        # the estimated count is scaled by the time window for integer math,
+        # and a request is denied if the count of its last unit reaches the
+        # quota limit like a request of cost 1.
+        window = self._window_ns
+        time_remained = window - time_passed
+        estimated = self._pre_cnt * time_remained + self._cur_cnt * window
+        limit = self._quota_limit * window
 
-        if (estimated_cnt >= self._quota_limit):
+        if estimated + (cost - 1) * window >= limit:
+            self._quota_remaining = max(-(-(limit - estimated) // window), 0)
             return False
 
-        self._cur_cnt += 1
-        self._quota_remaining = int(estimated_cnt)
+        self._cur_cnt += cost
+        estimated += cost * window
+        self._quota_remaining = max(-(-(limit - estimated) // window), 0)
         return True
 
-    def is_enough_time_window(self):
-        time_passed = self._clock.time() - self._last_update_time
-        return time_passed, time_passed > self._time_window
+    def is_enough_time_window(self, now=None):
+        if now is None:
+            now = self._clock.time_ns()
+        time_passed = now - self._last_update_time
+        return time_passed, time_passed > self._window_ns
 
-    def cur_remaining(self):
-        _, res = self.is_enough_time_window()
+    def cur_remaining(self, now=None):
+        _, res = self.is_enough_time_window(now)
         return self._quota_limit if res else self._quota_remaining
 
+    def reset_at(self):
+        return self._last_update_time + self._window_ns
+
     def quota_limit(self):
         return self._quota_limit
 
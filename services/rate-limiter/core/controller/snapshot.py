@@ -0,0 +1,272 @@
+"""Snapshot and Warm Restart of All Buckets of Rate Limiter
+
+The buckets and the tiers of a rate limiter are kept in its memory, so a
+restart starts w/o any bucket until all the users are configured again. The
+snapshots save the bucket table and the tiers to a compact binary file
+periodically, and the file is loaded by mmap when the rate limiter restarts.
+
+  +-----------+  copy (memcpy)   +-------------+  encode & write  +------+
+  | table     | ---------------> | image       | ---------------> | file |
+  | (arrays)  |  structure lock  | (copies)    |  snapshot thread | .tmp |
+  +-----------+                  +-------------+                  +------+
+        ^                                                            |
+        |         mmap, one copy per array, vectorized index         |
+        +------------------------------------------------------------+
+
+  - save   : the slot arrays of the table are copied in chunks under the
+             structure lock, which doesn't stop the decisions of the lock
+             stripes. Then the copies are compacted, encoded and written in
+             chunks by the snapshot thread to a temporary file which
+             replaces the file, so a decision waits for a chunk at most.
+  - restore: the arrays are copied from the mmap of the file into the
+             table at once, and the index of the keys is rebuilt by a
+             vectorized pass since the hash of a string is per process.
+  - clock  : the times of the buckets are shifted from the clock of the
+             saving process to the one of the restoring process, so the
+             time from the snapshot to the restart (wall clock) refills
+             the buckets as if the rate limiter didn't stop.
+
+File:
+=====
+  +---------------------+---------------------------------------------------+
+  | header              | magic, clock (ns), wall clock (ns), keys, lanes,  |
+  |                     | bytes of the tiers, bytes of the key text         |
+  | tiers               | JSON of [name, [[limit, window (sec)], ...]] per  |
+  |                     | tier ID (null if the tier ID is freed)            |
+  | key types           | uint8[keys] (0: str, 1: int)                      |
+  | key ends            | int64[keys] of the end of the key in the text     |
+  | key text            | UTF-8 of the keys joined by line feeds            |
+  | tier IDs            | uint32[keys]                                      |
+  | lanes               | int64[keys] x 2 (remaining, last update) x lanes  |
+  +---------------------+---------------------------------------------------+
+  The sections are aligned to 8 bytes in the native byte order.
+
+Note that the snapshots are supported by the bucket tables (token bucket and
+GCRA), and the tokens of the cells of a striped key (e.g. the global key)
+aren't included in its state.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+from array import array
+from itertools import repeat
+from operator import is_not
+from threading import Event, Thread
+
+import numpy as np
+
+from core.common.utils import MonotonicClock, WallClock
+from core.controller.bucket_table import RateLimitTableImage
+from core.controller.tier import RateLimitTier
+
+DEFAULT_INTERVAL = 60
+
+_MAGIC = b'RLSNAP01'
+_HEADER = struct.Struct('=8sqqQQQQ')
+_CHUNK = 1 << 16
+
+_log = logging.getLogger(__name__)
+
+
+class RateLimitSnapshots:
+    """Periodic snapshots of the buckets of a rate limiter to a file.
+
+    Attributes:
+        limiter : A RateLimiter of which the buckets are saved.
+        path    : A string of the path of the snapshot file.
+        interval: A float of seconds between the snapshots.
+        saved   : A tuple of (buckets, seconds) of the last snapshot, or None.
+    """
+
+    def __init__(self, limiter, path, interval=DEFAULT_INTERVAL,
+                 wall=None):
+        self.limiter = limiter
+        self.path = path
+        self.interval = interval
+        self.saved = None
+        self._wall = WallClock() if wall is None else wall
+        self._clock = MonotonicClock()
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        """Start the thread of saving the snapshots every interval."""
+        self._thread = Thread(target=self._run, name='snapshots', daemon=True)
+        self._thread.start()
+
+    def close(self, save=True):
+        """Stop the thread, and save the last snapshot if save is set."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        if save:
+            self.save()
+
+    def save(self):
+        """Save a snapshot of the buckets, and return the number of them."""
+        started = self._clock.time()
+        buckets = save_snapshot(self.limiter, self.path, self._wall)
+        self.saved = (buckets, self._clock.time() - started)
+        return buckets
+
+    def restore(self):
+        """Load the buckets of the snapshot file if it exists, and return
+        the number of them."""
+        if not os.path.exists(self.path):
+            return 0
+        return restore_snapshot(self.limiter, self.path, self._wall)
+
+    def _run(self):
+        """Save a snapshot every interval, of which a failed one (e.g. the
+        disk is full) is logged and saved again at the next interval."""
+        while not self._stopped.wait(self.interval):
+            try:
+                self.save()
+            except Exception:
+                _log.exception('snapshot (%s) not saved', self.path)
+
+
+def save_snapshot(limiter, path, wall=None):
+    """Write a snapshot of the buckets of the limiter to the path, and return
+    the number of the buckets. The file is replaced only when it is written
+    completely.
+
+    The keys are encoded and released in chunks of slots, so the thread of
+    the snapshot doesn't hold the GIL for all the keys at once."""
+    wall = WallClock() if wall is None else wall
+    image = limiter.image_buckets()
+    now, wall_now = limiter.time_ns(), wall.time_ns()
+    chunks = list(_encode_keys(image.keys))
+    keys = image.keys
+    while keys:
+        del keys[-_CHUNK:]
+
+    texts = []
+    for slots, _, _, text in chunks:
+        if len(slots):
+            texts += [b'\n', text] if texts else [text]
+    num_keys = sum(len(slots) for slots, *_ in chunks)
+    tiers = json.dumps([None if tier is None else [tier.name, tier.limits()]
+                        for tier in image.tiers]).encode()
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, now, wall_now, num_keys,
+                             len(image.lanes), len(tiers),
+                             sum(map(len, texts))))
+        _write(f, [tiers])
+        _write(f, [types for _, types, _, _ in chunks])
+        _write(f, [ends for _, _, ends, _ in chunks])
+        _write(f, texts)
+        _write(f, [np.frombuffer(image.tier_ids, dtype=np.uint32)[slots]
+                   for slots, *_ in chunks])
+        for lanes in image.lanes:
+            for lane in lanes:
+                _write(f, [np.frombuffer(lane, dtype=np.int64)[slots]
+                           for slots, *_ in chunks])
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return num_keys
+
+
+def read_snapshot(path, clock=None, wall=None):
+    """Return a RateLimitTableImage of the snapshot file of which the times
+    are shifted to the clock."""
+    clock = MonotonicClock() if clock is None else clock
+    wall = WallClock() if wall is None else wall
+    with open(path, 'rb') as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            memoryview(mm) as view:
+        magic, saved, wall_saved, n, num_lanes, tiers_size, text_size = (
+            _HEADER.unpack_from(view))
+        if magic != _MAGIC:
+            raise ValueError(f'not a snapshot file: {path}')
+        reader = _Reader(view, _HEADER.size)
+        tiers = tuple(
+            None if tier is None else RateLimitTier(
+                tier[0], *tier[1][0], tuple(map(tuple, tier[1][1:])))
+            for tier in json.loads(reader.bytes(tiers_size)))
+        types = reader.array('B', n)
+        ends = reader.array('q', n)
+        text = reader.bytes(text_size).decode()
+        tier_ids = reader.array('I', n)
+        lanes = [(reader.array('q', n), reader.array('q', n))
+                 for _ in range(num_lanes)]
+
+    keys = text.split('\n') if n > 1 else [text][:n]
+    if len(keys) != n:
+        # a key has a line feed, so the keys are sliced by the ends.
+        ends = ends.tolist()
+        starts = [0] + [end + 1 for end in ends[:-1]]
+        keys = list(map(text.__getitem__, map(slice, starts, ends)))
+    for slot in np.flatnonzero(np.frombuffer(types, dtype=np.uint8)).tolist():
+        keys[slot] = int(keys[slot])
+    # the time from the snapshot to now of the wall clock is passed.
+    shift = clock.time_ns() - saved - max(0, wall.time_ns() - wall_saved)
+    for _, last_update in lanes:
+        np.frombuffer(last_update, dtype=np.int64)[:] += shift
+    return RateLimitTableImage(tiers, keys, tier_ids, lanes)
+
+
+def restore_snapshot(limiter, path, wall=None):
+    """Replace the buckets of the limiter w/ the snapshot file, and return
+    the number of the buckets."""
+    image = read_snapshot(path, limiter, wall)
+    limiter.load_buckets(image)
+    return len(image.keys)
+
+
+class _Reader:
+    """Reader of the aligned sections of a memoryview of a snapshot."""
+
+    def __init__(self, view, pos):
+        self._view = view
+        self._pos = pos
+
+    def bytes(self, size):
+        with self._view[self._pos:self._pos + size] as part:
+            data = part.tobytes()
+        self._pos += size + (-size % 8)
+        return data
+
+    def array(self, typecode, count):
+        data = array(typecode)
+        size = count * data.itemsize
+        with self._view[self._pos:self._pos + size] as part:
+            data.frombytes(part)
+        self._pos += size + (-size % 8)
+        return data
+
+
+def _encode_keys(keys):
+    """Yield (slots, types, ends, text) of the live keys per chunk of slots,
+    of which the ends are of the text of all the keys joined by line feeds.
+    """
+    offset = 0
+    for start in range(0, len(keys), _CHUNK):
+        chunk = keys[start:start + _CHUNK]
+        slots = np.flatnonzero(np.fromiter(
+            map(is_not, chunk, repeat(None)), dtype=bool, count=len(chunk)))
+        if len(slots) < len(chunk):
+            chunk = [chunk[slot] for slot in slots.tolist()]
+        texts = list(map(str, chunk))
+        ends = np.cumsum(np.fromiter(map(len, texts), dtype=np.int64,
+                                     count=len(texts)) + 1) + (offset - 1)
+        if len(ends):
+            offset = int(ends[-1]) + 1
+        yield (slots + start,
+               np.fromiter(map(isinstance, chunk, repeat(int)),
+                           dtype=np.uint8, count=len(chunk)),
+               ends, '\n'.join(texts).encode())
+
+
+def _write(f, parts):
+    """Write the parts of a section, and pad the section to 8 bytes."""
+    size = 0
+    for part in parts:
+        f.write(part)
+        size += part.nbytes if isinstance(part, np.ndarray) else len(part)
+    f.write(bytes(-size % 8))
@@ -0,0 +1,287 @@
+"""Storage Backends of Token Buckets for Rate Limiter
+
+The buckets of RateLimitBucketTable are kept in the memory of a process. A
+storage backend keeps the state of the token buckets elsewhere (e.g. a remote
+key/value cache shared by the rate-limiters of many machines), and decides a
+request by an atomic check-and-decrement of the backend.
+
+  +--------------+     +------------------------+     +-------------------+
+  | RateLimiter  | --> | RateLimitStorageBuckets| --> | RateLimitStorage  |
+  |              |     | (tiers, bucket API)    |     +-------------------+
+  +--------------+     +------------------------+     | - in-process dict |
+                                                      | - RESP (Redis)    |
+                                                      +-------------------+
+
+  - state   : (limit, window, remaining, last update) per key. The backend
+              keeps a copy of the limit and window of the tier of the key
+              like RateLimitSharedTable, as the tiers are kept per process.
+  - decision: acquire_many() decides a batch of (key, cost, now) in one call
+              of the backend (e.g. a pipelined round trip), and acquire()
+              decides a request.
+  - clock   : the times of the state are of the clocks of the rate-limiters,
+              so the rate-limiters sharing a backend must share a clock
+              (e.g. WallClock of the machines).
+"""
+
+from abc import ABC, abstractmethod
+from threading import Lock
+
+import numpy as np
+
+from core.common.constants import NS_PER_SEC
+from core.common.exceptions import RateLimitNotSupported
+from core.common.utils import MonotonicClock, to_ns
+from core.controller.bucket_table import RateLimitScanOrder
+from core.controller.decision import RateLimitDecision
+from core.controller.tier import RateLimitTier, RateLimitTiers
+
+
+class RateLimitStorage(ABC):
+    """Interface of the storage backends of the token buckets."""
+
+    @abstractmethod
+    def __len__(self):
+        """Return the number of the keys w/o listing them."""
+
+    @abstractmethod
+    def put(self, key, limit, window, now):
+        """Create or update the state of the key w/ a full quota."""
+
+    @abstractmethod
+    def delete(self, key):
+        """Delete the state of the key. Return if the key is found."""
+
+    @abstractmethod
+    def get(self, key):
+        """Return (limit, window, remaining, last update) of the key, or
+        None if the key is not found."""
+
+    def missing(self, keys):
+        """Return a list of the keys which are not found."""
+        return [key for key in keys if self.get(key) is None]
+
+    @abstractmethod
+    def acquire_many(self, requests):
+        """Decide a list of (key, cost, now) requests in order by the token
+        bucket. Return a list of decisions (None if the key is not found).
+        """
+
+    def acquire(self, key, cost, now):
+        return self.acquire_many(((key, cost, now),))[0]
+
+    @abstractmethod
+    def keys(self):
+        """Return an iterable of the keys of the states."""
+
+    @abstractmethod
+    def scan(self, cursor, count):
+        """Return (next cursor, keys) of up to about count keys from the
+        cursor, of which the next cursor is 0 at the end. A key kept during
+        the whole scan is returned at least once."""
+
+    def close(self):
+        pass
+
+
+class RateLimitMemoryStorage(RateLimitStorage):
+    """In-process storage backend of a dict of the states of the keys.
+
+    Attributes:
+        _states: A dict of key to [limit, window, remaining, last update].
+        _order : A RateLimitScanOrder of the keys to scan them.
+        _lock  : A lock of the states shared by threads.
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._order = RateLimitScanOrder()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._states)
+
+    def put(self, key, limit, window, now):
+        with self._lock:
+            self._states[key] = [limit, window, limit, now]
+            self._order.add(key)
+
+    def delete(self, key):
+        with self._lock:
+            self._order.discard(key)
+            return self._states.pop(key, None) is not None
+
+    def get(self, key):
+        state = self._states.get(key)
+        return None if state is None else tuple(state)
+
+    def acquire_many(self, requests):
+        res = []
+        with self._lock:
+            for key, cost, now in requests:
+                state = self._states.get(key)
+                if state is None:
+                    res.append(None)
+                    continue
+                limit, window, remaining, last_update = state
+                time_allowance = max(0, (now - last_update) // window)
+                remaining += time_allowance * limit
+                last_update += time_allowance * window
+                if remaining >= limit:
+                    remaining = limit
+                    last_update = now
+                allowed = remaining >= cost
+                if allowed:
+                    remaining -= cost
+                state[2] = remaining
+                state[3] = last_update
+                res.append(RateLimitDecision(allowed, limit, remaining,
+                                             last_update + window, window))
+        return res
+
+    def keys(self):
+        return list(self._states)
+
+    def scan(self, cursor, count):
+        with self._lock:
+            return self._order.scan(cursor, count)
+
+
+class RateLimitStorageBuckets:
+    """Token buckets of all keys in a storage backend.
+
+    This exposes the same interface of RateLimitBucketTable except eviction
+    and multiple time windows, which are rejected by ValueError.
+
+    Attributes:
+        tiers    : A registry of tiers (RateLimitTiers) of the process.
+        evictions: An empty dict as the buckets are not evicted.
+        storage  : A storage backend (RateLimitStorage) of the states.
+    """
+
+    def __init__(self, storage, clock=None):
+        self.tiers = RateLimitTiers(multi_window=False)
+        self.evictions = {}
+        self.storage = storage
+        self._clock = MonotonicClock() if clock is None else clock
+
+    def __len__(self):
+        return len(self.storage)
+
+    def __contains__(self, key):
+        return self.storage.get(key) is not None
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return self.storage.keys()
+
+    def tier_ids(self):
+        """Return no tier ID as the states keep the copies of the limits."""
+        return set()
+
+    def scan(self, cursor, count):
+        """Return (next cursor, keys) of the keys of the storage by its own
+        cursor (e.g. SCAN of Redis), so a key may be returned more than once.
+        """
+        return self.storage.scan(cursor, count)
+
+    def configure(self, key, quota_limit, time_window, extra_limits=()):
+        """Create or update a bucket of the key with a full quota. The
+        limit is copied to the state w/o an anonymous tier."""
+        if extra_limits:
+            raise ValueError('multiple time windows')
+        self.storage.put(key, quota_limit, to_ns(time_window),
+                         self._clock.time_ns())
+
+    def assign(self, key, tier_id):
+        """Create or update a bucket w/ a copy of the tier w/ a full quota."""
+        tier = self.tiers[tier_id]
+        if tier.extra_limits:
+            raise ValueError('multiple time windows')
+        self.storage.put(key, tier.quota_limit, self.tiers.windows[tier_id],
+                         self._clock.time_ns())
+
+    def assign_many(self, keys, tier_ids):
+        """Assign the keys one by one, and return the number of the created
+        buckets."""
+        created = 0
+        for key, tier_id in zip(keys, tier_ids):
+            created += key not in self
+            self.assign(key, tier_id)
+        return created
+
+    def remove(self, key):
+        if not self.storage.delete(key):
+            raise KeyError(key)
+
+    def tier(self, key):
+        """Return an anonymous tier of the copy of the limit in the state."""
+        limit, window = self._state(key)[:2]
+        return RateLimitTier(None, limit, window / NS_PER_SEC)
+
+    def decrement(self, key, now=None):
+        decision = self.acquire(key, 1, now)
+        if decision is None:
+            raise KeyError(key)
+        return decision.allowed
+
+    def acquire(self, key, cost=1, now=None):
+        """Reduce the quota remaining of the key by cost in the storage.
+
+        Return a decision, or None if the key is not configured."""
+        if now is None:
+            now = self._clock.time_ns()
+        return self.storage.acquire(key, cost, now)
+
+    def acquire_many(self, keys, timestamps):
+        """Reduce the quota remaining of the keys at the timestamps in one
+        call of the storage. Raise a KeyError with the list of keys that are
+        not configured."""
+        if isinstance(keys, np.ndarray):
+            keys = keys.tolist()
+        missing = self.storage.missing(list(dict.fromkeys(keys)))
+        if missing:
+            raise KeyError(missing)
+        decisions = self.storage.acquire_many(
+            [(key, 1, now) for key, now in zip(
+                keys, np.asarray(timestamps).tolist())])
+        return np.fromiter((decision is not None and decision.allowed
+                            for decision in decisions),
+                           dtype=bool, count=len(keys))
+
+    def export(self, key):
+        raise RateLimitNotSupported(
+            'the buckets of the storage are shared, and are not moved')
+
+    def restore(self, key, state):
+        raise RateLimitNotSupported(
+            'the buckets of the storage are shared, and are not moved')
+
+    def image(self):
+        raise RateLimitNotSupported(
+            'the buckets of the storage are kept by the storage')
+
+    def load(self, image):
+        raise RateLimitNotSupported(
+            'the buckets of the storage are kept by the storage')
+
+    def cur_remaining(self, key):
+        """Return updated quota remainining as current time is changed."""
+        limit, window, remaining, last_update = self._state(key)
+        time_allowance = max(0, (self._clock.time_ns() - last_update)
+                             // window)
+        return min(limit, remaining + time_allowance * limit)
+
+    def quota_limit(self, key):
+        return self._state(key)[0]
+
+    def quota_remaining(self, key):
+        """Return quota remainining right after the last decrement()."""
+        return self._state(key)[2]
+
+    def _state(self, key):
+        state = self.storage.get(key)
+        if state is None:
+            raise KeyError(key)
+        return state
@@ -0,0 +1,186 @@
+"""Striped Token Bucket for the Contended Global Key
+
+Every request w/o a user ID goes to the single global bucket, so the stripe
+lock of the global key would serialize all the threads. The striped bucket
+splits the quota into a central pool and cells of tokens leased by threads
+like LongAdder of Java. A thread takes tokens from its own cell w/o touching
+the others, and only locks the pool to lease a batch of tokens when its cell
+is empty.
+
+  +----------+     +--------------------------------+     +---------------+
+  | thread   |     | cell (tokens, epoch)           |     | central pool  |
+  +----------+     +--------------------------------+     +---------------+
+  | thread-1 | --> | cell 0: 12 tokens of epoch E   | <-- | remaining: R  |
+  | thread-2 | --> | cell 1:  0 tokens              | <-- | epoch    : E  |
+  | thread-3 | --> | cell 2:  5 tokens of epoch E-W |     | (token bucket |
+  +----------+     +--------------------------------+     |  of the tier) |
+                                                          +---------------+
+
+  - lease    : the cost of the request + 'lease' tokens from the pool where
+               lease = quota_limit // (cells * LEASE_DIVISOR), 0 for a small
+               quota limit which is decided by the pool one by one.
+  - epoch    : the last update time of the pool when the tokens are leased.
+               The tokens of a cell are used only within the time window of
+               their epoch, and dropped when the pool is refilled.
+  - rebalance: if the pool is empty, the tokens of the other cells of the
+               epoch are taken back w/ try-lock (never waiting for a cell).
+               If the pool is still empty, the epoch is marked as exhausted
+               so that the requests are denied w/o the lock of the pool until
+               it is refilled.
+
+Error Bound:
+============
+  Each token of an epoch is leased once and used within the time window of
+  the epoch, so the key never admits more than quota_limit per time window
+  like the token bucket. The tokens left in the cells which are locked by the
+  other threads can't be rebalanced when the pool is empty, so the admission
+  per time window is at least:
+
+      quota_limit - (cells - 1) * lease  >=  quota_limit * (1 - 1/16)
+
+  Note that the quota remaining is the sum of the pool and the cells w/o the
+  locks, so it is approximate while the other threads are deciding.
+"""
+
+from itertools import count
+from threading import Lock, local
+
+from core.common.utils import MonotonicClock
+from core.controller.decision import RateLimitDecision
+
+DEFAULT_CELLS = 8
+LEASE_DIVISOR = 16
+
+
+class RateLimitStripedBucket:
+    """Token bucket of a key w/ the quota leased to the cells of threads.
+
+    Attributes:
+        _tiers      : A registry of tiers (RateLimitTiers) of the buckets. The
+                      limit and window are read from the tier when leasing so
+                      that redefining the tier is applied.
+        _tier_id    : An integer tier ID of the key.
+        _remaining  : An integer of the tokens of the central pool.
+        _last_update: An integer ns of the last update (epoch) of the pool.
+        _exhausted  : An integer ns of the epoch when the pool and the other
+                      cells are empty, or None.
+        _pool       : A lock of the central pool.
+        _cells      : A list of [tokens, epoch] per cell.
+        _cell_locks : A list of Lock per cell.
+        _local      : A thread-local index of the cell of each thread.
+    """
+
+    def __init__(self, tiers, tier_id, clock=None,
+                 cells=DEFAULT_CELLS):
+        self._tiers = tiers
+        self._tier_id = tier_id
+        self._clock = MonotonicClock() if clock is None else clock
+        self._remaining = tiers.limits[tier_id]
+        self._last_update = self._clock.time_ns()
+        self._exhausted = None
+        self._pool = Lock()
+        self._cells = [[0, 0] for _ in range(cells)]
+        self._cell_locks = [Lock() for _ in range(cells)]
+        self._local = local()
+        self._next_cell = count()
+
+    def decrement(self, cost=1, now=None):
+        """Reduce the tokens of the cell of the thread by cost, or lease the
+        tokens from the pool if the cell doesn't have enough tokens."""
+        if now is None:
+            now = self._clock.time_ns()
+        window = self._tiers.windows[self._tier_id]
+        cell = self._cell()
+        with self._cell_locks[cell]:
+            tokens = self._cells[cell]
+            if tokens[0] >= cost and now - tokens[1] < window:
+                tokens[0] -= cost
+                return True
+            if cost and self._exhausted == self._last_update and (
+                    now - self._last_update < window):
+                return False
+            return self._lease(cell, tokens, cost, now)
+
+    def acquire(self, cost=1, now=None):
+        """Return a decision of decrement() w/ the quota remaining."""
+        allowed = self.decrement(cost, now)
+        return RateLimitDecision(allowed, self.quota_limit(),
+                                 self.quota_remaining(), self.reset_at(),
+                                 self._tiers.windows[self._tier_id])
+
+    def cur_remaining(self, now=None):
+        """Return updated quota remainining as current time is changed."""
+        if now is None:
+            now = self._clock.time_ns()
+        if now - self._last_update >= self._tiers.windows[self._tier_id]:
+            return self.quota_limit()
+        return self.quota_remaining()
+
+    def reset_at(self):
+        """Return the clock time (ns) when the pool is refilled."""
+        return self._last_update + self._tiers.windows[self._tier_id]
+
+    def quota_limit(self):
+        return self._tiers.limits[self._tier_id]
+
+    def tier_id(self):
+        return self._tier_id
+
+    def quota_remaining(self):
+        """Return the tokens of the pool and the cells of the epoch."""
+        epoch = self._last_update
+        return self._remaining + sum(
+            tokens for tokens, leased_at in self._cells if leased_at == epoch)
+
+    def _cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            self._local.cell = next(self._next_cell) % len(self._cells)
+            return self._local.cell
+
+    def _lease(self, cell, tokens, cost, now):
+        """Lease the tokens of the request and a batch from the pool to the
+        cell which is locked by the caller."""
+        with self._pool:
+            limit = self._tiers.limits[self._tier_id]
+            self._refill(limit, self._tiers.windows[self._tier_id], now)
+            if tokens[1] != self._last_update:
+                tokens[0] = 0
+            need = cost - tokens[0]
+            if self._remaining < need:
+                self._rebalance(cell, need)
+                if self._remaining < need:
+                    if not self._remaining:
+                        self._exhausted = self._last_update
+                    return False
+            lease = min(self._remaining - need,
+                        limit // (len(self._cells) * LEASE_DIVISOR))
+            self._remaining -= need + lease
+            tokens[0] = lease
+            tokens[1] = self._last_update
+            return True
+
+    def _refill(self, limit, window, now):
+        """Refill the pool like the token bucket (RateLimitBucket)."""
+        time_allowance = max(0, (now - self._last_update) // window)
+        self._remaining += time_allowance * limit
+        self._last_update += time_allowance * window
+        if self._remaining >= limit:
+            self._remaining = limit
+            self._last_update = max(self._last_update, now)
+
+    def _rebalance(self, cell, need):
+        """Take back the tokens of the other cells of the epoch to the pool
+        until it has the tokens of the need. The cells locked by the other
+        threads are skipped not to wait for them while holding the pool."""
+        for i, lock in enumerate(self._cell_locks):
+            if i == cell or not lock.acquire(blocking=False):
+                continue
+            tokens = self._cells[i]
+            if tokens[1] == self._last_update:
+                self._remaining += tokens[0]
+            tokens[0] = 0
+            lock.release()
+            if self._remaining >= need:
+                return
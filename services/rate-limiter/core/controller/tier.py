@@ -0,0 +1,182 @@
+"""Rate Limit Tiers Shared by Buckets
+
+Thousands of users share the same handful of rate-limit policies. So a tier
+is an immutable object (flyweight) of the policy, and each bucket only keeps
+the ID of its tier in addition to the mutable counters.
+
+  +------------------+        +---------+---------------------------------+
+  | bucket (per key) |        | tier ID | tier (shared, immutable)        |
+  +------------------+        +---------+---------------------------------+
+  | user-1: tier 0   | -----> |    0    | (None, quota_limit=5, 1 sec)    |
+  | user-2: tier 1   | --+    |    1    | ('gold', quota_limit=50, 1 sec) |
+  | user-3: tier 1   | --+--> |         |                                 |
+  +------------------+        +---------+---------------------------------+
+
+  - anonymous tier: interned by (quota_limit, time_window) when a bucket is
+                    configured by the number of requests per time window.
+  - named tier    : defined by name (e.g. policy name of the control plane).
+                    Redefining the tier replaces the immutable object of the
+                    tier ID, which updates all the buckets of the tier in O(1).
+  - composite tier: multiple time windows such as 10 rps + 300 rpm + 10k rpd.
+                    The first window is the primary one, and the others are
+                    kept in extra_limits which are checked at once. It is
+                    rejected by ValueError when it is defined or interned if
+                    the buckets of the tiers decide a single window.
+  - reclaim       : a removed named tier is kept as an anonymous tier of its
+                    buckets, and the tier IDs which aren't named, referenced
+                    by a bucket or pinned are freed by a sweep of the tier
+                    IDs of the buckets to be reused by new tiers.
+"""
+
+from collections import namedtuple
+from core.common.utils import to_ns
+
+
+class RateLimitTier(namedtuple(
+        'RateLimitTier',
+        ['name', 'quota_limit', 'time_window', 'extra_limits'],
+        defaults=((),))):
+    """An immutable rate-limit policy shared by buckets.
+
+    Attributes:
+        name        : A string of tier name, or None if it is anonymous.
+        quota_limit : An integer of the maximum number of requests per window.
+        time_window : A number of seconds of the time window.
+        extra_limits: A tuple of (quota_limit, time_window) of the other time
+                      windows of a composite tier, or () for a single window.
+    """
+    __slots__ = ()
+
+    def limits(self):
+        """Return a list of (quota_limit, time_window) of all the windows."""
+        return [(self.quota_limit, self.time_window)] + list(self.extra_limits)
+
+
+class RateLimitTiers:
+    """Registry of tiers indexed by tier ID.
+
+    Attributes:
+        limits : A list of quota limit per tier ID for the decision hot path.
+        windows: A list of time window (ns) per tier ID for the hot path.
+        extras : A list of a tuple of (quota_limit, time_window (ns)) of the
+                 extra windows per tier ID, which is empty if not composite.
+        multi_window: A boolean if the composite tiers are allowed.
+        _tiers : A list of RateLimitTier per tier ID, which is None if the
+                 tier ID is freed.
+        _ids   : A dict of tier ID by name or (quota_limit, time_window).
+        _free  : A list of the freed tier IDs.
+        _pins  : A dict of tier ID to the number of the pins of the tier IDs
+                 which are being assigned to buckets.
+    """
+
+    def __init__(self, multi_window=True):
+        self.multi_window = multi_window
+        self.limits = []
+        self.windows = []
+        self.extras = []
+        self._tiers = []
+        self._ids = {}
+        self._free = []
+        self._pins = {}
+
+    def __len__(self):
+        """Return the number of the tiers which aren't freed."""
+        return len(self._tiers) - len(self._free)
+
+    def __getitem__(self, tier_id):
+        return self._tiers[tier_id]
+
+    def __iter__(self):
+        return iter(self._tiers)
+
+    def define(self, name, quota_limit, time_window, extra_limits=()):
+        """Create or replace a named tier, and return the tier ID."""
+        self._check(extra_limits)
+        return self._set(name, RateLimitTier(
+            name, quota_limit, time_window, tuple(extra_limits)))
+
+    def intern(self, quota_limit, time_window, extra_limits=()):
+        """Return the tier ID of an anonymous tier shared by the same limit."""
+        id_key = (quota_limit, time_window)
+        if extra_limits:
+            self._check(extra_limits)
+            id_key += (tuple(extra_limits),)
+        tier_id = self._ids.get(id_key)
+        if tier_id is None:
+            tier_id = self._set(id_key, RateLimitTier(
+                None, quota_limit, time_window, tuple(extra_limits)))
+        return tier_id
+
+    def id_of(self, name):
+        """Return the tier ID of the name, or None if it isn't defined."""
+        return self._ids.get(name)
+
+    def remove(self, name):
+        """Remove a named tier, and return if it is defined.
+
+        The buckets of the tier keep its limits as an anonymous tier until
+        they're configured again, and the tier ID is freed by reclaim() when
+        no bucket refers to it."""
+        tier_id = self._ids.pop(name, None)
+        if tier_id is None:
+            return False
+        self._tiers[tier_id] = self._tiers[tier_id]._replace(name=None)
+        return True
+
+    def pin(self, tier_ids):
+        """Keep the tier IDs from reclaim() until they're unpinned, while
+        they're assigned to buckets."""
+        for tier_id in tier_ids:
+            self._pins[tier_id] = self._pins.get(tier_id, 0) + 1
+
+    def unpin(self, tier_ids):
+        for tier_id in tier_ids:
+            count = self._pins.pop(tier_id) - 1
+            if count:
+                self._pins[tier_id] = count
+
+    def reclaim(self, used):
+        """Free the tier IDs which aren't named, pinned or in the used IDs
+        (e.g. the tier IDs of all the buckets), and return the number of the
+        freed IDs."""
+        keep = set(used)
+        keep.update(self._pins)
+        freed = 0
+        for tier_id, tier in enumerate(self._tiers):
+            if tier is None or tier.name is not None or tier_id in keep:
+                continue
+            id_key = (tier.quota_limit, tier.time_window)
+            if tier.extra_limits:
+                id_key += (tier.extra_limits,)
+            if self._ids.get(id_key) == tier_id:
+                del self._ids[id_key]
+            self._tiers[tier_id] = None
+            self._free.append(tier_id)
+            freed += 1
+        return freed
+
+    def _check(self, extra_limits):
+        if extra_limits and not self.multi_window:
+            raise ValueError('multiple time windows')
+
+    def _set(self, id_key, tier):
+        tier_id = self._ids.get(id_key)
+        if tier_id is None and not self._free:
+            tier_id = len(self._tiers)
+            self._ids[id_key] = tier_id
+            self._tiers.append(tier)
+            self.limits.append(tier.quota_limit)
+            self.windows.append(to_ns(tier.time_window))
+            self.extras.append(_extras_ns(tier))
+        else:
+            if tier_id is None:
+                tier_id = self._ids[id_key] = self._free.pop()
+            self._tiers[tier_id] = tier
+            self.limits[tier_id] = tier.quota_limit
+            self.windows[tier_id] = to_ns(tier.time_window)
+            self.extras[tier_id] = _extras_ns(tier)
+        return tier_id
+
+
+def _extras_ns(tier):
+    return tuple((limit, to_ns(window)) for limit, window in tier.extra_limits)
@@ -0,0 +1,80 @@
+"""Reference Client of the Binary Protocol of the Data Plane
+
+The client sends the request frames of a batch by one write, and reads the
+response frames of the pipelined requests as they arrive into a buffer which
+is parsed by memoryview w/o copying (see core/dataplane/binary_server.py).
+
+  with RateLimitBinaryClient(host='localhost') as client:
+      client.acquire('user-1')                       # a decision
+      client.acquire_many(['user-1', 'user-2'] * 50) # 100 decisions pipelined
+"""
+
+import socket
+
+from core.dataplane.binary_server import (
+    DEFAULT_PORT, RESPONSE, RateLimitReply, encode_request
+)
+
+_RECV_SIZE = 1 << 16
+
+
+class RateLimitBinaryClient:
+    """Connection to the binary protocol server over TCP or Unix socket.
+
+    Attributes:
+        _sock: A connected socket of the server.
+        _buf : A bytearray of the incomplete response received so far.
+    """
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT, path=None,
+                 timeout=None):
+        if path is not None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.settimeout(timeout)
+            self._sock.connect(path)
+        else:
+            self._sock = socket.create_connection((host, port), timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buf = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._sock.close()
+
+    def acquire(self, key, cost=1):
+        """Return a RateLimitReply of a request of the key by cost."""
+        return self.acquire_many((key,), cost)[0]
+
+    def acquire_many(self, keys, cost=1):
+        """Send the requests of the keys by cost in one write, and return a
+        list of RateLimitReply in the order of the keys."""
+        self._sock.sendall(b''.join(encode_request(key, cost)
+                                    for key in keys))
+        return self._receive(len(keys))
+
+    def _receive(self, count):
+        """Receive and decode the response frames of count requests."""
+        replies = []
+        buf, size = self._buf, RESPONSE.size
+        chunk = bytearray(_RECV_SIZE)
+        while len(replies) < count:
+            if len(buf) < size:
+                n = self._sock.recv_into(chunk)
+                if not n:
+                    raise ConnectionError('connection closed by the server')
+                with memoryview(chunk) as view:
+                    buf += view[:n]
+            pos = 0
+            end = min(len(buf) // size, count - len(replies)) * size
+            with memoryview(buf) as view:
+                while pos < end:
+                    replies.append(RateLimitReply._make(
+                        RESPONSE.unpack_from(view, pos)[1:]))
+                    pos += size
+            del buf[:pos]
+        return replies
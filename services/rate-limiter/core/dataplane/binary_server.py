@@ -0,0 +1,157 @@
+"""Binary Protocol Server of the Data Plane over TCP and Unix Domain Sockets
+
+A decision over HTTP costs a request line, headers and a JSON body which the
+gateway parses per request. This protocol sends a decision in a small frame
+prefixed by its length, so many frames of the pipelined requests are read
+and written by one system call, and parsed w/o copying by memoryview.
+
+Request Frame:
+==============
+  +-------------+-------------+-------------------------------+
+  | length (2B) | cost (4B)   | key (UTF-8, length - 4 bytes) |
+  +-------------+-------------+-------------------------------+
+
+Response Frame:
+===============
+  +-------------+------------+-----------+---------------+------------------+
+  | length (2B) | status (1B)| limit (8B)| remaining (8B)| reset after (8B) |
+  +-------------+------------+-----------+---------------+------------------+
+  | window (8B) |
+  +-------------+
+
+  - integers : unsigned in network byte order (big endian), of which a
+               negative limit or quota remaining is sent as 0.
+  - status   : 0 allowed, 1 denied (too many requests), 2 key not found,
+               3 bad request (the connection is closed after the response).
+  - reset    : nanoseconds until the quota remaining is refilled, which is
+               relative as the monotonic clock differs per machine.
+  - window   : nanoseconds of the time window of the limit.
+  - pipeline : the responses are sent in the order of the requests.
+"""
+
+import asyncio
+import struct
+import threading
+from collections import namedtuple
+
+DEFAULT_PORT = 8003
+MAX_KEY_SIZE = 0xFFFF - 4
+
+ALLOWED, DENIED, NOT_FOUND, BAD_REQUEST = 0, 1, 2, 3
+
+REQUEST_HEADER = struct.Struct('!HI')
+RESPONSE = struct.Struct('!HBQQQQ')
+RESPONSE_LENGTH = RESPONSE.size - 2
+
+_NOT_FOUND = RESPONSE.pack(RESPONSE_LENGTH, NOT_FOUND, 0, 0, 0, 0)
+_BAD_REQUEST = RESPONSE.pack(RESPONSE_LENGTH, BAD_REQUEST, 0, 0, 0, 0)
+
+
+class RateLimitReply(namedtuple(
+        'RateLimitReply',
+        ['status', 'limit', 'remaining', 'reset_after', 'window'])):
+    """A decoded response frame of the binary protocol."""
+    __slots__ = ()
+
+    @property
+    def allowed(self):
+        return self.status == ALLOWED
+
+
+def encode_request(key, cost=1):
+    """Return a request frame of the key and cost."""
+    key_bytes = str(key).encode()
+    if len(key_bytes) > MAX_KEY_SIZE:
+        raise ValueError(f'key is longer than {MAX_KEY_SIZE} bytes')
+    return REQUEST_HEADER.pack(len(key_bytes) + 4, cost) + key_bytes
+
+
+class RateLimitBinaryProtocol(asyncio.Protocol):
+    """Connection of the binary protocol over TCP or Unix domain socket.
+
+    Attributes:
+        _limiter  : A RateLimiter object to decide the requests.
+        _buf      : A bytearray of the incomplete frame received so far.
+        _transport: An asyncio transport of the connection.
+    """
+
+    def __init__(self, limiter):
+        self._limiter = limiter
+        self._buf = bytearray()
+        self._transport = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def data_received(self, data):
+        buf = self._buf
+        buf += data
+        out = []
+        pos, size = 0, len(buf)
+        # the clock is read once for the requests of a read.
+        now = self._limiter.time_ns()
+        with memoryview(buf) as view:
+            while size - pos >= 2:
+                length = view[pos] << 8 | view[pos + 1]
+                if length < 4:
+                    out.append(_BAD_REQUEST)
+                    pos = size
+                    break
+                end = pos + 2 + length
+                if end > size:
+                    break
+                cost = REQUEST_HEADER.unpack_from(view, pos)[1]
+                try:
+                    key = str(view[pos + 6:end], 'utf-8')
+                except UnicodeDecodeError:
+                    out.append(_BAD_REQUEST)
+                    pos = size
+                    break
+                out.append(self._respond(key, cost, now))
+                pos = end
+        closing = bool(out) and out[-1] is _BAD_REQUEST
+        del buf[:pos]
+        if out:
+            self._transport.write(b''.join(out))
+        if closing:
+            self._transport.close()
+
+    def _respond(self, key, cost, now):
+        """Return the response frame of a request."""
+        decision = self._limiter.try_acquire(key, cost, now)
+        if decision is None:
+            return _NOT_FOUND
+        return RESPONSE.pack(
+            RESPONSE_LENGTH, ALLOWED if decision.allowed else DENIED,
+            max(0, decision.limit), max(0, decision.remaining),
+            max(0, decision.reset_at - now), decision.window)
+
+
+def serve(limiter, host='0.0.0.0', port=DEFAULT_PORT, path=None):
+    """Run the server until it is interrupted. The server listens on the
+    Unix domain socket of the path instead of TCP if the path is given."""
+    async def serve_forever():
+        async with await _create_server(limiter, host, port, path) as server:
+            await server.serve_forever()
+    asyncio.run(serve_forever())
+
+
+def start_in_thread(limiter, host='0.0.0.0', port=DEFAULT_PORT, path=None):
+    """Start the server in the event loop of a daemon thread so that it
+    shares the rate-limiter w/ the Flask app, and return the server."""
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(
+        _create_server(limiter, host, port, path, loop))
+    threading.Thread(target=loop.run_forever, name='data-plane-binary',
+                     daemon=True).start()
+    return server
+
+
+def _create_server(limiter, host, port, path, loop=None):
+    loop = loop or asyncio.get_running_loop()
+    if path is not None:
+        return loop.create_unix_server(
+            lambda: RateLimitBinaryProtocol(limiter), path)
+    return loop.create_server(
+        lambda: RateLimitBinaryProtocol(limiter), host, port,
+        reuse_address=True)
@@ -0,0 +1,216 @@
+"""Asyncio HTTP Server of the Data Plane for Rate-Limit Decisions
+
+The Flask app serves all the APIs w/ the routing and marshalling of flask_restx
+per request, which cost much more than a decision of the rate-limiter. So this
+server only serves the decrement endpoints of the data plane, and the Flask
+app stays for the control plane APIs (policies, config and status).
+
+  +-------------+     +--------------------------------------+
+  | api-gateway | --> | GET /ratelimit-decrement/global      | data plane
+  |             | --> | GET /ratelimit-decrement/users/<id>  | (this server)
+  +-------------+     +--------------------------------------+
+                                       | RateLimiter (shared in a process)
+  +-------------+     +--------------------------------------+
+  | admin       | --> | /ratelimit-policies, -config, -status| control plane
+  +-------------+     +--------------------------------------+ (Flask app)
+
+  - decision : RateLimiter.try_acquire() is called in the event loop w/o
+               the routing of the Flask app.
+  - response : the same JSON body of the Flask app is encoded from the
+               precomputed templates of the status line and the body.
+  - user id  : the path is decoded as UTF-8 (and percent-encoded UTF-8)
+               like the Flask app, and a request of an invalid user id is
+               answered by 400 w/o closing the connection.
+  - body     : the endpoints take no body, so a body longer than
+               MAX_BODY_SIZE is answered by 413 and the connection is
+               closed instead of buffering it.
+  - keep-alive and pipelining: the connection of HTTP/1.1 is kept alive
+               unless 'Connection: close' is requested, and the responses of
+               the pipelined requests of a read are sent by one write.
+"""
+
+import asyncio
+import json
+import threading
+from functools import lru_cache
+from http import HTTPStatus
+from urllib.parse import unquote
+
+from core.common.constants import RateLimitLevel as Level
+from core.common.utils import limit_per
+
+DEFAULT_PORT = 8002
+MAX_HEADER_SIZE = 8192
+MAX_BODY_SIZE = 8192
+
+_GLOBAL_PATH = b'/ratelimit-decrement/global'
+_USER_PATH = b'/ratelimit-decrement/users/'
+_BODY = (b'{"quota_limit": %d, "limit_per": %s, "policy": null, '
+         b'"limits": null, "bucket_name": %s, "quota_remaining": %d}\n')
+_STATUS_LINES = {
+    status: b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n'
+            b'Content-Length: ' % (status, status.phrase.encode())
+    for status in (HTTPStatus.OK, HTTPStatus.BAD_REQUEST,
+                   HTTPStatus.NOT_FOUND, HTTPStatus.METHOD_NOT_ALLOWED,
+                   HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                   HTTPStatus.TOO_MANY_REQUESTS,
+                   HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+}
+_KEEP_ALIVE = b'\r\n\r\n'
+_KEEP_ALIVE_10 = b'\r\nConnection: keep-alive\r\n\r\n'
+_CLOSE = b'\r\nConnection: close\r\n\r\n'
+
+
+class RateLimitHTTPProtocol(asyncio.Protocol):
+    """HTTP/1.1 connection of the decrement endpoints.
+
+    Attributes:
+        _limiter  : A RateLimiter object to decide the requests.
+        _buf      : Bytes of the incomplete request received so far.
+        _transport: An asyncio transport of the connection.
+    """
+
+    def __init__(self, limiter):
+        self._limiter = limiter
+        self._buf = b''
+        self._transport = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def data_received(self, data):
+        buf = self._buf + data if self._buf else data
+        out = []
+        pos = 0
+        conn = _KEEP_ALIVE
+        while conn is not _CLOSE:
+            end = buf.find(b'\r\n\r\n', pos)
+            if end < 0:
+                if len(buf) - pos > MAX_HEADER_SIZE:
+                    conn = _CLOSE
+                    out.append(_message(
+                        HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                        'request header too large', conn))
+                break
+            line_end = buf.find(b'\r\n', pos)
+            headers = buf[line_end:end + 2].lower()
+            length = _content_length(headers)
+            if length < 0:
+                conn = _CLOSE
+                out.append(_message(HTTPStatus.BAD_REQUEST,
+                                    'invalid content-length', conn))
+                break
+            if length > MAX_BODY_SIZE:
+                conn = _CLOSE
+                out.append(_message(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                    'request body too large', conn))
+                break
+            if len(buf) < end + 4 + length:
+                break
+            method, _, rest = buf[pos:line_end].partition(b' ')
+            target, _, version = rest.partition(b' ')
+            pos = end + 4 + length
+            if version == b'HTTP/1.1':
+                conn = _CLOSE if b'\nconnection: close\r' in headers else (
+                    _KEEP_ALIVE)
+            elif b'\nconnection: keep-alive\r' in headers:
+                conn = _KEEP_ALIVE_10
+            else:
+                conn = _CLOSE
+            out.append(self._respond(method, target, conn))
+        self._buf = buf[pos:] if conn is not _CLOSE else b''
+        if out:
+            self._transport.write(b''.join(out))
+        if conn is _CLOSE:
+            self._transport.close()
+
+    def _respond(self, method, target, conn):
+        """Return the response of a request w/ the connection header."""
+        path = target.split(b'?', 1)[0]
+        if path == _GLOBAL_PATH:
+            key = Level.GLOBAL
+        elif path.startswith(_USER_PATH):
+            try:
+                key = path[len(_USER_PATH):].decode()
+                if '%' in key:
+                    key = unquote(key, errors='strict')
+            except UnicodeDecodeError:
+                return _message(HTTPStatus.BAD_REQUEST,
+                                'user id is not utf-8', conn)
+            if not key or '/' in key:
+                return _message(HTTPStatus.NOT_FOUND, 'not found', conn)
+        else:
+            return _message(HTTPStatus.NOT_FOUND, 'not found', conn)
+        if method != b'GET':
+            return _message(HTTPStatus.METHOD_NOT_ALLOWED,
+                            'method not allowed', conn)
+
+        decision = self._limiter.try_acquire(key)
+        if decision is None:
+            return _message(HTTPStatus.NOT_FOUND, f'{key} not found', conn)
+        body = _BODY % (decision.limit, _label(decision.window),
+                        _json_str(key), decision.remaining)
+        return b''.join((
+            _STATUS_LINES[HTTPStatus.OK if decision.allowed
+                          else HTTPStatus.TOO_MANY_REQUESTS],
+            b'%d' % len(body), conn, body))
+
+
+def serve(limiter, host='0.0.0.0', port=DEFAULT_PORT, sock=None):
+    """Run the server of the data plane until it is interrupted. The server
+    listens on the socket instead of the host and port if it is given."""
+    async def serve_forever():
+        loop = asyncio.get_running_loop()
+        factory = lambda: RateLimitHTTPProtocol(limiter)  # noqa: E731
+        if sock is None:
+            server = await loop.create_server(factory, host, port,
+                                              reuse_address=True)
+        else:
+            server = await loop.create_server(factory, sock=sock)
+        async with server:
+            await server.serve_forever()
+    asyncio.run(serve_forever())
+
+
+def start_in_thread(limiter, host='0.0.0.0', port=DEFAULT_PORT):
+    """Start the server in the event loop of a daemon thread so that it
+    shares the rate-limiter w/ the Flask app, and return the server."""
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(loop.create_server(
+        lambda: RateLimitHTTPProtocol(limiter), host, port,
+        reuse_address=True))
+    threading.Thread(target=loop.run_forever, name='data-plane',
+                     daemon=True).start()
+    return server
+
+
+def stop_in_thread(server):
+    """Close the server started by start_in_thread(), and stop its loop."""
+    loop = server.get_loop()
+    loop.call_soon_threadsafe(server.close)
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def _content_length(headers):
+    """Return the content length of the headers, or -1 if it is invalid."""
+    start = headers.find(b'\ncontent-length:')
+    if start < 0:
+        return 0
+    value = headers[start + 16:headers.index(b'\r', start)].strip()
+    return int(value) if value.isdigit() else -1
+
+
+def _message(status, message, conn):
+    body = b'{"message": %s}\n' % json.dumps(message).encode()
+    return b''.join((_STATUS_LINES[status], b'%d' % len(body), conn, body))
+
+
+@lru_cache(maxsize=None)
+def _label(window):
+    label = limit_per(window)
+    return b'null' if label is None else b'"%s"' % label.encode()
+
+
+@lru_cache(maxsize=1 << 16)
+def _json_str(key):
+    return json.dumps(str(key)).encode()
@@ -0,0 +1,136 @@
+"""Lease Client of Rate Limit Tokens w/ Adaptive Lease Sizing
+
+The client decides the requests of a key locally w/ the tokens leased from
+the lease API of the rate limiter (core/controller/lease.py), so a request
+costs a round trip only when the lease is spent or expired.
+
+  +-----------------------+            +-----------------------------+
+  | client (e.g. gateway) |  lease(n)  | rate limiter                |
+  |  try_acquire(): local | ---------> | POST /ratelimit-leases/...  |
+  |  tokens -= 1          | <--------- | n tokens, expires_in        |
+  +-----------------------+            +-----------------------------+
+
+  - size : the tokens of the next lease cover the requests of 'interval'
+           seconds at the rate observed since the last lease, which is
+           smoothed by an exponentially weighted moving average (EWMA):
+             rate = alpha * observed + (1 - alpha) * rate
+             size = clamp(ceil(rate * interval), min_tokens, max_tokens)
+           So a busy key leases large batches, and an idle key leases a few
+           tokens not to hold the quota which the others could use.
+  - deny : if no token is granted, the requests are denied locally until
+           the lease would expire (the end of the time window).
+  - close: the unused tokens are returned to the rate limiter.
+"""
+
+import json
+import math
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from core.common.constants import NS_PER_SEC
+from core.common.utils import MonotonicClock
+
+DEFAULT_URL = 'http://localhost:8001'
+
+
+class RateLimitLeaseClient:
+    """Local decisions of a key w/ the tokens of leases.
+
+    Attributes:
+        rate       : A float of the smoothed requests per second of the key.
+        round_trips: An integer of the calls of the lease API.
+        _tokens    : An integer of the tokens left in the current lease.
+        _lease_id  : An integer ID of the current lease, or None.
+        _expires_at: An integer ns when the current lease expires.
+        _requests  : An integer of the requests since the last lease.
+        _leased_at : An integer ns of the last lease.
+    """
+
+    def __init__(self, key=None, url=DEFAULT_URL, interval=0.1,
+                 min_tokens=1, max_tokens=1000, alpha=0.5, ttl=None,
+                 clock=None, timeout=1.0):
+        path = 'global' if key is None else f'users/{quote(str(key), "")}'
+        self.rate = 0.0
+        self.round_trips = 0
+        self._url = url.rstrip('/')
+        self._lease_url = f'{self._url}/ratelimit-leases/{path}'
+        self._interval = interval
+        self._min_tokens = min_tokens
+        self._max_tokens = max_tokens
+        self._alpha = alpha
+        self._ttl = ttl
+        self._clock = MonotonicClock() if clock is None else clock
+        self._timeout = timeout
+        self._tokens = 0
+        self._lease_id = None
+        self._expires_at = 0
+        self._requests = 0
+        self._leased_at = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def try_acquire(self):
+        """Return if a request is allowed by the tokens of the lease, and
+        lease the next batch of tokens when they are spent or expired."""
+        now = self._clock.time_ns()
+        self._requests += 1
+        if now < self._expires_at:
+            if self._tokens:
+                self._tokens -= 1
+                return True
+            if self._lease_id is None:
+                return False
+        self._lease(now)
+        if self._tokens:
+            self._tokens -= 1
+            return True
+        return False
+
+    def next_size(self):
+        """Return the number of tokens of the next lease."""
+        size = math.ceil(self.rate * self._interval)
+        return max(self._min_tokens, min(self._max_tokens, size))
+
+    def close(self):
+        """Return the unused tokens of the current lease."""
+        if self._lease_id is not None and self._tokens and (
+                self._clock.time_ns() < self._expires_at):
+            self._post(f'{self._url}/ratelimit-leases/{self._lease_id}'
+                       f'/release', {'unused': self._tokens})
+        self._lease_id = None
+        self._tokens = 0
+
+    def _lease(self, now):
+        """Observe the request rate since the last lease, and lease the
+        tokens of the next size."""
+        if self._leased_at is not None and now > self._leased_at:
+            observed = self._requests * NS_PER_SEC / (now - self._leased_at)
+            self.rate = self._alpha * observed + (1 - self._alpha) * self.rate
+        self._requests = 0
+        self._leased_at = now
+        body = {'tokens': self.next_size()}
+        if self._ttl is not None:
+            body['ttl'] = self._ttl
+        res = self._post(self._lease_url, body)
+        self._lease_id = res['lease_id']
+        self._tokens = res['tokens']
+        self._expires_at = now + int(res['expires_in'] * NS_PER_SEC)
+
+    def _post(self, url, body):
+        """Return the JSON body of the response of a POST request, which is
+        also returned for 429 (too many requests)."""
+        self.round_trips += 1
+        req = Request(url, json.dumps(body).encode(), method='POST',
+                      headers={'Content-Type': 'application/json'})
+        try:
+            with urlopen(req, timeout=self._timeout) as res:
+                return json.loads(res.read())
+        except HTTPError as e:
+            if e.code != 429:
+                raise
+            return json.loads(e.read())
@@ -0,0 +1,80 @@
+"""API Models for Rate Limit Lease API in Data Plane"""
+
+from core.common.constants import (
+    RateLimitLevel as Level,
+    RateLimitPer as Per,
+    LIMIT_PER_WINDOW
+)
+from flask_restx import fields
+
+
+def req_api_model():
+    """Request API Model for Leasing Tokens of Global/User Rate Limiter"""
+    return {
+        'tokens': fields.Integer(
+            required=True,
+            default=1,
+            description='the number of tokens to decide locally'
+        ),
+        'ttl': fields.Float(
+            description='seconds until the lease expires, which is capped '
+                        'by the end of the time window (optional)'
+        )
+    }
+
+
+def res_api_model():
+    """Response API Model for Leasing Tokens of Global/User Rate Limiter"""
+    return {
+        'lease_id': fields.Integer(
+            description='lease ID to return the unused tokens, or null if '
+                        'no token is granted'
+        ),
+        'bucket_name': fields.String(
+            required=True,
+            default=Level.GLOBAL,
+            description='rate-limiter bucket key: e.g. user-id'
+        ),
+        'tokens': fields.Integer(
+            required=True,
+            description='the number of granted tokens (0 if exhausted)'
+        ),
+        'expires_in': fields.Float(
+            required=True,
+            description='seconds until the lease expires, or to lease again '
+                        'if no token is granted'
+        ),
+        'quota_limit': fields.Integer(
+            description='the number of times you can request per limit_per'
+        ),
+        'limit_per': fields.String(
+            default=Per.SEC,
+            enum=list(LIMIT_PER_WINDOW),
+            description='requests per period of time such as second (rps)'
+        ),
+        'quota_remaining': fields.Integer(
+            description='remaining quota-units of the bucket after the lease'
+        )
+    }
+
+
+def release_req_api_model():
+    """Request API Model for Returning the Unused Tokens of a Lease"""
+    return {
+        'unused': fields.Integer(
+            required=True,
+            default=0,
+            description='the number of the unused tokens of the lease'
+        )
+    }
+
+
+def release_res_api_model():
+    """Response API Model for Returning the Unused Tokens of a Lease"""
+    return {
+        'lease_id': fields.Integer(required=True, description='lease ID'),
+        'returned': fields.Integer(
+            required=True,
+            description='the number of the tokens to be leased again'
+        )
+    }
@@ -9,7 +9,8 @@ def req_api_model():
         'name': fields.String(required=True,
                               description='rate-limit policy name'),
         'level': fields.String(description='global or user'),
-        'rate': fields.String(description='r/s: requests per second'),
+        'rate': fields.String(description='rps: requests per second, '
+                                          'rp100ms: requests per 100 ms'),
         'req_cnt': fields.Integer(description='numer of request per period')
     }
 
@@ -3,30 +3,57 @@
 from core.common.constants import (
     RateLimitLevel as Level,
     RateLimitPer as Per,
-    DEFAULT_RPS
+    DEFAULT_RPS,
+    LIMIT_PER_WINDOW
 )
 from flask_restx import fields
 
 
-def req_api_model():
+def window_api_model():
+    """API Model of a Time Window of Multi-Window Rate Limiter"""
+    return {
+        'quota_limit': fields.Integer(
+            required=True,
+            description='the number of times you can request per limit_per'
+        ),
+        'limit_per': fields.String(
+            required=True,
+            enum=list(LIMIT_PER_WINDOW),
+            description='requests per period of time such as second (rps)'
+        )
+    }
+
+
+def req_api_model(window_model):
     """Request API Model for Global/User Level Rate Limiter"""
     return {
         'quota_limit': fields.Integer(
             required=True,
             default=DEFAULT_RPS,
-            description='the number of times you can request per second (rps)'
+            description='the number of times you can request per limit_per'
         ),
         'limit_per': fields.String(
             required=True,
             default=Per.SEC,
-            description='requests per period of time such as second'
+            enum=list(LIMIT_PER_WINDOW),
+            description='requests per period of time such as second (rps) '
+                        'or 100 milliseconds (rp100ms)'
+        ),
+        'policy': fields.String(
+            description='name of rate-limit policy shared by users instead '
+                        'of quota_limit (optional)'
+        ),
+        'limits': fields.List(
+            fields.Nested(window_model),
+            description='multiple time windows checked at once such as 10 '
+                        'rps + 300 rpm instead of quota_limit (optional)'
         )
     }
 
 
-def res_api_model():
+def res_api_model(window_model):
     """Response API Model for Global/User Level Rate Limiter"""
-    res = req_api_model()
+    res = req_api_model(window_model)
     res['bucket_name'] = fields.String(
         required=True,
         default=Level.GLOBAL,
@@ -34,6 +61,6 @@ def res_api_model():
     )
     res['quota_remaining'] = fields.Integer(
         default=DEFAULT_RPS,
-        description='remaining quota-units'
+        description='remaining quota-units of the most restrictive window'
     )
     return res
@@ -0,0 +1,55 @@
+"""Benchmark for Memory Per Million Keys of Rate Limiter Buckets"""
+
+import sys
+import tracemalloc
+
+from core.controller.rate_limiter import RateLimiter
+
+
+def measure_bucket_memory(num_keys, compact):
+    """Return the number of bytes allocated to configure buckets of keys.
+
+    The keys are created before tracing so that only the memory allocated by
+    the rate limiter is measured."""
+    keys = [f'user-{i:09}' for i in range(num_keys)]
+    tracemalloc.start()
+    rate_limiter = RateLimiter(compact=compact)
+    for key in keys:
+        rate_limiter.configure_limit(user_id=key, rps=5)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return allocated
+
+
+def benchmark_bucket_memory(num_keys=1000000):
+    """benchmark: memory of dict of bucket objects vs. compact bucket table
+
+    Benchmark Result Example:
+
+             Memory Per Million Keys of Rate Limiter Buckets
+
+    +----------------------------+-----------+---------------+---------------+
+    | Bucket Storage             | # of Keys | Total (MiB)   | Bytes Per Key |
+    +----------------------------+-----------+---------------+---------------+
+    | dict of RateLimitBucket    |   1000000 |        159.04 |        166.76 |
+    | RateLimitBucketTable       |   1000000 |         55.28 |         57.96 |
+    +----------------------------+-----------+---------------+---------------+
+    """
+    print("\n         Memory Per Million Keys of Rate Limiter Buckets\n")
+    print("+----------------------------+-----------"
+          "+---------------+---------------+")
+    print("| Bucket Storage             | # of Keys "
+          "| Total (MiB)   | Bytes Per Key |")
+    print("+----------------------------+-----------"
+          "+---------------+---------------+")
+    for name, compact in (('dict of RateLimitBucket', False),
+                          ('RateLimitBucketTable', True)):
+        allocated = measure_bucket_memory(num_keys, compact)
+        print(f"| {name:26} | {num_keys:9} | {allocated / 2**20:13.2f} |"
+              f" {allocated / num_keys:13.2f} |")
+    print("+----------------------------+-----------"
+          "+---------------+---------------+")
+
+
+if __name__ == "__main__":
+    benchmark_bucket_memory(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
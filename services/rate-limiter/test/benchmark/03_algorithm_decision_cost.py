@@ -0,0 +1,70 @@
+"""Benchmark for Per-Decision Cost of Rate Limit Algorithms"""
+
+import sys
+import time
+
+from core.common.constants import RateLimitAlgorithm as Algo
+from core.controller.bucket import RateLimitBucket
+from core.controller.gcra import RateLimitGCRA
+from core.controller.rate_limiter import RateLimiter
+from core.controller.sliding_window import RateLimitSlidingWindowCounter
+
+
+def measure(decide, num_requests):
+    """Return the elapsed seconds and allowed requests of calling decide()."""
+    started = time.perf_counter()
+    allowed = 0
+    for _ in range(num_requests):
+        allowed += decide()
+    return time.perf_counter() - started, allowed
+
+
+def benchmark_decision_cost(num_requests=1000000, rps=100000):
+    """benchmark: per-decision cost of each algorithm of one key
+
+    Benchmark Result Example:
+
+        Deciding 1000000 Requests of One Key (limit: 100000 rps)
+
+    +------------------------------------------+----------+---------+---------+
+    | Algorithm                                | Time (s) | ns/Req. | Allowed |
+    +------------------------------------------+----------+---------+---------+
+    | RateLimitBucket.decrement()              |    0.821 |     821 |  100000 |
+    | RateLimitSlidingWindowCounter.decrement()|    0.975 |     975 |  179565 |
+    | RateLimitGCRA.decrement()                |    0.857 |     857 |  185662 |
+    | process_request(): token bucket table    |    3.386 |    3386 |  400000 |
+    | process_request(): GCRA table            |    3.983 |    3983 |  498269 |
+    +------------------------------------------+----------+---------+---------+
+    """
+    print(f"\n    Deciding {num_requests} Requests of One Key "
+          f"(limit: {rps} rps)\n")
+    print("+------------------------------------------"
+          "+----------+---------+---------+")
+    print("| Algorithm                                "
+          "| Time (s) | ns/Req. | Allowed |")
+    print("+------------------------------------------"
+          "+----------+---------+---------+")
+
+    cases = [
+        ('RateLimitBucket.decrement()', RateLimitBucket(rps, 1).decrement),
+        ('RateLimitSlidingWindowCounter.decrement()',
+         RateLimitSlidingWindowCounter(rps, 1).decrement),
+        ('RateLimitGCRA.decrement()', RateLimitGCRA(rps, 1).decrement),
+    ]
+    for name, algorithm in (('token bucket table', Algo.TOKEN_BUCKET),
+                            ('GCRA table', Algo.GCRA)):
+        rate_limiter = RateLimiter(algorithm=algorithm)
+        rate_limiter.configure_limit('user-1', rps)
+        cases.append((f'process_request(): {name}',
+                      lambda r=rate_limiter: r.process_request('user-1')))
+
+    for name, decide in cases:
+        elapsed, allowed = measure(decide, num_requests)
+        print(f"| {name:41}| {elapsed:8.3f} |"
+              f" {elapsed / num_requests * 1e9:7.0f} | {allowed:7} |")
+    print("+------------------------------------------"
+          "+----------+---------+---------+")
+
+
+if __name__ == "__main__":
+    benchmark_decision_cost(*map(int, sys.argv[1:3]))
@@ -0,0 +1,105 @@
+"""Benchmark for Rate Limiter Shared by Threads w/ Lock Striping"""
+
+import sys
+import threading
+import time
+
+from core.common.utils import CoarseClock
+from core.controller.rate_limiter import RateLimiter
+
+
+def stress(rate_limiter, num_threads, num_requests, num_users):
+    """Return the elapsed seconds and allowed requests of the threads which
+    call process_request() of the users concurrently."""
+    allowed = [0] * num_threads
+    barrier = threading.Barrier(num_threads + 1)
+
+    def request(thread_id):
+        users = [f'user-{(thread_id + i) % num_users}'
+                 for i in range(num_requests)]
+        barrier.wait()
+        count = 0
+        for user_id in users:
+            count += rate_limiter.process_request(user_id)
+        allowed[thread_id] = count
+
+    threads = [threading.Thread(target=request, args=(i,))
+               for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, sum(allowed)
+
+
+def benchmark_concurrent_stress(num_requests=100000, num_users=100,
+                                rps=500):
+    """benchmark: throughput and over-admission of threads sharing the buckets
+
+    The clock isn't ticked during the benchmark so that the quota isn't
+    refilled, and the users can't be allowed more than 'users x rps' requests.
+    Note that the GIL of CPython runs one thread at a time, so the throughput
+    doesn't scale up with the threads, and it doesn't switch the threads in
+    the middle of a decision of the table. So the buckets w/o locks aren't
+    over-admitted here, but the structural changes (new keys, eviction) race
+    and a free-threaded build would lose updates. Lock striping costs about a
+    quarter of the throughput of a thread, and no request is over-admitted.
+
+    Benchmark Result Example:
+
+        100000 Requests per Thread of 100 Users (limit: 50000 requests)
+
+    +--------------+---------+----------+-----------+---------+---------------+
+    | Lock Stripes | Threads | Time (s) | Req. / s  | Allowed | Over-Admitted |
+    +--------------+---------+----------+-----------+---------+---------------+
+    | none         |       1 |    0.290 |    344403 |   50000 |             0 |
+    | none         |       2 |    0.673 |    297142 |   50000 |             0 |
+    | none         |       4 |    1.184 |    337975 |   50000 |             0 |
+    | none         |       8 |    2.146 |    372839 |   50000 |             0 |
+    | 1            |       1 |    0.409 |    244674 |   50000 |             0 |
+    | 1            |       2 |    0.561 |    356808 |   50000 |             0 |
+    | 1            |       4 |    0.983 |    406836 |   50000 |             0 |
+    | 1            |       8 |    2.170 |    368604 |   50000 |             0 |
+    | 64           |       1 |    0.385 |    259781 |   50000 |             0 |
+    | 64           |       2 |    0.791 |    252750 |   50000 |             0 |
+    | 64           |       4 |    1.613 |    247954 |   50000 |             0 |
+    | 64           |       8 |    3.170 |    252394 |   50000 |             0 |
+    +--------------+---------+----------+-----------+---------+---------------+
+    """
+    limit = num_users * rps
+    print(f"\n    {num_requests} Requests per Thread of {num_users} Users "
+          f"(limit: {limit} requests)\n")
+    print("+--------------+---------+----------"
+          "+-----------+---------+---------------+")
+    print("| Lock Stripes | Threads | Time (s) "
+          "| Req. / s  | Allowed | Over-Admitted |")
+    print("+--------------+---------+----------"
+          "+-----------+---------+---------------+")
+
+    # the switch interval of the GIL is shortened to make the races of the
+    # buckets w/o locks happen as often as a busy server.
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for stripes in (None, 1, 64):
+            for num_threads in (1, 2, 4, 8):
+                rate_limiter = RateLimiter(CoarseClock(),
+                                           lock_stripes=stripes)
+                for i in range(num_users):
+                    rate_limiter.configure_limit(f'user-{i}', rps)
+                elapsed, allowed = stress(rate_limiter, num_threads,
+                                          num_requests, num_users)
+                total = num_threads * num_requests
+                print(f"| {str(stripes or 'none'):12} | {num_threads:7} |"
+                      f" {elapsed:8.3f} | {total / elapsed:9.0f} |"
+                      f" {allowed:7} | {max(0, allowed - limit):13} |")
+    finally:
+        sys.setswitchinterval(switch_interval)
+    print("+--------------+---------+----------"
+          "+-----------+---------+---------------+")
+
+
+if __name__ == "__main__":
+    benchmark_concurrent_stress(*map(int, sys.argv[1:4]))
@@ -0,0 +1,139 @@
+"""Benchmark for HTTP Servers of Decrement API w/ a Load Generator"""
+
+import asyncio
+import logging
+import multiprocessing
+import socket
+import sys
+import time
+
+from werkzeug.serving import make_server
+
+from core.controller.rate_limiter import RateLimiter
+from core.dataplane.http_server import serve
+
+
+def run_flask(sock, num_users):
+    """Run the Flask app (threaded werkzeug server) of all the APIs w/o the
+    access logs."""
+    from app.app import app, limiter
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    configure(limiter, num_users)
+    make_server('127.0.0.1', 0, app, threaded=True,
+                fd=sock.fileno()).serve_forever()
+
+
+def run_asyncio(sock, num_users):
+    """Run the asyncio server of the data plane."""
+    limiter = RateLimiter(lock_stripes=64)
+    configure(limiter, num_users)
+    serve(limiter, sock=sock)
+
+
+def configure(limiter, num_users):
+    limiter.configure_global_limit(rps=1000000)
+    for i in range(num_users):
+        limiter.configure_limit(f'user-{i}', rps=1000000)
+
+
+async def generate_load(port, num_conns, pipeline, num_requests, num_users):
+    """Return the elapsed seconds and latencies (sec) of the requests sent by
+    the connections w/ the number of pipelined requests per write."""
+    latencies = []
+
+    async def connection(conn_id):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for n in range(0, num_requests, pipeline):
+            requests = [b'GET /ratelimit-decrement/users/user-%d HTTP/1.1\r\n'
+                        b'Host: localhost\r\n\r\n' % (
+                            (conn_id + n + i) % num_users)
+                        for i in range(min(pipeline, num_requests - n))]
+            sent = time.perf_counter()
+            while requests:
+                writer.write(b''.join(requests))
+                while requests:
+                    head = (await reader.readuntil(b'\r\n\r\n')).lower()
+                    start = head.index(b'content-length: ') + 16
+                    await reader.readexactly(
+                        int(head[start:head.index(b'\r', start)]))
+                    latencies.append(time.perf_counter() - sent)
+                    requests.pop()
+                    # the server which doesn't keep the connection alive
+                    # drops the other pipelined requests, so they are sent
+                    # again over a new connection.
+                    if b'connection: close' in head:
+                        writer.close()
+                        reader, writer = await asyncio.open_connection(
+                            '127.0.0.1', port)
+                        break
+        writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connection(i) for i in range(num_conns)))
+    return time.perf_counter() - started, latencies
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def benchmark_data_plane_http(num_requests=5000, num_users=100):
+    """benchmark: decisions/sec and latency of the decrement API per server
+
+    Each server runs in a process, and the load generator sends the requests
+    of the users over keep-alive connections w/ pipelined requests per write.
+    The latency of a request is from the write of its batch to its response.
+    Note that the werkzeug server of the Flask app closes the connection per
+    response, so its requests are sent over a new connection each time. The
+    load generator shares the CPU cores w/ the server.
+
+    Benchmark Result Example:
+
+        5000 Requests per Connection of 100 Users
+
+    +---------+-------+----------+----------+----------+----------+----------+
+    | Server  | Conns | Pipeline | Time (s) | Req. / s | p50 (ms) | p99 (ms) |
+    +---------+-------+----------+----------+----------+----------+----------+
+    | flask   |     1 |        1 |    7.641 |      654 |     1.01 |     1.91 |
+    | flask   |     8 |        1 |   52.068 |      768 |     5.95 |    16.13 |
+    | asyncio |     1 |        1 |    0.328 |    15260 |     0.06 |     0.16 |
+    | asyncio |     8 |        1 |    1.980 |    20202 |     0.37 |     0.84 |
+    | asyncio |     8 |       16 |    0.832 |    48051 |     2.58 |     4.18 |
+    +---------+-------+----------+----------+----------+----------+----------+
+    """
+    print(f"\n    {num_requests} Requests per Connection of {num_users} "
+          f"Users\n")
+    print("+---------+-------+----------+----------"
+          "+----------+----------+----------+")
+    print("| Server  | Conns | Pipeline | Time (s) "
+          "| Req. / s | p50 (ms) | p99 (ms) |")
+    print("+---------+-------+----------+----------"
+          "+----------+----------+----------+")
+
+    ctx = multiprocessing.get_context('fork')
+    for name, run, cases in (('flask', run_flask, ((1, 1), (8, 1))),
+                             ('asyncio', run_asyncio,
+                              ((1, 1), (8, 1), (8, 16)))):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(1024)
+        server = ctx.Process(target=run, args=(sock, num_users), daemon=True)
+        server.start()
+        port = sock.getsockname()[1]
+        for num_conns, pipeline in cases:
+            elapsed, latencies = asyncio.run(generate_load(
+                port, num_conns, pipeline, num_requests, num_users))
+            print(f"| {name:7} | {num_conns:5} | {pipeline:8} |"
+                  f" {elapsed:8.3f} | {len(latencies) / elapsed:8.0f} |"
+                  f" {percentile(latencies, 50) * 1e3:8.2f} |"
+                  f" {percentile(latencies, 99) * 1e3:8.2f} |")
+        server.terminate()
+        server.join()
+        sock.close()
+    print("+---------+-------+----------+----------"
+          "+----------+----------+----------+")
+
+
+if __name__ == "__main__":
+    benchmark_data_plane_http(*map(int, sys.argv[1:3]))
@@ -0,0 +1,76 @@
+"""Benchmark for Consistent-Hash Router of Rate Limiter Instances"""
+
+import sys
+import time
+
+from core.controller.rate_limiter import RateLimiter
+from core.controller.router import RateLimitRouter
+
+
+def build(num_instances, num_users, vnodes):
+    router = RateLimitRouter(vnodes)
+    for i in range(num_instances):
+        router.add_instance(f'instance-{i}', RateLimiter())
+    users = [f'user-{i}' for i in range(num_users)]
+    for user in users:
+        router.configure_limit(user, rps=100)
+    return router, users
+
+
+def benchmark_hash_ring_router(num_users=100000, num_instances=4):
+    """benchmark: balance and movement of the buckets of the router
+
+    The balance is the max number of buckets of an instance to the mean. The
+    moved buckets are of adding an instance to K instances (the ideal is
+    1 / (K + 1)), and removing it again, w/ the migration of the state. The
+    route is the time of process_request() of the router minus the time of
+    the rate-limiter per request.
+
+    Benchmark Result Example:
+
+        100000 Users, 4 Instances (+1)
+
+    +--------+-----------+----------+-------+------------+-------------+
+    | VNodes | Max/Mean  | Add (%)  | Ideal | Remove (%) | Route (us)  |
+    +--------+-----------+----------+-------+------------+-------------+
+    |      1 |     2.352 |     9.06 | 20.00 |       9.06 |        3.51 |
+    |     16 |     1.283 |    23.71 | 20.00 |      23.71 |        2.54 |
+    |    128 |     1.122 |    19.62 | 20.00 |      19.62 |        1.50 |
+    |    512 |     1.039 |    21.44 | 20.00 |      21.44 |        3.11 |
+    +--------+-----------+----------+-------+------------+-------------+
+    """
+    print(f"\n    {num_users} Users, {num_instances} Instances (+1)\n")
+    print("+--------+-----------+----------"
+          "+-------+------------+-------------+")
+    print("| VNodes | Max/Mean  | Add (%)  "
+          "| Ideal | Remove (%) | Route (us)  |")
+    print("+--------+-----------+----------"
+          "+-------+------------+-------------+")
+    for vnodes in (1, 16, 128, 512):
+        router, users = build(num_instances, num_users, vnodes)
+        sizes = [len(limiter.buckets)
+                 for limiter in router.instances.values()]
+        balance = max(sizes) / (sum(sizes) / len(sizes))
+        added = router.add_instance('new', RateLimiter()) / num_users
+        removed = len(router.instances['new'].buckets) / num_users
+        router.remove_instance('new')
+
+        started = time.perf_counter()
+        for user in users:
+            router.process_request(user)
+        routed = time.perf_counter() - started
+        limiters = [router.instance(user) for user in users]
+        started = time.perf_counter()
+        for limiter, user in zip(limiters, users):
+            limiter.process_request(user)
+        direct = time.perf_counter() - started
+        route = (routed - direct) / num_users * 1e6
+        print(f"| {vnodes:6} | {balance:9.3f} | {added * 100:8.2f} |"
+              f" {100 / (num_instances + 1):5.2f} | {removed * 100:10.2f} |"
+              f" {route:11.2f} |")
+    print("+--------+-----------+----------"
+          "+-------+------------+-------------+")
+
+
+if __name__ == "__main__":
+    benchmark_hash_ring_router(*map(int, sys.argv[1:3]))
@@ -0,0 +1,101 @@
+"""Benchmark for Bulk Config API vs. Configuring Users One by One"""
+
+import json
+import logging
+import sys
+import time
+
+from core.controller.rate_limiter import RateLimiter
+
+
+def put_users(client, prefix, num_users):
+    """Return the seconds of a PUT API call per user."""
+    started = time.perf_counter()
+    for i in range(num_users):
+        res = client.put(f'/ratelimit-config/users/{prefix}-{i}',
+                         json={'policy': 'user-level-rate-limit'})
+        assert res.status_code == 201
+    return time.perf_counter() - started
+
+
+def post_bulk(client, prefix, num_users, ndjson=False):
+    """Return the seconds of a bulk API call of all the users."""
+    pairs = ([f'{prefix}-{i}', 'user-level-rate-limit']
+             for i in range(num_users))
+    if ndjson:
+        body = ''.join(f'{json.dumps(pair)}\n' for pair in pairs)
+        content_type = 'application/x-ndjson'
+    else:
+        body, content_type = json.dumps(list(pairs)), 'application/json'
+    started = time.perf_counter()
+    res = client.post('/ratelimit-config/bulk', data=body.encode(),
+                      content_type=content_type)
+    elapsed = time.perf_counter() - started
+    assert res.get_json()['created'] == num_users
+    return elapsed
+
+
+def configure(num_users, bulk):
+    """Return the seconds of configuring the users by the rate-limiter."""
+    limiter = RateLimiter(lock_stripes=64)
+    limiter.configure_tier('gold', rps=100)
+    keys = [f'user-{i}' for i in range(num_users)]
+    started = time.perf_counter()
+    if bulk:
+        limiter.configure_limits(dict.fromkeys(keys, 'gold'))
+    else:
+        for key in keys:
+            limiter.configure_limit(key, tier='gold')
+    return time.perf_counter() - started
+
+
+def benchmark_bulk_config(max_users=1000000, max_put_users=10000):
+    """benchmark: users per second of the bulk config API vs. the PUT API
+
+    The PUT is a call of the PUT API per user, and the bulk is a call of the
+    bulk API of a JSON array (or NDJSON) of all the users, which are served
+    by the Flask app in process (test client) w/o the network. The
+    configure_limit() and configure_limits() are the calls of the
+    rate-limiter w/o the APIs. The PUT of more than max_put_users isn't
+    measured as it takes too long.
+    Note that the example is measured on a VM of a single core.
+
+    Benchmark Result Example:
+
+    +---------+-----------+-----------+-----------+-------------+-------------+
+    | Users   | PUT/s     | Bulk/s    | NDJSON/s  | configure/s | bulk conf/s |
+    +---------+-----------+-----------+-----------+-------------+-------------+
+    |    1000 |      1400 |     96293 |    111233 |      125156 |      185552 |
+    |   10000 |      1426 |    123570 |    133330 |      141129 |      190478 |
+    |  100000 |         - |     90871 |     97343 |      135265 |      183067 |
+    | 1000000 |         - |     72863 |     55875 |      126799 |      160040 |
+    +---------+-----------+-----------+-----------+-------------+-------------+
+    """
+    from app.app import app
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    client = app.test_client()
+    print("+---------+-----------+-----------+-----------"
+          "+-------------+-------------+")
+    print("| Users   | PUT/s     | Bulk/s    | NDJSON/s  "
+          "| configure/s | bulk conf/s |")
+    print("+---------+-----------+-----------+-----------"
+          "+-------------+-------------+")
+    num_users = 1000
+    while num_users <= max_users:
+        put = f"{'-':>9}"
+        if num_users <= max_put_users:
+            elapsed = put_users(client, f'put-{num_users}', num_users)
+            put = f"{num_users / elapsed:9.0f}"
+        bulk = post_bulk(client, f'bulk-{num_users}', num_users)
+        ndjson = post_bulk(client, f'ndjson-{num_users}', num_users, True)
+        print(f"| {num_users:7} | {put} | {num_users / bulk:9.0f} |"
+              f" {num_users / ndjson:9.0f} |"
+              f" {num_users / configure(num_users, False):11.0f} |"
+              f" {num_users / configure(num_users, True):11.0f} |")
+        num_users *= 10
+    print("+---------+-----------+-----------+-----------"
+          "+-------------+-------------+")
+
+
+if __name__ == "__main__":
+    benchmark_bulk_config(*map(int, sys.argv[1:3]))
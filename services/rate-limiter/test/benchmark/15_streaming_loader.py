@@ -0,0 +1,84 @@
+"""Benchmark for Streaming Loader of the Limits of Users at Boot"""
+
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+
+from core.controller.loader import load_limits
+from core.controller.rate_limiter import RateLimiter
+
+
+def write_users(path, num_users):
+    """Write a file of the users of a policy or a quota limit per user."""
+    with open(path, 'w') as f:
+        for start in range(0, num_users, 10000):
+            users = range(start, min(start + 10000, num_users))
+            if path.endswith('.csv'):
+                f.writelines(f'user-{i},gold\n' if i % 2 else
+                             f'user-{i},{i % 100 + 1},rpm\n' for i in users)
+            else:
+                f.writelines(json.dumps([f'user-{i}', 'gold'] if i % 2 else
+                                        [f'user-{i}', i % 100 + 1]) + '\n'
+                             for i in users)
+
+
+def load(path):
+    """Return (rows per second, MB of the growth of the max RSS) of loading
+    the file in a forked process."""
+    limiter = RateLimiter(lock_stripes=64)
+    limiter.configure_tier('gold', rps=100)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    res = load_limits(limiter, path)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    assert res.created == res.rows
+    return res.rows_per_sec, (after - before) / 1024
+
+
+def benchmark_streaming_loader(max_users=1000000):
+    """benchmark: rows per second and memory of loading a file of users
+
+    The file of the users (a half of them w/ a policy, and the other half w/
+    a quota limit per minute) is loaded by the chunks of 10K rows, so the
+    growth of the max RSS is the one of the buckets (the table and the key
+    strings) and a chunk rather than the parsed file.
+    Note that the example is measured on a VM of a single core.
+
+    Benchmark Result Example:
+
+    +--------+-----------+-----------+------------+-------------+
+    | Format | Users     | File (MB) | Rows/s     | RSS+ (MB)   |
+    +--------+-----------+-----------+------------+-------------+
+    | csv    |     10000 |       0.2 |     117950 |         3.2 |
+    | csv    |    100000 |       1.6 |     111117 |        17.3 |
+    | csv    |   1000000 |      17.0 |     110589 |       155.8 |
+    | csv    |  10000000 |     179.7 |      84997 |      1027.0 |
+    | jsonl  |     10000 |       0.2 |     116006 |         3.2 |
+    | jsonl  |    100000 |       2.0 |     109402 |        17.8 |
+    | jsonl  |   1000000 |      20.8 |     105707 |       156.4 |
+    | jsonl  |  10000000 |     217.8 |      73845 |      1068.9 |
+    +--------+-----------+-----------+------------+-------------+
+    """
+    print("+--------+-----------+-----------+------------+-------------+")
+    print("| Format | Users     | File (MB) | Rows/s     | RSS+ (MB)   |")
+    print("+--------+-----------+-----------+------------+-------------+")
+    pool = multiprocessing.get_context('fork').Pool(1, maxtasksperchild=1)
+    for fmt in ('csv', 'jsonl'):
+        num_users = 10000
+        while num_users <= max_users:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, f'users.{fmt}')
+                write_users(path, num_users)
+                rate, rss = pool.apply(load, (path,))
+                print(f"| {fmt:6} | {num_users:9} |"
+                      f" {os.path.getsize(path) / 2 ** 20:9.1f} |"
+                      f" {rate:10.0f} | {rss:11.1f} |")
+            num_users *= 10
+    pool.close()
+    print("+--------+-----------+-----------+------------+-------------+")
+
+
+if __name__ == "__main__":
+    benchmark_streaming_loader(*map(int, sys.argv[1:2]))
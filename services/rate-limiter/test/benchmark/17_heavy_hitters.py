@@ -0,0 +1,78 @@
+"""Benchmark for Top-K Heavy Hitters of Rate Limit Decisions"""
+
+import random
+import sys
+import time
+import tracemalloc
+
+from core.controller.heavy_hitters import RateLimitHeavyHitters
+from core.controller.rate_limiter import RateLimiter
+
+
+def decide(num_users, heavy_hitters, num_requests):
+    """Return the ns per process_request() of zipf-like keys."""
+    limiter = RateLimiter(lock_stripes=64, heavy_hitters=heavy_hitters)
+    limiter.configure_tier('gold', rps=100)
+    limiter.configure_limits(
+        dict.fromkeys((f'user-{i}' for i in range(num_users)), 'gold'))
+    rand = random.Random(7)
+    keys = [f'user-{min(int(rand.paretovariate(1.2)) - 1, num_users - 1)}'
+            for _ in range(num_requests)]
+    process_request = limiter.process_request
+    started = time.perf_counter_ns()
+    for key in keys:
+        process_request(key)
+    return (time.perf_counter_ns() - started) / num_requests
+
+
+def memory(num_users, capacity):
+    """Return the KiB of the counters of a window of distinct keys."""
+    tracemalloc.start()
+    hitters = RateLimitHeavyHitters(capacity)
+    for i in range(num_users):
+        hitters.record(f'user-{i}', True, 0)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / 1024
+
+
+def benchmark_heavy_hitters(max_users=1000000, num_requests=200000):
+    """benchmark: cost per decision and memory of the heavy hitters
+
+    The requests of zipf-like keys are decided by process_request() w/o and
+    w/ the heavy hitters of 1024 counters. The memory is of the counters
+    after a window of distinct keys (the worst case of the replacements),
+    which doesn't grow w/ the number of the users. (but w/ the length of the
+    keys.) The overhead is about 0.6-0.9 us of a clock read and a Space-Saving
+    update per decision, which are counted by a batch of 256 decisions.
+    Note that the example is measured on a VM of a single core.
+
+    Benchmark Result Example:
+
+    +----------+-------------+-------------+-----------+--------------+
+    | Users    | Off (ns/op) | On (ns/op)  | Overhead  | Memory (KiB) |
+    +----------+-------------+-------------+-----------+--------------+
+    |    10000 |        1860 |        2438 |     31.1% |        248.3 |
+    |   100000 |        1787 |        2436 |     36.3% |        244.9 |
+    |  1000000 |        1828 |        2722 |     48.9% |        304.5 |
+    +----------+-------------+-------------+-----------+--------------+
+    """
+    print("+----------+-------------+-------------"
+          "+-----------+--------------+")
+    print("| Users    | Off (ns/op) | On (ns/op)  "
+          "| Overhead  | Memory (KiB) |")
+    print("+----------+-------------+-------------"
+          "+-----------+--------------+")
+    num_users = 10000
+    while num_users <= max_users:
+        off = decide(num_users, 0, num_requests)
+        on = decide(num_users, 1024, num_requests)
+        print(f"| {num_users:8} | {off:11.0f} | {on:11.0f} |"
+              f" {(on - off) / off:8.1%} | {memory(num_users, 1024):12.1f} |")
+        num_users *= 10
+    print("+----------+-------------+-------------"
+          "+-----------+--------------+")
+
+
+if __name__ == "__main__":
+    benchmark_heavy_hitters(*map(int, sys.argv[1:3]))
@@ -0,0 +1,50 @@
+# -----------------------------------------------------------------------------#
+#                                                                              #
+#           Running Script for Benchmarking Rate Limiter with Report           #
+#                                                                              #
+# -----------------------------------------------------------------------------#
+
+#
+# Common constants.
+#
+GREEN='\033[0;32m'
+YELLOW='\033[0;33m'
+NC='\033[0m' # No Color
+
+#
+# Set up environment variables if they are not set up.
+#
+if [ -z "$PYTHONPATH" ] 
+then
+   export PYTHONPATH=$(PWD)/../../
+   echo   $PYTHONPATH
+fi
+
+if [ -z "$BENCHMARK_PATH" ] 
+then
+   export BENCHMARK_PATH=$(PWD)
+   echo   $BENCHMARK_PATH
+fi
+
+#
+# Run benchmark cases for the rate limiter.
+#
+printf "\n"
+printf "${YELLOW}+--------------------------------------------------------+\n"
+printf "${YELLOW}|                                                        |\n"
+printf "${YELLOW}|                       Benchmark                        |\n"
+printf "${YELLOW}|                                                        |\n"
+printf "${YELLOW}|          (Rate Limiter -> Memory, Throughput)          |\n"
+printf "${YELLOW}|                                                        |\n"
+printf "${YELLOW}+--------------------------------------------------------+\n"
+
+n=0
+benchmark_files=`ls $BENCHMARK_PATH/*.py`
+for file_name in $benchmark_files
+do
+   let n=$n+1
+   printf "\n${GREEN}"
+   printf "__________________[ Benchmark $n Report ]__________________"
+   printf "${NC}\n\n"
+   python $file_name
+done
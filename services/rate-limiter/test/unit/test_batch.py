@@ -0,0 +1,85 @@
+"""Unit Test for Vectorized Batch Requests of Rate Limiter"""
+
+import numpy as np
+import pytest
+import random
+
+from core.common.constants import (
+    DEFAULT_RPS, DEFAULT_USER_ID, NS_PER_SEC, RateLimitAlgorithm as Algo)
+from core.common.exceptions import RateLimitConfigNotFound
+from core.common.utils import ManualClock
+from core.controller.rate_limiter import RateLimiter
+
+
+def test_process_requests_same_as_process_request():
+    # set up two rate-limiters w/ the same buckets and random requests.
+    rand = random.Random(7)
+    for _ in range(200):
+        clock = ManualClock(1000 * NS_PER_SEC + rand.randrange(NS_PER_SEC))
+        batch_limiter, seq_limiter = RateLimiter(clock), RateLimiter(clock)
+        keys = [f'user-{i}' for i in range(rand.randint(1, 5))]
+        for key in keys:
+            quota_limit = rand.randint(0, 4)
+            time_window = rand.choice([0.1, 0.3, 1, 2.5])
+            extra_limits = rand.choice([(), (), [(rand.randint(0, 6), 3)]])
+            for limiter in (batch_limiter, seq_limiter):
+                limiter.buckets.configure(key, quota_limit, time_window,
+                                          extra_limits)
+                limiter.process_request(key)
+
+        now, requests = clock.now, []
+        for _ in range(rand.randint(1, 100)):
+            now += int(rand.choice([0, 0, 0.1, 0.3, 0.7, 1.0, rand.random()])
+                       * NS_PER_SEC)
+            requests.append((rand.choice(keys), now))
+
+        # test the batch result is the same as the sequential requests.
+        res = batch_limiter.process_requests(
+            [key for key, _ in requests], [ts for _, ts in requests])
+        for i, (key, ts) in enumerate(requests):
+            clock.now = ts
+            assert res[i] == seq_limiter.process_request(key)
+
+        clock.now = now + NS_PER_SEC // 20
+        for key in keys:
+            assert (batch_limiter.quota_remaining(key) ==
+                    seq_limiter.quota_remaining(key))
+            assert (batch_limiter.cur_remaining(key) ==
+                    seq_limiter.cur_remaining(key))
+
+
+def test_process_requests_invalid_requests():
+    # set up rate-limiter for testing process_requests()
+    clock = ManualClock(1000 * NS_PER_SEC)
+    limiter = RateLimiter(clock)
+    limiter.configure_limit(user_id=DEFAULT_USER_ID, rps=DEFAULT_RPS)
+
+    # test empty requests, unknown keys, and unsorted timestamps.
+    assert len(limiter.process_requests([], [])) == 0
+    with pytest.raises(RateLimitConfigNotFound):
+        limiter.process_requests(['unknown'], [clock.now])
+    with pytest.raises(ValueError):
+        limiter.process_requests([DEFAULT_USER_ID] * 2,
+                                 [clock.now + NS_PER_SEC, clock.now])
+    with pytest.raises(ValueError):
+        limiter.process_requests([DEFAULT_USER_ID], [clock.now - NS_PER_SEC])
+
+    # test numpy arrays of keys and timestamps.
+    res = limiter.process_requests(np.array([DEFAULT_USER_ID] * 6),
+                                   np.full(6, clock.now))
+    assert res.tolist() == [True] * DEFAULT_RPS + [False]
+
+
+@pytest.mark.parametrize('algorithm', [Algo.SLIDING_WINDOW_COUNTER, Algo.GCRA])
+def test_process_requests_of_bucket_objects(algorithm):
+    # set up rate-limiter of the bucket objects of an algorithm.
+    clock = ManualClock(1000 * NS_PER_SEC)
+    limiter = RateLimiter(clock, algorithm, compact=False)
+    limiter.configure_limit(user_id=DEFAULT_USER_ID, rps=DEFAULT_RPS)
+    clock.sleep(1)
+
+    # test the batch is decided one by one, and unknown keys are reported.
+    res = limiter.process_requests([DEFAULT_USER_ID] * 6, [clock.now] * 6)
+    assert res.tolist() == [True] * DEFAULT_RPS + [False]
+    with pytest.raises(RateLimitConfigNotFound):
+        limiter.process_requests(['unknown'], [clock.now])
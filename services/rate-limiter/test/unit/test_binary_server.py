@@ -0,0 +1,73 @@
+"""Unit Test for Binary Protocol Server and Client of the Data Plane"""
+
+import os
+import socket
+import tempfile
+
+from core.common.constants import NS_PER_SEC
+from core.controller.rate_limiter import RateLimiter
+from core.dataplane.binary_client import RateLimitBinaryClient
+from core.dataplane.binary_server import (
+    ALLOWED, BAD_REQUEST, DENIED, NOT_FOUND, RESPONSE, encode_request,
+    start_in_thread
+)
+from core.dataplane.http_server import stop_in_thread
+
+
+def test_pipelined_decisions_over_tcp():
+    # set up the server of a rate-limiter w/ the global and a user limit.
+    limiter = RateLimiter(lock_stripes=4)
+    limiter.configure_global_limit(rps=10)
+    limiter.configure_limit('user 1', rps=2)
+    server = start_in_thread(limiter, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    # test the pipelined requests are answered in order.
+    with RateLimitBinaryClient('127.0.0.1', port) as client:
+        replies = client.acquire_many(['user 1', 'user 1', 'user 1',
+                                       'global', 'user-2'])
+        assert [r.status for r in replies] == [ALLOWED, ALLOWED, DENIED,
+                                               ALLOWED, NOT_FOUND]
+        assert replies[1].allowed and not replies[2].allowed
+        assert replies[1][1:3] == (2, 0)
+        assert replies[1].window == NS_PER_SEC
+        assert 0 < replies[1].reset_after <= NS_PER_SEC
+        assert client.acquire('global', cost=4).remaining == 5
+
+        # test the cost of 0 returns the status w/o consuming quota.
+        assert client.acquire('global', cost=0)[:3] == (ALLOWED, 10, 5)
+
+        # test a negative limit is answered as 0 over the connection.
+        limiter.configure_limit('user-3', rps=-1)
+        assert client.acquire('user-3')[:3] == (DENIED, 0, 0)
+        assert client.acquire('global', cost=0)[:3] == (ALLOWED, 10, 5)
+
+    # test a frame split across writes, and a bad frame closes the
+    # connection after the response.
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        frame = encode_request('global')
+        sock.sendall(frame[:3])
+        sock.sendall(frame[3:] + b'\x00\x02ab')
+        data = b''
+        while len(data) < 2 * RESPONSE.size:
+            data += sock.recv(4096)
+        assert RESPONSE.unpack_from(data)[1:3] == (ALLOWED, 10)
+        assert RESPONSE.unpack_from(data, RESPONSE.size)[1] == BAD_REQUEST
+        assert sock.recv(1) == b''
+    stop_in_thread(server)
+
+
+def test_decisions_over_unix_socket():
+    # set up the server on a Unix domain socket.
+    limiter = RateLimiter()
+    limiter.configure_limit('user-1', rps=100)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'rate-limiter.sock')
+        server = start_in_thread(limiter, path=path)
+
+        # test a batch of decisions larger than a read of the server.
+        with RateLimitBinaryClient(path=path) as client:
+            replies = client.acquire_many(['user-1'] * 5000)
+        assert sum(r.allowed for r in replies) == 100
+        assert replies[99].remaining == 0
+        stop_in_thread(server)
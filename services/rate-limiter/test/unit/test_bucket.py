@@ -1,10 +1,9 @@
 """Unit Test for Each Function of Rate Limiter Bucket"""
 
-import time
 from unittest import TestCase as t
 
 from core.common.constants import DEFAULT_TIME_WINDOW, DEFAULT_RPS
-from core.common.utils import FakeClock
+from core.common.utils import FakeClock, MonotonicClock
 from core.controller.rate_limiter import RateLimitBucket
 
 
@@ -15,7 +14,7 @@ def test_clear_and_quota_limit_remaining():
 
     # test the functions to check the variables are set.
     assert bucket.quota_remaining() == DEFAULT_RPS
-    assert bucket._last_update_time <= time.time()
+    assert bucket._last_update_time <= MonotonicClock().time_ns()
 
 
 def test_decrement_cur_remaining():
@@ -47,3 +46,17 @@ def test_time_allowance():
     bucket.decrement()
     res = bucket.time_allowance()
     assert res == 0
+
+
+def test_sub_second_time_window():
+    # set up a bucket w/ 2 requests per 100 ms.
+    clock = FakeClock(10)
+    bucket = RateLimitBucket(2, 0.1, clock)
+
+    # test the quota is refilled every 100 ms rather than every second.
+    t().assertTrue(bucket.decrement())
+    t().assertTrue(bucket.decrement())
+    t().assertFalse(bucket.decrement())
+    clock.sleep(0.1)
+    t().assertTrue(bucket.decrement())
+    assert bucket.cur_remaining() == 1
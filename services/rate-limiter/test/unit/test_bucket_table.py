@@ -0,0 +1,265 @@
+"""Unit Test for Each Function of Rate Limiter Bucket Table"""
+
+import pytest
+from unittest import TestCase as t
+
+from core.common.constants import DEFAULT_TIME_WINDOW, DEFAULT_RPS, NS_PER_SEC
+from core.common.utils import FakeClock, ManualClock
+from core.controller.bucket import RateLimitBucket
+from core.controller.bucket_table import (
+    RateLimitBucketMap,
+    RateLimitBucketTable
+)
+from core.controller.sliding_window import RateLimitSlidingWindowCounter
+
+
+def test_configure_and_remove():
+    # set up a table for testing configure(), remove() and membership.
+    table = RateLimitBucketTable()
+    table.configure('user-1', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    table.configure('user-2', DEFAULT_RPS + 1, DEFAULT_TIME_WINDOW)
+
+    # test the keys are configured with a full quota.
+    assert len(table) == 2
+    t().assertTrue('user-1' in table)
+    assert table.quota_limit('user-2') == DEFAULT_RPS + 1
+    assert table.quota_remaining('user-2') == DEFAULT_RPS + 1
+
+    # test the removed key is not found and its slot is recycled.
+    table.remove('user-1')
+    t().assertFalse('user-1' in table)
+    with pytest.raises(KeyError):
+        table.remove('user-1')
+    with pytest.raises(KeyError):
+        table.decrement('user-1')
+    table.configure('user-3', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    assert len(table._keys) == 2
+    assert sorted(table.keys()) == ['user-2', 'user-3']
+
+
+def test_assign_undefined_tier():
+    # set up a table w/ a bucket of a tier.
+    table = RateLimitBucketTable()
+    table.configure('user-1', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    table.decrement('user-1')
+
+    # test a bucket isn't created or changed by an undefined tier.
+    for tier_id in (-1, len(table.tiers.limits)):
+        with pytest.raises(KeyError):
+            table.assign('user-2', tier_id)
+        with pytest.raises(KeyError):
+            table.assign_many(['user-3', 'user-1'], [0, tier_id])
+        with pytest.raises(KeyError):
+            table.assign('user-1', tier_id)
+    assert sorted(table.keys()) == ['user-1', 'user-3']
+    assert len(table._keys) == 2
+    assert table.quota_remaining('user-1') == DEFAULT_RPS - 1
+
+
+def test_decrement_same_as_bucket():
+    # set up a table and a bucket object with the same clock.
+    clock = FakeClock(10)
+    table = RateLimitBucketTable(clock)
+    table.configure('user-1', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    bucket = RateLimitBucket(DEFAULT_RPS, DEFAULT_TIME_WINDOW, clock)
+
+    # test the table returns the same result of the bucket object.
+    for sleep_sec in (0, 0, 0.5, 0, 0, 0, 1, 0, 2.5, 0):
+        clock.sleep(sleep_sec)
+        assert table.decrement('user-1') == bucket.decrement()
+        assert table.quota_remaining('user-1') == bucket.quota_remaining()
+        assert table.cur_remaining('user-1') == bucket.cur_remaining()
+
+
+def test_grow_index_with_many_keys():
+    # set up a table with enough keys to rebuild the index several times.
+    table = RateLimitBucketTable()
+    for user_id in range(10000):
+        table.configure(user_id, DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    for user_id in range(0, 10000, 2):
+        table.remove(user_id)
+
+    # test every remaining key is still found at its own slot.
+    assert len(table) == 5000
+    for user_id in range(1, 10000, 2):
+        t().assertTrue(table.decrement(user_id))
+        assert table.quota_remaining(user_id) == DEFAULT_RPS - 1
+    t().assertFalse(0 in table)
+
+
+def test_assign_many_with_sized_index():
+    # set up a table w/ some keys, of which a half is assigned again.
+    table = RateLimitBucketTable()
+    tier_id = table.tiers.intern(DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    for user_id in range(100):
+        table.assign(user_id, tier_id)
+        table.decrement(user_id)
+
+    # test the index is rebuilt once for all the new keys, and the assigned
+    # keys are reset to a full quota.
+    assert table.assign_many(range(50, 10050), [tier_id] * 10000) == 9950
+    assert len(table) == 10050
+    assert len(table._index) == 32768
+    assert table.quota_remaining(0) == DEFAULT_RPS - 1
+    assert table.quota_remaining(50) == DEFAULT_RPS
+    t().assertTrue(table.decrement(10049))
+
+
+def test_image_and_load():
+    # set up a table of many keys w/ free slots, and its image.
+    table = RateLimitBucketTable()
+    for user_id in range(10000):
+        table.configure(user_id, DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    for user_id in range(0, 10000, 3):
+        table.remove(user_id)
+    table.decrement(1)
+    image = table.image()
+    table.decrement(1)
+
+    # test the loaded table finds every key, and reuses the free slots.
+    loaded = RateLimitBucketTable()
+    loaded.load(image)
+    assert len(loaded) == len(table) == 6666
+    assert loaded.quota_remaining(1) == DEFAULT_RPS - 1
+    for user_id in range(10000):
+        assert (user_id in loaded) == (user_id % 3 != 0)
+    loaded.configure('user-1', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    assert len(loaded._keys) == 10000
+
+
+def test_nbytes_per_key():
+    # set up a table with 100K keys.
+    keys = [f'user-{i}' for i in range(100000)]
+    table = RateLimitBucketTable()
+    for key in keys:
+        table.configure(key, DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+
+    # test the memory per key is tens of bytes.
+    assert table.nbytes() / len(keys) < 100
+
+
+def test_evict_by_max_buckets():
+    # set up a table with the max number of buckets and a pinned key.
+    clock = FakeClock(10)
+    table = RateLimitBucketTable(clock, max_buckets=3, pinned=('global',))
+    for key in ('global', 'user-1', 'user-2'):
+        table.configure(key, DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    table.decrement('user-1')
+    table.decrement('user-2')
+
+    # test a new bucket evicts the least recently used bucket.
+    table.configure('user-3', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    assert len(table) == 3
+    t().assertTrue('global' in table)
+    assert table.evictions == {'idle': 0, 'ttl': 0, 'lru': 1}
+
+    # test a bucket refilled to the quota limit is evicted first.
+    table.decrement('user-3')
+    clock.sleep(DEFAULT_TIME_WINDOW)
+    table.configure('user-4', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    assert len(table) == 3
+    assert table.evictions['idle'] == 1
+    t().assertTrue('global' in table)
+    t().assertTrue('user-4' in table)
+
+
+def test_evict_by_idle_ttl():
+    # set up a table with an idle TTL.
+    clock = FakeClock(10)
+    table = RateLimitBucketTable(clock, idle_ttl=2, pinned=('global',))
+    for key in ('global', 'user-1', 'user-2', 'user-3'):
+        table.configure(key, DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+
+    # test the idle buckets are evicted by the requests of the active key.
+    clock.sleep(2)
+    for _ in range(4):
+        table.decrement('user-3')
+    assert sorted(table.keys()) == ['global', 'user-3']
+    assert table.evictions == {'idle': 0, 'ttl': 2, 'lru': 0}
+
+
+def test_active_key_of_long_window_survives_idle_ttl():
+    # set up a table w/ an idle TTL shorter than the window of its keys.
+    clock = ManualClock(1000 * NS_PER_SEC)
+    table = RateLimitBucketTable(clock, idle_ttl=30)
+    table.configure('user-1', 100, 60)
+    table.configure('user-2', 100, 60)
+
+    # test the key of a request per second is kept after the TTL, and the
+    # idle key is evicted.
+    for _ in range(90):
+        clock.sleep(1)
+        table.decrement('user-1')
+    assert list(table.keys()) == ['user-1']
+    assert table.evictions == {'idle': 0, 'ttl': 1, 'lru': 0}
+    assert table.quota_remaining('user-1') == 70
+
+
+def test_multiple_time_windows():
+    # set up a table w/ a key of 3 rps + 4 per 2 sec, and a fixed time.
+    table = RateLimitBucketTable()
+    table.configure('user-1', 3, 1, extra_limits=[(4, 2)])
+    now = table._last_update[table._slot('user-1')]
+
+    # test the request is allowed only if all the windows have quota.
+    for remaining in (2, 1, 0):
+        decision = table.acquire('user-1', now=now)
+        t().assertTrue(decision.allowed)
+        assert decision.remaining == remaining
+    t().assertFalse(table.acquire('user-1', now=now).allowed)
+
+    # test the most restrictive window is reported, and a denied request
+    # doesn't consume the quota of the other windows.
+    decision = table.acquire('user-1', now=now + NS_PER_SEC)
+    t().assertTrue(decision.allowed)
+    assert (decision.limit, decision.remaining) == (4, 0)
+    assert decision.window == 2 * NS_PER_SEC
+    decision = table.acquire('user-1', now=now + NS_PER_SEC)
+    t().assertFalse(decision.allowed)
+    assert table.quota_remaining('user-1') == 0
+    t().assertTrue(table.acquire('user-1', now=now + 2 * NS_PER_SEC).allowed)
+
+
+def test_scan_with_inserts_and_removals():
+    # set up a table of keys, and scan a half of the slots.
+    table = RateLimitBucketTable()
+    for user_id in range(1000):
+        table.configure(user_id, DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    cursor, keys = table.scan(0, 500)
+    assert (cursor, keys) == (500, list(range(500)))
+
+    # test the kept keys are scanned once while the keys are removed and
+    # added in the free slots (before or after the cursor) or new slots.
+    for user_id in range(0, 1000, 2):
+        table.remove(user_id)
+    for user_id in range(1000, 1600):
+        table.configure(user_id, DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    while cursor:
+        cursor, more = table.scan(cursor, 64)
+        keys += more
+    assert len(keys) == len(set(keys))
+    assert set(range(1, 1000, 2)) <= set(keys)
+    assert set(range(1500, 1600)) <= set(keys)
+
+
+def test_scan_bucket_map_with_inserts_and_removals():
+    # set up a map of the bucket objects, and scan a half of the keys.
+    buckets = RateLimitBucketMap(RateLimitSlidingWindowCounter)
+    for user_id in range(1000):
+        buckets.configure(user_id, DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    cursor, keys = buckets.scan(0, 500)
+    assert keys == list(range(500))
+
+    # test the kept keys are scanned once in the insertion order while the
+    # keys are removed (and the order is compacted) and added.
+    for user_id in range(0, 1000, 2):
+        buckets.remove(user_id)
+    buckets.remove(1)
+    for user_id in range(1000, 1600):
+        buckets.configure(user_id, DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    while cursor:
+        cursor, more = buckets.scan(cursor, 64)
+        keys += more
+    assert keys == list(range(500)) + list(range(501, 1000, 2)) + list(
+        range(1000, 1600))
+    assert len(buckets._order._lists[0]) < 1100
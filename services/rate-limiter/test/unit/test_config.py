@@ -0,0 +1,100 @@
+"""Unit Test for Business Logic of Rate Limit Config API"""
+
+import io
+import json
+
+import pytest
+from flask_restx import Namespace
+from werkzeug.exceptions import BadRequest
+
+from core.apis.config import RateLimitConfig
+from core.apis.policies import RateLimitPolicy
+from core.common.constants import Duration as Dur, RateLimitPer as Per
+from core.controller.journal import RateLimitJournal
+from core.controller.rate_limiter import RateLimiter
+
+
+def restart(directory):
+    limiter = RateLimiter(lock_stripes=4)
+    policies = RateLimitPolicy(limiter=limiter)
+    journal = RateLimitJournal(str(directory), interval=3600)
+    replayed = journal.open(limiter, policies)
+    policies.journal = journal
+    return (journal, limiter, policies,
+            RateLimitConfig(limiter, Namespace('config'), journal), replayed)
+
+
+def test_put_invalid_quota_limit(tmp_path):
+    # set up the config API w/ a journal.
+    journal, limiter, _, config, _ = restart(tmp_path)
+
+    # test a missing, non-integer or negative quota limit is rejected by 400
+    # before the bucket is configured.
+    for data in ({}, {'quota_limit': 'abc'}, {'quota_limit': True},
+                 {'quota_limit': -1}, {'limits': [
+                     {'quota_limit': 3}, {'limit_per': Per.MIN}]}):
+        with pytest.raises(BadRequest):
+            config.put(data, 'user-1')
+    assert not limiter.is_configured('user-1')
+
+    # test a config of a policy needs no quota limit, and its limits aren't
+    # journaled.
+    res, code = config.put({'policy': 'user-level-rate-limit'}, 'user-1')
+    assert (res['quota_limit'], code) == (5, 201)
+    journal.close()
+    with open(tmp_path / 'journal.1') as f:
+        assert [json.loads(line) for line in f] == [
+            ['C', 'user-1', 'user-level-rate-limit', []]]
+
+
+def test_bulk_config(tmp_path):
+    # set up a stream of NDJSON and a JSON array of the users in chunks.
+    journal, limiter, policies, config, _ = restart(tmp_path)
+    policies.post({'name': 'gold', 'rate': Per.SEC, 'req_cnt': 10})
+    ndjson = b'["user-1","gold"]\n["user-2",5]\n{"user_id":"user-3",' \
+             b'"quota_limit":2,"limit_per":"rpm"}\n["user-4","silver"]\n' \
+             b'["user-5",{"limit_per":"rpy"}]\n\n7\n'
+    array = b' [' + b','.join(b'["bulk-%d",%d]' % (i, i % 5 + 1)
+                              for i in range(25000)) + b'] '
+
+    # test the users are configured, and the failed items are reported.
+    res, code = config.bulk(io.BytesIO(ndjson), ndjson=True)
+    assert code == 200
+    assert res == {'created': 3, 'updated': 0,
+                   'failed': [[3, 'user-4'], [4, 'user-5'], [5, None]]}
+    assert limiter.limits('user-3') == [(2, Dur.MIN)]
+    res, _ = config.bulk(io.BytesIO(array))
+    assert res == {'created': 25000, 'updated': 0, 'failed': []}
+    assert limiter.quota_limit('bulk-24999') == 5
+
+    # test the configured users are journaled by a commit per chunk.
+    assert journal.appended == 25004
+    journal.close()
+    journal, limiter, _, config, replayed = restart(tmp_path)
+    assert replayed == 25004
+    assert limiter.tier('user-1').name == 'gold'
+    assert limiter.quota_limit('bulk-3') == 4
+
+    # test the items w/o a valid user ID or quota limit are reported as
+    # failed.
+    body = b'[[null,"gold"],[true,3],[["user-6"],3],{"quota_limit":3},' \
+           b'[7,"gold"],{"user_id":"user-7","limit_per":"rpm"}]'
+    res, code = config.bulk(io.BytesIO(body))
+    assert code == 200
+    assert res == {'created': 1, 'updated': 0, 'failed': [
+        [0, None], [1, True], [2, ['user-6']], [3, None], [5, 'user-7']]}
+    assert not limiter.is_configured('None')
+    assert limiter.tier('7').name == 'gold'
+
+    # test the items before an error of the body are configured, and the
+    # index of the error is reported w/ the results of them.
+    for body, index, failed in (
+            (b'[["new-1",3],["new-2",true] ["new-3",3]]', 2, [[1, 'new-2']]),
+            (b'[["new-4",3],,["new-5",3]]', 1, [])):
+        res, code = config.bulk(io.BytesIO(body))
+        assert code == 400
+        assert (res['created'], res['failed']) == (1, failed)
+        assert res['error']['index'] == index
+    assert limiter.quota_limit('new-4') == 3
+    assert not limiter.is_configured('new-3')
+    journal.close()
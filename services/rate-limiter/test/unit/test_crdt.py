@@ -0,0 +1,93 @@
+"""Unit Test for Replicated G-Counters (CRDT) of Rate Limiter Nodes"""
+
+import time
+
+from core.common.constants import NS_PER_SEC
+from core.controller.crdt import RateLimitCRDTStorage
+from core.controller.rate_limiter import RateLimiter
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'not synced in time'
+        time.sleep(0.005)
+
+
+def test_merged_view_of_peers():
+    # set up two nodes of a user limit of 10 rps which sync every 10 ms.
+    nodes = [RateLimitCRDTStorage(node_id, interval=0.01)
+             for node_id in ('node-a', 'node-b')]
+    addresses = [node.start('127.0.0.1', 0) for node in nodes]
+    nodes[0].peers, nodes[1].peers = [addresses[1]], [addresses[0]]
+    a, b = (RateLimiter(storage=node) for node in nodes)
+    for limiter in (a, b):
+        limiter.configure_limit('user-1', rps=10)
+    now = a.time_ns() // NS_PER_SEC * NS_PER_SEC
+
+    # test a node decides on the consumption of the peer once it is synced.
+    assert sum(a.process_request('user-1', now) for _ in range(6)) == 6
+    wait_until(lambda: b.quota_remaining('user-1') == 4)
+    assert [b.process_request('user-1', now + 1) for _ in range(5)] == [
+        True, True, True, True, False]
+    wait_until(lambda: a.quota_remaining('user-1') == 0)
+    decision = a.try_acquire('user-1', 1, now + 2)
+    assert (decision.allowed, decision.remaining) == (False, 0)
+    assert decision.reset_at == now + NS_PER_SEC
+
+    # test the quota is refilled in the next window epoch of both nodes.
+    assert a.try_acquire('user-1', 3, now + NS_PER_SEC).remaining == 7
+    wait_until(lambda: b.quota_remaining('user-1') == 7)
+    for node in nodes:
+        node.close()
+
+
+def test_integer_and_global_keys_are_synced():
+    # set up two nodes of an integer key and the global key.
+    nodes = [RateLimitCRDTStorage(node_id, interval=0.01)
+             for node_id in ('node-a', 'node-b')]
+    addresses = [node.start('127.0.0.1', 0) for node in nodes]
+    nodes[0].peers, nodes[1].peers = [addresses[1]], [addresses[0]]
+    a, b = (RateLimiter(storage=node) for node in nodes)
+    for limiter in (a, b):
+        limiter.configure_limit(7, rps=10)
+        limiter.configure_global_limit(rps=10)
+    now = a.time_ns() // NS_PER_SEC * NS_PER_SEC
+
+    # test the consumption of both keys is merged by the peer, of which the
+    # integer key isn't a string.
+    for _ in range(5):
+        a.process_request(7, now)
+        a.process_request(None, now)
+    wait_until(lambda: b.quota_remaining(7) == 5)
+    wait_until(lambda: b.quota_remaining() == 5)
+    assert 7 in nodes[1]._counts and '7' not in nodes[1]._counts
+    for node in nodes:
+        node.close()
+
+
+def test_merge_is_idempotent():
+    # set up a node and a datagram of the deltas of a peer.
+    node = RateLimitCRDTStorage('node-a')
+    peer = RateLimitCRDTStorage('node-b')
+    node.put('user-1', 10, NS_PER_SEC, 0)
+    peer.put('user-1', 10, NS_PER_SEC, 0)
+    peer.acquire('user-1', 4, 5 * NS_PER_SEC)
+    datagram, = peer._datagrams([('user-1', 5, 4)])
+
+    # test a repeated or stale delta doesn't count the consumption twice.
+    for _ in range(3):
+        node.merge(datagram)
+    assert node.get('user-1')[2] == 6
+    assert node.acquire('user-1', 6, 5 * NS_PER_SEC).allowed
+    assert not node.acquire('user-1', 1, 5 * NS_PER_SEC).allowed
+    stale, = peer._datagrams([('user-1', 5, 2)])
+    node.merge(stale)
+    assert node.get('user-1')[2] == 0
+
+    # test the delta of a newer epoch drops the counters of the older one.
+    newer, = peer._datagrams([('user-1', 6, 1)])
+    node.merge(newer)
+    assert node.get('user-1') == (10, NS_PER_SEC, 9, 6 * NS_PER_SEC)
+    node.merge(datagram)
+    assert node.get('user-1')[2] == 9
@@ -0,0 +1,100 @@
+"""Unit Test for Each Function of Rate Limiter GCRA"""
+
+import pytest
+from unittest import TestCase as t
+
+from core.common.constants import DEFAULT_TIME_WINDOW, DEFAULT_RPS, NS_PER_SEC
+from core.common.constants import RateLimitAlgorithm as Algo
+from core.common.utils import FakeClock
+from core.controller.gcra import RateLimitGCRA, RateLimitGCRATable
+from core.controller.rate_limiter import RateLimiter
+
+
+def test_gcra_burst_and_spacing():
+    # set up a GCRA object w/ 5 requests per second.
+    clock = FakeClock(10)
+    gcra = RateLimitGCRA(5, DEFAULT_TIME_WINDOW, clock)
+
+    # test a burst of the quota limit is allowed at once.
+    for remaining in (4, 3, 2, 1, 0):
+        t().assertTrue(gcra.decrement())
+        assert gcra.quota_remaining() == remaining
+    t().assertFalse(gcra.decrement())
+
+    # test one request is allowed every emission interval (0.2 sec).
+    clock.sleep(0.1)
+    t().assertFalse(gcra.decrement())
+    clock.sleep(0.1)
+    t().assertTrue(gcra.decrement())
+    t().assertFalse(gcra.decrement())
+
+    # test the quota is refilled to the limit after a time window.
+    clock.sleep(DEFAULT_TIME_WINDOW)
+    assert gcra.cur_remaining() == 5
+    t().assertFalse(gcra.decrement(cost=6))
+    t().assertTrue(gcra.decrement(cost=5))
+
+
+def test_gcra_table_same_as_object():
+    # set up a table and a GCRA object with the same clock.
+    clock = FakeClock(10)
+    table = RateLimitGCRATable(clock)
+    table.configure('user-1', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    gcra = RateLimitGCRA(DEFAULT_RPS, DEFAULT_TIME_WINDOW, clock)
+
+    # test the table returns the same result of the GCRA object.
+    for sleep_sec in (0, 0, 0.2, 0, 0, 0, 0.3, 0, 1.5, 0, 0, 0, 0, 0, 0):
+        clock.sleep(sleep_sec)
+        decision = table.acquire('user-1')
+        assert decision.allowed == gcra.decrement()
+        assert decision.remaining == gcra.quota_remaining()
+        assert table.cur_remaining('user-1') == gcra.cur_remaining()
+    assert table.time_allowance('user-1') == 0
+
+    # test a batch of the requests is the same as the GCRA object.
+    now = clock.time_ns()
+    res = table.acquire_many(['user-1'] * 8, [now + i * NS_PER_SEC // 10
+                                              for i in range(8)])
+    for i in range(8):
+        assert res[i] == gcra.decrement(now=now + i * NS_PER_SEC // 10)
+    with pytest.raises(KeyError):
+        table.acquire_many(['user-1', 'user-2'], [now, now])
+
+
+def test_gcra_zero_limit():
+    # set up a GCRA object which denies every request.
+    gcra = RateLimitGCRA(0, DEFAULT_TIME_WINDOW, FakeClock(10))
+
+    # test requests are denied but the status (cost 0) is allowed.
+    t().assertFalse(gcra.decrement())
+    t().assertTrue(gcra.decrement(cost=0))
+    assert gcra.quota_remaining() == 0
+
+
+def test_rate_limiter_with_gcra():
+    # set up rate limiters w/ GCRA in a table and in objects per key.
+    for compact in (True, False):
+        limiter = RateLimiter(FakeClock(10), Algo.GCRA, compact=compact)
+        limiter.configure_limit('user-1', 2)
+
+        # test the quota of the user is decided by GCRA.
+        t().assertTrue(limiter.process_request('user-1'))
+        t().assertTrue(limiter.process_request('user-1'))
+        t().assertFalse(limiter.process_request('user-1'))
+        assert limiter.quota_remaining('user-1') == 0
+
+
+def test_gcra_table_with_multiple_windows():
+    # set up a GCRA table w/ a key of 2 rps + 3 per 10 sec, and a fixed time.
+    table = RateLimitGCRATable()
+    table.configure('user-1', 2, 1, extra_limits=[(3, 10)])
+    now = table._last_update[table._slot('user-1')]
+
+    # test the request is allowed only if all the windows have quota.
+    t().assertTrue(table.acquire('user-1', now=now).allowed)
+    t().assertTrue(table.acquire('user-1', now=now).allowed)
+    t().assertFalse(table.acquire('user-1', now=now).allowed)
+    decision = table.acquire('user-1', now=now + NS_PER_SEC)
+    t().assertTrue(decision.allowed)
+    assert (decision.limit, decision.remaining) == (3, 0)
+    t().assertFalse(table.acquire('user-1', now=now + 2 * NS_PER_SEC).allowed)
@@ -0,0 +1,70 @@
+"""Unit Test for Top-K Heavy Hitters of Rate Limit Decisions"""
+
+import random
+
+from core.apis.status import RateLimitStatus
+from core.common.constants import NS_PER_SEC
+from core.common.utils import ManualClock
+from core.controller.heavy_hitters import RateLimitHeavyHitters
+from core.controller.rate_limiter import RateLimiter
+
+
+def test_space_saving_bounds():
+    # set up a skewed stream of many keys and fewer counters.
+    rand = random.Random(7)
+    hitters = RateLimitHeavyHitters(capacity=50, window=60)
+    counts = {}
+    keys = [f'hot-{i}' for i in range(5)] * 200 + \
+        [f'cold-{rand.randrange(10000)}' for _ in range(4000)]
+    rand.shuffle(keys)
+    for key in keys:
+        counts[key] = counts.get(key, 0) + 1
+        hitters.record(key, not key.startswith('hot-0'), NS_PER_SEC)
+
+    # test the memory is bound, and the hot keys are the top talkers w/ the
+    # requests and the deny ratios within the error.
+    assert len(hitters._counters) == 50
+    window, = hitters.windows(top=5)
+    assert (window.requests, window.denied) == (5000, 200)
+    assert {talker.key for talker in window.talkers} == \
+        {f'hot-{i}' for i in range(5)}
+    for talker in window.talkers:
+        assert talker.requests - talker.error <= counts[talker.key]
+        assert counts[talker.key] <= talker.requests
+        assert talker.deny_ratio == (1.0 if talker.key == 'hot-0' else 0.0)
+
+
+def test_top_talkers_per_window():
+    # set up a rate-limiter of which the decisions are counted per minute.
+    clock = ManualClock(1000 * NS_PER_SEC)
+    limiter = RateLimiter(clock, heavy_hitter_window=60)
+    limiter.configure_limit('user-1', 2, window=60)
+    limiter.configure_limit('user-2', 10, window=60)
+    for _ in range(4):
+        limiter.process_request('user-1')
+    limiter.try_acquire('user-2')
+    limiter.try_acquire('user-2', cost=0)
+
+    # test the windows of the top talkers, of which the last one is first.
+    clock.now += 61 * NS_PER_SEC
+    limiter.try_acquire('user-2')
+    windows = limiter.top_talkers()
+    assert [(window.requests, window.denied) for window in windows] == \
+        [(1, 0), (5, 2)]
+    assert windows[1].deny_ratio == 0.4
+    assert windows[1].talkers[0] == ('user-1', 4, 0, 2)
+    assert windows[1].talkers[0].deny_ratio == 0.5
+    assert [talker.key for talker in windows[1].talkers] == \
+        ['user-1', 'user-2']
+
+    # test the status API of the top talkers, and the tracker turned off.
+    res, code = RateLimitStatus(limiter).top_talkers(top=1)
+    assert code == 200
+    assert res[1]['top_talkers'] == [{
+        'bucket_name': 'user-1', 'requests': 4, 'error': 0, 'denied': 2,
+        'deny_ratio': 0.5}]
+    limiter = RateLimiter(clock, heavy_hitters=0)
+    limiter.configure_limit('user-1', 2)
+    limiter.process_request('user-1')
+    assert limiter.top_talkers() == []
+    assert RateLimitStatus(limiter).top_talkers()[1] == 404
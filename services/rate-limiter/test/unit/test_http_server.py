@@ -0,0 +1,95 @@
+"""Unit Test for Asyncio HTTP Server of the Data Plane"""
+
+import json
+import socket
+
+from core.common.utils import FakeClock
+from core.controller.rate_limiter import RateLimiter
+from core.dataplane.http_server import start_in_thread, stop_in_thread
+
+
+def read_responses(sock, num_responses):
+    """Return a list of (status, headers, body) of the responses."""
+    data, res = b'', []
+    while len(res) < num_responses:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+        while True:
+            end = data.find(b'\r\n\r\n')
+            if end < 0:
+                break
+            head = data[:end].decode()
+            length = int(head.lower().split('content-length: ')[1].split()[0])
+            if len(data) < end + 4 + length:
+                break
+            res.append((int(head.split()[1]), head,
+                        json.loads(data[end + 4:end + 4 + length])))
+            data = data[end + 4 + length:]
+    return res
+
+
+def test_pipelined_decrements():
+    # set up the server of a rate-limiter w/ the global and a user limit.
+    limiter = RateLimiter(FakeClock(10), lock_stripes=4)
+    limiter.configure_global_limit(rps=10)
+    limiter.configure_limit('user 1', rps=2)
+    limiter.configure_limit('user-\u00e9', rps=2)
+    server = start_in_thread(limiter, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    # test the pipelined requests in one write are answered in order over a
+    # kept-alive connection w/ the same body of the Flask app.
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.sendall(b''.join(
+            b'GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n' % path for path in (
+                b'/ratelimit-decrement/users/user%201',
+                b'/ratelimit-decrement/users/user%201',
+                b'/ratelimit-decrement/users/user%201?x=1',
+                b'/ratelimit-decrement/global',
+                b'/ratelimit-decrement/users/user-2',
+                b'/ratelimit-status')))
+        res = read_responses(sock, 6)
+        assert [status for status, _, _ in res] == [200, 200, 429, 200,
+                                                    404, 404]
+        assert res[1][2] == {
+            'quota_limit': 2, 'limit_per': 'rps', 'policy': None,
+            'limits': None, 'bucket_name': 'user 1', 'quota_remaining': 0}
+        assert res[3][2]['quota_remaining'] == 9
+        assert res[4][2] == {'message': 'user-2 not found'}
+
+        # test the connection is closed if it is requested.
+        sock.sendall(b'POST /ratelimit-decrement/global HTTP/1.1\r\n'
+                     b'Content-Length: 2\r\nConnection: close\r\n\r\n{}')
+        status, head, _ = read_responses(sock, 1)[0]
+        assert status == 405
+        assert 'Connection: close' in head
+        assert sock.recv(1) == b''
+
+    # test the user id of raw or percent-encoded UTF-8 is decoded, and an
+    # invalid one is answered by 400 over the kept-alive connection.
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.sendall(b''.join(
+            b'GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n' % path for path in (
+                '/ratelimit-decrement/users/user-\u00e9'.encode(),
+                b'/ratelimit-decrement/users/user-%C3%A9',
+                b'/ratelimit-decrement/users/user-%ff',
+                b'/ratelimit-decrement/users/user-\xff',
+                b'/ratelimit-decrement/users/user-%C3%A9')))
+        res = read_responses(sock, 5)
+        assert [status for status, _, _ in res] == [200, 200, 400, 400,
+                                                    429]
+        assert res[1][2]['bucket_name'] == 'user-\u00e9'
+        assert res[2][2] == {'message': 'user id is not utf-8'}
+
+    # test a body longer than the limit is answered by 413 w/o buffering it,
+    # and the connection is closed.
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.sendall(b'GET /ratelimit-decrement/global HTTP/1.1\r\n'
+                     b'Content-Length: 1000000000\r\n\r\n')
+        status, head, body = read_responses(sock, 1)[0]
+        assert (status, body) == (413, {'message': 'request body too large'})
+        assert 'Connection: close' in head
+        assert sock.recv(1) == b''
+    stop_in_thread(server)
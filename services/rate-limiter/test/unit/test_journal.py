@@ -0,0 +1,163 @@
+"""Unit Test for Journal of Rate Limit Config and Policies"""
+
+import os
+from threading import Thread
+
+import pytest
+
+from core.apis.config import RateLimitConfig
+from core.apis.policies import RateLimitPolicy
+from core.common.constants import Duration as Dur, RateLimitPer as Per
+from core.common.exceptions import RateLimitJournalError
+from core.controller import journal as journal_module
+from core.controller.journal import RateLimitJournal
+from core.controller.rate_limiter import RateLimiter
+
+
+def restart(directory):
+    limiter = RateLimiter(lock_stripes=4)
+    policies = RateLimitPolicy(limiter=limiter)
+    journal = RateLimitJournal(str(directory), interval=3600)
+    replayed = journal.open(limiter, policies)
+    policies.journal = journal
+    return (journal, limiter, policies,
+            RateLimitConfig(limiter, journal=journal), replayed)
+
+
+def test_replay_config_and_policies(tmp_path):
+    # set up the changes of the policies and the config w/ a journal, of
+    # which the last line is torn.
+    journal, limiter, policies, config, replayed = restart(tmp_path)
+    assert replayed == 0
+    policies.post({'name': 'gold', 'rate': Per.SEC, 'req_cnt': 10})
+    policies.put(3, {'name': 'gold', 'rate': Per.SEC, 'req_cnt': 20})
+    policies.post({'name': 'old', 'rate': Per.MIN, 'req_cnt': 1})
+    policies.delete(4)
+    config._upsert('user-1', {'policy': 'gold'})
+    config._upsert(2, {'limits': [{'quota_limit': 3, 'limit_per': Per.SEC},
+                                  {'quota_limit': 9, 'limit_per': Per.MIN}]})
+    config._upsert('user-3', {'quota_limit': 1})
+    config._upsert('global', {'quota_limit': 50})
+    config.delete('user-3')
+    journal.close()
+    assert journal.commits == journal.appended == 9
+    with open(tmp_path / 'journal.1', 'ab') as f:
+        f.write(b'["D","user-1"')
+
+    # test the restarted rate-limiter has the same config and policies.
+    journal, limiter, policies, config, replayed = restart(tmp_path)
+    assert replayed == 9
+    assert journal.generation == 2
+    assert sorted(policies.rows) == [1, 2, 3]
+    assert policies.rows[3]['req_cnt'] == 20
+    assert limiter.tier('user-1').name == 'gold'
+    assert limiter.quota_limit('user-1') == 20
+    assert limiter.limits(2) == [(3, Dur.SEC), (9, Dur.MIN)]
+    assert not limiter.is_configured('user-3')
+    assert limiter.quota_limit() == 50
+    journal.close()
+
+
+def test_group_commit_and_compaction(tmp_path):
+    # set up the users configured by threads at once.
+    journal, limiter, policies, config, _ = restart(tmp_path)
+    policies.post({'name': 'gold', 'rate': Per.SEC, 'req_cnt': 10})
+
+    def configure(thread):
+        for i in range(50):
+            config._upsert(f'user-{thread}-{i}', {'policy': 'gold'})
+
+    threads = [Thread(target=configure, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # test the records of the threads share the fsyncs.
+    assert journal.appended == 401
+    assert journal.commits < journal.appended
+
+    # test the compaction folds the journal into a snapshot, and the new
+    # journal begins w/ the policies.
+    for _ in range(3):
+        limiter.process_request('user-0-0')
+    assert journal.compact() == 2
+    config.delete('user-1-0')
+    journal.close()
+    assert sorted(os.listdir(tmp_path)) == ['journal.2', 'snapshot.2']
+
+    journal, limiter, policies, config, replayed = restart(tmp_path)
+    assert replayed == 4
+    assert policies.rows[3]['name'] == 'gold'
+    assert len(limiter.buckets) == 399
+    assert limiter.tier('user-7-49').name == 'gold'
+    assert limiter.quota_remaining('user-0-0') == 7
+    journal.close()
+
+
+def test_replay_and_compact_deleted_policies(tmp_path):
+    # set up a deleted default policy.
+    journal, limiter, policies, _, _ = restart(tmp_path)
+    policies.delete(2)
+    journal.close()
+
+    # test the replayed removal frees the name and the tier of the policy.
+    journal, limiter, policies, _, replayed = restart(tmp_path)
+    assert replayed == 1
+    assert sorted(policies.rows) == [1]
+    assert limiter.buckets.tiers.id_of('user-level-rate-limit') is None
+    res, code = policies.post({'name': 'user-level-rate-limit',
+                               'rate': Per.SEC, 'req_cnt': 5})
+    assert code == 201
+    policies.delete(res['id'])
+
+    # test the deleted default policy isn't seeded again after compaction.
+    journal.compact()
+    journal.close()
+    journal, limiter, policies, _, _ = restart(tmp_path)
+    assert sorted(policies.rows) == [1]
+    assert 'user-level-rate-limit' not in policies.names
+    journal.close()
+
+
+def test_failed_writes_and_compaction(tmp_path, monkeypatch):
+    # set up a journal of which the fsync and the snapshot fail.
+    journal, limiter, policies, config, _ = restart(tmp_path)
+    journal.retry_interval = 0.01
+    fsync = os.fsync
+
+    def fail(*args):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(journal_module.os, 'fsync', fail)
+
+    # test the callers are raised instead of waiting, and the records are
+    # written once by the flusher when the disk is recovered.
+    with pytest.raises(RateLimitJournalError) as e:
+        config._upsert('user-1', {'quota_limit': 3})
+    assert e.value.status_code == 503
+    with pytest.raises(RateLimitJournalError):
+        config._upsert('user-2', {'quota_limit': 4})
+    assert journal.commits == 0
+    monkeypatch.setattr(journal_module.os, 'fsync', fsync)
+    config._upsert('user-3', {'quota_limit': 5})
+
+    # test a failed compaction is raised w/o a hang, and the next one
+    # compacts the journals.
+    monkeypatch.setattr(journal_module, 'save_snapshot', fail)
+    with pytest.raises(OSError):
+        journal.compact()
+    monkeypatch.undo()
+    monkeypatch.setattr('builtins.open', fail)
+    with pytest.raises(OSError):
+        journal.compact()
+    monkeypatch.undo()
+    assert journal.compact() == 4
+    config._upsert('user-4', {'quota_limit': 6})
+    journal.close()
+
+    journal, limiter, _, _, replayed = restart(tmp_path)
+    assert replayed == 3
+    assert [limiter.quota_limit(f'user-{i}') for i in range(1, 5)] == [
+        3, 4, 5, 6]
+    journal.close()
@@ -0,0 +1,84 @@
+"""Unit Test for Token Leases of Rate Limiter"""
+
+import threading
+import unittest
+
+from werkzeug.serving import make_server
+
+from core.common.constants import NS_PER_SEC, Duration as Dur
+from core.common.exceptions import RateLimitLeaseNotFound
+from core.controller.rate_limiter import RateLimiter
+from core.dataplane.lease_client import RateLimitLeaseClient
+
+t = unittest.TestCase
+
+
+def test_lease_is_charged_to_bucket():
+    # set up a user limit of 10 rps.
+    limiter = RateLimiter(lock_stripes=4)
+    limiter.configure_limit('user-1', rps=10)
+    now = limiter.time_ns()
+
+    # test the tokens are charged to the bucket, and the remaining tokens are
+    # granted if the bucket doesn't have enough.
+    first = limiter.lease('user-1', 6, now=now)
+    assert (first.tokens, first.remaining) == (6, 4)
+    assert not limiter.try_acquire('user-1', 5, now).allowed
+    second = limiter.lease('user-1', 6, now=now)
+    assert (second.tokens, second.remaining) == (4, 0)
+    assert limiter.leases.leased('user-1') == 10
+
+    # test no token is granted until the end of the time window.
+    denied = limiter.lease('user-1', 1, now=now)
+    assert denied.lease_id is None and denied.tokens == 0
+    assert denied.expires_at == first.expires_at <= now + NS_PER_SEC
+    assert limiter.lease('user-2', 1, now=now) is None
+
+
+def test_release_and_expiry():
+    # set up a user limit of 10 rps w/ a lease of all the tokens.
+    limiter = RateLimiter()
+    limiter.configure_limit('user-1', rps=10)
+    now = limiter.time_ns()
+    lease = limiter.lease('user-1', 10, ttl=0.5, now=now)
+    assert lease.expires_at == now + NS_PER_SEC // 2
+
+    # test the unused tokens are leased again w/o the bucket until the lease
+    # expires, and the lease can't be released twice.
+    assert limiter.release_lease(lease.lease_id, 3, now + 1) == 3
+    with t().assertRaises(RateLimitLeaseNotFound):
+        limiter.release_lease(lease.lease_id, 3, now + 1)
+    again = limiter.lease('user-1', 5, now=now + 2)
+    assert again.tokens == 3
+    assert again.expires_at == lease.expires_at
+    assert limiter.leases.leased('user-1') == 3
+
+    # test the leases are expired w/ the returned tokens.
+    with t().assertRaises(RateLimitLeaseNotFound):
+        limiter.release_lease(again.lease_id, 1, lease.expires_at)
+    assert limiter.leases.leased('user-1') == 0
+    assert len(limiter.leases) == 0
+
+
+def test_adaptive_lease_client():
+    # set up the app server of the lease API w/ a user limit of 1000 rpm.
+    from app.app import app, limiter
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    limiter.configure_limit('lease-user', rps=1000, window=Dur.MIN)
+    url = f'http://127.0.0.1:{server.server_port}'
+
+    # test the lease size grows w/ the observed rate, so the requests are
+    # decided w/ a few round trips.
+    with RateLimitLeaseClient('lease-user', url, interval=0.5,
+                              max_tokens=200) as client:
+        allowed = sum(client.try_acquire() for _ in range(500))
+        assert allowed == 500
+        assert client.next_size() == 200
+        assert client.round_trips < 50
+
+    # test the unused tokens are returned when the client is closed, so the
+    # quota except the allowed requests can be leased again.
+    assert limiter.lease('lease-user', 1000).tokens == 500
+    server.shutdown()
+    limiter.remove_bucket('lease-user')
@@ -0,0 +1,61 @@
+"""Unit Test for Streaming Loader of the Limits of Users"""
+
+import json
+
+from core.common.constants import Duration as Dur, NS_PER_SEC
+from core.common.utils import ManualClock
+from core.controller.loader import load_limits
+from core.controller.rate_limiter import RateLimiter
+
+
+def test_load_csv(tmp_path):
+    # set up a CSV file w/ a header, policies, quota limits and bad rows.
+    path = tmp_path / 'users.csv'
+    path.write_text('user_id,limit,limit_per\n'
+                    'user-1,gold\n'
+                    'user-2,10\n'
+                    'user-3,3,rpm\n'
+                    '\n'
+                    'user-4,silver\n'
+                    'user-5,3,rpy\n'
+                    'user-6\n'
+                    'user-1,5\n')
+    limiter = RateLimiter(lock_stripes=4)
+    limiter.configure_tier('gold', rps=20)
+    reports = []
+
+    # test the rows are loaded in chunks w/ the progress of each interval.
+    clock = ManualClock(1000 * NS_PER_SEC, step=NS_PER_SEC)
+    res = load_limits(limiter, str(path), chunk_size=2,
+                      progress=reports.append, clock=clock)
+    assert res.rows == 7
+    assert (res.created, res.updated, res.failed) == (3, 1, 3)
+    assert [report.rows for report in reports] == [2, 4, 6, 7, 7]
+    assert reports[-1].rows_per_sec == 7 / res.seconds
+    assert limiter.tier('user-2').quota_limit == 10
+    assert limiter.limits('user-3') == [(3, Dur.MIN)]
+    assert limiter.quota_limit('user-1') == 5
+    assert not limiter.is_configured('user-4')
+
+
+def test_load_jsonl(tmp_path):
+    # set up a JSONL file of many users.
+    path = tmp_path / 'users.jsonl'
+    with open(path, 'w') as f:
+        for i in range(25000):
+            f.write(json.dumps([f'user-{i}', 'gold'] if i % 2 else
+                               {'user_id': i, 'quota_limit': i % 7 + 1}))
+            f.write('\n')
+            if i == 12000:
+                f.write('["user-x", \n{bad}\n')
+        f.write('"bad"\n["user-y", 3]')
+    limiter = RateLimiter()
+    limiter.configure_tier('gold', rps=20)
+
+    # test the users are configured by chunks, and the bad rows (including
+    # the malformed lines) are counted.
+    res = load_limits(limiter, str(path), chunk_size=1000)
+    assert (res.rows, res.created, res.failed) == (25004, 25001, 3)
+    assert limiter.quota_limit('user-y') == 3
+    assert limiter.tier('user-1').name == 'gold'
+    assert limiter.quota_limit('24998') == 24998 % 7 + 1
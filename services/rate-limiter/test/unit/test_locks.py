@@ -0,0 +1,76 @@
+"""Unit Test for Rate Limiter Shared by Threads w/ Lock Striping"""
+
+import threading
+
+from core.common.constants import DEFAULT_RPS
+from core.common.utils import CoarseClock, FakeClock
+from core.controller.locks import RateLimitLocks
+from core.controller.rate_limiter import RateLimiter
+
+
+def run_threads(num_threads, target):
+    threads = [threading.Thread(target=target, args=(i,))
+               for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_stripes_of_keys():
+    # set up locks w/ a number of stripes which isn't a power of 2.
+    locks = RateLimitLocks(10)
+
+    # test the number of stripes is rounded up, and a key has its own stripe.
+    assert len(locks) == 16
+    assert locks.of('user-1') is locks.of('user-1')
+    with locks.all():
+        assert locks.of('user-2').acquire(blocking=False)
+        locks.of('user-2').release()
+
+
+def test_no_over_admission_by_threads():
+    # set up rate-limiter shared by threads w/ a clock which isn't ticked so
+    # that the quota isn't refilled during the test.
+    clock = CoarseClock(FakeClock(10))
+    limiter = RateLimiter(clock, lock_stripes=8)
+    quota_limit = 1000
+    for i in range(4):
+        limiter.configure_limit(f'user-{i}', rps=quota_limit)
+    allowed = [0] * 8
+
+    def request(thread_id):
+        for i in range(2000):
+            allowed[thread_id] += limiter.process_request(f'user-{i % 4}')
+
+    # test the total admission is exactly the quota limit of the users.
+    run_threads(8, request)
+    assert sum(allowed) == 4 * quota_limit
+    for i in range(4):
+        assert limiter.quota_remaining(f'user-{i}') == 0
+
+
+def test_configure_and_evict_while_requests():
+    # set up rate-limiter w/ the max number of buckets shared by threads.
+    limiter = RateLimiter(FakeClock(10), max_buckets=50, idle_ttl=1,
+                          lock_stripes=4)
+    limiter.configure_global_limit(rps=DEFAULT_RPS)
+    errors = []
+
+    def configure_and_request(thread_id):
+        try:
+            for i in range(500):
+                key = f'user-{thread_id}-{i}'
+                limiter.configure_limit(key, rps=DEFAULT_RPS)
+                limiter.try_acquire(key)
+                limiter.try_acquire(f'user-{thread_id}-{i // 2}')
+        except Exception as e:
+            errors.append(e)
+
+    # test the buckets are bounded w/o errors, and the global is pinned.
+    run_threads(4, configure_and_request)
+    assert errors == []
+    assert len(limiter.buckets) <= 50
+    assert limiter.is_configured()
+    assert sum(limiter.eviction_stats()[reason]
+               for reason in ('idle', 'ttl', 'lru')) >= 2000 - 50
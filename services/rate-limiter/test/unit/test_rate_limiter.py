@@ -3,11 +3,12 @@
 import pytest
 from unittest import TestCase as t
 
-from core.common.constants import RateLimitLevel as Level
+from core.common.constants import (
+    Duration as Dur, RateLimitAlgorithm as Algo, RateLimitLevel as Level)
 from core.common.exceptions import RateLimitConfigNotFound
 from core.controller.rate_limiter import RateLimiter
-from core.common.constants import DEFAULT_USER_ID, DEFAULT_RPS
-from core.common.utils import FakeClock
+from core.common.constants import DEFAULT_USER_ID, DEFAULT_RPS, NS_PER_SEC
+from core.common.utils import CoarseClock, FakeClock
 
 
 def test_configure_global_limit():
@@ -145,6 +146,37 @@ def test_is_exhausted():
         limiter.process_request(DEFAULT_USER_ID)
 
 
+def test_try_acquire():
+    # set up rate-limiter for testing try_acquire()
+    clock = FakeClock(10)
+    limiter = RateLimiter(clock)
+
+    # test try_acquire() returns None before configuring global/user limiter
+    assert limiter.try_acquire() is None
+    assert limiter.try_acquire(DEFAULT_USER_ID) is None
+
+    # test try_acquire() returns a decision after configuring user limiter
+    limiter.configure_limit(user_id=DEFAULT_USER_ID, rps=DEFAULT_RPS)
+    decision = limiter.try_acquire(DEFAULT_USER_ID, cost=2)
+    t().assertTrue(decision.allowed)
+    assert decision.limit == DEFAULT_RPS
+    assert decision.remaining == DEFAULT_RPS - 2
+    assert decision.reset_at > clock.time_ns()
+    assert limiter.quota_remaining(DEFAULT_USER_ID) == DEFAULT_RPS - 2
+
+    # test the cost of 0 returns the status without consuming quota
+    decision = limiter.try_acquire(DEFAULT_USER_ID, cost=0)
+    t().assertTrue(decision.allowed)
+    assert decision.remaining == DEFAULT_RPS - 2
+
+    # test the request is denied if the cost exceeds quota remaining
+    decision = limiter.try_acquire(DEFAULT_USER_ID, cost=DEFAULT_RPS)
+    t().assertFalse(decision.allowed)
+    assert decision.remaining == DEFAULT_RPS - 2
+    clock.sleep(1)
+    t().assertTrue(limiter.try_acquire(DEFAULT_USER_ID, DEFAULT_RPS).allowed)
+
+
 def _validate_global_process_request(limiter):
     """Validate global level rate-limiter process request"""
     quota_remaining = DEFAULT_RPS
@@ -166,3 +198,110 @@ def _validate_user_rate_limit_process_request(limiter):
     for i in range(DEFAULT_RPS):
         t().assertTrue(limiter.process_request(DEFAULT_USER_ID))
     t().assertFalse(limiter.process_request(DEFAULT_USER_ID))
+
+
+def test_process_request_with_coarse_clock():
+    # set up rate-limiter w/ a coarse clock which is read once per tick().
+    fake_clock = FakeClock(10)
+    clock = CoarseClock(fake_clock)
+    limiter = RateLimiter(clock)
+    limiter.configure_limit(user_id=DEFAULT_USER_ID, rps=DEFAULT_RPS)
+
+    # test the time isn't changed until the next tick.
+    for _ in range(DEFAULT_RPS):
+        t().assertTrue(limiter.process_request(DEFAULT_USER_ID))
+    fake_clock.sleep(1)
+    t().assertFalse(limiter.process_request(DEFAULT_USER_ID))
+    clock.tick()
+    t().assertTrue(limiter.process_request(DEFAULT_USER_ID))
+
+    # test the time given by the caller is used instead of the clock.
+    now = clock.time_ns() + NS_PER_SEC
+    decision = limiter.try_acquire(DEFAULT_USER_ID, now=now)
+    t().assertTrue(decision.allowed)
+    assert decision.remaining == DEFAULT_RPS - 1
+    assert decision.reset_at == now + NS_PER_SEC
+
+
+def test_configure_limit_with_sub_second_window():
+    # set up rate-limiter w/ 5 requests per 100 ms and a fixed time.
+    clock = CoarseClock(FakeClock(10))
+    limiter = RateLimiter(clock)
+    limiter.configure_limit(user_id=DEFAULT_USER_ID, rps=DEFAULT_RPS,
+                            window=Dur.MS100)
+    now = clock.time_ns()
+
+    # test the decision is exact at the boundary of the 100 ms window.
+    for _ in range(DEFAULT_RPS):
+        t().assertTrue(limiter.process_request(DEFAULT_USER_ID, now=now))
+    end = now + NS_PER_SEC // 10
+    t().assertFalse(limiter.process_request(DEFAULT_USER_ID, now=end - 1))
+    t().assertTrue(limiter.process_request(DEFAULT_USER_ID, now=end))
+    assert limiter.tier(DEFAULT_USER_ID).time_window == Dur.MS100
+
+
+def test_configure_limit_with_multiple_windows():
+    # set up rate-limiter w/ 2 rps + 3 rpm of a user.
+    clock = CoarseClock(FakeClock(10))
+    limiter = RateLimiter(clock)
+    limiter.configure_limit(user_id=DEFAULT_USER_ID,
+                            limits=[(2, Dur.SEC), (3, Dur.MIN)])
+    assert limiter.limits(DEFAULT_USER_ID) == [(2, Dur.SEC), (3, Dur.MIN)]
+    now = clock.time_ns()
+
+    # test the per-minute quota is exhausted over the per-second windows.
+    for sec, res in ((0, True), (0, True), (0, False), (1, True), (1, False),
+                     (2, False), (60, True)):
+        t().assertEqual(limiter.process_request(
+            DEFAULT_USER_ID, now=now + sec * NS_PER_SEC), res)
+    assert limiter.quota_remaining(DEFAULT_USER_ID) == 1
+
+
+def test_multiple_windows_of_single_window_buckets():
+    # set up rate-limiter of the buckets of a single window.
+    limiter = RateLimiter(algorithm=Algo.SLIDING_WINDOW_COUNTER,
+                          lock_stripes=4)
+    limits = [(2, Dur.SEC), (3, Dur.MIN)]
+
+    # test the multiple windows are rejected before the buckets are changed.
+    with pytest.raises(ValueError):
+        limiter.configure_limit(DEFAULT_USER_ID, limits=limits)
+    with pytest.raises(ValueError):
+        limiter.configure_tier('gold', limits=limits)
+    res = limiter.configure_limits([('user-2', limits), ('user-3', 2)])
+    assert res == (1, 0, [(0, 'user-2')])
+    t().assertFalse(limiter.is_configured(DEFAULT_USER_ID))
+    t().assertTrue(limiter.process_request('user-3'))
+
+
+@pytest.mark.parametrize('lock_stripes', [None, 4])
+def test_configure_limits(lock_stripes):
+    # set up rate-limiter w/ a tier and a partly consumed user.
+    limiter = RateLimiter(lock_stripes=lock_stripes)
+    limiter.configure_tier('gold', rps=10)
+    limiter.configure_limit(user_id=DEFAULT_USER_ID, rps=1)
+    limiter.process_request(DEFAULT_USER_ID)
+
+    # test the users are configured by tiers, rps and multiple windows, and
+    # the pairs of unknown tiers or invalid limits are reported.
+    res = limiter.configure_limits([
+        (DEFAULT_USER_ID, 'gold'), ('user-2', 5), ('user-3', 'silver'),
+        ('user-4', [(2, Dur.SEC), (3, Dur.MIN)]), (Level.GLOBAL, 50),
+        ('user-5', -1), ('user-6', {}), ('user-7', True),
+        ('user-8', [(True, Dur.SEC)])])
+    assert res == (3, 1, [(2, 'user-3'), (5, 'user-5'), (6, 'user-6'),
+                          (7, 'user-7'), (8, 'user-8')])
+    assert limiter.tier(DEFAULT_USER_ID).name == 'gold'
+    assert limiter.quota_remaining(DEFAULT_USER_ID) == 10
+    assert limiter.quota_limit('user-2') == 5
+    assert limiter.limits('user-4') == [(2, Dur.SEC), (3, Dur.MIN)]
+    assert limiter.quota_limit() == 50
+    t().assertFalse(limiter.is_configured('user-3'))
+
+    # test a mapping of many users grows the storage at once.
+    res = limiter.configure_limits({f'bulk-{i}': 'gold'
+                                    for i in range(10000)})
+    assert res == (10000, 0, [])
+    assert len(limiter.buckets) == 10004
+    t().assertTrue(all(limiter.process_request(f'bulk-{i}')
+                       for i in range(10000)))
@@ -0,0 +1,131 @@
+"""Unit Test for Hot-Standby Replica of Rate Limiter"""
+
+import multiprocessing
+import socket
+import time
+from unittest import TestCase as t
+
+import pytest
+
+from core.apis.policies import RateLimitPolicy
+from core.common.constants import Duration as Dur, RateLimitPer as Per
+from core.common.exceptions import RateLimitConfigNotFound
+from core.controller.rate_limiter import RateLimiter
+from core.controller.replica import (
+    RateLimitPrimary, RateLimitRecordedBuckets, RateLimitStandby)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'not replicated in time'
+        time.sleep(0.005)
+
+
+def run_primary(port, ready, proceed):
+    # the primary w/ a named tier and 2 users which are partly consumed.
+    limiter = RateLimiter(lock_stripes=4)
+    primary = RateLimitPrimary(limiter, interval=0.01)
+    primary.start('127.0.0.1', port)
+    limiter.configure_tier('gold', limits=[(10, Dur.MIN), (100, Dur.HOUR)])
+    limiter.configure_limit('user-1', tier='gold')
+    limiter.configure_limit(2, rps=5, window=Dur.MIN)
+    limiter.configure_limit('user-3', rps=5, window=Dur.MIN)
+    ready.set()
+    proceed.wait(10)
+    for _ in range(7):
+        limiter.process_request('user-1')
+    limiter.process_requests([2, 2], [limiter.time_ns()] * 2)
+    limiter.remove_bucket('user-3')
+    proceed.clear()
+    proceed.wait(10)
+
+
+def test_failover_to_standby():
+    # set up a primary in another process, and a standby following it.
+    ctx = multiprocessing.get_context('fork')
+    ready, proceed = ctx.Event(), ctx.Event()
+    promoted = []
+    standby = RateLimitStandby(RateLimiter(lock_stripes=4), promoted.append)
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    primary = ctx.Process(target=run_primary, args=(port, ready, proceed),
+                          daemon=True)
+    primary.start()
+    assert ready.wait(10)
+    wait_until(lambda: _follow(standby, port))
+
+    # test the snapshot and the deltas of the primary are applied.
+    wait_until(lambda: standby.limiter.is_configured('user-3'))
+    proceed.set()
+    wait_until(lambda: not standby.limiter.is_configured('user-3'))
+    wait_until(lambda: standby.limiter.quota_remaining('user-1') == 3)
+    assert standby.limiter.quota_remaining(2) == 3
+    assert standby.limiter.tier('user-1').name == 'gold'
+    assert standby.staleness() < 1
+
+    # test the standby is promoted w/ the quota when the primary is lost.
+    t().assertFalse(standby.promoted.is_set())
+    primary.terminate()
+    primary.join()
+    wait_until(lambda: standby.promoted.is_set())
+    assert promoted == [standby.limiter]
+    limiter = standby.promote()
+    assert promoted == [limiter]
+    assert [limiter.process_request('user-1') for _ in range(4)] == [
+        True, True, True, False]
+    assert limiter.limits('user-1') == [(10, Dur.MIN), (100, Dur.HOUR)]
+
+
+def test_recorded_changes_in_order():
+    # set up the recorded buckets of a rate-limiter w/ 2 users.
+    limiter = RateLimiter(lock_stripes=4)
+    buckets = limiter.buckets = RateLimitRecordedBuckets(limiter.buckets)
+    limiter.configure_limit('user-1', rps=5)
+    limiter.configure_limit('user-2', rps=5)
+    assert buckets.drain() == ({'user-1', 'user-2'}, set())
+
+    # test a probe of cost 0 isn't recorded, and the last change of a key
+    # removed and configured again wins.
+    limiter.try_acquire('user-1', cost=0)
+    limiter.process_request('user-2')
+    limiter.remove_bucket('user-2')
+    limiter.remove_bucket('user-1')
+    limiter.configure_limit('user-1', rps=5)
+    assert buckets.drain() == ({'user-1'}, {'user-2'})
+    assert buckets.drain() == (set(), set())
+
+
+def test_deleted_policy_after_failover():
+    # set up a primary w/ a policy of a user, and a standby following it.
+    limiter = RateLimiter(lock_stripes=4)
+    primary = RateLimitPrimary(limiter, interval=0.01)
+    _, port = primary.start('127.0.0.1', 0)
+    policies = RateLimitPolicy(limiter=limiter)
+    policies.post({'name': 'gold', 'rate': Per.MIN, 'req_cnt': 10})
+    limiter.configure_limit('user-1', tier='gold')
+    standby = RateLimitStandby(RateLimiter(lock_stripes=4))
+    standby.follow('127.0.0.1', port)
+    wait_until(lambda: standby.limiter.is_configured('user-1'))
+    assert standby.limiter.tier('user-1').name == 'gold'
+
+    # test the deleted policy isn't resolved by the promoted standby, and
+    # the user keeps the limits of it.
+    id = next(id for id, row in policies.rows.items()
+              if row['name'] == 'gold')
+    assert policies.delete(id) == ({}, 204)
+    wait_until(lambda: standby.limiter.tier('user-1').name is None)
+    primary.close()
+    promoted = standby.promote()
+    with pytest.raises(RateLimitConfigNotFound):
+        promoted.configure_limit('user-2', tier='gold')
+    assert promoted.limits('user-1') == [(10, Dur.MIN)]
+
+
+def _follow(standby, port):
+    try:
+        standby.follow('127.0.0.1', port)
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,125 @@
+"""Unit Test for Consistent-Hash Router of Rate Limiter Instances"""
+
+import unittest
+
+from core.common.constants import NS_PER_SEC
+from core.common.exceptions import (
+    RateLimitConfigNotFound,
+    RateLimitNotSupported
+)
+from core.common.utils import ManualClock
+from core.controller.rate_limiter import RateLimiter
+from core.controller.router import RateLimitHashRing, RateLimitRouter
+from core.controller.storage import RateLimitMemoryStorage
+
+t = unittest.TestCase
+
+
+def test_hash_ring_moves_one_kth_of_keys():
+    # set up a ring of 4 instances and the owners of 10k keys.
+    ring = RateLimitHashRing()
+    for name in 'abcd':
+        ring.add(name)
+    keys = [f'user-{i}' for i in range(10000)]
+    before = {key: ring.owner(key) for key in keys}
+    assert max(list(before.values()).count(n) for n in 'abcd') < 3000
+
+    # test adding a 5th instance moves about 1/5 of the keys only to it, and
+    # removing it moves them back.
+    ring.add('e')
+    moved = [key for key in keys if ring.owner(key) != before[key]]
+    assert 1500 < len(moved) < 2500
+    assert all(ring.owner(key) == 'e' for key in moved)
+    ring.remove('e')
+    assert all(ring.owner(key) == before[key] for key in keys)
+    with t().assertRaises(ValueError):
+        ring.add('a')
+
+
+def test_migration_keeps_quota():
+    # set up a router of 2 instances w/ the users of 10 rps and a tier.
+    router = RateLimitRouter()
+    for name in ('a', 'b'):
+        router.add_instance(name, RateLimiter())
+    router.configure_tier('gold', rps=20)
+    users = [f'user-{i}' for i in range(100)]
+    for user in users:
+        router.configure_limit(user, rps=10)
+    router.configure_limit('vip', tier='gold')
+    for user in users + ['vip']:
+        router.process_request(user)
+    assert len(router) == 101
+
+    # test the moved buckets keep the quota remaining and the named tier.
+    moved = router.add_instance('c', RateLimiter())
+    assert 20 < moved < 50
+    assert len(router.instances['c'].buckets) == moved
+    assert all(router.quota_remaining(user) == 9 for user in users)
+    assert router.instance('vip').tier('vip').name == 'gold'
+    assert router.quota_remaining('vip') == 19
+    router.remove_instance('a')
+    assert len(router) == 101
+    assert all(router.cur_remaining(user) == 9 for user in users)
+    with t().assertRaises(RateLimitConfigNotFound):
+        router.process_request('user-x')
+
+
+def test_global_limit_split_by_weight():
+    # set up a router of 3 instances of the weights of 1:1:2.
+    router = RateLimitRouter()
+    for name, weight in (('a', 1), ('b', 1), ('c', 2)):
+        router.add_instance(name, RateLimiter(), weight)
+    router.configure_global_limit(rps=10)
+
+    # test the shares sum to the limit, and the global requests are spread
+    # over the instances by the shares.
+    assert [router.global_share(n) for n in 'abc'] == [3, 2, 5]
+    assert router.quota_limit() == 10
+    assert sum(router.process_request() for _ in range(12)) == 10
+    assert router.quota_remaining() == 0
+
+    # test the shares are split again by the new weights.
+    router.remove_instance('c')
+    assert [router.global_share(n) for n in 'ab'] == [5, 5]
+    assert router.limits() == [(10, 1)]
+
+
+def test_global_quota_consumed_across_instance_changes():
+    # set up a router of 2 instances of a shared clock, of which the global
+    # limit of 100 per minute is exhausted.
+    clock = ManualClock(1000 * NS_PER_SEC)
+    router = RateLimitRouter()
+    for name in 'ab':
+        router.add_instance(name, RateLimiter(clock))
+    router.configure_global_limit(rps=100, window=60)
+    assert sum(router.process_request() for _ in range(150)) == 100
+
+    # test a new instance doesn't reset the quota in the same window.
+    router.add_instance('c', RateLimiter(clock))
+    assert sum(router.process_request() for _ in range(50)) == 0
+    clock.sleep(60)
+    assert sum(router.process_request() for _ in range(150)) == 100
+
+    # test the fraction of the quota remaining is carried over to the new
+    # shares when an instance is removed.
+    clock.sleep(60)
+    assert sum(router.process_request() for _ in range(60)) == 60
+    router.remove_instance('c')
+    assert router.quota_remaining() == 40
+    assert sum(router.process_request() for _ in range(60)) == 40
+
+
+def test_ring_kept_if_buckets_not_moved():
+    # set up a router of an instance of the buckets in a storage backend.
+    router = RateLimitRouter()
+    router.add_instance('a', RateLimiter(storage=RateLimitMemoryStorage()))
+    for i in range(100):
+        router.configure_limit(f'user-{i}', 10)
+
+    # test the buckets of the storage can't move, and the ring and the
+    # instances are kept as they were.
+    with t().assertRaises(RateLimitNotSupported):
+        router.add_instance('b', RateLimiter(storage=RateLimitMemoryStorage()))
+    assert list(router.ring) == ['a'] and list(router.instances) == ['a']
+    assert len(router) == 100
+    t().assertTrue(router.process_request('user-1'))
@@ -0,0 +1,120 @@
+"""Unit Test for Shared-Memory Bucket Table of Worker Processes"""
+
+import multiprocessing
+import pytest
+from unittest import TestCase as t
+
+from core.common.constants import DEFAULT_RPS, DEFAULT_TIME_WINDOW
+from core.common.exceptions import RateLimitException
+from core.common.utils import CoarseClock, FakeClock
+from core.controller.bucket_table import RateLimitBucketTable
+from core.controller.rate_limiter import RateLimiter
+from core.controller.shared_table import _HEADER, RateLimitSharedTable
+
+
+def test_decrement_same_as_table():
+    # set up a shared table and a table with the same clock.
+    clock = FakeClock(10)
+    shared = RateLimitSharedTable(clock, capacity=8)
+    shared.configure('user-1', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    table = RateLimitBucketTable(clock)
+    table.configure('user-1', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+
+    # test the shared table returns the same result of the table.
+    for sleep_sec in (0, 0, 0.5, 0, 0, 0, 1, 0, 2.5, 0):
+        clock.sleep(sleep_sec)
+        assert shared.decrement('user-1') == table.decrement('user-1')
+        assert shared.quota_remaining('user-1') == (
+            table.quota_remaining('user-1'))
+        assert shared.cur_remaining('user-1') == table.cur_remaining('user-1')
+
+
+def test_configure_and_remove():
+    # set up a shared table w/ the capacity of 3 keys.
+    shared = RateLimitSharedTable(capacity=3)
+    for key in ('global', 'user-1', 2):
+        shared.configure(key, DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+
+    # test the keys are strings, and the table is full.
+    assert len(shared) == 3
+    assert sorted(shared.keys()) == ['2', 'global', 'user-1']
+    t().assertTrue(2 in shared)
+    with pytest.raises(RateLimitException):
+        shared.configure('user-3', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    with pytest.raises(ValueError):
+        shared.configure('u' * 64, DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+
+    # test the slot of the removed key is reused.
+    shared.remove('user-1')
+    t().assertFalse('user-1' in shared)
+    with pytest.raises(KeyError):
+        shared.remove('user-1')
+    assert shared.acquire('user-1') is None
+    shared.configure('user-3', DEFAULT_RPS + 1, DEFAULT_TIME_WINDOW)
+    assert shared.quota_limit('user-3') == DEFAULT_RPS + 1
+    assert shared.tier('user-3').limits() == [(DEFAULT_RPS + 1, 1)]
+
+
+def decide_in_worker(limiter, num_requests, results):
+    results.put(sum(limiter.process_request('user-1')
+                    for _ in range(num_requests)))
+
+
+def test_quota_shared_by_forked_workers():
+    # set up rate-limiter w/ the shared table before forking the workers,
+    # and a clock which isn't ticked so that the quota isn't refilled.
+    ctx = multiprocessing.get_context('fork')
+    limiter = RateLimiter(CoarseClock(), shared_capacity=16)
+    limiter.configure_limit('user-1', rps=1000)
+    results = ctx.Queue()
+    workers = [ctx.Process(target=decide_in_worker,
+                           args=(limiter, 400, results)) for _ in range(4)]
+
+    # test the workers enforce one quota limit in total.
+    for worker in workers:
+        worker.start()
+    allowed = sum(results.get(timeout=30) for _ in workers)
+    for worker in workers:
+        worker.join()
+    assert allowed == 1000
+    assert limiter.quota_remaining('user-1') == 0
+
+
+def test_export_and_restore():
+    # set up a shared table and a table w/ a consumed bucket.
+    shared = RateLimitSharedTable(capacity=4)
+    table = RateLimitBucketTable()
+    table.configure('user-1', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    table.decrement('user-1')
+
+    # test the bucket moves between the tables w/ its quota remaining.
+    shared.restore('user-1', table.export('user-1'))
+    assert shared.quota_remaining('user-1') == DEFAULT_RPS - 1
+    assert shared.export('user-1') == table.export('user-1')
+    table.remove('user-1')
+    table.restore('user-1', shared.export('user-1'))
+    assert table.cur_remaining('user-1') == DEFAULT_RPS - 1
+
+
+def test_deleted_slots_are_rehashed():
+    # set up a shared table of 8 slots w/ a kept key.
+    shared = RateLimitSharedTable(capacity=4)
+    shared.configure('user-0', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    shared.decrement('user-0')
+
+    # test the deleted slots of the keys added and removed are bound, and
+    # the kept key is found w/ its quota.
+    for i in range(1, 100):
+        shared.configure(f'user-{i}', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+        shared.configure(f'user-{i}-x', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+        shared.remove(f'user-{i}')
+        shared.remove(f'user-{i}-x')
+        assert len(shared) == 1
+    size, deleted = _HEADER.unpack_from(shared._buf, 0)
+    assert size == 1 and deleted <= 2
+    assert shared.keys() == ['user-0']
+    assert shared.quota_remaining('user-0') == DEFAULT_RPS - 1
+
+    # test the multiple time windows are rejected.
+    with pytest.raises(ValueError):
+        shared.configure('user-1', 1, 1, extra_limits=[(10, 60)])
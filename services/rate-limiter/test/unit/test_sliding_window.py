@@ -0,0 +1,39 @@
+"""Unit Test for Sliding Window Counter of Rate Limiter"""
+
+from unittest import TestCase as t
+
+from core.common.constants import NS_PER_SEC
+from core.common.utils import ManualClock
+from core.controller.sliding_window import RateLimitSlidingWindowCounter
+
+
+def test_first_window_and_remaining():
+    # set up a counter of 10 per sec, of which the previous window is
+    # estimated to be full at first.
+    clock = ManualClock(1000 * NS_PER_SEC)
+    counter = RateLimitSlidingWindowCounter(10, 1, clock)
+
+    # test the first window allows the requests of the time passed, and the
+    # quota remaining is the number of the requests allowed next.
+    clock.sleep(0.5)
+    for remaining in (4, 3, 2, 1, 0):
+        t().assertTrue(counter.decrement())
+        assert counter.quota_remaining() == remaining
+    t().assertFalse(counter.decrement())
+
+    # test the count of the previous window is estimated in the next one.
+    clock.sleep(1)
+    for remaining in (4, 3, 2, 1, 0):
+        t().assertTrue(counter.decrement())
+        assert counter.quota_remaining() == remaining
+    t().assertFalse(counter.decrement())
+
+    # test a request of the cost is allowed only if all its units are.
+    clock.sleep(0.5)
+    t().assertTrue(counter.decrement(cost=2))
+    assert counter.quota_remaining() == 1
+    t().assertFalse(counter.decrement(cost=2))
+    assert counter.quota_remaining() == 1
+    t().assertTrue(counter.decrement())
+    assert counter.quota_remaining() == 0
+    t().assertFalse(counter.decrement())
@@ -0,0 +1,117 @@
+"""Unit Test for Snapshot and Warm Restart of Rate Limiter Buckets"""
+
+import os
+import time
+
+import pytest
+
+from core.common.constants import (
+    Duration as Dur,
+    RateLimitAlgorithm as Algo,
+    NS_PER_SEC
+)
+from core.common.exceptions import RateLimitNotSupported
+from core.common.utils import ManualClock
+from core.controller.rate_limiter import RateLimiter
+from core.controller.snapshot import RateLimitSnapshots
+
+
+def test_save_and_restore(tmp_path):
+    # set up a rate-limiter w/ a named composite tier, and partly consumed
+    # buckets of string and integer keys w/ a removed key.
+    clock = ManualClock(1000 * NS_PER_SEC)
+    wall = ManualClock(5000 * NS_PER_SEC)
+    limiter = RateLimiter(clock, lock_stripes=4)
+    limiter.configure_tier('gold', limits=[(10, Dur.SEC), (100, Dur.MIN)])
+    limiter.configure_global_limit(rps=50)
+    for user_id in ('user-1', 2, 'user-3', '4'):
+        limiter.configure_limit(user_id, tier='gold')
+    limiter.configure_limit('user-5', rps=5, window=Dur.MS100)
+    limiter.remove_bucket('user-3')
+    for user_id, count in (('user-1', 3), (2, 7), ('user-5', 5)):
+        for _ in range(count):
+            limiter.process_request(user_id)
+    snapshots = RateLimitSnapshots(limiter, str(tmp_path / 'buckets.snap'),
+                                   wall=wall)
+    assert snapshots.save() == 5
+
+    # test the restarted rate-limiter has the same buckets and tiers.
+    restarted = RateLimiter(ManualClock(7 * NS_PER_SEC), lock_stripes=4)
+    restarted.configure_tier('gold', rps=1)
+    assert RateLimitSnapshots(restarted, snapshots.path,
+                              wall=wall).restore() == 5
+    assert len(restarted.buckets) == 5
+    assert not restarted.is_configured('user-3')
+    assert restarted.limits(2) == [(10, Dur.SEC), (100, Dur.MIN)]
+    assert restarted.tier('4').name == 'gold'
+    assert restarted.quota_remaining('user-1') == 7
+    assert restarted.quota_remaining(2) == 3
+    assert restarted.quota_remaining('user-5') == 0
+    assert restarted.quota_limit() == 50
+    assert [restarted.process_request(2) for _ in range(4)] == [
+        True, True, True, False]
+
+    # test the time of the restart refills the buckets by the wall clock.
+    wall.now += int(Dur.MS100 * NS_PER_SEC)
+    assert RateLimitSnapshots(restarted, snapshots.path,
+                              wall=wall).restore() == 5
+    assert restarted.cur_remaining('user-5') == 5
+    assert restarted.cur_remaining('user-1') == 7
+
+
+def test_restore_w_o_snapshot_file(tmp_path):
+    # set up a rate-limiter of GCRA w/o a snapshot file.
+    limiter = RateLimiter(algorithm=Algo.GCRA)
+    snapshots = RateLimitSnapshots(limiter, str(tmp_path / 'buckets.snap'))
+
+    # test nothing is restored, and an empty snapshot is restored as well.
+    assert snapshots.restore() == 0
+    assert snapshots.save() == 0
+    assert snapshots.restore() == 0
+    limiter.configure_limit('user-1', rps=2)
+    assert limiter.process_request('user-1')
+    snapshots.close()
+    assert snapshots.saved[0] == 1
+    restarted = RateLimiter(algorithm=Algo.GCRA)
+    RateLimitSnapshots(restarted, snapshots.path).restore()
+    assert [restarted.process_request('user-1') for _ in range(2)] == [
+        True, False]
+
+
+def test_snapshot_of_bucket_objects(tmp_path):
+    # set up a snapshot file, and a rate-limiter of the bucket objects.
+    snapshots = RateLimitSnapshots(RateLimiter(),
+                                   str(tmp_path / 'buckets.snap'))
+    snapshots.save()
+    limiter = RateLimiter(algorithm=Algo.SLIDING_WINDOW_COUNTER)
+    limiter.configure_limit('user-1', rps=2)
+
+    # test the snapshot isn't supported by the bucket objects.
+    for method in ('save', 'restore'):
+        with pytest.raises(RateLimitNotSupported) as e:
+            getattr(RateLimitSnapshots(limiter, snapshots.path), method)()
+        assert e.value.status_code == 501
+
+
+def test_periodic_snapshot_after_failure(tmp_path, caplog):
+    # set up the periodic snapshots to a directory which doesn't exist.
+    limiter = RateLimiter(lock_stripes=4)
+    limiter.configure_limit('user-1', rps=5)
+    snapshots = RateLimitSnapshots(
+        limiter, str(tmp_path / 'data' / 'buckets.snap'), interval=0.01)
+    snapshots.start()
+
+    # test a failed save is logged, and the next interval saves a snapshot.
+    for _ in range(500):
+        if caplog.records:
+            break
+        time.sleep(0.01)
+    assert 'not saved' in caplog.records[0].getMessage()
+    (tmp_path / 'data').mkdir()
+    for _ in range(500):
+        if snapshots.saved is not None:
+            break
+        time.sleep(0.01)
+    snapshots.close(save=False)
+    assert snapshots.saved[0] == 1
+    assert os.path.exists(snapshots.path)
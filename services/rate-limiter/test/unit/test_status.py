@@ -0,0 +1,63 @@
+"""Unit Test for Pagination and Streaming of Rate Limit Status API"""
+
+import json
+
+from core.apis.status import RateLimitStatus
+from core.common.constants import Duration as Dur, NS_PER_SEC
+from core.common.utils import ManualClock
+from core.controller.rate_limiter import RateLimiter
+
+
+def test_list_pages_and_stream():
+    # set up buckets of users and admins, of which some are exhausted.
+    limiter = RateLimiter(lock_stripes=4)
+    limiter.configure_limits([(f'user-{i}', 1) for i in range(2500)] +
+                             [(f'admin-{i}', 5) for i in range(10)])
+    for i in range(0, 2500, 5):
+        limiter.process_request(f'user-{i}')
+    status = RateLimitStatus(limiter)
+
+    # test the pages are listed by the cursor w/ a removed bucket.
+    res, code, headers = status.list(limit=1000)
+    assert (len(res), code) == (1000, 200)
+    limiter.remove_bucket('user-1500')
+    names = [data['bucket_name'] for data in res]
+    cursor = int(headers['X-Next-Cursor'])
+    while cursor:
+        res, *headers = status.list(cursor, 1000)
+        names += [data['bucket_name'] for data in res]
+        cursor = int(headers[1]['X-Next-Cursor']) if len(headers) > 1 else 0
+    assert len(names) == len(set(names)) == 2509
+
+    # test the filters of the pages and the stream w/o the removed bucket.
+    res, code = status.list(limit=20, prefix='admin-')
+    assert (len(res), code) == (10, 200)
+    assert status.list(prefix='none-') == ([], 404)
+    lines = b''.join(status.stream(exhausted=True)).decode().splitlines()
+    assert len(lines) == 499
+    assert json.loads(lines[0]) == {
+        'bucket_name': 'user-0', 'quota_limit': 1, 'limit_per': 'rps',
+        'quota_remaining': 0}
+
+
+def test_status_reads_dont_block_eviction():
+    # set up idle buckets of a long window w/ an idle TTL, and an active
+    # key of which the requests sweep the idle buckets.
+    clock = ManualClock(1000 * NS_PER_SEC)
+    limiter = RateLimiter(clock, idle_ttl=10, lock_stripes=4)
+    limiter.configure_limits([(f'user-{i}', [(100, Dur.MIN)])
+                              for i in range(50)] + [('active', 100)])
+    for i in range(50):
+        limiter.process_request(f'user-{i}')
+    status = RateLimitStatus(limiter)
+
+    # test the buckets scraped by the status API every second are evicted
+    # by the TTL, and the statuses are read w/o consuming the quota.
+    assert status.list(limit=10)[0][0]['quota_remaining'] == 99
+    for _ in range(40):
+        clock.sleep(1)
+        status.list(limit=100)
+        list(status.stream())
+        limiter.process_request('active')
+    assert list(limiter.buckets.keys()) == ['active']
+    assert limiter.buckets.evictions['ttl'] == 50
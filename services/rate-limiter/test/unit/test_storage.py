@@ -0,0 +1,157 @@
+"""Unit Test for Storage Backends of Rate Limiter"""
+
+import hashlib
+import re
+import unittest
+
+import numpy as np
+
+from core.common.constants import NS_PER_SEC
+from core.common.exceptions import RateLimitConfigNotFound
+from core.controller.rate_limiter import RateLimiter
+from core.controller.redis_storage import (
+    TOKEN_BUCKET_SCRIPT,
+    RateLimitRedisStorage
+)
+from core.controller.resp_server import (
+    RESPStandIn,
+    start_in_thread,
+    stop_in_thread
+)
+from core.controller.storage import RateLimitMemoryStorage
+
+t = unittest.TestCase
+
+
+def check_decisions(limiter):
+    """Check the decisions of a rate-limiter of a storage backend."""
+    limiter.configure_limit('user-1', rps=3)
+    now = limiter.time_ns() // 1000 * 1000  # the RESP storage keeps us.
+    assert [limiter.process_request('user-1', now) for _ in range(4)] == [
+        True, True, True, False]
+    decision = limiter.try_acquire('user-1', 1, now)
+    assert (decision.allowed, decision.limit, decision.remaining) == (
+        False, 3, 0)
+    assert decision.reset_at == now + NS_PER_SEC
+    assert limiter.try_acquire('user-1', 2, now + NS_PER_SEC).remaining == 1
+    assert limiter.try_acquire('user-2') is None
+
+    # test a batch of requests in one call of the storage.
+    limiter.configure_limit('user-2', rps=2)
+    res = limiter.process_requests(['user-1', 'user-2'] * 3,
+                                   [now + 2 * NS_PER_SEC] * 6)
+    assert res.tolist() == [True, True, True, True, True, False]
+    with t().assertRaises(RateLimitConfigNotFound):
+        limiter.process_requests(['user-3'], np.array([now]))
+    assert sorted(limiter.buckets.keys()) == ['user-1', 'user-2']
+    assert len(limiter.buckets) == 2
+    limiter.remove_bucket('user-2')
+    assert not limiter.is_configured('user-2')
+
+    # test the kept keys are scanned while the keys are removed and added.
+    limiter.configure_limits((f'scan-{i}', 1) for i in range(1000))
+    cursor, keys = limiter.scan_buckets(0, 100)
+    for i in range(0, 1000, 2):
+        limiter.remove_bucket(f'scan-{i}')
+    limiter.configure_limits((f'scan-{i}', 1) for i in range(1000, 1200))
+    while cursor:
+        cursor, more = limiter.scan_buckets(cursor, 100)
+        keys += more
+    assert {f'scan-{i}' for i in range(1, 1000, 2)} <= set(keys)
+    for key in list(limiter.buckets.keys()):
+        if key.startswith('scan-'):
+            limiter.remove_bucket(key)
+    assert len(limiter.buckets) == 1
+
+
+def test_memory_storage():
+    # set up a rate-limiter w/ the in-process storage.
+    limiter = RateLimiter(storage=RateLimitMemoryStorage())
+
+    # test the decisions are the same as the buckets of the rate-limiter.
+    check_decisions(limiter)
+
+
+def test_resp_storage():
+    # set up a rate-limiter w/ the RESP storage of the local stand-in.
+    server = start_in_thread()
+    port = server.sockets[0].getsockname()[1]
+    storage = RateLimitRedisStorage('127.0.0.1', port)
+
+    # test the decisions are the same as the in-process storage.
+    check_decisions(RateLimiter(storage=storage))
+
+    # test the script is loaded again if the server lost it.
+    storage._call(b'SCRIPT', b'FLUSH')
+    assert storage.acquire('user-1', 0, 0).limit == 3
+
+    # test the rate-limiters of the same server share the quota.
+    other = RateLimiter(storage=RateLimitRedisStorage.from_url(
+        f'redis://127.0.0.1:{port}'))
+    other.configure_limit('shared', rps=4)
+    limiter = RateLimiter(storage=storage)
+    assert sum(rate_limiter.process_request('shared')
+               for rate_limiter in (limiter, other) * 4) == 4
+    assert limiter.quota_remaining('shared') == 0
+
+    # test the keys are listed by the pages of SCAN, and the multiple time
+    # windows are rejected.
+    limiter.configure_limits((f'bulk-{i}', 1) for i in range(2500))
+    assert sorted(limiter.buckets.keys()) == sorted(
+        ['user-1', 'shared'] + [f'bulk-{i}' for i in range(2500)])
+    assert limiter.eviction_stats()['buckets'] == 2502
+    assert limiter.configure_limits([('bulk-x', [(1, 1), (2, 60)])]) == (
+        0, 0, [(0, 'bulk-x')])
+    with t().assertRaises(ValueError):
+        limiter.configure_limit('bulk-x', limits=[(1, 1), (2, 60)])
+    storage.close()
+    stop_in_thread(server)
+
+
+def test_resp_script(monkeypatch):
+    # set up the RESP storage of the stand-in recording the commands.
+    commands = []
+    execute = RESPStandIn.execute
+    monkeypatch.setattr(RESPStandIn, 'execute', lambda self, command: (
+        commands.append(command), execute(self, command))[1])
+    server = start_in_thread()
+    storage = RateLimitRedisStorage(
+        '127.0.0.1', server.sockets[0].getsockname()[1], prefix='rl:')
+    limiter = RateLimiter(storage=storage)
+    limiter.configure_limit('user-1', rps=3)
+
+    # test the script text is loaded, and is run by its SHA1 w/ the key of
+    # the hash and the args of (now (us), cost).
+    sha = hashlib.sha1(TOKEN_BUCKET_SCRIPT).hexdigest().encode()
+    assert commands[0] == [b'SCRIPT', b'LOAD', TOKEN_BUCKET_SCRIPT]
+    del commands[:]
+    now = limiter.time_ns()
+    decision = limiter.try_acquire('user-1', 2, now)
+    assert commands == [[b'EVALSHA', sha, b'1', b'rl:user-1',
+                         b'%d' % (now // 1000), b'2']]
+    assert (decision.allowed, decision.limit, decision.remaining) == (
+        True, 3, 1)
+
+    # test the script text reads the fields written by the storage and the
+    # args in the same order, and replies the array of the decision.
+    script = TOKEN_BUCKET_SCRIPT.decode()
+    fields = [field.decode() for field in storage._call(
+        b'HGETALL', 'rl:user-1')[::2]]
+    assert fields == ['limit', 'window', 'remaining', 'last']
+    assert re.findall(r"'HMGET', KEYS\[1\],\s+'(\w+)', '(\w+)', '(\w+)',"
+                      r"\s+'(\w+)'", script) == [tuple(fields)]
+    assert re.findall(r'local (\w+) = tonumber\(ARGV\[(\d)\]\)',
+                      script) == [('now', '1'), ('cost', '2')]
+    assert re.findall(r'\nreturn \{(.*)\}', script) == [
+        'allowed, limit, remaining, last, window']
+
+    # test EVAL of the script text is a round trip of the same decision,
+    # and the number of the keys is read w/o SCAN.
+    reply = storage._call(b'EVAL', TOKEN_BUCKET_SCRIPT, 1, 'rl:user-1',
+                          now // 1000, 0)
+    assert reply == [1, 3, 1, now // 1000, 1000000]
+    del commands[:]
+    assert len(limiter.buckets) == 1
+    assert commands == [[b'GET', b'count:rl:']]
+    storage.close()
+    stop_in_thread(server)
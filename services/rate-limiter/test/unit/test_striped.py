@@ -0,0 +1,88 @@
+"""Unit Test for Striped Token Bucket of the Global Key"""
+
+import threading
+from unittest import TestCase as t
+
+from core.common.constants import NS_PER_SEC
+from core.common.utils import CoarseClock, FakeClock
+from core.controller.rate_limiter import RateLimiter
+from core.controller.striped import LEASE_DIVISOR, RateLimitStripedBucket
+from core.controller.tier import RateLimitTiers
+
+
+def test_lease_and_refill():
+    # set up a striped bucket of 1000 rps w/ 4 cells at a fixed time.
+    tiers = RateLimitTiers()
+    tier_id = tiers.define('free', 1000, 1)
+    clock = CoarseClock(FakeClock(10))
+    bucket = RateLimitStripedBucket(tiers, tier_id, clock, cells=4)
+    now = clock.time_ns()
+    lease = 1000 // (4 * LEASE_DIVISOR)
+
+    # test a request leases a batch of tokens from the pool to the cell, and
+    # the tokens of the cell are counted in the quota remaining.
+    t().assertTrue(bucket.decrement(1, now))
+    assert bucket._remaining == 1000 - 1 - lease
+    assert bucket.quota_remaining() == 999
+    for _ in range(998):
+        t().assertTrue(bucket.decrement(1, now))
+    t().assertTrue(bucket.decrement(1, now))
+    t().assertFalse(bucket.decrement(1, now))
+    assert bucket.quota_remaining() == 0
+
+    # test the pool is refilled after the time window, and redefining the
+    # tier is applied to the striped bucket.
+    now += NS_PER_SEC
+    assert bucket.cur_remaining(now) == 1000
+    tiers.define('free', 10, 1)
+    decision = bucket.acquire(1, now)
+    t().assertTrue(decision.allowed)
+    assert (decision.limit, decision.remaining) == (10, 9)
+    assert decision.reset_at == now + NS_PER_SEC
+
+
+def test_rebalance_tokens_of_other_cells():
+    # set up a striped bucket whose tokens are leased to the cell of thread.
+    tiers = RateLimitTiers()
+    clock = CoarseClock(FakeClock(10))
+    bucket = RateLimitStripedBucket(tiers, tiers.intern(640, 1), clock,
+                                    cells=4)
+    thread = threading.Thread(target=bucket.decrement)
+    thread.start()
+    thread.join()
+
+    # test the main thread takes back the tokens of the other cell when the
+    # pool is empty, so the whole quota limit is admitted.
+    allowed = sum(bucket.decrement() for _ in range(700))
+    assert allowed == 639
+    assert bucket.quota_remaining() == 0
+
+
+def test_global_limit_by_threads():
+    # set up rate-limiter shared by threads w/ a clock which isn't ticked.
+    clock = CoarseClock(FakeClock(10))
+    limiter = RateLimiter(clock, lock_stripes=8)
+    limiter.configure_global_limit(rps=10000)
+    limiter.configure_limit('user-1', rps=10)
+    allowed = [0] * 8
+
+    def request(thread_id):
+        for _ in range(2000):
+            allowed[thread_id] += limiter.process_request()
+
+    # test the global admission is within the error bound of the quota limit.
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    lease = 10000 // (8 * LEASE_DIVISOR)
+    assert 10000 - 7 * lease <= sum(allowed) <= 10000
+    assert limiter.cur_remaining() == 10000 - sum(allowed)
+
+    # test a batch decides the global key by the striped bucket.
+    now = clock.time_ns() + NS_PER_SEC
+    res = limiter.process_requests(['global', 'user-1', 'global'],
+                                   [now, now, now + 1])
+    assert res.tolist() == [True, True, True]
+    assert limiter.quota_remaining() == 9998
@@ -0,0 +1,120 @@
+"""Unit Test for Each Function of Rate Limit Tiers"""
+
+import pytest
+
+from core.apis.policies import RateLimitPolicy
+from core.common.constants import DEFAULT_RPS, DEFAULT_TIME_WINDOW, NS_PER_SEC
+from core.common.constants import RateLimitPer as Per
+from core.common.exceptions import RateLimitConfigNotFound
+from core.common.utils import FakeClock
+from core.controller.rate_limiter import TIER_RECLAIM, RateLimiter
+from core.controller.snapshot import RateLimitSnapshots
+from core.controller.tier import RateLimitTiers
+
+
+def test_intern_and_define():
+    # set up tiers for testing intern() and define().
+    tiers = RateLimitTiers()
+    anonymous = tiers.intern(DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+    gold = tiers.define('gold', DEFAULT_RPS, DEFAULT_TIME_WINDOW)
+
+    # test an anonymous tier is shared by the same limit and window.
+    assert tiers.intern(DEFAULT_RPS, DEFAULT_TIME_WINDOW) == anonymous
+    assert tiers.intern(DEFAULT_RPS + 1, DEFAULT_TIME_WINDOW) != anonymous
+    assert tiers[anonymous].name is None
+
+    # test a named tier isn't shared with anonymous tiers, and is replaced.
+    assert gold != anonymous
+    assert tiers.id_of('gold') == gold
+    assert tiers.id_of('silver') is None
+    assert tiers.define('gold', 50, DEFAULT_TIME_WINDOW) == gold
+    assert tiers[gold].quota_limit == 50
+    assert tiers.limits[gold] == 50
+    assert tiers[anonymous].quota_limit == DEFAULT_RPS
+
+    # test a composite tier isn't shared with the tier of the first window.
+    composite = tiers.intern(DEFAULT_RPS, DEFAULT_TIME_WINDOW, [(50, 60)])
+    assert composite != anonymous
+    assert tiers.intern(DEFAULT_RPS, DEFAULT_TIME_WINDOW, [(50, 60)]) == (
+        composite)
+    assert tiers[composite].limits() == [(DEFAULT_RPS, DEFAULT_TIME_WINDOW),
+                                         (50, 60)]
+    assert tiers.extras[composite] == ((50, 60 * NS_PER_SEC),)
+
+
+def test_configure_limit_with_tier():
+    # set up rate-limiter w/ users of a tier.
+    clock = FakeClock(10)
+    limiter = RateLimiter(clock)
+    limiter.configure_tier('gold', rps=DEFAULT_RPS)
+    for user_id in ('user-1', 'user-2'):
+        limiter.configure_limit(user_id, tier='gold')
+    limiter.configure_limit('user-3', rps=DEFAULT_RPS)
+
+    # test the users of the tier refer to the same tier.
+    assert limiter.tier('user-1') is limiter.tier('user-2')
+    assert limiter.tier('user-1').name == 'gold'
+    assert limiter.tier('user-3').name is None
+    with pytest.raises(RateLimitConfigNotFound):
+        limiter.configure_limit('user-4', tier='silver')
+
+    # test changing the tier updates all the users of the tier.
+    limiter.process_request('user-1')
+    limiter.configure_tier('gold', rps=2)
+    assert limiter.quota_limit('user-1') == 2
+    assert limiter.quota_limit('user-2') == 2
+    assert limiter.quota_limit('user-3') == DEFAULT_RPS
+    for user_id in ('user-1', 'user-2'):
+        assert limiter.try_acquire(user_id).remaining == 1
+        assert limiter.try_acquire(user_id).remaining == 0
+        assert not limiter.process_request(user_id)
+
+
+@pytest.mark.parametrize('lock_stripes', [None, 4])
+def test_remove_and_reclaim_tiers(tmp_path, lock_stripes):
+    # set up rate-limiter w/ the users of a policy and a global limit.
+    limiter = RateLimiter(lock_stripes=lock_stripes)
+    policies = RateLimitPolicy(limiter=limiter)
+    policies.post({'name': 'gold', 'rate': Per.SEC, 'req_cnt': 10})
+    id, = [row['id'] for row in policies.rows.values()
+           if row['name'] == 'gold']
+    limiter.configure_global_limit(rps=50)
+    for user_id in ('user-1', 'user-2'):
+        limiter.configure_limit(user_id, tier='gold')
+    tiers = limiter.buckets.tiers
+    gold = tiers.id_of('gold')
+
+    # test the tier of a deleted policy is removed, and the buckets keep its
+    # limit until they're configured again, after which the tier ID is freed
+    # and reused.
+    policies.delete(id)
+    assert tiers.id_of('gold') is None
+    with pytest.raises(RateLimitConfigNotFound):
+        limiter.configure_limit('user-3', tier='gold')
+    assert limiter.tier('user-1').name is None
+    assert limiter.quota_limit('user-1') == 10
+    limiter.configure_limit('user-1', rps=3)
+    limiter.remove_bucket('user-2')
+    limiter.configure_limits([('user-2', 3)])
+    assert tiers.reclaim(limiter.buckets.tier_ids()) == 1
+    limiter.configure_tier('silver', rps=20)
+    assert tiers.id_of('silver') == gold
+    assert policies.post({'name': 'gold', 'rate': Per.SEC,
+                          'req_cnt': 5})[1] == 201
+
+    # test the anonymous tiers which no bucket refers to are reclaimed, and
+    # the snapshot of the freed tier IDs is restored.
+    for rps in range(100, 100 + 4 * TIER_RECLAIM):
+        limiter.configure_limit('user-4', rps=rps)
+    limiter.configure_limits([('user-5', rps) for rps in range(5000, 7000)])
+    assert len(tiers) <= 2 * TIER_RECLAIM
+    assert None in list(tiers)
+    assert limiter.quota_limit() == 50
+    assert limiter.quota_limit('user-5') == 6999
+    snapshots = RateLimitSnapshots(limiter, str(tmp_path / 'buckets.snap'))
+    snapshots.save()
+    restarted = RateLimiter(lock_stripes=lock_stripes)
+    RateLimitSnapshots(restarted, snapshots.path).restore()
+    assert restarted.quota_limit('user-4') == 99 + 4 * TIER_RECLAIM
+    restarted.configure_limit('user-6', tier='gold')
+    assert restarted.quota_limit('user-6') == 5